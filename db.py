@@ -1,12 +1,21 @@
+import hashlib
+import json
 import os
+import threading
+import time
 from pathlib import Path
 from dotenv import load_dotenv
 from datetime import datetime
 from sqlalchemy import (
     create_engine, Column, String, Integer, Float, DateTime, JSON, Text,
-    ForeignKey, Boolean
+    ForeignKey, Boolean, LargeBinary, text, event
 )
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy.exc import TimeoutError as SATimeoutError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, deferred, undefer
+from timing import record as record_timing
+from html_cache import render_fingerprint, render_fingerprint_sql
 
 load_dotenv()
 # Também suportar um arquivo local não-dot (gitignored) para dev sem export manual.
@@ -59,15 +68,133 @@ def _build_connect_args(url: str) -> dict:
     return {}
 
 
+# Pool de conexões (por processo). Dimensionar contra o max_connections do Postgres:
+# workers do gunicorn × (DB_POOL_SIZE + DB_MAX_OVERFLOW) + scripts/jobs externos.
+DB_POOL_SIZE = max(1, int(os.getenv("DB_POOL_SIZE", "5")))
+DB_MAX_OVERFLOW = max(0, int(os.getenv("DB_MAX_OVERFLOW", "10")))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))      # espera máxima por conexão (s)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))      # reciclar conexões (s)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") not in ("0", "false", "False")
+
+_pool_lock = threading.Lock()
+_pool_contadores = {
+    "checkouts": 0,
+    "checkins": 0,
+    "conexoes_abertas": 0,
+    "invalidadas": 0,   # pre-ping que falhou ou erro de desconexão
+    "timeouts": 0,      # esperou DB_POOL_TIMEOUT sem conexão livre
+    "espera_ms_total": 0.0,
+    "espera_ms_max": 0.0,
+}
+
+
+def _contar(chave: str, n: float = 1) -> None:
+    with _pool_lock:
+        _pool_contadores[chave] += n
+
+
+class _PoolMedido(QueuePool):
+    """QueuePool que mede a espera no checkout (fila cheia = pool subdimensionado)."""
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        except SATimeoutError:
+            _contar("timeouts")
+            raise
+        finally:
+            ms = (time.perf_counter() - inicio) * 1000.0
+            record_timing("db_pool_wait", ms)
+            with _pool_lock:
+                _pool_contadores["espera_ms_total"] += ms
+                if ms > _pool_contadores["espera_ms_max"]:
+                    _pool_contadores["espera_ms_max"] = ms
+
+
+def _pool_kwargs(url: str) -> dict:
+    kwargs = {
+        "pool_pre_ping": DB_POOL_PRE_PING,  # Verificar conexão antes de usar
+        "pool_timeout": DB_POOL_TIMEOUT,    # Timeout para obter conexão do pool
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+    if not url.startswith('sqlite'):
+        kwargs.update(poolclass=_PoolMedido, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    return kwargs
+
+
 engine = create_engine(
     DATABASE_URL,
     connect_args=_build_connect_args(DATABASE_URL),
     future=True,
-    pool_pre_ping=True,  # Verificar conexão antes de usar
-    pool_timeout=30,     # Timeout para obter conexão do pool
-    pool_recycle=1800,   # Reciclar conexões a cada 30 min
+    **_pool_kwargs(DATABASE_URL),
 )
 
+
+@event.listens_for(engine, "connect")
+def _ao_conectar(dbapi_conn, registro):
+    _contar("conexoes_abertas")
+
+
+@event.listens_for(engine, "checkout")
+def _ao_checkout(dbapi_conn, registro, proxy):
+    _contar("checkouts")
+
+
+@event.listens_for(engine, "checkin")
+def _ao_checkin(dbapi_conn, registro):
+    _contar("checkins")
+
+
+@event.listens_for(engine, "invalidate")
+def _ao_invalidar(dbapi_conn, registro, erro):
+    _contar("invalidadas")
+
+
+if DATABASE_URL.startswith('sqlite'):
+    # pysqlite só abre a transação antes de um INSERT/UPDATE e o SAVEPOINT de uma
+    # sessão só de leitura vira a própria transação (o RELEASE grava). Receita do
+    # SQLAlchemy: o driver não controla a transação e o BEGIN sai no início dela.
+    @event.listens_for(engine, "connect")
+    def _sqlite_sem_autocommit(dbapi_conn, registro):
+        dbapi_conn.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _sqlite_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+
+def pool_stats() -> dict:
+    """
+    Estado do pool deste processo: configuração, conexões (ociosas, em uso, overflow)
+    e contadores desde a subida. Espera média alta ou timeouts > 0 pedem pool maior
+    (ou menos tempo com a conexão presa); invalidadas crescendo = conexões caindo.
+    """
+    with _pool_lock:
+        cont = dict(_pool_contadores)
+    stats = {
+        "config": {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout_s": DB_POOL_TIMEOUT,
+            "pool_recycle_s": DB_POOL_RECYCLE,
+            "pre_ping": DB_POOL_PRE_PING,
+        },
+        **cont,
+        "espera_ms_media": round(cont["espera_ms_total"] / cont["checkouts"], 2) if cont["checkouts"] else 0.0,
+    }
+    stats["espera_ms_total"] = round(cont["espera_ms_total"], 1)
+    stats["espera_ms_max"] = round(cont["espera_ms_max"], 1)
+    pool = engine.pool
+    for nome, chave in (("size", "tamanho"), ("checkedin", "ociosas"), ("checkedout", "em_uso"), ("overflow", "overflow")):
+        metodo = getattr(pool, nome, None)
+        if callable(metodo):
+            try:
+                stats[chave] = metodo()
+            except Exception:
+                pass
+    return stats
+
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
 Base = declarative_base()
 
@@ -190,14 +317,125 @@ class PropostaDB(Base):
 
     # ====== Payload JSON completo (para dados adicionais e auditoria) ======
     # Inclui: consumo_mes_a_mes, graficos_base64, metrics, kit_selecionado, etc.
-    payload = Column(JSON)
+    # Adiado (vários MB por linha): só vem do banco quando acessado ou com
+    # get_proposta(..., payload=True) / options(*CARREGAR_PAYLOAD).
+    # JSONB no Postgres (->> sem reinterpretar o texto a cada linha; índices de expressão
+    # em init_db). Bancos antigos são convertidos por migrar_payload_jsonb.
+    payload = deferred(Column(JSON().with_variant(JSONB(), "postgresql")))
     
     # ====== Cache do PDF ======
     # Armazena o PDF gerado para evitar regeneração a cada requisição
-    pdf_cache = Column(Text, nullable=True)  # PDF em base64 para compatibilidade
+    pdf_cache = deferred(Column(Text, nullable=True))  # PDF em base64 (legado; ver pdf_store)
     pdf_cached_at = Column(DateTime, nullable=True)  # Quando foi gerado
     pdf_payload_hash = Column(String(64), nullable=True)  # Hash do payload para invalidação
 
+    # Impressão digital de renderização (campos relevantes do payload + versão do motor),
+    # calculada ao salvar; valida os caches de HTML/ETag e de PDF sem serializar o payload
+    render_fingerprint = Column(String(64), nullable=True)
+
+    # ====== Vínculo normalizado (filtro de acesso da listagem) ======
+    # Mantidos ao gravar (coluna ou, no legado, payload): o filtro vira busca em índice
+    # em vez de regexp_replace/lower sobre a tabela inteira
+    cliente_telefone_norm = Column(String(32), nullable=True, index=True)  # só dígitos
+    cliente_nome_norm = Column(String(255), nullable=True, index=True)     # minúsculas, sem espaços nas pontas
+    owner_cliente_id = Column(String(64), nullable=True, index=True)       # cliente_id da coluna ou do payload
+
+    # Versão do payload (PATCH /propostas/<id> com If-Match): +1 a cada gravação do payload
+    versao = Column(Integer, nullable=False, default=1, server_default="1")
+
+    # ====== Resumo da listagem ======
+    # Campos do payload que /projetos/list mostra e filtra (RESUMO_CHAVES), copiados ao
+    # gravar: objeto pequeno, guardado na própria linha. A listagem não lê o payload
+    # (cada ->> nele descomprime o jsonb inteiro, vários MB)
+    resumo = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)
+
+
+# Colunas pesadas de 'propostas', fora das consultas por padrão
+PROPOSTA_COLUNAS_PESADAS = ("payload", "pdf_cache")
+# Loader option para os caminhos que precisam do payload (renderização, edição)
+CARREGAR_PAYLOAD = (undefer(PropostaDB.payload),)
+
+
+# Chaves do payload copiadas para propostas.resumo
+RESUMO_CHAVES = (
+    "nome_projeto", "cliente_id", "cliente_nome", "cliente_telefone", "cliente_email",
+    "email_cliente", "estado", "endereco_completo", "status", "prioridade", "consumo_medio",
+    "quantidade_modulos", "geracao_media_mensal", "area_estimada", "tipo_telhado",
+    "concessionaria", "preco_venda", "vendedor_email", "created_by_email", "marca_modulo",
+    "modulo_marca", "modelo_modulo", "modulo_modelo", "marca_inversor", "inversor_marca",
+    "modelo_inversor", "inversor_modelo",
+)
+
+
+def resumo_listagem(payload) -> dict:
+    """Subconjunto do payload guardado em propostas.resumo (chaves sem valor ficam de fora)."""
+    if not isinstance(payload, dict):
+        return {}
+    return {k: payload[k] for k in RESUMO_CHAVES if payload.get(k) is not None}
+
+
+def resumo_listagem_sql(payload_sql: str) -> str:
+    """
+    O mesmo resumo calculado no Postgres a partir de uma expressão jsonb (objeto):
+    uma passada por jsonb_each, em vez de um -> por chave.
+    """
+    chaves = ", ".join(f"'{k}'" for k in RESUMO_CHAVES)
+    return (
+        f"COALESCE((SELECT jsonb_object_agg(r.key, r.value) FROM jsonb_each({payload_sql}) r "
+        f"WHERE r.key = ANY(ARRAY[{chaves}]) AND jsonb_typeof(r.value) <> 'null'), '{{}}'::jsonb)"
+    )
+
+
+def get_proposta(db, proposta_id, payload: bool = False):
+    """
+    db.get da proposta. Com payload=True o JSON vem na mesma consulta — necessário
+    quando a sessão é fechada antes de ler row.payload (atributo adiado não carrega
+    em objeto desanexado).
+    """
+    return db.get(PropostaDB, proposta_id, options=CARREGAR_PAYLOAD if payload else None)
+
+
+def resumo_propostas_query(db, *extra, colunas=None):
+    """
+    Consulta leve de propostas: só as colunas escalares (nunca payload/pdf_cache),
+    mais expressões extras (ex.: campos do payload com ->>). Devolve linhas, não entidades.
+    """
+    if colunas is None:
+        cols = [c for c in PropostaDB.__table__.columns if c.name not in PROPOSTA_COLUNAS_PESADAS]
+    else:
+        cols = [getattr(PropostaDB, c) for c in colunas]
+    return db.query(*cols, *extra)
+
+
+class PdfCacheDB(Base):
+    """
+    Cache binário do PDF da proposta (bytea), fora da tabela 'propostas':
+    carregar a proposta não traz o PDF junto, e não há o inchaço de ~33% do base64.
+    Uma linha por proposta (o PDF do payload atual); `sha256` endereça a cópia
+    em disco (propostas/pdfs/<sha256>.pdf) usada para servir com Range.
+    """
+    __tablename__ = 'propostas_pdf_cache'
+
+    proposta_id = Column(String, ForeignKey('propostas.id', ondelete='CASCADE'), primary_key=True)
+    payload_hash = Column(String(64), nullable=False)  # chave de renderização (impressão digital + template)
+    sha256 = Column(String(64), nullable=False)
+    size = Column(Integer, nullable=False)
+    pdf = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class PropostaVisibilidadeDB(Base):
+    """
+    Quem (e-mail do usuário) vê cada proposta, materializado a partir das regras de
+    criador/dono do cliente (ver visibilidade.py). A PK (user_email, proposta_id)
+    atende a listagem de um usuário; o índice em proposta_id, as atualizações.
+    """
+    __tablename__ = 'proposta_visibilidade'
+
+    user_email = Column(String(255), primary_key=True)
+    proposta_id = Column(String, ForeignKey('propostas.id', ondelete='CASCADE'), primary_key=True, index=True)
+    via_cliente_id = Column(String(64), nullable=True)  # cliente do usuário inferido por telefone/nome
+
 
 class UserDB(Base):
     __tablename__ = 'users'
@@ -271,139 +509,503 @@ class ConfigDB(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
-def init_db():
-    Base.metadata.create_all(bind=engine)
+def _backfill_vinculo_normalizado(conn) -> None:
+    """
+    Preenche (uma vez) as colunas normalizadas das propostas antigas e traz
+    created_by/created_by_email do payload legado para as colunas. Linhas novas
+    são mantidas pelo listener em servidor_proposta (_atualizar_vinculo_normalizado).
+    Só Postgres (regexp_replace); no SQLite de dev o listener cobre ao salvar.
+    """
+    res = conn.execute(text(r"""
+        UPDATE propostas SET
+            cliente_telefone_norm = NULLIF(regexp_replace(
+                COALESCE(NULLIF(cliente_telefone, ''), payload->>'cliente_telefone', ''), '\D', '', 'g'), ''),
+            cliente_nome_norm = NULLIF(lower(trim(
+                COALESCE(NULLIF(cliente_nome, ''), payload->>'cliente_nome', ''))), ''),
+            owner_cliente_id = COALESCE(NULLIF(cliente_id, ''), NULLIF(payload->>'cliente_id', '')),
+            created_by = COALESCE(created_by, payload->>'created_by'),
+            created_by_email = COALESCE(created_by_email, payload->>'created_by_email')
+        WHERE cliente_telefone_norm IS NULL AND cliente_nome_norm IS NULL AND owner_cliente_id IS NULL
+          AND (cliente_telefone IS NOT NULL OR cliente_nome IS NOT NULL OR cliente_id IS NOT NULL
+               OR payload IS NOT NULL)
+    """))
+    if res.rowcount:
+        print(f"✅ Vínculo normalizado preenchido em {res.rowcount} propostas")
+
+
+# Linhas copiadas por transação na conversão json -> jsonb do payload
+PAYLOAD_JSONB_LOTE = max(1, int(os.getenv("PAYLOAD_JSONB_LOTE", "200")))
+
+# Índices de expressão sobre o payload (jsonb): mesmas expressões dos filtros da
+# listagem (servidor._aplicar_filtros_listagem) e do vínculo legado por cliente.
+# text_pattern_ops: atende "=" e LIKE 'prefixo%' (filtro por vendedor).
+_INDICES_PAYLOAD = {
+    "idx_propostas_p_created_by_email": "(lower(COALESCE(payload->>'created_by_email', '')) text_pattern_ops)",
+    "idx_propostas_p_vendedor_email": "(lower(COALESCE(payload->>'vendedor_email', '')) text_pattern_ops)",
+    "idx_propostas_p_cliente_id": "((payload->>'cliente_id'))",
+    "idx_propostas_p_cliente_nome": "(lower(trim(payload->>'cliente_nome')))",
+    "idx_propostas_p_cliente_telefone": r"(regexp_replace(payload->>'cliente_telefone', '\D', '', 'g'))",
+    "idx_propostas_p_status": "(COALESCE(payload->>'status', status, 'dimensionamento'))",
+}
+
+
+def _tipo_payload(conn) -> str:
+    return conn.execute(text(
+        "SELECT data_type FROM information_schema.columns "
+        "WHERE table_name = 'propostas' AND column_name = 'payload'"
+    )).scalar() or ""
+
+
+def _payload_jsonb_pendente(conn) -> bool:
+    """Ainda há linhas sem cópia em payload_jsonb (a troca só acontece sem pendências)."""
+    return bool(conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM propostas WHERE payload_jsonb IS NULL AND payload IS NOT NULL)"
+    )).scalar())
+
+
+def _preparar_payload_jsonb(conn) -> None:
+    """Coluna sombra payload_jsonb + trigger que a mantém nas gravações em andamento."""
+    conn.execute(text("ALTER TABLE propostas ADD COLUMN IF NOT EXISTS payload_jsonb jsonb"))
+    existe = conn.execute(text(
+        "SELECT 1 FROM pg_trigger WHERE tgname = 'trg_propostas_payload_jsonb'"
+    )).scalar()
+    if existe:
+        return
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION propostas_payload_jsonb_sync() RETURNS trigger AS $$
+        BEGIN
+            NEW.payload_jsonb := NEW.payload::jsonb;
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """))
+    conn.execute(text(
+        "CREATE TRIGGER trg_propostas_payload_jsonb BEFORE INSERT OR UPDATE OF payload "
+        "ON propostas FOR EACH ROW EXECUTE PROCEDURE propostas_payload_jsonb_sync()"
+    ))
+
+
+def _copiar_payload_jsonb() -> int:
+    """Cópia em lotes de PAYLOAD_JSONB_LOTE linhas, cada lote na sua transação."""
+    total = 0
+    while True:
+        with engine.begin() as conn:
+            n = conn.execute(text(
+                "UPDATE propostas SET payload_jsonb = payload::jsonb WHERE id IN ("
+                "SELECT id FROM propostas WHERE payload_jsonb IS NULL AND payload IS NOT NULL LIMIT :n)"
+            ), {"n": PAYLOAD_JSONB_LOTE}).rowcount
+        total += n
+        if not n:
+            return total
+
+
+def _trocar_payload_jsonb() -> None:
+    """Troca numa transação curta (lock_timeout): copia o resto e renomeia as colunas."""
+    with engine.begin() as conn:
+        conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+        conn.execute(text("LOCK TABLE propostas IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text(
+            "UPDATE propostas SET payload_jsonb = payload::jsonb "
+            "WHERE payload_jsonb IS NULL AND payload IS NOT NULL"
+        ))
+        conn.execute(text("DROP TRIGGER IF EXISTS trg_propostas_payload_jsonb ON propostas"))
+        conn.execute(text("ALTER TABLE propostas RENAME COLUMN payload TO payload_json_antigo"))
+        conn.execute(text("ALTER TABLE propostas RENAME COLUMN payload_jsonb TO payload"))
+        conn.execute(text("ALTER TABLE propostas DROP COLUMN payload_json_antigo"))
+        conn.execute(text("DROP FUNCTION IF EXISTS propostas_payload_jsonb_sync()"))
+    print("✅ propostas.payload convertido para jsonb")
+
+
+def _com_lock_payload(fn):
+    """Advisory lock: só um processo (worker/réplica/comando) mexe na conversão por vez."""
+    with engine.connect() as lock_conn:
+        if not lock_conn.execute(text("SELECT pg_try_advisory_lock(hashtext('fohat_payload_jsonb'))")).scalar():
+            print("ℹ️ Conversão do payload para jsonb em andamento em outro processo")
+            return None
+        try:
+            return fn()
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(hashtext('fohat_payload_jsonb'))"))
+
+
+def _payload_jsonb_no_boot() -> bool:
+    """
+    Parte da conversão json -> jsonb que roda no init_db (rápida): garante a coluna
+    sombra e o trigger e, se a cópia já terminou, faz a troca. A cópia em lotes fica
+    para migrar_payload_jsonb (agendar_migracoes_pendentes ou `python db.py migrar-payload`).
+    True se o payload já é jsonb.
+    """
+    def _passo():
+        with engine.begin() as conn:
+            if _tipo_payload(conn) != "json":
+                return True
+            _preparar_payload_jsonb(conn)
+            pendente = _payload_jsonb_pendente(conn)
+        if pendente:
+            print("ℹ️ propostas.payload ainda é json: cópia para jsonb fica para depois do boot")
+            return False
+        _trocar_payload_jsonb()
+        return True
+
+    try:
+        return bool(_com_lock_payload(_passo))
+    except Exception as e:
+        print(f"⚠️ Conversão do payload para jsonb adiada: {e}")
+        return False
+
+
+def migrar_payload_jsonb() -> bool:
+    """
+    Converte propostas.payload de json para jsonb sem travar a tabela durante a cópia
+    (ALTER ... TYPE jsonb reescreveria vários GB sob lock exclusivo):
+    1. coluna sombra payload_jsonb + trigger que a mantém nas gravações em andamento;
+    2. cópia em lotes de PAYLOAD_JSONB_LOTE linhas, cada lote na sua transação;
+    3. troca numa transação curta (lock_timeout): copia o resto, renomeia as colunas
+       e remove a antiga (DROP COLUMN não reescreve a tabela).
+    Concluída a troca, init_db() cria os índices do payload e grava a versão do schema.
+    Falha ou lock indisponível: o payload continua json e a próxima chamada retoma.
+    Só Postgres. Retorna True se o payload terminou como jsonb.
+    """
+    def _passo():
+        with engine.begin() as conn:
+            if _tipo_payload(conn) != "json":
+                return True
+            print("🔄 Convertendo propostas.payload para jsonb...")
+            _preparar_payload_jsonb(conn)
+        total = _copiar_payload_jsonb()
+        print(f"✅ Payload copiado para jsonb ({total} linhas)")
+        _trocar_payload_jsonb()
+        return True
+
+    if not str(DATABASE_URL).startswith("postgresql"):
+        return False
+    try:
+        if not _com_lock_payload(_passo):
+            return False
+    except Exception as e:
+        print(f"⚠️ Conversão do payload para jsonb adiada: {e}")
+        return False
+    init_db()
+    return True
+
+
+# Linhas por transação no preenchimento das colunas derivadas das propostas antigas
+DERIVADAS_LOTE = max(1, int(os.getenv("DERIVADAS_LOTE", "200")))
+
+
+def _derivadas_pendentes(conn) -> bool:
+    """Há propostas com payload e sem render_fingerprint/resumo (gravadas antes das colunas)."""
+    return bool(conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM propostas WHERE (render_fingerprint IS NULL OR resumo IS NULL) "
+        "AND payload IS NOT NULL)"
+    )).scalar())
+
+
+def preencher_colunas_derivadas() -> int:
+    """
+    Preenche render_fingerprint e resumo das propostas antigas em lotes de DERIVADAS_LOTE
+    linhas, cada lote na sua transação. No Postgres os dois são calculados no banco
+    (html_cache.render_fingerprint_sql, resumo_listagem_sql: o payload não vem para o
+    Python); no SQLite de dev, em Python. As leituras nunca gravam essas colunas (ver
+    servidor._fingerprint_row). Retorna o número de linhas preenchidas.
+    """
+    total = 0
+    postgres = str(DATABASE_URL).startswith("postgresql")
+    while True:
+        with engine.begin() as conn:
+            if postgres:
+                # Payload lido uma vez por linha (subconsulta); não-objeto vale como {}
+                n = conn.execute(text(
+                    "UPDATE propostas SET (render_fingerprint, resumo) = ("
+                    f"SELECT COALESCE(propostas.render_fingerprint, {render_fingerprint_sql('x.j')}), "
+                    f"COALESCE(propostas.resumo, {resumo_listagem_sql('x.j')}) "
+                    "FROM (SELECT CASE WHEN jsonb_typeof(propostas.payload::jsonb) = 'object' "
+                    "THEN propostas.payload::jsonb ELSE '{}'::jsonb END AS j) x) "
+                    "WHERE id IN (SELECT id FROM propostas WHERE (render_fingerprint IS NULL OR resumo IS NULL) "
+                    "AND payload IS NOT NULL LIMIT :n)"
+                ), {"n": DERIVADAS_LOTE}).rowcount
+            else:
+                linhas = conn.execute(text(
+                    "SELECT id, payload FROM propostas WHERE (render_fingerprint IS NULL OR resumo IS NULL) "
+                    "AND payload IS NOT NULL LIMIT :n"
+                ), {"n": DERIVADAS_LOTE}).all()
+                for proposta_id, payload in linhas:
+                    if isinstance(payload, str):
+                        payload = json.loads(payload)
+                    if not isinstance(payload, dict):
+                        payload = {}
+                    conn.execute(text(
+                        "UPDATE propostas SET render_fingerprint = COALESCE(render_fingerprint, :fp), "
+                        "resumo = COALESCE(resumo, :r) WHERE id = :i"
+                    ), {"fp": render_fingerprint(payload), "r": json.dumps(resumo_listagem(payload)), "i": proposta_id})
+                n = len(linhas)
+        total += n
+        if not n:
+            break
+    if total:
+        print(f"✅ render_fingerprint/resumo preenchidos em {total} propostas")
+    return total
+
+
+# Passos que ficaram pendentes no init_db deste processo (ver agendar_migracoes_pendentes)
+_payload_pendente = False
+_derivadas_pendentes_boot = False
+_migracao_pid = None
+
+
+def _migracoes_em_segundo_plano() -> None:
+    try:
+        if _payload_pendente:
+            migrar_payload_jsonb()
+        if _derivadas_pendentes_boot:
+            preencher_colunas_derivadas()
+            init_db()  # grava a versão do schema se nada mais ficou pendente
+    except Exception as e:
+        print(f"⚠️ Migração em segundo plano interrompida: {e}")
+
+
+def agendar_migracoes_pendentes() -> None:
+    """
+    Roda numa thread daemon, uma vez por processo, o que o init_db deixou para depois
+    do boot: a cópia json -> jsonb do payload e o preenchimento das colunas derivadas
+    (render_fingerprint, resumo).
+    Chamado no primeiro request de cada worker (depois do fork, então vale também
+    com --preload). PAYLOAD_JSONB_BACKGROUND=0 desliga: fica para os comandos
+    `python db.py migrar-payload` / `python db.py preencher-derivadas`.
+    """
+    global _migracao_pid
+    if not (_payload_pendente or _derivadas_pendentes_boot) or _migracao_pid == os.getpid():
+        return
+    _migracao_pid = os.getpid()
+    if os.getenv("PAYLOAD_JSONB_BACKGROUND", "1") in ("0", "false", "False"):
+        return
+    threading.Thread(target=_migracoes_em_segundo_plano, name="migracoes", daemon=True).start()
+
 
-    # Migração leve (sem Alembic): garantir novas colunas existam em produção.
+def _criar_indices_payload() -> bool:
+    """
+    Índices de expressão do payload, criados CONCURRENTLY (sem bloquear gravações).
+    False se o payload ainda não é jsonb ou algum índice falhou.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if _tipo_payload(conn) != "jsonb":
+            return False
+        ok = True
+        for nome, expressao in _INDICES_PAYLOAD.items():
+            try:
+                conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON propostas {expressao}"))
+            except Exception as e:
+                ok = False
+                print(f"⚠️ Falha ao criar índice {nome}: {e}")
+        return ok
+
+
+# Versão dos passos de dados/índices de _passos_postgres: subir ao acrescentar um passo.
+# Colunas novas nos modelos mudam a assinatura sozinhas (ver _assinatura_schema).
+# 2: render_fingerprint das propostas antigas; 3: resumo da listagem (preencher_colunas_derivadas)
+SCHEMA_VERSAO = 3
+
+
+class SchemaVersionDB(Base):
+    """Assinatura do schema já aplicado: workers que a encontram em dia pulam a migração."""
+    __tablename__ = 'schema_version'
+
+    id = Column(Integer, primary_key=True)
+    versao = Column(String(80), nullable=False)
+    aplicado_em = Column(DateTime, default=datetime.utcnow)
+
+
+def _assinatura_schema() -> str:
+    """SCHEMA_VERSAO + hash das tabelas/colunas/tipos declarados nos modelos."""
+    partes = []
+    for tabela in Base.metadata.sorted_tables:
+        for coluna in tabela.columns:
+            partes.append(f"{tabela.name}.{coluna.name}:{coluna.type.compile(dialect=engine.dialect)}")
+    digest = hashlib.sha256("|".join(partes).encode("utf-8")).hexdigest()[:16]
+    return f"{SCHEMA_VERSAO}-{digest}"
+
+
+def _versao_gravada(conn=None):
+    """Assinatura registrada em schema_version (None se a tabela ainda não existe)."""
+    consulta = text("SELECT versao FROM schema_version WHERE id = 1")
+    try:
+        if conn is None:
+            with engine.connect() as c:
+                return c.execute(consulta).scalar()
+        # Dentro da transação da migração: savepoint para o erro não abortá-la
+        with conn.begin_nested():
+            return conn.execute(consulta).scalar()
+    except Exception:
+        return None
+
+
+def _gravar_versao(conn, assinatura: str) -> None:
+    if not conn.execute(text("UPDATE schema_version SET versao = :v, aplicado_em = :t WHERE id = 1"),
+                        {"v": assinatura, "t": datetime.utcnow()}).rowcount:
+        conn.execute(text("INSERT INTO schema_version (id, versao, aplicado_em) VALUES (1, :v, :t)"),
+                     {"v": assinatura, "t": datetime.utcnow()})
+
+
+def _catalogo_colunas(conn) -> set:
+    """(tabela, coluna) de todas as tabelas do banco, numa consulta só."""
+    if str(DATABASE_URL).startswith("postgresql"):
+        rows = conn.execute(text(
+            "SELECT table_name, column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema()"
+        ))
+    else:
+        rows = conn.execute(text(
+            "SELECT m.name, p.name FROM sqlite_master m JOIN pragma_table_info(m.name) p "
+            "WHERE m.type = 'table'"
+        ))
+    return {(t, c) for t, c in rows}
+
+
+def _ddl_coluna(coluna) -> str:
+    """
+    Definição da coluna para ALTER TABLE ... ADD COLUMN. O DEFAULT sai pelo compilador
+    de DDL do dialeto: string vira literal entre aspas (aspas internas escapadas) e
+    text()/expressões saem como estão.
+    """
+    ddl = f"{coluna.name} {coluna.type.compile(dialect=engine.dialect)}"
+    padrao = engine.dialect.ddl_compiler(engine.dialect, None).get_column_default_string(coluna)
+    if padrao is not None:
+        ddl += f" DEFAULT {padrao}"
+        if not coluna.nullable:
+            ddl += " NOT NULL"
+    return ddl
+
+
+def _adicionar_colunas_faltantes(conn) -> int:
+    """Compara o catálogo com os modelos e adiciona as colunas que faltam."""
+    existentes = _catalogo_colunas(conn)
+    tabelas = {t for t, _ in existentes}
+    novas = 0
+    for tabela in Base.metadata.sorted_tables:
+        if tabela.name not in tabelas:
+            continue
+        for coluna in tabela.columns:
+            if coluna.primary_key or (tabela.name, coluna.name) in existentes:
+                continue
+            conn.execute(text(f"ALTER TABLE {tabela.name} ADD COLUMN {_ddl_coluna(coluna)}"))
+            print(f"✅ Coluna '{coluna.name}' adicionada à tabela '{tabela.name}'")
+            novas += 1
+    return novas
+
+
+def _passos_postgres(conn) -> bool:
+    """Índices e preenchimentos de dados. Cada passo num savepoint; False se algum falhou."""
+    passos = [
+        ("índices básicos", [
+            "CREATE INDEX IF NOT EXISTS idx_propostas_status ON propostas(status)",
+            "CREATE INDEX IF NOT EXISTS idx_propostas_cliente_id ON propostas(cliente_id)",
+            "CREATE INDEX IF NOT EXISTS idx_propostas_concessionaria ON propostas(concessionaria)",
+        ]),
+        # Listagem paginada por (created_at, id): created_at não pode ser nulo no cursor
+        ("cursor da listagem", [
+            "UPDATE propostas SET created_at = COALESCE(updated_at, NOW()) WHERE created_at IS NULL",
+            "CREATE INDEX IF NOT EXISTS idx_propostas_created_at_id ON propostas(created_at, id)",
+        ]),
+        # Filtro de acesso por dono: colunas normalizadas + índices
+        ("vínculo normalizado", [
+            _backfill_vinculo_normalizado,
+            "CREATE INDEX IF NOT EXISTS idx_propostas_tel_norm ON propostas(cliente_telefone_norm)",
+            "CREATE INDEX IF NOT EXISTS idx_propostas_nome_norm ON propostas(cliente_nome_norm)",
+            "CREATE INDEX IF NOT EXISTS idx_propostas_owner_cliente ON propostas(owner_cliente_id)",
+            "CREATE INDEX IF NOT EXISTS idx_propostas_created_by_email ON propostas(created_by_email)",
+        ]),
+        # Filtros da listagem sobre o resumo (servidor._aplicar_filtros_listagem)
+        ("resumo da listagem", [
+            "CREATE INDEX IF NOT EXISTS idx_propostas_r_status "
+            "ON propostas ((COALESCE(resumo->>'status', status, 'dimensionamento')))",
+            "CREATE INDEX IF NOT EXISTS idx_propostas_r_vendedor_email "
+            "ON propostas ((lower(COALESCE(resumo->>'vendedor_email', ''))) text_pattern_ops)",
+        ]),
+    ]
+    ok = True
+    for nome, comandos in passos:
+        try:
+            with conn.begin_nested():
+                for comando in comandos:
+                    if callable(comando):
+                        comando(conn)
+                    else:
+                        conn.execute(text(comando))
+        except Exception as e:
+            ok = False
+            print(f"⚠️ Falha na migração ({nome}): {e}")
+    return ok
+
+
+def init_db():
+    """
+    Migração leve (sem Alembic). Caminho rápido: uma consulta a schema_version; se a
+    assinatura bate com os modelos, nada mais roda. Senão, numa transação (advisory
+    lock no Postgres): create_all, catálogo de colunas numa consulta, ALTERs do que
+    falta e passos de dados/índices; depois o passo de boot da conversão do payload
+    para jsonb (trigger + troca, se a cópia já terminou). A cópia em lotes e o
+    preenchimento das colunas derivadas rodam fora do boot (agendar_migracoes_pendentes
+    ou os comandos de `python db.py`). A versão só é gravada se tudo concluiu (o que
+    ficou pendente ou falhou é refeito na próxima subida).
+    """
+    global _payload_pendente, _derivadas_pendentes_boot
+    assinatura = _assinatura_schema()
+    if _versao_gravada() == assinatura:
+        print(f"✅ Schema em dia ({assinatura})")
+        return
+    postgres = str(DATABASE_URL).startswith("postgresql")
+    completo = True
     try:
         with engine.begin() as conn:
-            from sqlalchemy import text
-            
-            if str(DATABASE_URL).startswith("postgresql"):
-                # Função auxiliar para verificar e adicionar coluna
-                def add_column_if_not_exists(table: str, column: str, col_type: str):
-                    try:
-                        r = conn.execute(
-                            text(f"SELECT 1 FROM information_schema.columns WHERE table_name='{table}' AND column_name='{column}' LIMIT 1")
-                        ).fetchone()
-                        if not r:
-                            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}"))
-                            print(f"✅ Coluna '{column}' adicionada à tabela '{table}'")
-                    except Exception as e:
-                        print(f"⚠️ Erro ao adicionar coluna {column}: {e}")
-                
-                # Migrações para tabela 'users'
-                add_column_if_not_exists('users', 'password_hash', 'TEXT')
-                add_column_if_not_exists('users', 'telefone', 'VARCHAR(50)')
-                
-                # Migrações para tabela 'clientes'
-                add_column_if_not_exists('clientes', 'numero', 'VARCHAR(64)')
-                
-                # Migrações para tabela 'propostas' - novas colunas
-                add_column_if_not_exists('propostas', 'updated_at', 'TIMESTAMP')
-                add_column_if_not_exists('propostas', 'nome_projeto', 'VARCHAR(255)')
-                add_column_if_not_exists('propostas', 'status', 'VARCHAR(64)')
-                add_column_if_not_exists('propostas', 'estado', 'VARCHAR(32)')
-                add_column_if_not_exists('propostas', 'cep', 'VARCHAR(32)')
-                add_column_if_not_exists('propostas', 'logradouro', 'VARCHAR(255)')
-                add_column_if_not_exists('propostas', 'numero', 'VARCHAR(64)')
-                add_column_if_not_exists('propostas', 'bairro', 'VARCHAR(255)')
-                add_column_if_not_exists('propostas', 'complemento', 'VARCHAR(255)')
-                add_column_if_not_exists('propostas', 'concessionaria', 'VARCHAR(255)')
-                add_column_if_not_exists('propostas', 'potencia_kw', 'FLOAT')
-                add_column_if_not_exists('propostas', 'tipo_telhado', 'VARCHAR(64)')
-                add_column_if_not_exists('propostas', 'tensao', 'VARCHAR(32)')
-                add_column_if_not_exists('propostas', 'preco_venda', 'FLOAT')
-                add_column_if_not_exists('propostas', 'consumo_mensal_reais', 'FLOAT')
-                add_column_if_not_exists('propostas', 'margem_adicional_percentual', 'FLOAT')
-                add_column_if_not_exists('propostas', 'margem_adicional_kwh', 'FLOAT')
-                add_column_if_not_exists('propostas', 'margem_adicional_reais', 'FLOAT')
-                add_column_if_not_exists('propostas', 'modulo_marca', 'VARCHAR(255)')
-                add_column_if_not_exists('propostas', 'modulo_modelo', 'VARCHAR(255)')
-                add_column_if_not_exists('propostas', 'inversor_marca', 'VARCHAR(255)')
-                add_column_if_not_exists('propostas', 'inversor_modelo', 'VARCHAR(255)')
-                add_column_if_not_exists('propostas', 'tipo_inversor', 'VARCHAR(64)')
-                add_column_if_not_exists('propostas', 'vendedor_nome', 'VARCHAR(255)')
-                add_column_if_not_exists('propostas', 'vendedor_email', 'VARCHAR(255)')
-                add_column_if_not_exists('propostas', 'vendedor_telefone', 'VARCHAR(64)')
-                add_column_if_not_exists('propostas', 'vendedor_cargo', 'VARCHAR(255)')
-                add_column_if_not_exists('propostas', 'proposta_id', 'VARCHAR(64)')
-                add_column_if_not_exists('propostas', 'url_proposta', 'TEXT')
-                
-                # Cache do PDF
-                add_column_if_not_exists('propostas', 'pdf_cache', 'TEXT')
-                add_column_if_not_exists('propostas', 'pdf_cached_at', 'TIMESTAMP')
-                add_column_if_not_exists('propostas', 'pdf_payload_hash', 'VARCHAR(64)')
-                
-                # Custos Detalhados
-                add_column_if_not_exists('propostas', 'custo_transporte', 'FLOAT')
-                add_column_if_not_exists('propostas', 'custo_ca_aterramento', 'FLOAT')
-                add_column_if_not_exists('propostas', 'custo_placas_sinalizacao', 'FLOAT')
-                add_column_if_not_exists('propostas', 'custo_despesas_gerais', 'FLOAT')
-                add_column_if_not_exists('propostas', 'custo_operacional', 'FLOAT')
-                
-                # DRE do Projeto
-                add_column_if_not_exists('propostas', 'valor_comissao', 'FLOAT')
-                add_column_if_not_exists('propostas', 'despesas_obra', 'FLOAT')
-                add_column_if_not_exists('propostas', 'despesas_diretoria', 'FLOAT')
-                add_column_if_not_exists('propostas', 'impostos', 'FLOAT')
-                add_column_if_not_exists('propostas', 'lldi', 'FLOAT')
-                add_column_if_not_exists('propostas', 'divisao_lucro', 'FLOAT')
-                add_column_if_not_exists('propostas', 'fundo_caixa', 'FLOAT')
-                
-                # Formas de Pagamento
-                add_column_if_not_exists('propostas', 'preco_avista', 'FLOAT')
-                add_column_if_not_exists('propostas', 'desconto_avista', 'FLOAT')
-                add_column_if_not_exists('propostas', 'parcelas_json', 'JSON')
-                
-                # Criar índices se não existirem
-                try:
-                    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_propostas_status ON propostas(status)"))
-                    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_propostas_cliente_id ON propostas(cliente_id)"))
-                    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_propostas_concessionaria ON propostas(concessionaria)"))
-                except Exception:
-                    pass
-                    
-            elif str(DATABASE_URL).startswith("sqlite"):
-                # SQLite: tentar adicionar colunas se não existirem
-                def add_sqlite_column(table: str, column: str, col_type: str):
-                    try:
-                        r = conn.execute(text(f"PRAGMA table_info({table})")).fetchall()
-                        cols = {row[1] for row in (r or [])}
-                        if column not in cols:
-                            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {col_type}"))
-                    except Exception:
-                        pass
-                
-                add_sqlite_column('users', 'password_hash', 'TEXT')
-                add_sqlite_column('users', 'telefone', 'VARCHAR(50)')
-                # Adicionar novas colunas da proposta
-                for col, typ in [
-                    ('updated_at', 'TIMESTAMP'), ('nome_projeto', 'TEXT'), ('status', 'TEXT'),
-                    ('estado', 'TEXT'), ('cep', 'TEXT'), ('logradouro', 'TEXT'), ('numero', 'TEXT'),
-                    ('bairro', 'TEXT'), ('complemento', 'TEXT'), ('concessionaria', 'TEXT'),
-                    ('potencia_kw', 'REAL'), ('tipo_telhado', 'TEXT'), ('tensao', 'TEXT'),
-                    ('preco_venda', 'REAL'), ('consumo_mensal_reais', 'REAL'),
-                    ('margem_adicional_percentual', 'REAL'), ('margem_adicional_kwh', 'REAL'),
-                    ('margem_adicional_reais', 'REAL'), ('modulo_marca', 'TEXT'), ('modulo_modelo', 'TEXT'),
-                    ('inversor_marca', 'TEXT'), ('inversor_modelo', 'TEXT'), ('tipo_inversor', 'TEXT'),
-                    ('vendedor_nome', 'TEXT'), ('vendedor_email', 'TEXT'), ('vendedor_telefone', 'TEXT'),
-                    ('vendedor_cargo', 'TEXT'), ('proposta_id', 'TEXT'), ('url_proposta', 'TEXT'),
-                    ('pdf_cache', 'TEXT'), ('pdf_cached_at', 'TIMESTAMP'), ('pdf_payload_hash', 'TEXT'),
-                    # Custos Detalhados
-                    ('custo_transporte', 'REAL'), ('custo_ca_aterramento', 'REAL'),
-                    ('custo_placas_sinalizacao', 'REAL'), ('custo_despesas_gerais', 'REAL'),
-                    ('custo_operacional', 'REAL'),
-                    # DRE do Projeto
-                    ('valor_comissao', 'REAL'), ('despesas_obra', 'REAL'), ('despesas_diretoria', 'REAL'),
-                    ('impostos', 'REAL'), ('lldi', 'REAL'), ('divisao_lucro', 'REAL'), ('fundo_caixa', 'REAL'),
-                    # Formas de Pagamento
-                    ('preco_avista', 'REAL'), ('desconto_avista', 'REAL'), ('parcelas_json', 'TEXT')
-                ]:
-                    add_sqlite_column('propostas', col, typ)
+            if postgres:
+                conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('fohat_schema'))"))
+                if _versao_gravada(conn) == assinatura:
+                    return  # outro processo migrou enquanto esperávamos o lock
+            Base.metadata.create_all(bind=conn)
+            novas = _adicionar_colunas_faltantes(conn)
+            if postgres:
+                completo = _passos_postgres(conn)
+            print(f"✅ Schema migrado: {novas} coluna(s) nova(s)")
     except Exception as e:
         print(f"⚠️ Erro na migração do banco: {e}")
-        # best-effort
-        pass
+        return
 
+    if postgres:
+        try:
+            _payload_pendente = not _payload_jsonb_no_boot()
+            completo = _criar_indices_payload() and completo
+        except Exception as e:
+            completo = False
+            print(f"⚠️ Erro na migração do payload para jsonb: {e}")
 
+    try:
+        with engine.connect() as conn:
+            _derivadas_pendentes_boot = _derivadas_pendentes(conn)
+        if _derivadas_pendentes_boot:
+            completo = False
+            print("ℹ️ Propostas sem render_fingerprint/resumo: preenchimento fica para depois do boot")
+    except Exception as e:
+        completo = False
+        print(f"⚠️ Falha ao verificar colunas derivadas: {e}")
+
+    if completo:
+        try:
+            with engine.begin() as conn:
+                _gravar_versao(conn, assinatura)
+        except Exception as e:
+            print(f"⚠️ Falha ao gravar versão do schema: {e}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python db.py migrar-payload: conversão json -> jsonb do payload fora do servidor
+    if sys.argv[1:] == ["migrar-payload"]:
+        sys.exit(0 if migrar_payload_jsonb() else 1)
+    # python db.py preencher-derivadas: render_fingerprint/resumo das propostas antigas
+    if sys.argv[1:] == ["preencher-derivadas"]:
+        preencher_colunas_derivadas()
+        init_db()
+        sys.exit(0)
+    print("Uso: python db.py migrar-payload | preencher-derivadas")
+    sys.exit(2)
@@ -0,0 +1,592 @@
+#!/usr/bin/env python3
+"""
+graficos_pool.py
+================
+Renderização dos gráficos estáticos (PNG) da proposta em um pool de processos.
+
+Antes os cinco gráficos eram desenhados um após o outro na thread da requisição,
+então o tempo total era a SOMA dos cinco. Aqui cada gráfico é uma função de topo
+(picklável) executada em um ProcessPoolExecutor "quente":
+- cada worker importa o pyplot e aplica o tema visual UMA vez (initializer);
+- os cinco gráficos rodam em paralelo e o tempo fica limitado pelo mais lento;
+- o lote tem prazo de GRAFICOS_TIMEOUT_S por rodada de workers (5 gráficos em 2
+  workers = 3 rodadas); gráfico que não terminar nele é omitido (quem chama mantém
+  o fallback, ex.: graficos_base64 pré-salvo) e o pool é descartado com os workers
+  encerrados, para um gráfico travado não ocupar o pool das próximas propostas;
+- cada gráfico converte os próprios dados: valor inválido derruba só aquele gráfico;
+- `warmup()` sobe o pool no início de cada worker do gunicorn (gunicorn.conf.py);
+- se o pool quebrar (worker morto, ambiente sem multiprocessing), os gráficos
+  pendentes são desenhados inline no processo atual.
+
+Variáveis de ambiente:
+- GRAFICOS_POOL_WORKERS: nº de processos (0 desliga o pool e desenha inline)
+- GRAFICOS_TIMEOUT_S: prazo (segundos) por rodada de workers
+- GRAFICOS_POOL_START_METHOD: forkserver | spawn | fork
+"""
+from __future__ import annotations
+
+import io
+import os
+import threading
+import multiprocessing
+from concurrent.futures import CancelledError, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+
+# ====== TEMA VISUAL PREMIUM - Design Moderno 2024 ======
+# Paleta de cores vibrante e moderna
+BRAND_BLUE = "#2563EB"       # Azul vibrante (mais moderno)
+BRAND_BLUE_DARK = "#1D4ED8"  # Azul escuro para contraste
+BRAND_GREEN = "#10B981"      # Verde esmeralda vibrante
+BRAND_GREEN_DARK = "#059669" # Verde escuro
+BRAND_RED = "#EF4444"        # Vermelho coral moderno
+BRAND_RED_DARK = "#DC2626"   # Vermelho escuro
+BRAND_ORANGE = "#F59E0B"     # Laranja para destaque
+BRAND_TEXT = "#1E293B"       # Texto principal (slate-800)
+BRAND_MUTED = "#64748B"      # Texto secundário (slate-500)
+BRAND_GRID = "#E2E8F0"       # Grid suave (slate-200)
+BRAND_BG = "#FFFFFF"         # Fundo branco
+
+MESES = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
+
+GRAFICOS_POOL_WORKERS = int(os.environ.get("GRAFICOS_POOL_WORKERS", str(min(5, max(2, os.cpu_count() or 2)))))
+GRAFICOS_TIMEOUT_S = float(os.environ.get("GRAFICOS_TIMEOUT_S", "20"))
+
+# Módulos carregados pelo initializer (None até o tema ser aplicado neste processo)
+plt = None
+np = None
+FuncFormatter = None
+
+
+def _init_worker() -> None:
+    """Importa o Matplotlib (backend Agg) e aplica o tema global uma única vez por processo."""
+    global plt, np, FuncFormatter
+    if plt is not None:
+        return
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as _plt
+    from matplotlib.ticker import FuncFormatter as _FuncFormatter
+    import numpy as _np
+
+    # Configuração global de alta qualidade
+    _plt.rcParams.update({
+        "figure.facecolor": BRAND_BG,
+        "axes.facecolor": BRAND_BG,
+        "savefig.facecolor": BRAND_BG,
+        "font.family": "sans-serif",
+        "font.sans-serif": ["Poppins", "Inter", "Segoe UI", "DejaVu Sans", "Arial"],
+        "font.size": 14,
+        "font.weight": "medium",
+        "axes.edgecolor": BRAND_GRID,
+        "axes.labelcolor": BRAND_TEXT,
+        "axes.labelweight": "bold",
+        "axes.titleweight": "bold",
+        "xtick.color": BRAND_MUTED,
+        "ytick.color": BRAND_MUTED,
+        "xtick.labelsize": 13,
+        "ytick.labelsize": 13,
+        "legend.fontsize": 14,
+        "legend.frameon": False,
+        "figure.dpi": 100,
+    })
+    plt, np, FuncFormatter = _plt, _np, _FuncFormatter
+
+
+def _warm_worker() -> None:
+    """Initializer do pool: falha de import não pode derrubar o pool (o erro aparece por gráfico)."""
+    try:
+        _init_worker()
+    except Exception as e:
+        print(f"❌ [GRAFICOS] Matplotlib indisponível no worker: {e}")
+
+
+# ====== Helpers de desenho ======
+
+def _to_png(fig) -> bytes:
+    buf = io.BytesIO()
+    # DPI alto para máxima qualidade e nitidez
+    fig.savefig(buf, format="png", dpi=220, bbox_inches="tight",
+                pad_inches=0.15, transparent=False)
+    plt.close(fig)
+    return buf.getvalue()
+
+
+def _fmt_compact(v, _pos=None):
+    """Formatar valores em formato compacto e legível"""
+    try:
+        v = float(v)
+    except Exception:
+        return ""
+    av = abs(v)
+    if av >= 1_000_000:
+        return f"R$ {v/1_000_000:.1f} mi"
+    if av >= 1_000:
+        return f"R$ {v/1_000:.0f} mil"
+    return f"R$ {v:,.0f}"
+
+
+def _fmt_brl_full(v):
+    """Formatar valor em BRL completo"""
+    try:
+        v = float(v)
+        if v >= 1_000_000:
+            return f"R$ {v/1_000_000:.2f} milhões"
+        if v >= 1_000:
+            return f"R$ {v:,.0f}".replace(",", ".")
+        return f"R$ {v:.0f}"
+    except Exception:
+        return "R$ 0"
+
+
+def _style_axes_modern(ax, show_y_grid=True):
+    """Estilização moderna dos eixos - limpo e elegante"""
+    # Grid suave apenas no eixo Y
+    if show_y_grid:
+        ax.grid(True, axis="y", color=BRAND_GRID, linewidth=1.5, alpha=0.8, linestyle="-")
+    ax.grid(False, axis="x")
+
+    # Remover bordas desnecessárias
+    for side in ["top", "right"]:
+        ax.spines[side].set_visible(False)
+    for side in ["left", "bottom"]:
+        ax.spines[side].set_color(BRAND_GRID)
+        ax.spines[side].set_linewidth(1.5)
+
+    # Ticks mais elegantes
+    ax.tick_params(axis="both", which="both", length=0, pad=10)
+    ax.set_axisbelow(True)
+
+    # Fontes maiores e mais legíveis
+    for label in ax.get_xticklabels():
+        label.set_fontsize(14)
+        label.set_fontweight("600")
+        label.set_color(BRAND_MUTED)
+    for label in ax.get_yticklabels():
+        label.set_fontsize(13)
+        label.set_fontweight("500")
+        label.set_color(BRAND_MUTED)
+
+
+# ====== Gráficos (funções de topo para serem pickláveis) ======
+# Todas recebem o dict `dados` montado por process_template_html:
+#   cas, ca, fca, prod, consumo_vec (listas de números, ainda não convertidas),
+#   gasto_total_25_anos, preco_venda, economia_total_25_calc
+# e retornam os bytes do PNG, ou None quando não há dados suficientes.
+
+def grafico1(dados: Dict[str, Any]) -> Optional[bytes]:
+    """Slide 03 - Gasto Acumulado (Linha com área)"""
+    _init_worker()
+    cas = dados.get("cas") or []
+    idxs = [0, 4, 9, 14, 19, 24]
+    xs = [f"Ano {i+1}" for i in idxs]
+    ys = [float(cas[i]) for i in idxs] if len(cas) >= 25 else []
+    if not ys:
+        return None
+    fig, ax = plt.subplots(figsize=(14, 9.5))
+
+    # Linha principal com marcadores destacados
+    ax.plot(xs, ys, color=BRAND_BLUE, linewidth=4, marker="o",
+            markersize=12, markerfacecolor=BRAND_BLUE,
+            markeredgecolor="white", markeredgewidth=3, zorder=5)
+
+    # Área com gradiente suave
+    ax.fill_between(range(len(ys)), ys, [0]*len(ys),
+                    color=BRAND_BLUE, alpha=0.12)
+
+    ax.set_ylim(0, max(ys)*1.18 if ys else 1)
+    _style_axes_modern(ax)
+    ax.yaxis.set_major_formatter(FuncFormatter(_fmt_compact))
+
+    # Labels grandes e destacados nos pontos
+    for xi, yi in enumerate(ys):
+        ax.annotate(
+            _fmt_compact(yi),
+            xy=(xi, yi),
+            xytext=(0, 30),
+            textcoords="offset points",
+            ha='center', va='bottom',
+            fontsize=15,
+            fontweight='bold',
+            color=BRAND_TEXT,
+            bbox=dict(boxstyle='round,pad=0.3', facecolor='white',
+                      edgecolor=BRAND_GRID, alpha=0.9)
+        )
+
+    fig.tight_layout(pad=1.5)
+    return _to_png(fig)
+
+
+def grafico2(dados: Dict[str, Any]) -> Optional[bytes]:
+    """Slide 04 - Custo Anual (não usado no template copy)"""
+    _init_worker()
+    ca = dados.get("ca") or []
+    if not ca:
+        return None
+    xs = [f"Ano {i+1}" for i in range(len(ca))]
+    ys = [float(v) for v in ca]
+    fig, ax = plt.subplots(figsize=(12, 5))
+    ax.plot(xs, ys, color=BRAND_BLUE, linewidth=3.5)
+    ax.fill_between(range(len(ys)), ys, [0]*len(ys), color=BRAND_BLUE, alpha=0.1)
+    _style_axes_modern(ax)
+    ax.yaxis.set_major_formatter(FuncFormatter(_fmt_compact))
+
+    # Mostrar apenas alguns anos no eixo X
+    tick_positions = [0, 4, 9, 14, 19, 24]
+    ax.set_xticks(tick_positions)
+    ax.set_xticklabels([xs[i] for i in tick_positions if i < len(xs)], fontsize=13)
+
+    fig.tight_layout(pad=1.5)
+    return _to_png(fig)
+
+
+def grafico3(dados: Dict[str, Any]) -> Optional[bytes]:
+    """Slide 05 - Consumo x Produção (Barras Duplas)"""
+    _init_worker()
+    consumo_vec = dados.get("consumo_vec")
+    prod = dados.get("prod")
+    if not (isinstance(consumo_vec, list) and len(consumo_vec) == 12 and isinstance(prod, list) and len(prod) == 12):
+        return None
+    consumo_vec = [float(v or 0.0) for v in consumo_vec]
+    prod = [float(v) for v in prod]
+    # Figura maior verticalmente para ocupar todo o espaço do card
+    fig, ax = plt.subplots(figsize=(14, 9.5))
+    x = np.arange(12)
+    width = 0.38
+
+    # Barras com cores vibrantes (sem label para legenda)
+    ax.bar(x - width/2, consumo_vec, width, color=BRAND_BLUE,
+           alpha=0.92, edgecolor='white', linewidth=1.7)
+    ax.bar(x + width/2, prod, width, color=BRAND_GREEN,
+           alpha=0.92, edgecolor='white', linewidth=1.7)
+
+    ax.set_xticks(x)
+    ax.set_xticklabels(MESES, fontsize=15, fontweight='700')
+    _style_axes_modern(ax)
+
+    # Espaço para labels em cima das colunas
+    ymax = max(max(consumo_vec), max(prod)) if (consumo_vec and prod) else 1
+    ax.set_ylim(0, ymax * 1.18)
+
+    # Labels em TODAS as colunas (consumo e produção)
+    for i in range(12):
+        try:
+            cv = float(consumo_vec[i])
+            pv = float(prod[i])
+            # Label do consumo (azul)
+            ax.annotate(f"{cv:.0f}", xy=(i - width/2, cv), xytext=(0, 4),
+                        textcoords="offset points", ha='center', va='bottom',
+                        fontsize=16, fontweight='bold', color=BRAND_BLUE_DARK)
+            # Label da produção (verde)
+            ax.annotate(f"{pv:.0f}", xy=(i + width/2, pv), xytext=(0, 4),
+                        textcoords="offset points", ha='center', va='bottom',
+                        fontsize=16, fontweight='bold', color=BRAND_GREEN_DARK)
+        except Exception:
+            pass
+
+    # Ajustar margens para ocupar melhor o espaço
+    fig.subplots_adjust(left=0.05, right=0.98, top=0.95, bottom=0.12)
+    fig.tight_layout(pad=1.0)
+    return _to_png(fig)
+
+
+def grafico4(dados: Dict[str, Any]) -> Optional[bytes]:
+    """Slide 07 - Payback (Fluxo de Caixa Acumulado)"""
+    _init_worker()
+    fca = dados.get("fca") or []
+    if not fca:
+        return None
+    xs_labels = [f"Ano {i+1}" for i in range(len(fca))]
+    ys = [float(v) for v in fca]
+    pay_idx = next((i for i, v in enumerate(ys) if v >= 0), None)
+
+    fig, ax = plt.subplots(figsize=(14, 9.5))
+    x_positions = list(range(len(fca)))
+
+    # Linha principal
+    ax.plot(x_positions, ys, color=BRAND_GREEN, linewidth=4, zorder=4)
+
+    # Área colorida (vermelho abaixo de zero, verde acima)
+    ys_neg = [min(y, 0) for y in ys]
+    ys_pos = [max(y, 0) for y in ys]
+    ax.fill_between(x_positions, ys_neg, 0, color=BRAND_RED, alpha=0.15)
+    ax.fill_between(x_positions, 0, ys_pos, color=BRAND_GREEN, alpha=0.15)
+
+    # Linha do zero destacada
+    ax.axhline(0, color=BRAND_TEXT, linewidth=2, alpha=0.3, linestyle='-')
+
+    _style_axes_modern(ax)
+    ax.yaxis.set_major_formatter(FuncFormatter(_fmt_compact))
+
+    # Apenas alguns anos no eixo X
+    tick_idx = [0, 4, 9, 14, 19, 24]
+    ax.set_xticks(tick_idx)
+    ax.set_xticklabels([xs_labels[i] for i in tick_idx if i < len(xs_labels)], fontsize=13)
+
+    # Destaque do ponto de payback
+    if pay_idx is not None:
+        ax.axvline(pay_idx, color=BRAND_ORANGE, linestyle="--", linewidth=3, alpha=0.8)
+        ax.scatter([pay_idx], [ys[pay_idx]], s=200, color=BRAND_ORANGE,
+                   edgecolors="white", linewidths=3, zorder=6)
+
+        # Label do payback com destaque
+        ax.annotate(
+            f"PAYBACK\nAno {pay_idx+1}",
+            xy=(pay_idx, ys[pay_idx]),
+            xytext=(-100, 20),
+            textcoords="offset points",
+            fontsize=16,
+            fontweight='bold',
+            color=BRAND_ORANGE,
+            ha='left',
+            bbox=dict(boxstyle='round,pad=0.5', facecolor='white',
+                      edgecolor=BRAND_ORANGE, linewidth=2, alpha=0.95),
+            arrowprops=dict(arrowstyle='->', color=BRAND_ORANGE, lw=2)
+        )
+
+    fig.tight_layout(pad=1.5)
+    return _to_png(fig)
+
+
+def grafico5(dados: Dict[str, Any]) -> Optional[bytes]:
+    """Slide 11 - Comparativo 25 Anos vs Investimento"""
+    _init_worker()
+    cas = dados.get("cas") or []
+    if cas:
+        sem_solar_25 = float(cas[-1])
+    else:
+        sem_solar_25 = float(dados.get("gasto_total_25_anos", 0) or 0.0)
+    inv = float(dados.get("preco_venda", 0) or 0.0)
+    economia_total_25_calc = float(dados.get("economia_total_25_calc", 0) or 0.0)
+
+    fig, ax = plt.subplots(figsize=(14, 9.5))
+    labels = ["Gasto SEM\nenergia solar\n(25 anos)", "Investimento\nno sistema"]
+    vals = [sem_solar_25, inv]
+    colors = [BRAND_RED, BRAND_GREEN]
+
+    # Barras largas e impactantes
+    bars = ax.bar(labels, vals, color=colors, width=0.55,
+                  edgecolor='white', linewidth=2)
+
+    _style_axes_modern(ax, show_y_grid=True)
+    ax.yaxis.set_major_formatter(FuncFormatter(_fmt_compact))
+
+    # Eixo X mais legível
+    ax.tick_params(axis='x', labelsize=16, pad=12)
+
+    # Espaço para os labels
+    ymax = max(vals) if vals else 1
+    ax.set_ylim(0, ymax * 1.25)
+
+    # Rótulos grandes e destacados em cima das barras
+    for bar, val, color in zip(bars, vals, [BRAND_RED_DARK, BRAND_GREEN_DARK]):
+        height = bar.get_height()
+        ax.annotate(
+            _fmt_brl_full(val),
+            xy=(bar.get_x() + bar.get_width() / 2, height),
+            xytext=(0, 12),
+            textcoords="offset points",
+            ha='center', va='bottom',
+            fontsize=18,
+            fontweight='bold',
+            color=color,
+            bbox=dict(boxstyle='round,pad=0.4', facecolor='white',
+                      edgecolor=color, linewidth=2, alpha=0.95)
+        )
+
+    # Adicionar indicador de economia
+    # Usar economia_total_25_calc (fluxo de caixa acumulado) para consistência
+    # com o valor mostrado no texto "Economia de R$..."
+    if sem_solar_25 > 0 and inv > 0:
+        # Priorizar economia_total_25_calc (economia líquida real)
+        # Se não disponível, calcular como diferença simples
+        economia = economia_total_25_calc if economia_total_25_calc > 0 else (sem_solar_25 - inv)
+        economia_pct = (economia / sem_solar_25) * 100
+        economia_text = f"Economia: {_fmt_brl_full(economia)} ({economia_pct:.0f}%)"
+        ax.text(0.5, 0.02, economia_text, transform=ax.transAxes,
+                fontsize=16, fontweight='bold', color=BRAND_GREEN_DARK,
+                ha='center', va='bottom',
+                bbox=dict(boxstyle='round,pad=0.5', facecolor='#ECFDF5',
+                          edgecolor=BRAND_GREEN, linewidth=1.5))
+
+    fig.tight_layout(pad=2)
+    return _to_png(fig)
+
+
+GRAFICOS: Dict[str, Callable[[Dict[str, Any]], Optional[bytes]]] = {
+    "grafico1": grafico1,
+    "grafico2": grafico2,
+    "grafico3": grafico3,
+    "grafico4": grafico4,
+    "grafico5": grafico5,
+}
+
+
+# ====== Pool de processos ======
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_PID: Optional[int] = None
+_POOL_LOCK = threading.Lock()
+
+
+def _mp_context():
+    """
+    forkserver evita fork() de um processo com threads (gunicorn/Flask) e não
+    reimporta o servidor nos workers; o próprio módulo é pré-carregado no forkserver.
+    """
+    method = (os.environ.get("GRAFICOS_POOL_START_METHOD") or "").strip().lower()
+    available = multiprocessing.get_all_start_methods()
+    if method not in available:
+        method = "forkserver" if "forkserver" in available else "spawn"
+    ctx = multiprocessing.get_context(method)
+    if method == "forkserver":
+        try:
+            ctx.set_forkserver_preload([__name__])
+        except Exception:
+            pass
+    return ctx
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    """Pool lazy por processo (após o fork do gunicorn cada worker cria o seu)."""
+    global _POOL, _POOL_PID
+    if GRAFICOS_POOL_WORKERS <= 0:
+        return None
+    with _POOL_LOCK:
+        if _POOL is not None and _POOL_PID == os.getpid():
+            return _POOL
+        try:
+            _POOL = ProcessPoolExecutor(
+                max_workers=GRAFICOS_POOL_WORKERS,
+                mp_context=_mp_context(),
+                initializer=_warm_worker,
+            )
+            _POOL_PID = os.getpid()
+            print(f"📊 [GRAFICOS] Pool de processos iniciado ({GRAFICOS_POOL_WORKERS} workers)")
+        except Exception as e:
+            print(f"⚠️ [GRAFICOS] Pool de processos indisponível, renderizando inline: {e}")
+            _POOL = None
+            _POOL_PID = None
+        return _POOL
+
+
+def _reset_pool(terminar: bool = False) -> None:
+    """
+    Descarta o pool; o próximo uso cria outro. `terminar` encerra os workers: um
+    gráfico já em execução não é interrompido por cancel()/shutdown().
+    """
+    global _POOL, _POOL_PID
+    with _POOL_LOCK:
+        pool, _POOL, _POOL_PID = _POOL, None, None
+    if pool is None:
+        return
+    processos = list((getattr(pool, "_processes", None) or {}).values()) if terminar else []
+    try:
+        pool.shutdown(wait=False, cancel_futures=True)
+    except Exception:
+        pass
+    for proc in processos:
+        try:
+            proc.terminate()
+        except Exception:
+            pass
+
+
+def warmup() -> None:
+    """Sobe os workers antecipadamente (import do pyplot + tema) para a 1ª proposta não pagar o custo."""
+    pool = _get_pool()
+    if pool is None:
+        return
+    try:
+        for _ in range(GRAFICOS_POOL_WORKERS):
+            pool.submit(_warm_worker)
+    except Exception as e:
+        print(f"⚠️ [GRAFICOS] Falha no warmup do pool: {e}")
+
+
+def _render_inline(nome: str, dados: Dict[str, Any]) -> Optional[bytes]:
+    try:
+        return GRAFICOS[nome](dados)
+    except Exception as e:
+        print(f"⚠️ Falha ao gerar {nome} estático: {e}")
+        return None
+
+
+def _aguardar(futures: Dict[str, Any], timeout_s: float, out: Dict[str, bytes]):
+    """
+    Coleta os resultados em `out`. O prazo vale para o lote: `timeout_s` por rodada
+    de workers (wait(timeout=...)). Não dá para contar o tempo de cada gráfico a partir
+    de running(): o ProcessPoolExecutor passa à fila interna (EXTRA_QUEUED_CALLS) itens
+    que ainda não chegaram a um worker, e eles já aparecem como "running".
+    Retorna (pendentes, expirados, quebrado): pendentes = refazer inline (pool quebrou,
+    ou o gráfico foi cancelado antes de começar); expirados = não terminaram no prazo.
+    """
+    rodadas = -(-len(futures) // max(1, GRAFICOS_POOL_WORKERS))
+    _, atrasados = wait(list(futures.values()), timeout=timeout_s * rodadas)
+    pendentes: List[str] = []
+    expirados: List[str] = []
+    quebrado = False
+    for nome, fut in futures.items():
+        if fut in atrasados:
+            # cancel() só funciona para quem nem chegou à fila interna: esse pode ir inline
+            (pendentes if fut.cancel() else expirados).append(nome)
+            continue
+        try:
+            png = fut.result()
+            if png:
+                out[nome] = png
+        except CancelledError:
+            # Pool descartado por outra requisição antes de o gráfico rodar
+            pendentes.append(nome)
+        except BrokenProcessPool as e:
+            pendentes.append(nome)
+            quebrado = True
+            print(f"⚠️ [GRAFICOS] Pool quebrado ao gerar {nome}: {e}")
+        except Exception as e:
+            print(f"⚠️ Falha ao gerar {nome} estático: {e}")
+    return pendentes, expirados, quebrado
+
+
+def render_graficos(dados: Dict[str, Any], nomes: Optional[List[str]] = None,
+                    timeout_s: Optional[float] = None) -> Dict[str, bytes]:
+    """
+    Renderiza os gráficos em paralelo e retorna {nome: png_bytes}.
+
+    - Gráficos sem dados ou com erro ficam de fora do resultado.
+    - Gráfico que não terminar no prazo do lote (`timeout_s` por rodada de workers)
+      também fica de fora; o pool é descartado com os workers encerrados.
+    - Pool quebrado/indisponível: os pendentes são renderizados inline.
+    """
+    nomes = [n for n in (nomes or list(GRAFICOS.keys())) if n in GRAFICOS]
+    timeout_s = GRAFICOS_TIMEOUT_S if timeout_s is None else float(timeout_s)
+    out: Dict[str, bytes] = {}
+
+    pool = _get_pool()
+    pendentes = list(nomes)
+    if pool is not None:
+        futures = {}
+        try:
+            for nome in nomes:
+                futures[nome] = pool.submit(GRAFICOS[nome], dados)
+        except Exception as e:
+            # BrokenProcessPool / RuntimeError após shutdown
+            print(f"⚠️ [GRAFICOS] Falha ao submeter ao pool, renderizando inline: {e}")
+            for f in futures.values():
+                f.cancel()
+            futures = {}
+            _reset_pool()
+
+        if futures:
+            pendentes, expirados, quebrado = _aguardar(futures, timeout_s, out)
+            if expirados:
+                print(f"⚠️ [GRAFICOS] Timeout ({timeout_s:.0f}s) ao gerar {', '.join(expirados)}; "
+                      f"mantendo fallback e reiniciando o pool")
+                _reset_pool(terminar=True)
+            elif quebrado:
+                _reset_pool()
+
+    for nome in pendentes:
+        png = _render_inline(nome, dados)
+        if png:
+            out[nome] = png
+    return out
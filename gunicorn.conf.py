@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+gunicorn.conf.py
+================
+Configuração lida automaticamente pelo gunicorn (arquivo no diretório de trabalho).
+As opções da linha de comando (Procfile/Dockerfile) continuam valendo por cima desta.
+
+- post_fork: em cada worker, sobe o pool de gráficos (graficos_pool.warmup) numa
+  thread, para a primeira proposta do worker não pagar o início dos processos nem o
+  import do Matplotlib. Roda depois do fork, então vale também com --preload.
+- when_ready / on_exit: sobe e encerra o consumidor de jobs de PDF (pdf_jobs.py
+  worker), processo separado dos workers da API. Se ele morrer, o próximo job
+  enfileirado sobe outro.
+"""
+import threading
+
+
+def post_fork(server, worker):
+    def _aquecer():
+        try:
+            import graficos_pool
+            graficos_pool.warmup()
+        except Exception as e:
+            print(f"⚠️ [GRAFICOS] Falha no warmup do pool: {e}")
+
+    threading.Thread(target=_aquecer, name="graficos-warmup", daemon=True).start()
+
+
+def when_ready(server):
+    try:
+        import pdf_jobs
+        if pdf_jobs.PDF_JOBS_PROCESS:
+            pdf_jobs.pdf_jobs.ensure_consumer()
+    except Exception as e:
+        print(f"⚠️ [PDF_JOBS] Falha ao subir consumidor: {e}")
+
+
+def on_exit(server):
+    try:
+        import pdf_jobs
+        pdf_jobs.pdf_jobs.stop_consumer()
+    except Exception as e:
+        print(f"⚠️ [PDF_JOBS] Falha ao encerrar consumidor: {e}")
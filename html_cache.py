@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+html_cache.py
+=============
+Cache do HTML renderizado da proposta (memória + disco, ambos LRU).
+
+A chave é derivada de:
+- hash do payload da proposta (sem campos voláteis que não afetam o HTML);
+- hash do arquivo de template (template.html / template_online.html);
+- ENGINE_VERSION (incrementar quando process_template_html/dimensionamento_core
+  mudarem a saída para o mesmo payload);
+- um "extra" opcional com dependências externas (tarifas, formas de pagamento).
+
+A mesma chave serve de ETag, então uma visualização repetida do cliente pode ser
+respondida com 304 sem nem renderizar o template.
+
+Variáveis de ambiente:
+- HTML_CACHE_MEM_ITEMS: nº máximo de HTMLs em memória (por processo)
+- HTML_CACHE_DISK_MB: tamanho máximo do cache em disco (compartilhado entre workers)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+# Incrementar quando a renderização mudar para o mesmo payload (invalida tudo)
+ENGINE_VERSION = "2026.10.2"
+
+# Campos do payload que mudam sem alterar o HTML renderizado
+VOLATILE_FIELDS = frozenset({
+    "status",
+    "updated_at",
+    "created_at",
+    "graficos_base64",  # regenerados a partir do núcleo a cada renderização
+    "pdf_cache",
+    "pdf_cached_at",
+    "pdf_payload_hash",
+})
+
+HTML_CACHE_DIR = Path(__file__).parent / "propostas" / "html_cache"
+HTML_CACHE_MEM_ITEMS = int(os.environ.get("HTML_CACHE_MEM_ITEMS", "64"))
+HTML_CACHE_DISK_MB = float(os.environ.get("HTML_CACHE_DISK_MB", "256"))
+
+
+def payload_hash(payload: Dict[str, Any]) -> str:
+    """sha256 do payload canônico (chaves ordenadas, sem campos voláteis)."""
+    stable = {k: v for k, v in (payload or {}).items() if k not in VOLATILE_FIELDS}
+    raw = json.dumps(stable, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+_TEMPLATE_HASHES: Dict[str, Tuple[int, int, str]] = {}
+
+
+def template_hash(template_path: Path) -> str:
+    """sha256 do arquivo de template, recalculado só quando mtime/tamanho mudam."""
+    try:
+        st = template_path.stat()
+    except OSError:
+        return "missing"
+    k = str(template_path)
+    cached = _TEMPLATE_HASHES.get(k)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+    h = hashlib.sha256(template_path.read_bytes()).hexdigest()
+    _TEMPLATE_HASHES[k] = (st.st_mtime_ns, st.st_size, h)
+    return h
+
+
+def render_fingerprint(payload: Dict[str, Any]) -> str:
+    """
+    Impressão digital do payload para renderização (campos relevantes + versão do motor).
+    Calculada ao salvar e guardada em propostas.render_fingerprint: nos acessos não é
+    preciso serializar o payload (com graficos_base64, vários MB) de novo.
+    """
+    return hashlib.sha256(f"{ENGINE_VERSION}|{payload_hash(payload)}".encode("utf-8")).hexdigest()
+
+
+def render_fingerprint_sql(payload_sql: str) -> str:
+    """
+    Impressão digital calculada no próprio Postgres sobre uma expressão jsonb (autosave
+    por merge-patch, preenchimento das linhas antigas): md5 do jsonb sem os campos
+    voláteis + versão do motor. Não coincide com render_fingerprint() para o mesmo
+    payload (serializações diferentes): só custa um cache miss quando a proposta troca
+    de caminho de gravação; muda sempre que um campo relevante muda.
+    """
+    volateis = ", ".join(f"'{campo}'" for campo in sorted(VOLATILE_FIELDS))
+    return f"md5(CAST(({payload_sql}) - ARRAY[{volateis}] AS text) || '|{ENGINE_VERSION}')"
+
+
+def cache_key(payload: Optional[Dict[str, Any]], template_path: Path, extra: str = "",
+              fingerprint: Optional[str] = None) -> str:
+    """
+    Chave do HTML renderizado (também usada como ETag e como chave do PDF em cache).
+    Com `fingerprint` (pré-calculado) o payload não é serializado.
+    """
+    fp = fingerprint or render_fingerprint(payload or {})
+    # ENGINE_VERSION também aqui: a impressão digital gravada é da versão do motor ao salvar
+    parts = [template_path.name, template_hash(template_path), ENGINE_VERSION, fp, extra or ""]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def etag_for(key: str) -> str:
+    return f'"{key[:40]}"'
+
+
+def etag_matches(if_none_match: Optional[str], key: str) -> bool:
+    """Compara o header If-None-Match (pode ter várias tags ou '*') com a chave."""
+    if not if_none_match:
+        return False
+    tag = etag_for(key)
+    for candidate in if_none_match.split(","):
+        c = candidate.strip()
+        if c.startswith("W/"):
+            c = c[2:]
+        if c == "*" or c == tag:
+            return True
+    return False
+
+
+def _safe_id(proposta_id: str) -> str:
+    return "".join(ch if (ch.isalnum() or ch in "-_") else "_" for ch in str(proposta_id or ""))[:80]
+
+
+class HtmlCache:
+    """LRU em memória (por processo) com segundo nível em disco (compartilhado entre workers)."""
+
+    def __init__(self, cache_dir: Path, mem_items: int, disk_max_bytes: int):
+        self.cache_dir = cache_dir
+        self.mem_items = max(0, mem_items)
+        self.disk_max_bytes = max(0, disk_max_bytes)
+        self._mem: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()  # key -> (proposta_id, html)
+        self._lock = threading.Lock()
+
+    def _path(self, proposta_id: str, key: str) -> Path:
+        return self.cache_dir / f"{_safe_id(proposta_id)}.{key[:40]}.html"
+
+    def get(self, proposta_id: str, key: str) -> Optional[str]:
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                self._mem.move_to_end(key)
+                return hit[1]
+        p = self._path(proposta_id, key)
+        try:
+            html = p.read_text(encoding="utf-8")
+        except OSError:
+            return None
+        try:
+            os.utime(p, None)  # mtime = último acesso (ordem do LRU em disco)
+        except OSError:
+            pass
+        self._remember(proposta_id, key, html)
+        return html
+
+    def put(self, proposta_id: str, key: str, html: str) -> None:
+        self._remember(proposta_id, key, html)
+        if self.disk_max_bytes <= 0:
+            return
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            # Remover versões antigas desta proposta (só a última chave interessa)
+            for old in self.cache_dir.glob(f"{_safe_id(proposta_id)}.*.html"):
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+            p = self._path(proposta_id, key)
+            tmp = p.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(html, encoding="utf-8")
+            os.replace(tmp, p)
+            self._trim_disk()
+        except Exception as e:
+            print(f"⚠️ [HTML_CACHE] Falha ao gravar cache em disco: {e}")
+
+    def _remember(self, proposta_id: str, key: str, html: str) -> None:
+        if self.mem_items <= 0:
+            return
+        with self._lock:
+            # Só a versão mais recente de cada proposta fica em memória
+            for k in [k for k, (pid, _) in self._mem.items() if pid == proposta_id and k != key]:
+                self._mem.pop(k, None)
+            self._mem[key] = (proposta_id, html)
+            self._mem.move_to_end(key)
+            while len(self._mem) > self.mem_items:
+                self._mem.popitem(last=False)
+
+    def _trim_disk(self) -> None:
+        try:
+            files = []
+            total = 0
+            for f in self.cache_dir.glob("*.html"):
+                try:
+                    st = f.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, f))
+                total += st.st_size
+            if total <= self.disk_max_bytes:
+                return
+            for _, size, f in sorted(files):
+                try:
+                    f.unlink()
+                    total -= size
+                except OSError:
+                    pass
+                if total <= self.disk_max_bytes:
+                    break
+        except Exception as e:
+            print(f"⚠️ [HTML_CACHE] Falha ao limpar cache em disco: {e}")
+
+    def invalidate(self, proposta_id: str) -> None:
+        """Remove todas as versões de uma proposta (memória deste processo + disco)."""
+        with self._lock:
+            for k in [k for k, (pid, _) in self._mem.items() if pid == proposta_id]:
+                self._mem.pop(k, None)
+        try:
+            for f in self.cache_dir.glob(f"{_safe_id(proposta_id)}.*.html"):
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
+        except Exception:
+            pass
+
+    def clear(self) -> None:
+        with self._lock:
+            self._mem.clear()
+        try:
+            for f in self.cache_dir.glob("*.html"):
+                try:
+                    f.unlink()
+                except OSError:
+                    pass
+        except Exception:
+            pass
+
+
+html_cache = HtmlCache(HTML_CACHE_DIR, HTML_CACHE_MEM_ITEMS, int(HTML_CACHE_DISK_MB * 1024 * 1024))
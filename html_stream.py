@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+html_stream.py
+==============
+Renderização em streaming do HTML da proposta.
+
+process_template_html(..., deferred=[...]) devolve o HTML com as substituições
+rápidas já feitas e registra as etapas lentas (gráficos, formas de pagamento)
+como DeferredJob. Este módulo:
+- envia imediatamente o documento em segmentos (o navegador já pinta a capa);
+- calcula os jobs em paralelo enquanto os segmentos são enviados;
+- ao final, envia <template> com o conteúdo de cada "slot" + um <script> que
+  troca o slot pelo conteúdo (antes dos <script> do próprio template, para que
+  eles enxerguem o DOM já preenchido);
+- o documento entregue a `on_complete` (cache) é o preenchido, sem depender de JS.
+
+Slots são identificados pelos `marcadores` do job:
+- "{{placeholder}}": vira <span data-fohat-slot="N"></span> no envio inicial;
+- "id-do-elemento": o elemento (outerHTML) é enviado como está e substituído depois.
+Se um marcador só existir após o ponto de preenchimento, o job roda de forma
+síncrona antes do streaming (mesmo resultado, sem ganho).
+"""
+from __future__ import annotations
+
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from timing import propagar
+
+_SEP = "<!--fohat-slot-sep-->"
+
+# Segmentação do documento: cada slide/seção vira um pedaço do stream
+_SEGMENT_RE = re.compile(r'(?=<section\b|<div class="(?:hero-)?section\b)')
+
+_FILL_SCRIPT = (
+    "<script>window.__fohatFill=function(n,id){"
+    "var t=document.getElementById('fohat-slot-'+n);if(!t)return;"
+    "var el=id?document.getElementById(id):document.querySelector('[data-fohat-slot=\"'+n+'\"]');"
+    "if(el){el.replaceWith(t.content.cloneNode(true));}t.remove();};</script>"
+)
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="html-stream")
+
+
+@dataclass(eq=False)
+class DeferredJob:
+    """Etapa lenta da renderização: `calcular()` roda em paralelo; `aplicar(html, resultado)` é puro."""
+    nome: str
+    marcadores: List[str]
+    calcular: Callable[[], Any]
+    aplicar: Callable[[str, Any], str]
+
+    def resultado(self) -> Any:
+        try:
+            return self.calcular()
+        except Exception as e:
+            print(f"⚠️ [STREAM] Falha ao calcular '{self.nome}': {e}")
+            return None
+
+    def run(self, html: str, resultado: Any = None, calculado: bool = False) -> str:
+        """Aplica o job de forma síncrona (modo sem streaming)."""
+        return self.aplicar(html, resultado if calculado else self.resultado())
+
+
+def apply_jobs(html: str, jobs: List[DeferredJob]) -> str:
+    for job in jobs:
+        html = job.run(html)
+    return html
+
+
+def _outer_html_span(html: str, element_id: str) -> Optional[Tuple[int, int]]:
+    """(início, fim) do outerHTML do elemento com o id informado (tags aninhadas do mesmo nome balanceadas)."""
+    m = re.search(r'<([a-zA-Z][a-zA-Z0-9]*)\b[^>]*\bid=["\']%s["\'][^>]*>' % re.escape(element_id), html)
+    if not m:
+        return None
+    tag = m.group(1).lower()
+    if tag in ("img", "br", "hr", "input", "meta", "link") or m.group(0).endswith("/>"):
+        return m.start(), m.end()
+    depth = 1
+    for t in re.finditer(r'<(/?)%s\b[^>]*>' % re.escape(tag), html[m.end():], flags=re.IGNORECASE):
+        depth += -1 if t.group(1) else 1
+        if depth == 0:
+            return m.start(), m.end() + t.end()
+    return None
+
+
+def _fill_point(html: str) -> int:
+    """Posição onde os preenchimentos são inseridos: antes do 1º <script> do body (ou do </body>)."""
+    body = re.search(r'<body\b[^>]*>', html, flags=re.IGNORECASE)
+    start = body.end() if body else 0
+    m = re.search(r'<script\b|</body>', html[start:], flags=re.IGNORECASE)
+    return start + m.start() if m else len(html)
+
+
+def _check_leftovers(segment: str) -> int:
+    if "{{" not in segment:
+        return 0
+    return len(re.findall(r'\{\{[^}]+\}\}', segment))
+
+
+def _locate_slots(head: str, tail: str, jobs: List[DeferredJob]):
+    """
+    Slots de cada job no trecho enviado antes do ponto de preenchimento.
+    Retorna (slots ordenados, jobs que precisam rodar de forma síncrona).
+    """
+    slots: List[Tuple[int, int, int, Optional[str], DeferredJob]] = []  # (ini, fim, n, element_id, job)
+    sync_jobs: List[DeferredJob] = []
+    for job in jobs:
+        found: List[Tuple[int, int, Optional[str]]] = []
+        only_in_tail = False
+        for marcador in job.marcadores:
+            if marcador.startswith("{{"):
+                pos = head.find(marcador)
+                while pos != -1:
+                    found.append((pos, pos + len(marcador), None))
+                    pos = head.find(marcador, pos + len(marcador))
+                if marcador in tail:
+                    only_in_tail = True
+            else:
+                span = _outer_html_span(head, marcador)
+                if span:
+                    found.append((span[0], span[1], marcador))
+                elif _outer_html_span(tail, marcador):
+                    only_in_tail = True
+        if only_in_tail:
+            sync_jobs.append(job)
+            continue
+        for ini, fim, element_id in found:
+            slots.append((ini, fim, 0, element_id, job))
+
+    # Slots não podem se sobrepor; os jobs envolvidos rodam de forma síncrona
+    slots.sort(key=lambda x: x[0])
+    for a, b in zip(slots, slots[1:]):
+        if b[0] < a[1]:
+            for job in (a[4], b[4]):
+                if job not in sync_jobs:
+                    sync_jobs.append(job)
+    if sync_jobs:
+        return [], sync_jobs
+    return [(ini, fim, n, eid, job) for n, (ini, fim, _n, eid, job) in enumerate(slots)], []
+
+
+def stream_html(html: str, jobs: List[DeferredJob],
+                on_complete: Optional[Callable[[str], None]] = None) -> Iterator[str]:
+    """
+    Gera o documento em pedaços. `on_complete(html_final)` recebe, quando o stream
+    termina sem erro, o documento já preenchido (os mesmos resultados aplicados ao
+    HTML inteiro, sem slots nem __fohatFill): é o que vai para o cache, igual ao da
+    renderização sem streaming (?stream=0, PDF).
+    """
+    # propagar: etapas medidas nos jobs entram no Server-Timing/histograma da requisição
+    futures = {id(job): _executor.submit(propagar(job.resultado)) for job in jobs}
+    jobs = list(jobs)
+
+    while True:
+        point = _fill_point(html)
+        head, tail = html[:point], html[point:]
+        slots, sync_jobs = _locate_slots(head, tail, jobs)
+        if not sync_jobs:
+            break
+        # Marcadores após o ponto de preenchimento (ou slots sobrepostos): aplicar antes de enviar
+        for job in sync_jobs:
+            html = job.run(html, futures[id(job)].result(), calculado=True)
+        jobs = [j for j in jobs if j not in sync_jobs]
+
+    # Documento inicial: placeholders viram <span data-fohat-slot>, elementos ficam como estão
+    parts: List[str] = []
+    cursor = 0
+    for ini, fim, n, element_id, _job in slots:
+        parts.append(head[cursor:ini])
+        parts.append(head[ini:fim] if element_id else f'<span data-fohat-slot="{n}"></span>')
+        cursor = fim
+    parts.append(head[cursor:])
+    initial = "".join(parts)
+
+    sent: List[str] = []
+    leftovers = 0
+    for segment in _SEGMENT_RE.split(initial):
+        if segment:
+            sent.append(segment)
+            yield segment
+
+    # Preenchimentos: um aplicar() por job sobre os fragmentos dos seus slots
+    if slots:
+        fillers = [_FILL_SCRIPT]
+        for job in jobs:
+            job_slots = [s for s in slots if s[4] is job]
+            if not job_slots:
+                continue
+            fragments = _SEP.join(head[ini:fim] for ini, fim, _n, _eid, _j in job_slots)
+            try:
+                filled = job.aplicar(fragments, futures[id(job)].result()).split(_SEP)
+            except Exception as e:
+                print(f"⚠️ [STREAM] Falha ao aplicar '{job.nome}': {e}")
+                filled = [head[ini:fim] for ini, fim, _n, _eid, _j in job_slots]
+            if len(filled) != len(job_slots):
+                print(f"⚠️ [STREAM] '{job.nome}' alterou a quantidade de slots; ignorando preenchimento")
+                continue
+            for (ini, fim, n, element_id, _j), content in zip(job_slots, filled):
+                leftovers += _check_leftovers(content)
+                eid = f"'{element_id}'" if element_id else "null"
+                fillers.append(f'<template id="fohat-slot-{n}">{content}</template><script>__fohatFill({n},{eid})</script>')
+        chunk = "".join(fillers)
+        sent.append(chunk)
+        yield chunk
+
+    sent.append(tail)
+    yield tail
+
+    leftovers += sum(_check_leftovers(s) for s in sent if "fohat-slot-" not in s)
+    if leftovers:
+        print(f"⚠️ Variáveis não substituídas: {leftovers}")
+    if on_complete:
+        try:
+            final = html
+            for job in jobs:
+                final = job.run(final, futures[id(job)].result(), calculado=True)
+            on_complete(final)
+        except Exception as e:
+            print(f"⚠️ [STREAM] Falha no on_complete: {e}")
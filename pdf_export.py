@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+pdf_export.py
+=============
+Exportação em lote dos PDFs de propostas como um arquivo ZIP.
+
+- Os PDFs vêm do mesmo caminho da rota pública (cache binário, single-flight e
+  controle de admissão), com paralelismo limitado (PDF_EXPORT_PARALLEL).
+- Cada entrada é escrita no ZIP assim que o PDF fica pronto (ordem de conclusão),
+  em blocos; o arquivo nunca é montado inteiro em memória.
+- Falhas não interrompem a exportação: viram o arquivo ERROS.txt no final.
+- A exportação roda como job em background (`export_jobs`, no molde do pdf_jobs):
+  o ZIP é gravado em disco (propostas/pdf_exports/<job_id>.zip) e servido por uma
+  rota de resultado. Nenhum worker síncrono do gunicorn fica preso (nem morre no
+  --timeout) durante centenas de renderizações; o estado em disco é lido por
+  qualquer worker. O job roda numa thread do worker que o recebeu.
+
+Variáveis de ambiente:
+- PDF_EXPORT_PARALLEL: PDFs obtidos em paralelo (padrão 2)
+- PDF_EXPORT_MAX: máximo de propostas por exportação (padrão 500)
+- PDF_EXPORT_JOBS: exportações simultâneas por worker (padrão 1)
+- PDF_EXPORT_MAX_PENDING: exportações na fila por worker (padrão 2)
+- PDF_EXPORT_TTL_S: tempo que o ZIP fica disponível (padrão 3600)
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from pdf_jobs import ESTADOS_FINAIS, QueueFull, _agora, _pid_vivo
+from pdf_service import RenderSaturated
+
+PDF_EXPORT_PARALLEL = max(1, int(os.environ.get("PDF_EXPORT_PARALLEL", "2")))
+PDF_EXPORT_MAX = max(1, int(os.environ.get("PDF_EXPORT_MAX", "500")))
+PDF_EXPORT_JOBS = max(1, int(os.environ.get("PDF_EXPORT_JOBS", "1")))
+PDF_EXPORT_MAX_PENDING = max(1, int(os.environ.get("PDF_EXPORT_MAX_PENDING", "2")))
+PDF_EXPORT_TTL_S = max(60, int(os.environ.get("PDF_EXPORT_TTL_S", "3600")))
+PDF_EXPORT_DIR = Path(__file__).parent / "propostas" / "pdf_exports"
+
+_CHUNK = 64 * 1024
+_TENTATIVAS_SATURADO = 3
+
+# obter(proposta_id) -> (caminho do PDF, payload) ou (None, None)
+ObterPdf = Callable[[str], Tuple[Optional[Path], Optional[dict]]]
+
+
+class _Saida:
+    """Destino do ZipFile sem seek: acumula os bytes até o gerador repassá-los."""
+
+    def __init__(self):
+        self._partes: List[bytes] = []
+
+    def write(self, b) -> int:
+        self._partes.append(bytes(b))
+        return len(b)
+
+    def flush(self) -> None:
+        pass
+
+    def drenar(self) -> bytes:
+        dados = b"".join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def _obter_com_espera(obter: ObterPdf, proposta_id: str):
+    """Sem vaga de renderização, espera o Retry-After sugerido e tenta de novo."""
+    for tentativa in range(_TENTATIVAS_SATURADO):
+        try:
+            return obter(proposta_id)
+        except RenderSaturated as e:
+            if tentativa == _TENTATIVAS_SATURADO - 1:
+                raise
+            time.sleep(max(1, e.retry_after))
+
+
+def _nome_unico(nome: str, usados: set) -> str:
+    base, ext = (nome[:-4], ".pdf") if nome.lower().endswith(".pdf") else (nome, "")
+    candidato, n = nome, 2
+    while candidato in usados:
+        candidato = f"{base} ({n}){ext}"
+        n += 1
+    usados.add(candidato)
+    return candidato
+
+
+def _avisar(progresso, exportados: int, erros: int) -> None:
+    if progresso is None:
+        return
+    try:
+        progresso(exportados, erros)
+    except Exception:
+        pass
+
+
+def stream_zip(ids: List[str], obter: ObterPdf, nomear: Callable[[str, dict], str],
+               paralelo: int = PDF_EXPORT_PARALLEL,
+               progresso: Optional[Callable[[int, int], None]] = None) -> Iterator[bytes]:
+    """
+    Gera o ZIP em blocos. `nomear(proposta_id, payload)` dá o nome da entrada.
+    `progresso(exportados, erros)` é chamado a cada proposta concluída.
+    Se o gerador for fechado antes do fim, os PDFs pendentes são cancelados.
+    """
+    saida = _Saida()
+    zf = zipfile.ZipFile(saida, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=1)
+    executor = ThreadPoolExecutor(max_workers=paralelo, thread_name_prefix="pdf-export")
+    pendentes = {}
+    fila = list(ids)
+    usados: set = set()
+    erros: List[str] = []
+    t0 = time.time()
+    try:
+        while fila or pendentes:
+            # Janela limitada: no máximo 2x o paralelismo em voo
+            while fila and len(pendentes) < paralelo * 2:
+                pid = fila.pop(0)
+                pendentes[executor.submit(_obter_com_espera, obter, pid)] = pid
+            prontos, _ = wait(list(pendentes), return_when=FIRST_COMPLETED)
+            for fut in prontos:
+                pid = pendentes.pop(fut)
+                try:
+                    pdf_path, payload = fut.result()
+                except Exception as e:
+                    erros.append(f"{pid}: {e}")
+                    _avisar(progresso, len(usados), len(erros))
+                    continue
+                if pdf_path is None:
+                    erros.append(f"{pid}: proposta não encontrada")
+                    _avisar(progresso, len(usados), len(erros))
+                    continue
+                info = zipfile.ZipInfo(_nome_unico(nomear(pid, payload or {}), usados),
+                                       date_time=time.localtime(time.time())[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(pdf_path, "rb") as src, zf.open(info, mode="w") as dst:
+                    while True:
+                        bloco = src.read(_CHUNK)
+                        if not bloco:
+                            break
+                        dst.write(bloco)
+                        dados = saida.drenar()
+                        if dados:
+                            yield dados
+                dados = saida.drenar()
+                if dados:
+                    yield dados
+                _avisar(progresso, len(usados), len(erros))
+        if erros:
+            zf.writestr("ERROS.txt", "\n".join(erros) + "\n")
+        zf.close()
+        yield saida.drenar()
+        print(f"📦 [EXPORT] {len(ids) - len(erros)}/{len(ids)} PDFs exportados em {time.time() - t0:.1f}s")
+    finally:
+        for fut in pendentes:
+            fut.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def escrever_zip(ids: List[str], obter: ObterPdf, nomear: Callable[[str, dict], str], destino: Path,
+                 progresso: Optional[Callable[[int, int], None]] = None) -> int:
+    """Grava o ZIP em `destino` (via arquivo temporário + rename). Retorna o tamanho em bytes."""
+    destino.parent.mkdir(parents=True, exist_ok=True)
+    tmp = destino.with_name(f"{destino.name}.{os.getpid()}.part")
+    try:
+        with open(tmp, "wb") as f:
+            for bloco in stream_zip(ids, obter, nomear, progresso=progresso):
+                f.write(bloco)
+        os.replace(tmp, destino)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return destino.stat().st_size
+
+
+class ExportJobs:
+    """
+    Exportações em background com estado em disco (propostas/pdf_exports/<job_id>.json),
+    visível de qualquer worker. Estados: queued -> running -> done | error.
+    """
+
+    def __init__(self, base_dir: Path = PDF_EXPORT_DIR, workers: int = PDF_EXPORT_JOBS,
+                 max_pending: int = PDF_EXPORT_MAX_PENDING, ttl_s: int = PDF_EXPORT_TTL_S):
+        self.base_dir = Path(base_dir)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._pending = 0
+
+    def _path(self, job_id: str) -> Path:
+        return self.base_dir / f"{job_id}.json"
+
+    def _zip_path(self, job_id: str) -> Path:
+        return self.base_dir / f"{job_id}.zip"
+
+    def _write(self, job: dict) -> None:
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self._path(job["job_id"]).with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self._path(job["job_id"]))
+
+    def _update(self, job: dict, **campos) -> dict:
+        job.update(campos)
+        self._write(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Estado do job (de qualquer worker). Jobs órfãos (worker morreu) viram erro."""
+        if not job_id or not all(c.isalnum() or c == "-" for c in job_id):
+            return None
+        try:
+            job = json.loads(self._path(job_id).read_text(encoding="utf-8"))
+        except Exception:
+            return None
+        if job.get("status") not in ESTADOS_FINAIS and not _pid_vivo(job.get("owner_pid", 0)):
+            job = self._update(job, status="error", error="Exportação interrompida (worker reiniciado)",
+                               finished_at=_agora())
+        return job
+
+    def result_path(self, job_id: str) -> Optional[Path]:
+        job = self.get(job_id)
+        if not job or job.get("status") != "done":
+            return None
+        p = self._zip_path(job_id)
+        return p if p.exists() else None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Após fork (gunicorn --preload), o executor do processo pai não serve
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pdf-export-job")
+            self._executor_pid = os.getpid()
+            self._pending = 0
+        return self._executor
+
+    def submit(self, ids: List[str], obter: ObterPdf, nomear: Callable[[str, dict], str],
+               filtros: Optional[dict] = None) -> dict:
+        """Enfileira a exportação. Levanta QueueFull se o limite deste worker foi atingido."""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFull(f"{self._pending} exportações na fila")
+            executor = self._get_executor()
+            job = {
+                "job_id": uuid.uuid4().hex,
+                "status": "queued",
+                "filtros": filtros or {},
+                "total": len(ids),
+                "exportados": 0,
+                "erros": 0,
+                "owner_pid": os.getpid(),
+                "created_at": _agora(),
+                "started_at": None,
+                "finished_at": None,
+                "error": None,
+                "size": None,
+            }
+            self._write(job)
+            self._pending += 1
+            # O job segue mudando na thread; quem chamou recebe o estado de agora
+            executor.submit(self._run, dict(job), list(ids), obter, nomear)
+        self._cleanup()
+        return job
+
+    def _run(self, job: dict, ids: List[str], obter: ObterPdf, nomear: Callable[[str, dict], str]) -> None:
+        try:
+            self._update(job, status="running", started_at=_agora())
+
+            def _progresso(exportados: int, erros: int) -> None:
+                self._update(job, exportados=exportados, erros=erros)
+
+            size = escrever_zip(ids, obter, nomear, self._zip_path(job["job_id"]), progresso=_progresso)
+            self._update(job, status="done", size=size, finished_at=_agora())
+            print(f"✅ [EXPORT] Job {job['job_id'][:8]} pronto ({job['exportados']}/{job['total']} PDFs, {size} bytes)")
+        except Exception as e:
+            print(f"❌ [EXPORT] Job {job['job_id'][:8]} falhou: {e}")
+            try:
+                self._update(job, status="error", error=str(e)[:500], finished_at=_agora())
+            except Exception:
+                pass
+        finally:
+            with self._lock:
+                self._pending = max(0, self._pending - 1)
+
+    def stats(self) -> dict:
+        return {"pending": self._pending, "max_pending": self.max_pending, "workers": self.workers}
+
+    def _cleanup(self) -> None:
+        """Remove jobs/ZIPs mais antigos que o TTL (best-effort)."""
+        try:
+            limite = time.time() - self.ttl_s
+            for p in self.base_dir.iterdir():
+                try:
+                    if p.stat().st_mtime < limite:
+                        p.unlink()
+                except Exception:
+                    pass
+        except Exception:
+            pass
+
+
+def public_view(job: dict) -> dict:
+    """Campos do job de exportação expostos na API."""
+    return {k: job.get(k) for k in ("job_id", "status", "filtros", "total", "exportados", "erros",
+                                    "created_at", "started_at", "finished_at", "error", "size")}
+
+
+export_jobs = ExportJobs()
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+pdf_jobs.py
+===========
+Fila assíncrona de geração de PDF.
+
+Antes o PDF era gerado dentro da requisição: com 2 workers do gunicorn, dois
+downloads simultâneos travavam todas as outras chamadas da API. Agora:
+- `POST /propostas/<id>/pdf-jobs` enfileira e responde 202 com o job_id;
+- o job roda num processo consumidor separado (`python pdf_jobs.py worker`), não
+  nos workers da API: a montagem do HTML não disputa CPU/GIL com as requisições.
+  Os workers só gravam o job em disco (propostas/pdf_jobs/<job_id>.json + um
+  marcador fila_<ns>_<job_id>); o consumidor pega cada marcador (unlink atômico:
+  um job nunca roda duas vezes) e executa até PDF_JOBS_WORKERS jobs por vez;
+- o consumidor é único por host (flock em consumidor.lock, mantido enquanto ele
+  vive). Sobe no when_ready do gunicorn (gunicorn.conf.py) e, se tiver morrido,
+  de novo pelo primeiro worker que enfileirar ou consultar um job na fila;
+  encerra sozinho depois de PDF_JOBS_IDLE_S sem trabalho (um deploy não deixa
+  código antigo rodando) e no on_exit do gunicorn;
+- o cliente acompanha por polling em GET /pdf-jobs/<id> (Retry-After indica o
+  intervalo); não há conexão longa presa a um worker síncrono;
+- o estado do job fica em disco, então qualquer worker responde status/resultado;
+  job "running" cujo consumidor morreu vira erro; job "queued" espera o próximo
+  consumidor;
+- a fila é limitada (PDF_JOBS_MAX_PENDING marcadores no host): cheia => QueueFull (503);
+- pedidos repetidos para o mesmo (proposta, payload) reaproveitam o mesmo job;
+- `schedule_warmup` pré-gera o PDF após salvar/mudar status, com debounce
+  (rajadas de autosave geram um único job, para o payload final).
+
+Estados: queued -> running -> done | error.
+
+Variáveis de ambiente:
+- PDF_JOBS_WORKERS: jobs simultâneos no consumidor (padrão 1)
+- PDF_JOBS_MAX_PENDING (padrão 8)
+- PDF_JOBS_TTL_S: tempo que o resultado fica disponível (padrão 1800)
+- PDF_JOBS_PROCESS: 0 roda o consumidor numa thread de cada worker (dev/Windows)
+- PDF_JOBS_APP: módulo que, importado, configura o render (padrão servidor_proposta)
+- PDF_JOBS_IDLE_S: ociosidade até o consumidor encerrar (padrão 600)
+- PDF_WARMUP: 0 desliga o pré-aquecimento
+- PDF_WARMUP_DELAY_S: silêncio exigido antes de pré-gerar (padrão 20)
+"""
+from __future__ import annotations
+
+import hashlib
+import importlib
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows (dev): consumidor numa thread do próprio worker
+    fcntl = None
+
+from timing import record as record_timing
+
+PDF_JOBS_DIR = Path(__file__).parent / "propostas" / "pdf_jobs"
+PDF_JOBS_WORKERS = max(1, int(os.environ.get("PDF_JOBS_WORKERS", "1")))
+PDF_JOBS_MAX_PENDING = max(1, int(os.environ.get("PDF_JOBS_MAX_PENDING", "8")))
+PDF_JOBS_TTL_S = max(60, int(os.environ.get("PDF_JOBS_TTL_S", "1800")))
+PDF_JOBS_PROCESS = (os.environ.get("PDF_JOBS_PROCESS", "1").strip().lower() not in ("0", "false", "no"))
+PDF_JOBS_APP = os.environ.get("PDF_JOBS_APP", "servidor_proposta").strip()
+PDF_JOBS_IDLE_S = max(10.0, float(os.environ.get("PDF_JOBS_IDLE_S", "600")))
+PDF_WARMUP = (os.environ.get("PDF_WARMUP", "1").strip().lower() not in ("0", "false", "no"))
+PDF_WARMUP_DELAY_S = max(0.0, float(os.environ.get("PDF_WARMUP_DELAY_S", "20")))
+
+ESTADOS_FINAIS = ("done", "error")
+
+# Intervalo de varredura da fila no consumidor
+_POLL_S = 0.25
+# Depois de subir o consumidor, não subir outro enquanto ele importa o app
+_SPAWN_BACKOFF_S = 15.0
+_LOCK_NOME = "consumidor.lock"
+
+# render(proposta_id, force) -> caminho do PDF pronto (pdf_store) ou bytes;
+# None se a proposta não existir
+RenderFn = Callable[[str, bool], Optional[Union[Path, bytes]]]
+# chave(proposta_id) -> chave do conteúdo atual (None se não existir / nada a fazer)
+ChaveFn = Callable[[str], Optional[str]]
+
+
+class QueueFull(Exception):
+    """Fila de PDFs cheia; o cliente deve tentar de novo depois."""
+
+
+def _agora() -> float:
+    return round(time.time(), 3)
+
+
+def _pid_vivo(pid: int) -> bool:
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except Exception:
+        return True
+
+
+class PdfJobs:
+    def __init__(self, base_dir: Path = PDF_JOBS_DIR, workers: int = PDF_JOBS_WORKERS,
+                 max_pending: int = PDF_JOBS_MAX_PENDING, ttl_s: int = PDF_JOBS_TTL_S):
+        self.base_dir = Path(base_dir)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl_s = ttl_s
+        self._render: Optional[RenderFn] = None
+        self._lock = threading.Lock()
+        self._spawned_at = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._thread_pid: Optional[int] = None
+        self._warmups: Dict[str, threading.Timer] = {}
+
+    def configure(self, render: RenderFn) -> None:
+        self._render = render
+
+    # ------------------------------------------------------------------
+    # Estado em disco
+    # ------------------------------------------------------------------
+    def _path(self, job_id: str) -> Path:
+        return self.base_dir / f"{job_id}.json"
+
+    def _pdf_path(self, job_id: str) -> Path:
+        return self.base_dir / f"{job_id}.pdf"
+
+    def _idx_path(self, chave: str) -> Path:
+        return self.base_dir / f"idx_{hashlib.sha1(chave.encode('utf-8')).hexdigest()[:24]}"
+
+    def _fila(self) -> list:
+        """Marcadores dos jobs na fila, do mais antigo ao mais novo."""
+        try:
+            return sorted(self.base_dir.glob("fila_*"))
+        except Exception:
+            return []
+
+    def _write(self, job: dict) -> None:
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self._path(job["job_id"]).with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self._path(job["job_id"]))
+
+    def _update(self, job: dict, **campos) -> dict:
+        job.update(campos)
+        self._write(job)
+        return job
+
+    def _read(self, job_id: str) -> Optional[dict]:
+        if not job_id or not all(c.isalnum() or c == "-" for c in job_id):
+            return None
+        try:
+            return json.loads(self._path(job_id).read_text(encoding="utf-8"))
+        except Exception:
+            return None
+
+    def _estado(self, job_id: str) -> Optional[dict]:
+        """Estado em disco; job em execução cujo consumidor morreu vira erro."""
+        job = self._read(job_id)
+        if job and job.get("status") == "running" and not _pid_vivo(job.get("owner_pid") or 0):
+            job = self._update(job, status="error", error="Job interrompido (consumidor reiniciado)",
+                               finished_at=_agora())
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Estado do job (de qualquer worker). Job na fila garante um consumidor no ar para atendê-lo."""
+        job = self._estado(job_id)
+        if job and job.get("status") == "queued":
+            self.ensure_consumer()
+        return job
+
+    def result_path(self, job_id: str) -> Optional[Path]:
+        job = self.get(job_id)
+        if not job or job.get("status") != "done":
+            return None
+        p = self._result_file(job)
+        return p if p.exists() else None
+
+    def _result_file(self, job: dict) -> Path:
+        # Resultado no armazenamento de PDFs (pdf_path) ou cópia própria do job
+        return Path(job["pdf_path"]) if job.get("pdf_path") else self._pdf_path(job["job_id"])
+
+    def _find(self, chave: str) -> Optional[dict]:
+        """Job reaproveitável para a chave (em andamento, ou pronto e ainda no disco)."""
+        try:
+            job_id = self._idx_path(chave).read_text(encoding="utf-8").strip()
+        except Exception:
+            return None
+        job = self._estado(job_id)
+        if not job:
+            return None
+        if job["status"] in ("queued", "running"):
+            return job
+        if job["status"] == "done" and self._result_file(job).exists():
+            return job
+        return None
+
+    # ------------------------------------------------------------------
+    # Enfileiramento (workers da API)
+    # ------------------------------------------------------------------
+    def submit(self, proposta_id: str, chave: str, force: bool = False) -> Tuple[dict, bool]:
+        """
+        Enfileira a geração do PDF. `chave` identifica o conteúdo (ex.: id + hash do payload).
+        Retorna (job, criado). Levanta QueueFull se a fila do host estiver cheia
+        (contagem aproximada entre workers: dois pedidos simultâneos podem passar juntos).
+        """
+        if self._render is None:
+            raise RuntimeError("pdf_jobs não configurado (configure(render))")
+        with self._lock:
+            if not force:
+                existente = self._find(chave)
+                if existente:
+                    return existente, False
+            na_fila = len(self._fila())
+            if na_fila >= self.max_pending:
+                raise QueueFull(f"{na_fila} PDFs na fila")
+            job = {
+                "job_id": uuid.uuid4().hex,
+                "proposta_id": proposta_id,
+                "status": "queued",
+                "chave": chave,
+                "force": bool(force),
+                "owner_pid": None,
+                "created_at": _agora(),
+                "started_at": None,
+                "finished_at": None,
+                "error": None,
+                "size": None,
+            }
+            self._write(job)
+            self._idx_path(chave).write_text(job["job_id"], encoding="utf-8")
+            # Marcador por último: o consumidor só vê o job com o estado já gravado
+            (self.base_dir / f"fila_{time.time_ns():020d}_{job['job_id']}").touch()
+        self.ensure_consumer()
+        self._cleanup()
+        return job, True
+
+    # ------------------------------------------------------------------
+    # Consumidor
+    # ------------------------------------------------------------------
+    def _lock_path(self) -> Path:
+        return self.base_dir / _LOCK_NOME
+
+    def consumer_alive(self) -> bool:
+        """Algum processo segura o lock do consumidor (sem fcntl: a thread local está viva)."""
+        if fcntl is None:
+            return self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid()
+        try:
+            self.base_dir.mkdir(parents=True, exist_ok=True)
+            with open(self._lock_path(), "a") as fh:
+                try:
+                    fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return True
+                fcntl.flock(fh, fcntl.LOCK_UN)
+                return False
+        except Exception:
+            return False
+
+    def ensure_consumer(self) -> None:
+        """Sobe o consumidor se nenhum estiver vivo (best-effort; o job fica na fila)."""
+        try:
+            if not PDF_JOBS_PROCESS or fcntl is None:
+                self._ensure_thread()
+                return
+            if time.time() - self._spawned_at < _SPAWN_BACKOFF_S or self.consumer_alive():
+                return
+            self._spawned_at = time.time()
+            print("🚀 [PDF_JOBS] Subindo consumidor de jobs de PDF...")
+            # Nova sessão: sobrevive ao reciclar do worker que o subiu
+            subprocess.Popen(
+                [sys.executable, str(Path(__file__).resolve()), "worker"],
+                cwd=str(Path(__file__).parent),
+                stdin=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except Exception as e:
+            print(f"⚠️ [PDF_JOBS] Falha ao subir consumidor: {e}")
+
+    def _ensure_thread(self) -> None:
+        with self._lock:
+            # Após fork (gunicorn --preload), a thread do processo pai não existe aqui
+            if self._thread is not None and self._thread.is_alive() and self._thread_pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self.consume, name="pdf-jobs-consumidor", daemon=True)
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _claim(self) -> Optional[dict]:
+        """Pega o job mais antigo da fila. O unlink do marcador é a posse: só um consumidor consegue."""
+        for marcador in self._fila():
+            try:
+                marcador.unlink()
+            except FileNotFoundError:
+                continue  # outro consumidor pegou
+            job = self._read(marcador.name.rsplit("_", 1)[-1])
+            if job and job.get("status") == "queued":
+                return self._update(job, status="running", owner_pid=os.getpid(), started_at=_agora())
+        return None
+
+    def consume(self, parar: Optional[threading.Event] = None, idle_s: Optional[float] = None) -> None:
+        """
+        Laço do consumidor: executa até `workers` jobs por vez. Volta quando `parar`
+        é sinalizado (esperando os jobs em execução) ou após `idle_s` sem trabalho.
+        """
+        parar = parar or threading.Event()
+        ocioso_desde = limpeza = time.time()
+        em_execucao = set()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pdf-job") as executor:
+            while not parar.is_set():
+                if em_execucao:
+                    _, em_execucao = wait(em_execucao, timeout=0, return_when=FIRST_COMPLETED)
+                while len(em_execucao) < self.workers:
+                    job = self._claim()
+                    if job is None:
+                        break
+                    em_execucao.add(executor.submit(self._run, job))
+                if em_execucao:
+                    ocioso_desde = time.time()
+                elif idle_s is not None and time.time() - ocioso_desde >= idle_s:
+                    break
+                parar.wait(_POLL_S)
+                if time.time() - limpeza >= 60:
+                    limpeza = time.time()
+                    self._cleanup()
+
+    def _run(self, job: dict) -> None:
+        try:
+            record_timing("pdf_job_queue", (job["started_at"] - job["created_at"]) * 1000.0)
+            pdf = self._render(job["proposta_id"], bool(job.get("force")))
+            if pdf is None:
+                self._update(job, status="error", error="Proposta não encontrada", finished_at=_agora())
+                return
+            if isinstance(pdf, Path):
+                size = pdf.stat().st_size
+                job["pdf_path"] = str(pdf)
+            else:
+                size = len(pdf)
+                tmp = self._pdf_path(job["job_id"]).with_suffix(".pdf.tmp")
+                tmp.write_bytes(pdf)
+                os.replace(tmp, self._pdf_path(job["job_id"]))
+            self._update(job, status="done", size=size, finished_at=_agora())
+            record_timing("pdf_job_total", (job["finished_at"] - job["created_at"]) * 1000.0)
+            print(f"✅ [PDF_JOBS] Job {job['job_id'][:8]} pronto ({size} bytes)")
+        except Exception as e:
+            print(f"❌ [PDF_JOBS] Job {job['job_id'][:8]} falhou: {e}")
+            try:
+                self._update(job, status="error", error=str(e)[:500], finished_at=_agora())
+            except Exception:
+                pass
+
+    def stats(self) -> dict:
+        return {"pending": len(self._fila()), "max_pending": self.max_pending, "workers": self.workers,
+                "consumidor": self.consumer_alive(), "warmups_agendados": len(self._warmups)}
+
+    def stop_consumer(self) -> None:
+        """SIGTERM ao consumidor (pid gravado no arquivo de lock); usado no on_exit do gunicorn."""
+        try:
+            pid = int(self._lock_path().read_text(encoding="utf-8").strip() or 0)
+            if pid and pid != os.getpid() and self.consumer_alive():
+                os.kill(pid, signal.SIGTERM)
+        except Exception:
+            pass
+
+    # ------------------------------------------------------------------
+    # Pré-aquecimento (debounce)
+    # ------------------------------------------------------------------
+    def schedule_warmup(self, proposta_id: str, chave: ChaveFn, delay_s: Optional[float] = None) -> None:
+        """
+        Agenda a pré-geração do PDF da proposta daqui a `delay_s`. Um novo agendamento
+        para a mesma proposta reinicia o prazo (debounce). A chave é calculada só no
+        disparo, com o payload final; se já houver job/resultado para ela, nada é feito.
+        """
+        if not PDF_WARMUP or not proposta_id or self._render is None:
+            return
+        delay = PDF_WARMUP_DELAY_S if delay_s is None else delay_s
+        with self._lock:
+            anterior = self._warmups.pop(proposta_id, None)
+            if anterior is not None:
+                anterior.cancel()
+            t = threading.Timer(delay, self._fire_warmup, args=(proposta_id, chave))
+            t.daemon = True
+            self._warmups[proposta_id] = t
+            t.start()
+
+    def _fire_warmup(self, proposta_id: str, chave: ChaveFn) -> None:
+        with self._lock:
+            self._warmups.pop(proposta_id, None)
+        try:
+            k = chave(proposta_id)
+            if not k:
+                return
+            job, criado = self.submit(proposta_id, k)
+            if criado:
+                print(f"🔥 [PDF_JOBS] Pré-geração agendada {job['job_id'][:8]} - proposta_id={proposta_id}")
+        except QueueFull:
+            # Fila ocupada com pedidos reais: a primeira visualização gera sob demanda
+            print(f"⚠️ [PDF_JOBS] Fila cheia; pré-geração ignorada - proposta_id={proposta_id}")
+        except Exception as e:
+            print(f"⚠️ [PDF_JOBS] Falha na pré-geração ({proposta_id}): {e}")
+
+    # ------------------------------------------------------------------
+    # Limpeza
+    # ------------------------------------------------------------------
+    def _cleanup(self) -> None:
+        """Remove jobs/resultados mais antigos que o TTL (best-effort)."""
+        try:
+            limite = time.time() - self.ttl_s
+            for p in self.base_dir.iterdir():
+                if p.name == _LOCK_NOME:
+                    continue  # preso pelo consumidor vivo; apagar permitiria um segundo
+                try:
+                    if p.stat().st_mtime < limite:
+                        p.unlink()
+                except Exception:
+                    pass
+        except Exception:
+            pass
+
+
+def public_view(job: dict) -> dict:
+    """Campos do job expostos na API."""
+    return {k: job.get(k) for k in ("job_id", "proposta_id", "status", "created_at",
+                                    "started_at", "finished_at", "error", "size")}
+
+
+pdf_jobs = PdfJobs()
+
+
+def run_consumer() -> int:
+    """
+    Processo consumidor (`python pdf_jobs.py worker`): segura o lock do host, importa
+    PDF_JOBS_APP (que chama pdf_jobs.configure) e consome a fila até ficar ocioso
+    por PDF_JOBS_IDLE_S ou receber SIGTERM. Retorna 0 também se outro consumidor já roda.
+    """
+    if fcntl is None:
+        print("⚠️ [PDF_JOBS] Consumidor em processo exige fcntl; use PDF_JOBS_PROCESS=0")
+        return 1
+    pdf_jobs.base_dir.mkdir(parents=True, exist_ok=True)
+    lock_fh = open(pdf_jobs._lock_path(), "a+")
+    try:
+        fcntl.flock(lock_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return 0
+    lock_fh.seek(0)
+    lock_fh.truncate()
+    lock_fh.write(str(os.getpid()))
+    lock_fh.flush()
+
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    signal.signal(signal.SIGINT, lambda *_: parar.set())
+    importlib.import_module(PDF_JOBS_APP)
+    if pdf_jobs._render is None:
+        print(f"❌ [PDF_JOBS] {PDF_JOBS_APP} não configurou o render (pdf_jobs.configure)")
+        return 1
+    print(f"✅ [PDF_JOBS] Consumidor pid={os.getpid()} ({pdf_jobs.workers} job(s) por vez)")
+    pdf_jobs.consume(parar, idle_s=PDF_JOBS_IDLE_S)
+    print(f"ℹ️ [PDF_JOBS] Consumidor pid={os.getpid()} encerrado")
+    return 0
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["worker"]:
+        print("Uso: python pdf_jobs.py worker")
+        sys.exit(2)
+    # Executado como script este arquivo é __main__; o app importa o módulo pdf_jobs
+    import pdf_jobs as _modulo
+    sys.exit(_modulo.run_consumer())
@@ -0,0 +1,339 @@
+import puppeteer from "puppeteer-core";
+import fs from "node:fs";
+import os from "node:os";
+import path from "node:path";
+
+// Código compartilhado entre o renderizador one-shot (render_pdf.js)
+// e o serviço persistente (render_server.js).
+
+export const executablePath =
+  process.env.CHROMIUM_PATH ||
+  process.env.PUPPETEER_EXECUTABLE_PATH ||
+  "/usr/bin/chromium";
+
+const BASE_ARGS = [
+  "--no-sandbox",
+  "--disable-setuid-sandbox",
+  "--disable-dev-shm-usage",
+  "--disable-gpu",
+  "--disable-software-rasterizer",
+  "--disable-extensions",
+  "--disable-background-networking",
+  "--disable-sync",
+  "--disable-translate",
+  "--no-first-run",
+  "--font-render-hinting=none",
+];
+
+/**
+ * Inicia o Chromium.
+ * singleProcess=true no one-shot (menos memória para 1 PDF);
+ * o serviço persistente usa multi-processo para reaproveitar várias páginas.
+ */
+export function launchBrowser({ singleProcess = false } = {}) {
+  return puppeteer.launch({
+    executablePath,
+    args: singleProcess ? [...BASE_ARGS, "--single-process"] : BASE_ARGS,
+    headless: "new",
+  });
+}
+
+/** Prepara uma página (viewport usado em todas as renderizações). */
+export async function preparePage(page) {
+  await page.setViewport({ width: 1920, height: 1080, deviceScaleFactor: 1.5 });
+}
+
+function createTimer() {
+  const timings = {};
+  let mark = Date.now();
+  return {
+    timings,
+    lap(name) {
+      const now = Date.now();
+      timings[name] = now - mark;
+      mark = now;
+    },
+  };
+}
+
+/**
+ * Lê a declaração de conteúdo do HTML (<meta name="fohat-render" content='{"charts": ...}'>).
+ * charts: "static" (PNG embutido), "echarts" (gráficos via JS) ou "none".
+ * HTML sem declaração (legado): assume ECharts se a lib estiver carregada na página.
+ */
+async function readRenderDeclaration(page) {
+  return page.evaluate(() => {
+    const meta = document.querySelector('meta[name="fohat-render"]');
+    if (meta) {
+      try {
+        return { declared: true, ...JSON.parse(meta.getAttribute("content") || "{}") };
+      } catch (_) {
+        // conteúdo inválido: cair na detecção abaixo
+      }
+    }
+    return { declared: false, charts: typeof window.echarts !== "undefined" ? "echarts" : "static" };
+  });
+}
+
+/**
+ * Espera as condições concretas de "pronto" (sem sleeps fixos):
+ * fontes carregadas, imagens decodificadas, gráficos ECharts sinalizados (se declarados)
+ * e dois frames de pintura.
+ */
+async function waitUntilReady(page, log) {
+  const decl = await readRenderDeclaration(page);
+  log(`Render declaration: ${JSON.stringify(decl)}`);
+
+  if (decl.charts === "echarts") {
+    try {
+      await page.waitForFunction("window.__FOHAT_ECHARTS_READY__ === true", { timeout: 10000 });
+      log("ECharts ready!");
+    } catch (_) {
+      log("ECharts timeout - continuing anyway...");
+    }
+  }
+
+  try {
+    await page.evaluate(async () => {
+      if (document.fonts && document.fonts.ready) {
+        await document.fonts.ready;
+      }
+      await Promise.all(
+        Array.from(document.images).map((img) => {
+          if (img.decode) {
+            return img.decode().catch(() => {});
+          }
+          return img.complete ? null : new Promise((resolve) => { img.onload = img.onerror = resolve; });
+        })
+      );
+      // Garantir layout/pintura após a troca de imagens e SVGs
+      await new Promise((resolve) => requestAnimationFrame(() => requestAnimationFrame(resolve)));
+    });
+  } catch (_) {
+    log("Readiness wait error - continuing...");
+  }
+}
+
+/**
+ * Renderiza o HTML em PDF usando uma página já criada.
+ * Retorna { pdf: Buffer, timings: {page_load, page_ready, pdf_print} }.
+ * beforePrint(page), se informado, roda com a página pronta; o retorno vai em `measured`.
+ */
+export async function renderHtmlToPdf(page, html, log = () => {}, { beforePrint = null } = {}) {
+  const t = createTimer();
+
+  // "load" basta: imagens são data URIs e o CSS externo (fontes) é aguardado em waitUntilReady.
+  // networkidle0 adicionava ~500 ms de ociosidade obrigatória.
+  log("Setting HTML content...");
+  await page.setContent(html, { waitUntil: "load", timeout: 30000 });
+  t.lap("page_load");
+
+  log("Waiting for readiness...");
+  await waitUntilReady(page, log);
+  t.lap("page_ready");
+
+  const measured = beforePrint ? await beforePrint(page) : undefined;
+
+  log("Generating PDF...");
+  const pdf = await page.pdf({
+    format: "A4",
+    landscape: true,
+    printBackground: true,
+    preferCSSPageSize: true,
+    margin: { top: "0mm", right: "0mm", bottom: "0mm", left: "0mm" },
+  });
+  t.lap("pdf_print");
+
+  return { pdf: Buffer.from(pdf), timings: t.timings, measured };
+}
+
+// ---------------------------------------------------------------------------
+// Renderização composta (slides estáticos pré-renderizados + páginas dinâmicas)
+// O Python (pdf_static.py) separa o HTML; aqui: PDF estático por chave (cache),
+// PDF dinâmico por proposta e merge das páginas com pdf-lib. O cabeçalho
+// ("Cliente | 05") dos slides estáticos é escrito com drawText na posição
+// medida quando o PDF estático foi renderizado (sem páginas overlay no Chromium).
+// ---------------------------------------------------------------------------
+const STATIC_DIR = process.env.PDF_STATIC_DIR || path.join(os.tmpdir(), "fohat_static_pages");
+const STATIC_MEM_MAX = 8;
+const staticMem = new Map();
+
+export class LayoutMismatch extends Error {}
+
+function readStatic(key) {
+  if (staticMem.has(key)) {
+    const entry = staticMem.get(key);
+    staticMem.delete(key);
+    staticMem.set(key, entry); // LRU
+    return entry;
+  }
+  try {
+    // Marcas antes do PDF: arquivo .pdf sem .json (formato antigo) conta como ausente
+    const marks = JSON.parse(fs.readFileSync(path.join(STATIC_DIR, `${key}.json`), "utf8"));
+    const entry = { pdf: fs.readFileSync(path.join(STATIC_DIR, `${key}.pdf`)), marks };
+    rememberStatic(key, entry);
+    return entry;
+  } catch (_) {
+    return null;
+  }
+}
+
+function rememberStatic(key, entry) {
+  staticMem.set(key, entry);
+  while (staticMem.size > STATIC_MEM_MAX) {
+    staticMem.delete(staticMem.keys().next().value);
+  }
+}
+
+function writeAtomic(file, data) {
+  const tmp = `${file}.${process.pid}.tmp`;
+  fs.writeFileSync(tmp, data);
+  fs.renameSync(tmp, file);
+}
+
+function writeStatic(key, entry) {
+  rememberStatic(key, entry);
+  try {
+    fs.mkdirSync(STATIC_DIR, { recursive: true });
+    writeAtomic(path.join(STATIC_DIR, `${key}.json`), JSON.stringify(entry.marks));
+    writeAtomic(path.join(STATIC_DIR, `${key}.pdf`), entry.pdf);
+  } catch (_) {
+    // cache em disco é opcional (fica o da memória)
+  }
+}
+
+/**
+ * Posição do `.header-meta` (vazio no documento estático) de cada página, em px CSS
+ * relativos à página, com a mídia de impressão: borda direita, linha de base,
+ * tamanho e cor da fonte. Um inline-block vazio tem a borda inferior na linha de base.
+ */
+async function measureHeaderMarks(page) {
+  await page.emulateMediaType("print");
+  try {
+    return await page.evaluate(() =>
+      Array.from(document.querySelectorAll("section.page")).map((sec) => {
+        const meta = sec.querySelector(".slide-header .header-meta");
+        if (!meta) {
+          return null;
+        }
+        const probe = document.createElement("span");
+        probe.style.cssText = "display:inline-block;width:0;height:0;vertical-align:baseline";
+        meta.appendChild(probe);
+        const box = sec.getBoundingClientRect();
+        const baseline = probe.getBoundingClientRect().bottom - box.top;
+        const right = meta.getBoundingClientRect().right - box.left;
+        probe.remove();
+        const style = getComputedStyle(meta);
+        const rgb = (style.color.match(/[\d.]+/g) || ["0", "0", "0"]).slice(0, 3).map((c) => Number(c) / 255);
+        return {
+          page_w: box.width,
+          right,
+          baseline,
+          font_size: parseFloat(style.fontSize) || 14,
+          color: rgb,
+        };
+      })
+    );
+  } finally {
+    await page.emulateMediaType(null);
+  }
+}
+
+/**
+ * Monta o PDF final: layout[i] === "d" usa a próxima página do dinâmico;
+ * "s" usa a próxima página estática com headers[j] escrito na posição marks[j].
+ * Texto que a fonte padrão (WinAnsi) não codifica vira LayoutMismatch: o Python
+ * renderiza o HTML inteiro.
+ */
+async function mergeLayout(dynamicPdf, staticEntry, layout, headers) {
+  const { PDFDocument, StandardFonts, rgb } = await import("pdf-lib");
+  const dyn = await PDFDocument.load(dynamicPdf);
+  const st = await PDFDocument.load(staticEntry.pdf);
+  const marks = staticEntry.marks || [];
+  const nStatic = layout.filter((k) => k === "s").length;
+  const nDynamic = layout.length - nStatic;
+  if (
+    dyn.getPageCount() !== nDynamic ||
+    st.getPageCount() !== nStatic ||
+    headers.length !== nStatic ||
+    marks.length !== nStatic ||
+    marks.some((m) => !m)
+  ) {
+    throw new LayoutMismatch(
+      `páginas: dinâmico=${dyn.getPageCount()}/${nDynamic}, estático=${st.getPageCount()}/${nStatic}, ` +
+        `cabeçalhos=${headers.length}, marcas=${marks.length}`
+    );
+  }
+
+  const out = await PDFDocument.create();
+  // .header-meta usa peso 600: Helvetica Bold é a fonte padrão mais próxima
+  const font = await out.embedFont(StandardFonts.HelveticaBold);
+  const dynPages = await out.copyPages(dyn, dyn.getPageIndices());
+  const stPages = await out.copyPages(st, st.getPageIndices());
+
+  let d = 0;
+  let s = 0;
+  for (const kind of layout) {
+    if (kind === "d") {
+      out.addPage(dynPages[d]);
+      d += 1;
+      continue;
+    }
+    const page = out.addPage(stPages[s]);
+    const mark = marks[s];
+    const text = String(headers[s] || "");
+    s += 1;
+    if (!text) {
+      continue;
+    }
+    const scale = page.getWidth() / mark.page_w;
+    const size = mark.font_size * scale;
+    let width;
+    try {
+      width = font.widthOfTextAtSize(text, size);
+    } catch (err) {
+      throw new LayoutMismatch(`cabeçalho não codificável: ${err.message}`);
+    }
+    page.drawText(text, {
+      x: mark.right * scale - width,
+      y: page.getHeight() - mark.baseline * scale,
+      size,
+      font,
+      color: rgb(...mark.color),
+    });
+  }
+  return Buffer.from(await out.save());
+}
+
+/**
+ * job = { dynamic_html, static_html, static_key, layout, headers }.
+ * Retorna { pdf, timings } como renderHtmlToPdf (+ static_render quando o cache faltou, pdf_merge).
+ */
+export async function renderComposite(page, job, log = () => {}) {
+  const { dynamic_html, static_html, static_key, layout, headers } = job || {};
+  if (
+    !dynamic_html ||
+    !static_html ||
+    !Array.isArray(layout) ||
+    !Array.isArray(headers) ||
+    !/^[0-9a-f]{16,64}$/.test(static_key || "")
+  ) {
+    throw new LayoutMismatch("job composto inválido");
+  }
+
+  const extra = {};
+  let staticEntry = readStatic(static_key);
+  if (!staticEntry) {
+    log(`Static pages ${static_key.slice(0, 12)} not cached - rendering...`);
+    const t0 = Date.now();
+    const { pdf, measured } = await renderHtmlToPdf(page, static_html, log, { beforePrint: measureHeaderMarks });
+    staticEntry = { pdf, marks: measured };
+    extra.static_render = Date.now() - t0;
+    writeStatic(static_key, staticEntry);
+  }
+
+  const { pdf, timings } = await renderHtmlToPdf(page, dynamic_html, log);
+  const t1 = Date.now();
+  const merged = await mergeLayout(pdf, staticEntry, layout, headers);
+  return { pdf: merged, timings: { ...timings, ...extra, pdf_merge: Date.now() - t1 } };
+}
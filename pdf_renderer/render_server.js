@@ -0,0 +1,306 @@
+import http from "node:http";
+import fs from "node:fs";
+import { launchBrowser, preparePage, renderHtmlToPdf, renderComposite, LayoutMismatch } from "./render_common.js";
+
+// Serviço persistente de renderização de PDF (localhost HTTP).
+// Mantém um Chromium quente e um pool de páginas reaproveitáveis.
+//
+//   POST /render   corpo = HTML (text/html) -> application/pdf
+//                  header X-Fohat-Timings = JSON com os tempos por etapa
+//   POST /render-composite  corpo = JSON {dynamic_html, static_html, static_key, layout, headers}
+//                  (slides estáticos vêm do cache por static_key; 422 se as páginas não baterem)
+//   GET  /health   estado do serviço (jobs, páginas, memória)
+//
+// O browser é reciclado após PDF_RENDER_MAX_JOBS jobs ou quando a memória
+// (Node + Chromium) passa de PDF_RENDER_MAX_RSS_MB.
+
+const HOST = process.env.PDF_RENDER_HOST || "127.0.0.1";
+const PORT = parseInt(process.env.PDF_RENDER_PORT || "3900", 10);
+const POOL_SIZE = Math.max(1, parseInt(process.env.PDF_RENDER_PAGES || "2", 10));
+const MAX_JOBS = Math.max(1, parseInt(process.env.PDF_RENDER_MAX_JOBS || "200", 10));
+const MAX_RSS_MB = Math.max(128, parseInt(process.env.PDF_RENDER_MAX_RSS_MB || "1200", 10));
+const MAX_BODY_BYTES = 64 * 1024 * 1024;
+
+const state = {
+  browser: null,
+  launching: null,
+  generation: 0,
+  jobsOnBrowser: 0,
+  jobsTotal: 0,
+  inFlight: 0,
+  recycling: false,
+  idlePages: [],
+  waiters: [],
+  lastLaunchMs: 0,
+};
+
+function log(msg) {
+  console.error(`[render-server] ${msg}`);
+}
+
+// ---------------------------------------------------------------------------
+// Memória (Linux: /proc/<pid>/status). Chromium multi-processo: somar filhos.
+// ---------------------------------------------------------------------------
+function rssOfPidMb(pid) {
+  try {
+    const status = fs.readFileSync(`/proc/${pid}/status`, "utf8");
+    const m = status.match(/VmRSS:\s+(\d+)\s+kB/);
+    return m ? parseInt(m[1], 10) / 1024 : 0;
+  } catch (_) {
+    return 0;
+  }
+}
+
+function childPids(pid) {
+  try {
+    const raw = fs.readFileSync(`/proc/${pid}/task/${pid}/children`, "utf8").trim();
+    return raw ? raw.split(/\s+/).map((x) => parseInt(x, 10)) : [];
+  } catch (_) {
+    return [];
+  }
+}
+
+function browserRssMb() {
+  const proc = state.browser?.process?.();
+  if (!proc?.pid) return 0;
+  let total = 0;
+  const stack = [proc.pid];
+  while (stack.length) {
+    const pid = stack.pop();
+    total += rssOfPidMb(pid);
+    stack.push(...childPids(pid));
+  }
+  return total;
+}
+
+function totalRssMb() {
+  return process.memoryUsage().rss / (1024 * 1024) + browserRssMb();
+}
+
+// ---------------------------------------------------------------------------
+// Browser + pool de páginas
+// ---------------------------------------------------------------------------
+async function ensureBrowser() {
+  if (state.browser && state.browser.connected) return state.browser;
+  if (state.launching) return state.launching;
+  state.launching = (async () => {
+    const t0 = Date.now();
+    const browser = await launchBrowser({ singleProcess: false });
+    state.lastLaunchMs = Date.now() - t0;
+    state.generation += 1;
+    state.jobsOnBrowser = 0;
+    state.idlePages = [];
+    browser.on("disconnected", () => {
+      if (state.browser === browser) {
+        log("Chromium desconectado; será reiniciado no próximo job");
+        state.browser = null;
+        state.idlePages = [];
+      }
+    });
+    state.browser = browser;
+    log(`Chromium iniciado em ${state.lastLaunchMs} ms (geração ${state.generation})`);
+    return browser;
+  })();
+  try {
+    return await state.launching;
+  } finally {
+    state.launching = null;
+  }
+}
+
+async function acquirePage() {
+  // Respeitar o tamanho do pool: esperar uma página livre
+  while (state.inFlight >= POOL_SIZE || state.recycling) {
+    await new Promise((resolve) => state.waiters.push(resolve));
+  }
+  state.inFlight += 1;
+  try {
+    let launchMs = 0;
+    if (!state.browser || !state.browser.connected) {
+      await ensureBrowser();
+      launchMs = state.lastLaunchMs;
+    }
+    const generation = state.generation;
+    let page = state.idlePages.pop();
+    if (!page || page.isClosed()) {
+      page = await state.browser.newPage();
+      await preparePage(page);
+    }
+    return { page, generation, launchMs };
+  } catch (err) {
+    releaseSlot();
+    throw err;
+  }
+}
+
+function releaseSlot() {
+  state.inFlight -= 1;
+  const next = state.waiters.shift();
+  if (next) next();
+}
+
+async function releasePage(page, generation, broken) {
+  try {
+    if (broken || generation !== state.generation || page.isClosed()) {
+      await page.close().catch(() => {});
+    } else {
+      // Limpar o conteúdo para não manter o DOM/imagens da proposta anterior em memória
+      await page.goto("about:blank").catch(() => {});
+      state.idlePages.push(page);
+    }
+  } finally {
+    releaseSlot();
+    maybeRecycle();
+  }
+}
+
+async function maybeRecycle() {
+  if (state.recycling || !state.browser) return;
+  const tooManyJobs = state.jobsOnBrowser >= MAX_JOBS;
+  const rss = totalRssMb();
+  const tooMuchMemory = rss >= MAX_RSS_MB;
+  if (!tooManyJobs && !tooMuchMemory) return;
+
+  state.recycling = true;
+  log(`Reciclando Chromium (jobs=${state.jobsOnBrowser}, rss=${rss.toFixed(0)} MB)`);
+  try {
+    // Esperar os jobs em andamento terminarem
+    while (state.inFlight > 0) {
+      await new Promise((r) => setTimeout(r, 50));
+    }
+    const old = state.browser;
+    state.browser = null;
+    state.idlePages = [];
+    await old?.close().catch(() => {});
+  } finally {
+    state.recycling = false;
+    // Acordar quem estava esperando
+    const waiters = state.waiters.splice(0);
+    waiters.forEach((w) => w());
+  }
+}
+
+// ---------------------------------------------------------------------------
+// HTTP
+// ---------------------------------------------------------------------------
+function readBody(req) {
+  return new Promise((resolve, reject) => {
+    const chunks = [];
+    let size = 0;
+    req.on("data", (c) => {
+      size += c.length;
+      if (size > MAX_BODY_BYTES) {
+        reject(new Error("HTML muito grande"));
+        req.destroy();
+        return;
+      }
+      chunks.push(c);
+    });
+    req.on("end", () => resolve(Buffer.concat(chunks).toString("utf8")));
+    req.on("error", reject);
+  });
+}
+
+async function handleRender(req, res, composite = false) {
+  const t0 = Date.now();
+  const body = await readBody(req);
+  if (!body || !body.trim()) {
+    res.writeHead(400, { "Content-Type": "text/plain" });
+    res.end("No HTML provided.");
+    return;
+  }
+  let job = null;
+  if (composite) {
+    try {
+      job = JSON.parse(body);
+    } catch (_) {
+      res.writeHead(400, { "Content-Type": "text/plain" });
+      res.end("Invalid JSON.");
+      return;
+    }
+  }
+  const queuedAt = Date.now();
+  const { page, generation, launchMs } = await acquirePage();
+  const queueMs = Date.now() - queuedAt;
+  let broken = false;
+  try {
+    const { pdf, timings } = composite ? await renderComposite(page, job) : await renderHtmlToPdf(page, body);
+    state.jobsOnBrowser += 1;
+    state.jobsTotal += 1;
+    const allTimings = { render_queue: queueMs, chromium_launch: launchMs, ...timings };
+    res.writeHead(200, {
+      "Content-Type": "application/pdf",
+      "Content-Length": pdf.length,
+      "X-Fohat-Timings": JSON.stringify(allTimings),
+    });
+    res.end(pdf);
+    log(`PDF ${pdf.length} bytes em ${Date.now() - t0} ms (fila ${queueMs} ms)`);
+  } catch (err) {
+    // Layout divergente não é falha da página: devolver 422 (o Python renderiza o HTML inteiro)
+    broken = !(err instanceof LayoutMismatch);
+    throw err;
+  } finally {
+    await releasePage(page, generation, broken);
+  }
+}
+
+function handleHealth(res) {
+  const body = JSON.stringify({
+    ok: true,
+    pid: process.pid,
+    browser: Boolean(state.browser && state.browser.connected),
+    generation: state.generation,
+    jobs_total: state.jobsTotal,
+    jobs_on_browser: state.jobsOnBrowser,
+    in_flight: state.inFlight,
+    waiting: state.waiters.length,
+    pool_size: POOL_SIZE,
+    rss_mb: Math.round(totalRssMb()),
+  });
+  res.writeHead(200, { "Content-Type": "application/json" });
+  res.end(body);
+}
+
+const server = http.createServer((req, res) => {
+  const url = (req.url || "").split("?")[0];
+  if (req.method === "GET" && url === "/health") {
+    handleHealth(res);
+    return;
+  }
+  if (req.method === "POST" && (url === "/render" || url === "/render-composite")) {
+    handleRender(req, res, url === "/render-composite").catch((err) => {
+      log(`Falha ao renderizar: ${err?.stack || err}`);
+      if (!res.headersSent) {
+        res.writeHead(err instanceof LayoutMismatch ? 422 : 500, { "Content-Type": "text/plain" });
+      }
+      res.end(String(err?.message || err));
+    });
+    return;
+  }
+  res.writeHead(404, { "Content-Type": "text/plain" });
+  res.end("Not found");
+});
+
+// Renderizações podem levar dezenas de segundos
+server.requestTimeout = 0;
+server.headersTimeout = 60000;
+
+server.on("error", (err) => {
+  // EADDRINUSE: outro worker já subiu o serviço
+  log(`Erro no servidor HTTP: ${err?.message || err}`);
+  process.exit(err?.code === "EADDRINUSE" ? 0 : 1);
+});
+
+server.listen(PORT, HOST, () => {
+  log(`Escutando em http://${HOST}:${PORT} (páginas=${POOL_SIZE}, max_jobs=${MAX_JOBS}, max_rss=${MAX_RSS_MB} MB)`);
+  // Aquecer o browser já na subida
+  ensureBrowser().catch((err) => log(`Falha ao iniciar Chromium: ${err?.message || err}`));
+});
+
+async function shutdown() {
+  server.close();
+  await state.browser?.close().catch(() => {});
+  process.exit(0);
+}
+process.on("SIGTERM", shutdown);
+process.on("SIGINT", shutdown);
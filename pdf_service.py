@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+pdf_service.py
+==============
+Cliente do serviço persistente de renderização de PDF (pdf_renderer/render_server.js).
+
+Antes cada PDF rodava `node render_pdf.js`, que subia um Chromium novo
+(segundos de startup + centenas de MB). Agora:
+- um daemon Node local mantém o Chromium quente e um pool de páginas;
+- o primeiro worker que precisar sobe o daemon (lock em arquivo evita que os
+  dois workers do gunicorn subam dois daemons);
+- cada PDF é um POST em http://127.0.0.1:<porta>/render com timeout;
+- qualquer falha do serviço cai no caminho one-shot antigo (render_pdf.js);
+- renderização composta: slides marcados como estáticos no template são
+  impressos uma vez por versão do template (cache no renderizador) e só as
+  páginas dinâmicas são impressas por proposta (ver pdf_static.py). Qualquer
+  falha nesse caminho renderiza o HTML inteiro;
+- controle de admissão: no máximo PDF_RENDER_MAX_CONCURRENT renderizações por host
+  (somando os workers), com fila de espera limitada. Fila cheia ou espera esgotada
+  => RenderSaturated (a rota responde 503 + Retry-After) em vez de subir Chromiums
+  até o container morrer por OOM.
+
+Variáveis de ambiente:
+- PDF_RENDER_SERVICE: 0 desliga o serviço (sempre one-shot)
+- PDF_RENDER_PORT: porta local do serviço (padrão 3900)
+- PDF_RENDER_PAGES / PDF_RENDER_MAX_JOBS / PDF_RENDER_MAX_RSS_MB: repassadas ao daemon
+- PDF_RENDER_MAX_CONCURRENT: renderizações simultâneas por host (padrão 2)
+- PDF_RENDER_QUEUE: pedidos que podem esperar por uma vaga (padrão 6)
+- PDF_RENDER_QUEUE_TIMEOUT_S: espera máxima por uma vaga (padrão 20)
+- PDF_STATIC_PAGES: 0 desliga a renderização composta
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows (dev): sem lock entre processos
+    fcntl = None
+
+import pdf_static
+from timing import span, record as record_timing
+
+RENDERER_DIR = Path(__file__).parent / "pdf_renderer"
+ONESHOT_SCRIPT = RENDERER_DIR / "render_pdf.js"
+SERVER_SCRIPT = RENDERER_DIR / "render_server.js"
+
+PDF_RENDER_SERVICE = (os.environ.get("PDF_RENDER_SERVICE", "1").strip().lower() not in ("0", "false", "no"))
+PDF_RENDER_HOST = "127.0.0.1"
+PDF_RENDER_PORT = int(os.environ.get("PDF_RENDER_PORT", "3900"))
+SPAWN_WAIT_S = float(os.environ.get("PDF_RENDER_SPAWN_WAIT_S", "15"))
+
+_LOCK_FILE = Path(tempfile.gettempdir()) / f"fohat_render_server_{PDF_RENDER_PORT}.lock"
+
+PDF_RENDER_MAX_CONCURRENT = max(1, int(os.environ.get("PDF_RENDER_MAX_CONCURRENT", "2")))
+PDF_RENDER_QUEUE = max(0, int(os.environ.get("PDF_RENDER_QUEUE", "6")))
+PDF_RENDER_QUEUE_TIMEOUT_S = max(1.0, float(os.environ.get("PDF_RENDER_QUEUE_TIMEOUT_S", "20")))
+
+_SLOTS_DIR = Path(tempfile.gettempdir()) / "fohat_render_slots"
+
+PDF_STATIC_PAGES = (os.environ.get("PDF_STATIC_PAGES", "1").strip().lower() not in ("0", "false", "no"))
+
+# Depois de uma falha ao subir o serviço, não tentar de novo a cada PDF
+_SPAWN_BACKOFF_S = 60.0
+_spawn_failed_at = 0.0
+
+
+def _renderer_env() -> dict:
+    env = os.environ.copy()
+    env.setdefault("CHROMIUM_PATH", "/usr/bin/chromium")
+    env.setdefault("PUPPETEER_EXECUTABLE_PATH", "/usr/bin/chromium")
+    return env
+
+
+def _base_url() -> str:
+    return f"http://{PDF_RENDER_HOST}:{PDF_RENDER_PORT}"
+
+
+def _registrar_tempos(tempos: Optional[dict]) -> None:
+    for nome, ms in (tempos or {}).items():
+        record_timing(str(nome), ms)
+
+
+def _registrar_tempos_stderr(stderr_log: str) -> None:
+    """
+    Lê a linha 'FOHAT_TIMINGS {...}' do render_pdf.js (launch, page load, espera, print).
+    Único leitor desses tempos: o caminho one-shot passa só por aqui.
+    """
+    try:
+        m = re.search(r'FOHAT_TIMINGS (\{[^\n]*\})', stderr_log or "")
+        if m:
+            _registrar_tempos(json.loads(m.group(1)))
+    except Exception as e:
+        print(f"⚠️ [PDF] Falha ao ler tempos do renderer: {e}")
+
+
+# -----------------------------------------------------------------------------
+# Controle de admissão (vagas por host)
+# -----------------------------------------------------------------------------
+
+class RenderTimeout(RuntimeError):
+    """A renderização estourou o tempo (não vale repetir por outro caminho)."""
+
+
+class RenderSaturated(RuntimeError):
+    """Sem vaga para renderizar agora; `retry_after` sugere quando tentar de novo (s)."""
+
+    def __init__(self, message: str, retry_after: int = 10):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+_admissao_lock = threading.Lock()
+_admissao = {"admitidos": 0, "rejeitados_fila": 0, "rejeitados_espera": 0}
+
+
+def _contar(nome: str) -> None:
+    with _admissao_lock:
+        _admissao[nome] += 1
+
+
+def _try_slot(prefixo: str, n: int):
+    """Tenta pegar uma das `n` vagas (flock não bloqueante em n arquivos). Retorna o handle ou None."""
+    _SLOTS_DIR.mkdir(parents=True, exist_ok=True)
+    for i in range(n):
+        fh = open(_SLOTS_DIR / f"{prefixo}_{i}.lock", "w")
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return fh
+        except BlockingIOError:
+            fh.close()
+    return None
+
+
+def _release_slot(fh) -> None:
+    if fh is None:
+        return
+    try:
+        fcntl.flock(fh, fcntl.LOCK_UN)
+        fh.close()
+    except Exception:
+        pass
+
+
+@contextmanager
+def render_slot(timeout_s: float = PDF_RENDER_QUEUE_TIMEOUT_S) -> Iterator[None]:
+    """
+    Vaga de renderização (compartilhada entre os workers do host).
+    Sem vaga livre: entra na fila (limitada) e espera até `timeout_s`.
+    Fila cheia ou espera esgotada: RenderSaturated.
+    """
+    if fcntl is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    vaga = _try_slot("render", PDF_RENDER_MAX_CONCURRENT)
+    if vaga is None:
+        lugar = _try_slot("fila", PDF_RENDER_QUEUE) if PDF_RENDER_QUEUE else None
+        if lugar is None:
+            _contar("rejeitados_fila")
+            print(f"🚦 [PDF] Saturado: {PDF_RENDER_MAX_CONCURRENT} renderizando e fila cheia ({PDF_RENDER_QUEUE})")
+            raise RenderSaturated("Servidor ocupado gerando PDFs. Tente novamente em instantes.", retry_after=10)
+        try:
+            deadline = time.monotonic() + timeout_s
+            while vaga is None:
+                if time.monotonic() >= deadline:
+                    _contar("rejeitados_espera")
+                    print(f"🚦 [PDF] Sem vaga após {timeout_s:.0f}s na fila")
+                    raise RenderSaturated("Servidor ocupado gerando PDFs. Tente novamente em instantes.",
+                                          retry_after=int(timeout_s))
+                time.sleep(0.1)
+                vaga = _try_slot("render", PDF_RENDER_MAX_CONCURRENT)
+        finally:
+            _release_slot(lugar)
+    espera_ms = (time.perf_counter() - t0) * 1000.0
+    record_timing("render_admission_wait", espera_ms)
+    _contar("admitidos")
+    try:
+        yield
+    finally:
+        _release_slot(vaga)
+
+
+def admission_stats() -> dict:
+    with _admissao_lock:
+        stats = dict(_admissao)
+    stats.update({
+        "max_concurrent": PDF_RENDER_MAX_CONCURRENT,
+        "queue": PDF_RENDER_QUEUE,
+        "queue_timeout_s": PDF_RENDER_QUEUE_TIMEOUT_S,
+    })
+    return stats
+
+
+# -----------------------------------------------------------------------------
+# Serviço persistente
+# -----------------------------------------------------------------------------
+
+def service_health(timeout_s: float = 1.0) -> Optional[dict]:
+    try:
+        with urllib.request.urlopen(_base_url() + "/health", timeout=timeout_s) as resp:
+            return json.loads(resp.read().decode("utf-8") or "{}")
+    except Exception:
+        return None
+
+
+def _spawn_service() -> None:
+    """Sobe o daemon em uma nova sessão (sobrevive ao reciclar de um worker do gunicorn)."""
+    env = _renderer_env()
+    env["PDF_RENDER_PORT"] = str(PDF_RENDER_PORT)
+    subprocess.Popen(
+        ["node", str(SERVER_SCRIPT)],
+        cwd=str(RENDERER_DIR),
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def ensure_service() -> bool:
+    """Garante o daemon no ar. Retorna False se não foi possível (usar one-shot)."""
+    global _spawn_failed_at
+    if not PDF_RENDER_SERVICE or not SERVER_SCRIPT.exists():
+        return False
+    if service_health():
+        return True
+    if _spawn_failed_at and (time.time() - _spawn_failed_at) < _SPAWN_BACKOFF_S:
+        return False
+
+    lock_fh = None
+    try:
+        if fcntl is not None:
+            lock_fh = open(_LOCK_FILE, "w")
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            # Outro worker pode ter subido enquanto esperávamos o lock
+            if service_health():
+                return True
+        print(f"🚀 [PDF] Subindo serviço de renderização em {_base_url()}...")
+        _spawn_service()
+        deadline = time.time() + SPAWN_WAIT_S
+        while time.time() < deadline:
+            time.sleep(0.25)
+            if service_health(timeout_s=0.5):
+                print("✅ [PDF] Serviço de renderização pronto")
+                return True
+        print(f"⚠️ [PDF] Serviço de renderização não respondeu em {SPAWN_WAIT_S:.0f}s")
+        _spawn_failed_at = time.time()
+        return False
+    except Exception as e:
+        print(f"⚠️ [PDF] Falha ao subir serviço de renderização: {e}")
+        _spawn_failed_at = time.time()
+        return False
+    finally:
+        if lock_fh is not None:
+            try:
+                fcntl.flock(lock_fh, fcntl.LOCK_UN)
+                lock_fh.close()
+            except Exception:
+                pass
+
+
+def render_via_service(html: str, timeout_s: float, composite: bool = False) -> bytes:
+    """POST do HTML (ou do JSON da renderização composta) ao daemon."""
+    req = urllib.request.Request(
+        _base_url() + ("/render-composite" if composite else "/render"),
+        data=html.encode("utf-8"),
+        headers={"Content-Type": "application/json" if composite else "text/html; charset=utf-8"},
+        method="POST",
+    )
+    with urllib.request.urlopen(req, timeout=timeout_s) as resp:
+        pdf = resp.read()
+        tempos = resp.headers.get("X-Fohat-Timings")
+    if not pdf or not pdf.startswith(b"%PDF"):
+        raise RuntimeError("Resposta inválida do serviço de renderização")
+    try:
+        _registrar_tempos(json.loads(tempos) if tempos else None)
+    except Exception:
+        pass
+    return pdf
+
+
+# -----------------------------------------------------------------------------
+# One-shot (caminho antigo, fallback)
+# -----------------------------------------------------------------------------
+
+def render_oneshot(html: str, timeout_s: int = 60, composite: bool = False) -> bytes:
+    """Roda `node render_pdf.js` (HTML no stdin, PDF no stdout) com um Chromium novo."""
+    if not ONESHOT_SCRIPT.exists():
+        raise RuntimeError("pdf_renderer/render_pdf.js não encontrado.")
+
+    try:
+        with span("chromium_total"):
+            proc = subprocess.run(
+                ["node", str(ONESHOT_SCRIPT)] + (["--composite"] if composite else []),
+                input=html.encode("utf-8"),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                env=_renderer_env(),
+                timeout=timeout_s,
+                check=False,
+            )
+    except subprocess.TimeoutExpired:
+        print(f"❌ [PDF] Timeout após {timeout_s}s")
+        raise RenderTimeout("Timeout ao gerar PDF (Puppeteer).")
+
+    stderr_log = (proc.stderr or b"").decode("utf-8", errors="ignore")
+    _registrar_tempos_stderr(stderr_log)
+    if stderr_log:
+        print(f"📄 [PDF] Puppeteer log: {stderr_log[:500]}")
+
+    if proc.returncode != 0 or not proc.stdout:
+        print(f"❌ [PDF] Falha rc={proc.returncode}")
+        raise RuntimeError(f"Falha ao gerar PDF (Puppeteer). rc={proc.returncode} err={stderr_log[:800]}")
+    return proc.stdout
+
+
+def render_pdf(html: str, timeout_s: int = 60) -> bytes:
+    """
+    Serviço persistente quando disponível; senão (ou em erro) o one-shot.
+    Só renderiza com vaga (render_slot); sem vaga levanta RenderSaturated.
+    """
+    with render_slot():
+        return _render_pdf(html, timeout_s)
+
+
+def _render_pdf(html: str, timeout_s: int) -> bytes:
+    job = None
+    if PDF_STATIC_PAGES:
+        try:
+            job = pdf_static.split_static(html)
+        except Exception as e:
+            print(f"⚠️ [PDF] Falha ao separar slides estáticos: {e}")
+    if job is not None:
+        try:
+            return _render_body(json.dumps(job), timeout_s, composite=True)
+        except RenderTimeout:
+            raise
+        except Exception as e:
+            print(f"⚠️ [PDF] Renderização composta falhou ({e}) — renderizando o HTML inteiro")
+    return _render_body(html, timeout_s)
+
+
+def _render_body(html: str, timeout_s: int, composite: bool = False) -> bytes:
+    if ensure_service():
+        try:
+            with span("chromium_total"):
+                return render_via_service(html, timeout_s, composite=composite)
+        except TimeoutError:
+            # Não repetir no one-shot: dobraria o tempo de uma renderização que já estourou
+            print(f"❌ [PDF] Timeout após {timeout_s}s (serviço)")
+            raise RenderTimeout("Timeout ao gerar PDF (Puppeteer).")
+        except urllib.error.HTTPError as e:
+            detail = ""
+            try:
+                detail = e.read().decode("utf-8", errors="ignore")[:300]
+            except Exception:
+                pass
+            if composite:
+                # O serviço está no ar e recusou a composição: renderizar o HTML inteiro nele
+                raise RuntimeError(f"serviço retornou {e.code}: {detail}")
+            print(f"⚠️ [PDF] Serviço retornou {e.code}: {detail} — usando one-shot")
+        except Exception as e:
+            print(f"⚠️ [PDF] Serviço de renderização indisponível ({e}) — usando one-shot")
+    return render_oneshot(html, timeout_s, composite=composite)
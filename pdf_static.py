@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+pdf_static.py
+=============
+Separação dos slides estáticos do template.html para a renderização composta.
+
+Vários slides (apresentação da Fohat, "como funciona", "solução completa") são
+iguais para todo cliente — a única diferença é o `.header-meta` ("Cliente | 05").
+Eles são marcados no template com `data-fohat-static`. A partir do HTML final
+da proposta, `split_static` monta:
+- documento estático: só os slides marcados, com o `.header-meta` vazio. Não
+  depende da proposta; `static_key` (sha256 do documento) muda só quando o
+  template/motor muda, e o renderizador guarda o PDF dessas páginas por chave;
+- documento dinâmico: só os demais slides (o Chromium não imprime nada dos
+  slides estáticos);
+- `layout`: "d" (próxima página do dinâmico) ou "s" (próxima página estática),
+  na ordem final;
+- `headers`: o texto do `.header-meta` de cada slide estático, na ordem.
+O merge das páginas é feito no pdf_renderer (render_common.js, pdf-lib), que
+escreve o texto do cabeçalho direto na página estática (drawText), na posição
+medida quando o documento estático foi renderizado.
+"""
+from __future__ import annotations
+
+import hashlib
+import html as html_lib
+import re
+from typing import Optional
+
+STATIC_ATTR = "data-fohat-static"
+
+_SECTION_SPLIT_RE = re.compile(r"(?=<section\b)")
+_SECTION_OPEN_RE = re.compile(r"<section\b[^>]*>")
+_HEADER_RE = re.compile(
+    r'<div class="slide-header">(?:(?!<div class="slide-header">).)*?'
+    r'<div class="header-meta">(.*?)</div>\s*</div>',
+    re.S,
+)
+_TITLE_RE = re.compile(r"<title>.*?</title>", re.S)
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def _static_section(section: str) -> str:
+    """Slide estático sem o texto do cabeçalho (nome do cliente)."""
+    m = _HEADER_RE.search(section)
+    return section[:m.start(1)] + section[m.end(1):]
+
+
+def _header_text(section: str) -> str:
+    """Texto do `.header-meta` como o navegador mostraria (sem tags, entidades resolvidas, espaços colapsados)."""
+    bruto = _TAG_RE.sub("", _HEADER_RE.search(section).group(1))
+    return " ".join(html_lib.unescape(bruto).split())
+
+
+def split_static(html: str) -> Optional[dict]:
+    """
+    Divide o HTML final em {dynamic_html, static_html, static_key, layout, headers}.
+    Retorna None se não houver slides estáticos utilizáveis (renderizar o HTML inteiro).
+    """
+    if STATIC_ATTR not in html or "</head>" not in html:
+        return None
+    partes = _SECTION_SPLIT_RE.split(html)
+    head, secoes = partes[0], partes[1:]
+    if not secoes:
+        return None
+
+    dinamico = [head]
+    estaticos = []
+    cabecalhos = []
+    layout = []
+    for parte in secoes:
+        fim = parte.rfind("</section>")
+        if fim < 0:
+            return None
+        fim += len("</section>")
+        secao, depois = parte[:fim], parte[fim:]
+        # Uma <section> por página: seção aninhada quebraria o mapeamento de páginas
+        if secao.count("<section") != 1:
+            return None
+        abertura = _SECTION_OPEN_RE.match(secao)
+        if abertura and STATIC_ATTR in abertura.group(0) and _HEADER_RE.search(secao):
+            estaticos.append(_static_section(secao))
+            cabecalhos.append(_header_text(secao))
+            dinamico.append(depois)
+            layout.append("s")
+        else:
+            dinamico.append(parte)
+            layout.append("d")
+
+    if not estaticos or "d" not in layout:
+        return None
+    # <title> traz o nome do cliente: fora do documento estático
+    head_estatico = _TITLE_RE.sub("<title>Fohat</title>", head, count=1)
+    static_html = head_estatico + "\n".join(estaticos) + "\n</body>\n</html>\n"
+    return {
+        "dynamic_html": "".join(dinamico),
+        "static_html": static_html,
+        "static_key": hashlib.sha256(static_html.encode("utf-8")).hexdigest(),
+        "layout": layout,
+        "headers": cabecalhos,
+    }
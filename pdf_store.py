@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+pdf_store.py
+============
+Armazenamento binário dos PDFs das propostas.
+
+- Fonte da verdade: tabela `propostas_pdf_cache` (bytea, ver db.PdfCacheDB),
+  uma linha por proposta com o hash do payload que gerou o PDF.
+- Cópia local endereçada por conteúdo: propostas/pdfs/<sha256>.pdf. É o que a
+  rota serve (send_file com Range/ETag, em blocos), sem decodificar base64 nem
+  carregar o PDF na linha da proposta. Se o container for recriado, a cópia é
+  refeita a partir do banco no primeiro acesso.
+- A coluna antiga `propostas.pdf_cache` (base64) só é lida para migrar: o PDF vai
+  para a tabela nova e a coluna é limpa.
+- `single_flight(chave)`: renderizações idênticas simultâneas (link compartilhado
+  em grupo) viram uma só. Lock em arquivo por (proposta, hash do payload), então
+  vale entre os workers do gunicorn; quem espera relê o cache ao entrar.
+- Modo arquivo (sem DB): `lookup_ref`/`store_ref` apontam a chave para a cópia local.
+
+Variáveis de ambiente:
+- PDF_STORE_MAX_MB: limite da cópia local; os arquivos menos usados saem primeiro (padrão 512)
+- PDF_SINGLE_FLIGHT_WAIT_S: espera máxima pela renderização de outro worker (padrão 90)
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows (dev): sem coalescência entre processos
+    fcntl = None
+
+from sqlalchemy.orm import load_only
+
+from db import PdfCacheDB
+
+PDF_STORE_DIR = Path(__file__).parent / "propostas" / "pdfs"
+PDF_STORE_MAX_MB = max(16, int(os.environ.get("PDF_STORE_MAX_MB", "512")))
+PDF_SINGLE_FLIGHT_WAIT_S = max(1.0, float(os.environ.get("PDF_SINGLE_FLIGHT_WAIT_S", "90")))
+
+_LOCKS_DIR = Path(tempfile.gettempdir()) / "fohat_pdf_locks"
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def path_for(sha: str) -> Path:
+    return PDF_STORE_DIR / f"{sha}.pdf"
+
+
+def materializar(pdf_bytes: bytes, sha: Optional[str] = None) -> Path:
+    """Grava (se ainda não existir) a cópia local endereçada por conteúdo."""
+    sha = sha or sha256_hex(pdf_bytes)
+    path = path_for(sha)
+    if path.exists():
+        try:
+            os.utime(path, None)  # "usado agora" para o descarte por LRU
+        except Exception:
+            pass
+        return path
+    PDF_STORE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_bytes(pdf_bytes)
+    os.replace(tmp, path)
+    _prune()
+    return path
+
+
+def lookup(db, proposta_id: str, payload_hash: str) -> Optional[Path]:
+    """
+    Caminho do PDF em cache para (proposta, hash do payload), ou None.
+    Lê só os metadados; os bytes só saem do banco se a cópia local não existir.
+    """
+    meta = (
+        db.query(PdfCacheDB)
+        .options(load_only(PdfCacheDB.proposta_id, PdfCacheDB.payload_hash, PdfCacheDB.sha256))
+        .populate_existing()  # reler após esperar o single_flight (outro worker pode ter gravado)
+        .filter(PdfCacheDB.proposta_id == proposta_id)
+        .one_or_none()
+    )
+    if meta is None or meta.payload_hash != payload_hash:
+        return None
+    path = path_for(meta.sha256)
+    if path.exists():
+        try:
+            os.utime(path, None)
+        except Exception:
+            pass
+        return path
+    pdf = db.query(PdfCacheDB.pdf).filter(PdfCacheDB.proposta_id == proposta_id).scalar()
+    if not pdf:
+        return None
+    return materializar(bytes(pdf), meta.sha256)
+
+
+def store(db, proposta_id: str, payload_hash: str, pdf_bytes: bytes) -> Path:
+    """Grava o PDF no banco (upsert da linha da proposta) e a cópia local. Faz commit."""
+    sha = sha256_hex(pdf_bytes)
+    path = materializar(pdf_bytes, sha)
+    db.merge(PdfCacheDB(
+        proposta_id=proposta_id,
+        payload_hash=payload_hash,
+        sha256=sha,
+        size=len(pdf_bytes),
+        pdf=pdf_bytes,
+        created_at=datetime.utcnow(),
+    ))
+    db.commit()
+    return path
+
+
+def migrar_legado(db, row, payload_hash: str) -> Optional[Path]:
+    """
+    Se a proposta ainda tem o PDF em base64 (propostas.pdf_cache) para o hash atual,
+    move para a tabela binária e limpa a coluna. Retorna o caminho local ou None.
+    """
+    cached_pdf = getattr(row, "pdf_cache", None)
+    if not cached_pdf:
+        return None
+    try:
+        if getattr(row, "pdf_payload_hash", None) != payload_hash:
+            row.pdf_cache = None
+            db.commit()
+            return None
+        pdf_bytes = base64.b64decode(cached_pdf)
+        row.pdf_cache = None
+        return store(db, row.id, payload_hash, pdf_bytes)
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ [PDF_STORE] Falha ao migrar cache base64 ({row.id}): {e}")
+        return None
+
+
+def has_valid(db, proposta_id: str, payload_hash: str) -> bool:
+    """Há PDF em cache para o payload atual? (só metadados)"""
+    h = db.query(PdfCacheDB.payload_hash).filter(PdfCacheDB.proposta_id == proposta_id).scalar()
+    return h == payload_hash
+
+
+def _chave_hash(chave: str) -> str:
+    return hashlib.sha1(chave.encode("utf-8")).hexdigest()[:32]
+
+
+@contextmanager
+def single_flight(chave: str, timeout_s: float = PDF_SINGLE_FLIGHT_WAIT_S) -> Iterator[bool]:
+    """
+    Exclusão mútua por chave entre threads e processos (flock). Entrega True se
+    precisou esperar outro dono (o chamador deve reler o cache antes de renderizar).
+    Passado `timeout_s`, segue sem o lock: melhor renderizar em dobro que falhar.
+    """
+    if fcntl is None:
+        yield False
+        return
+    fh = None
+    esperou = False
+    try:
+        _LOCKS_DIR.mkdir(parents=True, exist_ok=True)
+        caminho = _LOCKS_DIR / f"{_chave_hash(chave)}.lock"
+        deadline = time.monotonic() + timeout_s
+        while True:
+            if fh is None:
+                fh = open(caminho, "a")
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                esperou = True
+                if time.monotonic() >= deadline:
+                    print(f"⚠️ [PDF_STORE] Espera de {timeout_s:.0f}s esgotada; renderizando em paralelo")
+                    fh.close()
+                    fh = None
+                    break
+                time.sleep(0.2)
+                continue
+            # A limpeza pode ter apagado o arquivo entre o open e o flock: o lock
+            # seria de um inode órfão. Só vale se o caminho ainda é este arquivo.
+            try:
+                mesmo = os.stat(caminho).st_ino == os.fstat(fh.fileno()).st_ino
+            except FileNotFoundError:
+                mesmo = False
+            if mesmo:
+                os.utime(caminho, None)  # "usado agora": a limpeza só remove locks parados
+                break
+            fh.close()
+            fh = None
+    except Exception as e:
+        print(f"⚠️ [PDF_STORE] Lock indisponível: {e}")
+        if fh is not None:
+            fh.close()
+            fh = None
+    try:
+        yield esperou
+    finally:
+        if fh is not None:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+                fh.close()
+            except Exception:
+                pass
+
+
+def _ref_path(chave: str) -> Path:
+    return PDF_STORE_DIR / f"ref_{_chave_hash(chave)}"
+
+
+def lookup_ref(chave: str) -> Optional[Path]:
+    """Modo arquivo: cópia local do PDF já gerado para a chave, se ainda existir."""
+    try:
+        path = path_for(_ref_path(chave).read_text(encoding="utf-8").strip())
+    except Exception:
+        return None
+    if not path.exists():
+        return None
+    try:
+        os.utime(path, None)  # a referência sai junto com o PDF (LRU em _prune)
+    except Exception:
+        pass
+    return path
+
+
+def store_ref(chave: str, pdf_bytes: bytes) -> Path:
+    """Modo arquivo: grava a cópia local e aponta a chave para ela."""
+    sha = sha256_hex(pdf_bytes)
+    path = materializar(pdf_bytes, sha)
+    try:
+        _ref_path(chave).write_text(sha, encoding="utf-8")
+    except Exception as e:
+        print(f"⚠️ [PDF_STORE] Falha ao gravar referência: {e}")
+    return path
+
+
+def _remover_lock_parado(p: Path) -> None:
+    """Apaga o lock só se ninguém o segura (LOCK_NB); com o lock na mão, o unlink é seguro."""
+    with open(p, "a") as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return  # renderização em andamento
+        try:
+            p.unlink()
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _prune() -> None:
+    """
+    Mantém a cópia local abaixo de PDF_STORE_MAX_MB (menos usados primeiro). As
+    referências do modo arquivo saem junto com o PDF para o qual apontam (ou quando
+    ele já não existe). Locks do single_flight parados há 1 dia são removidos só se
+    estiverem livres. Best-effort.
+    """
+    try:
+        arquivos = []
+        total = 0
+        for p in PDF_STORE_DIR.glob("*.pdf"):
+            st = p.stat()
+            arquivos.append((st.st_mtime, st.st_size, p))
+            total += st.st_size
+        refs = {}
+        for p in PDF_STORE_DIR.glob("ref_*"):
+            try:
+                refs.setdefault(p.read_text(encoding="utf-8").strip(), []).append(p)
+            except Exception:
+                pass
+        limite = PDF_STORE_MAX_MB * 1024 * 1024
+        removidos = set()
+        if total > limite:
+            for _, size, p in sorted(arquivos):
+                try:
+                    p.unlink()
+                    removidos.add(p.stem)
+                    total -= size
+                except Exception:
+                    pass
+                if total <= limite * 0.8:
+                    break
+        existentes = {p.stem for _, _, p in arquivos} - removidos
+        for sha, caminhos in refs.items():
+            if sha not in existentes:
+                for p in caminhos:
+                    try:
+                        p.unlink()
+                    except Exception:
+                        pass
+        if fcntl is not None:
+            velho = time.time() - 86400
+            for p in _LOCKS_DIR.glob("*.lock"):
+                try:
+                    if p.stat().st_mtime < velho:
+                        _remover_lock_parado(p)
+                except Exception:
+                    pass
+    except Exception as e:
+        print(f"⚠️ [PDF_STORE] Falha ao limpar cópias locais: {e}")
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+proposta_patch.py
+=================
+Autosave de propostas com JSON merge-patch (RFC 7386) aplicado no próprio Postgres.
+
+O /salvar-proposta lê o payload inteiro, mescla em Python e regrava a linha
+(duas idas ao banco e o payload de vários MB nos dois sentidos). Aqui o cliente
+manda só o que mudou e uma única instrução faz tudo:
+
+    INSERT ... ON CONFLICT (id) DO UPDATE SET payload = <payload atual mesclado com o patch>, ...
+
+- Mescla em jsonb: objeto aninhado é mesclado recursivamente, `null` remove a
+  chave, qualquer outro valor (inclusive listas) substitui.
+- Colunas desnormalizadas (ver servidor._proposta_fields_from_data) são
+  recalculadas na mesma instrução: as que dependem só de chaves presentes no
+  patch recebem o valor calculado em Python; as que combinam mais de uma chave
+  (ex.: potencia_kw = potencia_kw ou potencia_sistema) leem do payload atual a
+  chave que não veio.
+- render_fingerprint e o resumo da listagem são recalculados na mesma instrução, em
+  SQL, sobre o payload mesclado (html_cache.render_fingerprint_sql,
+  db.resumo_listagem_sql): o payload completo não passa pelo Python e as leituras
+  seguintes (ver-pdf, HTML, /projetos/list) continuam sem carregá-lo.
+- A permissão é checada no próprio WHERE do DO UPDATE: sem linha retornada, o
+  usuário não pode editar a proposta.
+- Controle de concorrência: `propostas.versao` avança a cada gravação do payload.
+  Com `versao_base` (If-Match do PATCH) a instrução vira um UPDATE condicionado
+  à versão; outra gravação no meio do caminho faz o patch ser recusado (412).
+
+Os listeners do ORM (before_insert/before_update) não rodam neste caminho; as
+colunas que eles mantêm são preenchidas aqui.
+
+Variáveis de ambiente:
+- PATCH_MAX_KB: tamanho máximo do corpo do patch (padrão 2048)
+- PATCH_MAX_PROFUNDIDADE: aninhamento máximo de objetos no patch (padrão 8)
+"""
+from __future__ import annotations
+
+import json
+import os
+from datetime import datetime
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import Float, Integer, text
+
+from db import PropostaDB, resumo_listagem, resumo_listagem_sql
+from html_cache import render_fingerprint, render_fingerprint_sql
+from visibilidade import norm_nome, norm_telefone
+
+PATCH_MAX_KB = max(1, int(os.environ.get("PATCH_MAX_KB", "2048")))
+PATCH_MAX_PROFUNDIDADE = max(1, int(os.environ.get("PATCH_MAX_PROFUNDIDADE", "8")))
+
+STATUS_RASCUNHO = ("rascunho", "draft")
+
+# Nunca vêm do cliente: dono e identidade são definidos pelo servidor
+CHAVES_PROTEGIDAS = ("id", "created_by", "created_by_email", "user_id")
+
+# Colunas que combinam mais de uma chave do payload: (chaves, tipo)
+_COLUNAS_COMPOSTAS = {
+    "nome_projeto": (("nome_projeto", "nome"), "texto"),
+    "potencia_kw": (("potencia_kw", "potencia_sistema"), "numero"),
+    "preco_final": (("preco_final", "preco_venda"), "numero"),
+    "preco_venda": (("preco_venda", "preco_final"), "numero"),
+}
+_COLUNAS_JSON = ("parcelas_json",)
+_COLUNAS_FIXAS = ("id", "created_by", "created_by_email", "payload", "created_at", "updated_at",
+                  "render_fingerprint", "cliente_telefone_norm", "cliente_nome_norm", "owner_cliente_id", "versao",
+                  "resumo")
+# Pares por jsonb_build_object (limite de 100 argumentos por função)
+_PARES_POR_OBJETO = 50
+_NUMERO_RE = r"^-?[0-9]+(\.[0-9]+)?$"
+
+
+def merge_patch(alvo, patch):
+    """RFC 7386 em Python (modo arquivo e payload de criação)."""
+    if not isinstance(patch, dict):
+        return patch
+    resultado = dict(alvo) if isinstance(alvo, dict) else {}
+    for chave, valor in patch.items():
+        if valor is None:
+            resultado.pop(chave, None)
+        else:
+            resultado[chave] = merge_patch(resultado.get(chave), valor)
+    return resultado
+
+
+def _profundidade(valor) -> int:
+    if isinstance(valor, dict):
+        return 1 + max((_profundidade(v) for v in valor.values()), default=0)
+    if isinstance(valor, list):
+        return max((_profundidade(v) for v in valor), default=0)
+    return 0
+
+
+def validar(patch, to_float: Callable) -> None:
+    """Recusa (ValueError) patch que não é objeto, profundo demais, com chaves do
+    servidor, status que não é rascunho ou texto em coluna numérica."""
+    if not isinstance(patch, dict):
+        raise ValueError("O patch deve ser um objeto JSON")
+    if _profundidade(patch) > PATCH_MAX_PROFUNDIDADE:
+        raise ValueError("Patch com aninhamento excessivo")
+    protegidas = [k for k in CHAVES_PROTEGIDAS if k in patch]
+    if protegidas:
+        raise ValueError(f"Campos não editáveis: {', '.join(protegidas)}")
+    if "status" in patch and str(patch.get("status") or "").strip().lower() not in STATUS_RASCUNHO:
+        raise ValueError("Autosave só grava rascunhos; use /salvar-proposta")
+    for coluna in PropostaDB.__table__.columns:
+        if coluna.name not in patch or not isinstance(coluna.type, (Float, Integer)):
+            continue
+        valor = patch[coluna.name]
+        if valor in (None, "") or isinstance(valor, bool):
+            continue
+        if isinstance(valor, (dict, list)) or to_float(valor) is None:
+            raise ValueError(f"Campo '{coluna.name}' deve ser numérico")
+
+
+class _Params:
+    """Nomes únicos para os parâmetros da instrução."""
+
+    def __init__(self):
+        self.valores: Dict[str, object] = {}
+
+    def add(self, valor) -> str:
+        nome = f"p{len(self.valores)}"
+        self.valores[nome] = valor
+        return f":{nome}"
+
+
+def _merge_sql(alvo: str, patch: dict, params: _Params) -> str:
+    """Expressão jsonb de `alvo` (expressão jsonb) mesclado com `patch`."""
+    base = f"(CASE WHEN jsonb_typeof({alvo}) = 'object' THEN {alvo} ELSE '{{}}'::jsonb END)"
+    removidas = [k for k, v in patch.items() if v is None]
+    if removidas:
+        base = f"({base} - CAST({params.add(removidas)} AS text[]))"
+    pares = []
+    for chave, valor in patch.items():
+        if valor is None:
+            continue
+        k = f"CAST({params.add(chave)} AS text)"
+        if isinstance(valor, dict):
+            v = _merge_sql(f"({alvo} -> {k})", valor, params)
+        else:
+            v = f"CAST({params.add(json.dumps(valor, ensure_ascii=False, default=str))} AS jsonb)"
+        pares.append(f"{k}, {v}")
+    for i in range(0, len(pares), _PARES_POR_OBJETO):
+        base = f"({base} || jsonb_build_object({', '.join(pares[i:i + _PARES_POR_OBJETO])}))"
+    return base
+
+
+def _valor_coluna(coluna: str, valor, params: _Params) -> str:
+    if coluna in _COLUNAS_JSON:
+        return "NULL" if valor is None else f"CAST({params.add(json.dumps(valor, default=str))} AS json)"
+    return params.add(valor)
+
+
+def _composta_sql(coluna: str, patch: dict, params: _Params, to_float: Callable) -> str:
+    """Coluna de várias chaves: valor do patch quando veio, senão o do payload atual."""
+    chaves, tipo = _COLUNAS_COMPOSTAS[coluna]
+    termos = []
+    for chave in chaves:
+        if chave in patch:
+            valor = patch[chave]
+            if tipo == "numero":
+                termos.append(f"CAST({params.add(to_float(valor))} AS float8)")
+            else:
+                termos.append(f"CAST({params.add(valor if isinstance(valor, str) else None)} AS text)")
+        elif tipo == "numero":
+            # Payload legado com número formatado ("R$ 1.234,56") não casa: vale como vazio
+            atual = f"trim(propostas.payload::jsonb ->> '{chave}')"
+            termos.append(f"(CASE WHEN {atual} ~ '{_NUMERO_RE}' THEN CAST({atual} AS float8) END)")
+        else:
+            termos.append(f"(propostas.payload::jsonb ->> '{chave}')")
+    if tipo == "texto":
+        return "COALESCE(" + ", ".join(f"NULLIF({t}, '')" for t in termos) + ")"
+    # Mesma regra de _proposta_fields_from_data: zero conta como ausente
+    if coluna == "potencia_kw":
+        return f"COALESCE(NULLIF({termos[0]}, 0), {termos[1]})"
+    return f"COALESCE(NULLIF({termos[0]}, 0), NULLIF({termos[1]}, 0), 0)"
+
+
+def upsert(db, proposta_id: str, patch: dict, campos_fn: Callable[[dict, str], dict],
+           to_float: Callable, na_criacao: dict, uid: str, email: str, pode_tudo: bool,
+           versao_base: Optional[int] = None) -> Optional[Tuple[bool, int]]:
+    """
+    Aplica o merge-patch à proposta numa única instrução (não faz commit).
+    `campos_fn(payload, id)` dá as colunas desnormalizadas; `na_criacao` entra só
+    no payload de uma proposta nova (dono, data de criação).
+    Sem `versao_base`: cria a proposta se não existir. Com `versao_base`: só
+    atualiza se a versão gravada for essa.
+    Retorna (criada, nova versão), ou None se nada foi gravado (sem permissão,
+    versão divergente ou proposta inexistente; ver `motivo_recusa`).
+    """
+    patch = {k: v for k, v in patch.items() if k not in CHAVES_PROTEGIDAS}
+    colunas_tabela = {c.name for c in PropostaDB.__table__.columns}
+    params = _Params()
+    agora = datetime.utcnow()
+
+    # INSERT: o payload novo é o patch aplicado a {} e as colunas saem dele
+    payload_novo = merge_patch({**na_criacao, "id": proposta_id}, patch)
+    campos_novos = {k: v for k, v in campos_fn(payload_novo, proposta_id).items()
+                    if k in colunas_tabela and k not in _COLUNAS_FIXAS}
+
+    # UPDATE: payload mesclado no banco; colunas só quando as chaves delas vieram.
+    # Payload, impressão digital e resumo numa subconsulta: a mescla é avaliada uma vez só
+    payload_sql = _merge_sql("propostas.payload::jsonb", patch, params)
+    payload_fp = (
+        f"(payload, render_fingerprint, resumo) = (SELECT m.novo, {render_fingerprint_sql('m.novo')}, "
+        f"{resumo_listagem_sql('m.novo')} FROM (SELECT {payload_sql} AS novo) m)"
+    )
+    sets = {
+        "updated_at": params.add(agora),
+        "versao": "propostas.versao + 1",
+    }
+    campos_patch = campos_fn(patch, proposta_id)
+    for coluna in campos_novos:
+        if coluna in _COLUNAS_COMPOSTAS:
+            chaves = _COLUNAS_COMPOSTAS[coluna][0]
+            if any(k in patch for k in chaves):
+                sets[coluna] = _composta_sql(coluna, patch, params, to_float)
+        elif coluna in patch:
+            valor = patch[coluna]
+            if isinstance(valor, dict):
+                if coluna in _COLUNAS_JSON:
+                    sub = _merge_sql(f"(propostas.payload::jsonb -> '{coluna}')", valor, params)
+                    sets[coluna] = f"CAST({sub} AS json)"
+                continue
+            sets[coluna] = _valor_coluna(coluna, campos_patch.get(coluna), params)
+    if "cliente_telefone" in patch:
+        sets["cliente_telefone_norm"] = params.add(norm_telefone(patch["cliente_telefone"]) or None)
+    if "cliente_nome" in patch:
+        sets["cliente_nome_norm"] = params.add(norm_nome(patch["cliente_nome"]) or None)
+    if "cliente_id" in patch:
+        sets["owner_cliente_id"] = params.add(patch["cliente_id"] or None)
+    atribuicoes = ", ".join([payload_fp, *(f"{c} = {v}" for c, v in sets.items())])
+
+    guarda = _guarda_sql(params, uid, email, pode_tudo)
+    if versao_base is not None:
+        sql = (
+            f"UPDATE propostas SET {atribuicoes} "
+            f"WHERE propostas.id = {params.add(proposta_id)} AND propostas.versao = {params.add(int(versao_base))} "
+            f"AND ({guarda}) "
+            "RETURNING false AS inserido, versao"
+        )
+    else:
+        insert = {
+            "id": params.add(proposta_id),
+            "created_by": params.add(uid),
+            "created_by_email": params.add(email),
+            "payload": f"CAST({params.add(json.dumps(payload_novo, ensure_ascii=False, default=str))} AS jsonb)",
+            "created_at": params.add(agora),
+            "updated_at": params.add(agora),
+            "render_fingerprint": params.add(render_fingerprint(payload_novo)),
+            "resumo": f"CAST({params.add(json.dumps(resumo_listagem(payload_novo), ensure_ascii=False, default=str))} AS jsonb)",
+            "cliente_telefone_norm": params.add(norm_telefone(payload_novo.get("cliente_telefone")) or None),
+            "cliente_nome_norm": params.add(norm_nome(payload_novo.get("cliente_nome")) or None),
+            "owner_cliente_id": params.add(payload_novo.get("cliente_id") or None),
+            "versao": "1",
+        }
+        for coluna, valor in campos_novos.items():
+            insert[coluna] = _valor_coluna(coluna, valor, params)
+        sql = (
+            f"INSERT INTO propostas ({', '.join(insert)}) VALUES ({', '.join(insert.values())}) "
+            f"ON CONFLICT (id) DO UPDATE SET {atribuicoes} "
+            f"WHERE {guarda} "
+            "RETURNING (xmax = 0) AS inserido, versao"
+        )
+    row = db.execute(text(sql), params.valores).first()
+    return None if row is None else (bool(row[0]), int(row[1]))
+
+
+def _guarda_sql(params: _Params, uid: str, email: str, pode_tudo: bool) -> str:
+    """Quem pode editar: admin/gestor, o criador ou quem enxerga a proposta."""
+    return (
+        f"{params.add(bool(pode_tudo))} OR propostas.created_by = {params.add(uid)}"
+        f" OR propostas.created_by_email = {params.add(email)}"
+        f" OR EXISTS (SELECT 1 FROM proposta_visibilidade v"
+        f" WHERE v.proposta_id = propostas.id AND v.user_email = {params.add(email)})"
+    )
+
+
+def motivo_recusa(db, proposta_id: str, uid: str, email: str, pode_tudo: bool) -> Tuple[str, Optional[int]]:
+    """Depois de um upsert sem linha: ("inexistente"|"negado"|"versao", versão atual)."""
+    params = _Params()
+    sql = (
+        f"SELECT versao, ({_guarda_sql(params, uid, email, pode_tudo)}) AS pode "
+        f"FROM propostas WHERE propostas.id = {params.add(proposta_id)}"
+    )
+    row = db.execute(text(sql), params.valores).first()
+    if row is None:
+        return "inexistente", None
+    return ("versao" if row[1] else "negado"), int(row[0] or 1)
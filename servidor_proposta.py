@@ -14,7 +14,10 @@ import uuid
 import math
 import logging
 import hashlib
-from datetime import datetime, timezone
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
 
 # Fuso horário de Brasília
@@ -24,19 +27,38 @@ def now_brasilia():
     """Retorna datetime atual no fuso horário de Brasília"""
     return datetime.now(TZ_BRASILIA)
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file, send_from_directory, redirect
+from functools import lru_cache
+from flask import Flask, request, jsonify, send_file, send_from_directory, redirect, Response, stream_with_context, g, has_request_context
 from flask_cors import CORS
 import io
 import re
 import time
 import csv
 #
-from db import init_db, SessionLocal, PropostaDB, ClienteDB, EnderecoDB, UserDB, RoleDB, ConfigDB, DATABASE_URL
-from sqlalchemy import text, func, or_
+from db import (
+    init_db, SessionLocal, PropostaDB, ClienteDB, EnderecoDB, UserDB, RoleDB, ConfigDB, DATABASE_URL,
+    PropostaVisibilidadeDB, get_proposta, resumo_propostas_query, CARREGAR_PAYLOAD, resumo_listagem,
+    engine as db_engine, pool_stats as db_pool_stats, agendar_migracoes_pendentes,
+)
+from sqlalchemy import text, func, or_, tuple_, event, inspect as sa_inspect
 # WeasyPrint comentado - requer: brew install cairo pango gdk-pixbuf libffi
 # from weasyprint import HTML, CSS
 # from weasyprint.text.fonts import FontConfiguration
 from dimensionamento_core import calcular_dimensionamento
+from html_stream import DeferredJob, stream_html
+import pdf_service
+from pdf_service import RenderSaturated
+from pdf_export import PDF_EXPORT_MAX, export_jobs, public_view as export_job_view
+import pdf_store
+import proposta_patch
+import visibilidade
+from visibilidade import norm_telefone as _norm_telefone, norm_nome as _norm_nome
+from pdf_jobs import pdf_jobs, QueueFull, public_view as pdf_job_view
+from timing import (
+    span, timed, record as record_timing, restante as restante_timing, server_timing_header,
+    snapshot as timing_snapshot,
+)
+from html_cache import html_cache, cache_key as html_cache_key, etag_for, etag_matches, render_fingerprint
 # import requests  # Removido para evitar erro de permissão em sandbox
 import urllib.request
 import urllib.error
@@ -67,6 +89,12 @@ try:
     init_db()
     DB_READY = True
     print("✅ DB schema pronto (init_db)")
+    if USE_DB:
+        _db_vis = SessionLocal()
+        try:
+            visibilidade.garantir_populada(_db_vis)
+        finally:
+            _db_vis.close()
     sys.stdout.flush()
 except Exception as _init_err:
     print(f"⚠️ Falha ao preparar schema do DB (init_db): {_init_err}")
@@ -74,6 +102,17 @@ except Exception as _init_err:
     traceback.print_exc()
     sys.stdout.flush()
     # Não travar o servidor - continuar mesmo com erro no DB
+# gunicorn --preload: conexões abertas no master (init_db) não podem ser herdadas
+# pelos workers no fork; cada worker abre as suas sob demanda.
+db_engine.dispose()
+
+
+@app.before_request
+def _migracoes_apos_boot():
+    # Cópia json -> jsonb do payload e render_fingerprint das propostas antigas:
+    # thread no worker, fora do boot (no-op se nada pendente)
+    agendar_migracoes_pendentes()
+
 
 # Health check para Railway
 @app.route('/health')
@@ -88,6 +127,62 @@ def add_security_headers(response):
     response.headers['Content-Security-Policy'] = "frame-ancestors *"
     return response
 
+@app.after_request
+def add_server_timing(response):
+    # Etapas medidas por timing.span durante a requisição (DevTools > Network > Timing)
+    try:
+        header = server_timing_header()
+        if header:
+            response.headers['Server-Timing'] = header
+            response.headers['Timing-Allow-Origin'] = '*'
+    except Exception:
+        pass
+    return response
+
+
+# ====== SESSÃO DO BANCO POR REQUISIÇÃO ======
+# Autenticação, helpers e rota compartilham uma sessão: um checkout do pool (e um
+# pre-ping) por requisição em vez de um por SessionLocal(). Fechada no teardown.
+
+
+@contextmanager
+def _sessao():
+    """
+    Sessão do banco para um bloco. Dentro de uma requisição reaproveita a sessão de `g`
+    (não fecha ao sair; o teardown fecha); fora dela (threads, jobs) abre e fecha uma
+    própria. Erro no bloco: rollback e a exceção segue.
+    """
+    if not has_request_context():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+        return
+    db = g.get("_db_sessao")
+    if db is None:
+        db = g._db_sessao = SessionLocal()
+    try:
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+
+
+def _liberar_sessao() -> None:
+    """Devolve a conexão da requisição ao pool antes de trabalho longo (render, streaming)."""
+    db = g.pop("_db_sessao", None) if has_request_context() else None
+    if db is not None:
+        db.close()
+
+
+@app.teardown_appcontext
+def _fechar_sessao(_exc):
+    db = g.pop("_db_sessao", None)
+    if db is not None:
+        db.close()
+
+
 # Servidor para propostas HTML (sem dependência do proposta_solar)
 
 # Diretório para salvar propostas
@@ -370,6 +465,80 @@ def _create_proposta_row(data: dict, proposta_id: str) -> 'PropostaDB':
     fields['payload'] = data
     return PropostaDB(**fields)
 
+
+@event.listens_for(PropostaDB, "before_insert")
+@event.listens_for(PropostaDB, "before_update")
+def _atualizar_colunas_derivadas(mapper, connection, target):
+    """
+    Recalcula a impressão digital de renderização e o resumo da listagem sempre que
+    o payload é gravado (qualquer rota que atribua row.payload). Os acessos só leem
+    as colunas. Payload não carregado (adiado) não é lido aqui: não mudou, e
+    carregá-lo no flush custaria vários MB; linhas antigas são preenchidas pela
+    migração (db.preencher_colunas_derivadas).
+    """
+    try:
+        estado = sa_inspect(target)
+        if "payload" in estado.unloaded:
+            return
+        mudou = estado.attrs.payload.history.has_changes()
+        if mudou or not target.render_fingerprint:
+            target.render_fingerprint = render_fingerprint(target.payload or {})
+        if mudou or target.resumo is None:
+            target.resumo = resumo_listagem(target.payload)
+    except Exception as e:
+        print(f"⚠️ Falha ao calcular colunas derivadas da proposta: {e}")
+
+
+@event.listens_for(PropostaDB, "before_update")
+def _incrementar_versao(mapper, connection, target):
+    """Gravação do payload pelo ORM também avança a versão usada no If-Match do PATCH."""
+    try:
+        estado = sa_inspect(target)
+        if "payload" not in estado.unloaded and estado.attrs.payload.history.has_changes():
+            target.versao = PropostaDB.versao + 1
+    except Exception as e:
+        print(f"⚠️ Falha ao incrementar versão da proposta: {e}")
+
+
+@event.listens_for(PropostaDB, "before_insert")
+@event.listens_for(PropostaDB, "before_update")
+def _atualizar_vinculo_normalizado(mapper, connection, target):
+    """
+    Mantém as colunas usadas no filtro de acesso da listagem (ver db.PropostaDB):
+    telefone só dígitos, nome normalizado e cliente dono, da coluna ou do payload legado;
+    created_by/created_by_email vazios vêm do payload. Payload não carregado (adiado)
+    não é lido: só valores da própria linha substituem os já gravados.
+    """
+    try:
+        payload_carregado = "payload" not in sa_inspect(target).unloaded
+        payload = (target.payload if payload_carregado else None) or {}
+        if not isinstance(payload, dict):
+            payload = {}
+
+        def _definir(campo, valor):
+            if valor or payload_carregado:
+                setattr(target, campo, valor or None)
+
+        _definir("cliente_telefone_norm", _norm_telefone(target.cliente_telefone or payload.get("cliente_telefone")))
+        _definir("cliente_nome_norm", _norm_nome(target.cliente_nome or payload.get("cliente_nome")))
+        _definir("owner_cliente_id", target.cliente_id or payload.get("cliente_id"))
+        if not target.created_by and payload.get("created_by"):
+            target.created_by = payload.get("created_by")
+        if not target.created_by_email and payload.get("created_by_email"):
+            target.created_by_email = payload.get("created_by_email")
+    except Exception as e:
+        print(f"⚠️ Falha ao normalizar vínculo da proposta: {e}")
+
+
+def _filtro_propostas_do_cliente(cliente_id: str, tel_norm: str, nome_norm: str):
+    """Propostas ligadas ao cliente: por id, telefone normalizado (> 8 dígitos) ou nome."""
+    conds = [PropostaDB.cliente_id == cliente_id, PropostaDB.owner_cliente_id == cliente_id]
+    if tel_norm and len(tel_norm) > 8:
+        conds.append(PropostaDB.cliente_telefone_norm == tel_norm)
+    if nome_norm:
+        conds.append(PropostaDB.cliente_nome_norm == nome_norm)
+    return or_(*conds)
+
 def _load_roles() -> dict:
     try:
         if ROLES_FILE.exists():
@@ -460,24 +629,76 @@ def _create_app_jwt(email: str) -> str:
     payload = {"sub": email.lower(), "iat": now, "exp": now + (60 * 60 * 24 * 14)}  # 14 dias
     return jwt.encode(payload, secret, algorithm="HS256")
 
+# Cache de identidade (por processo): token já verificado e usuário por e-mail.
+# Cada requisição resolve a identidade uma vez (flask.g); entre requisições, TTL curto.
+# Edições em /admin/users invalidam o cache deste worker; nos demais vale o TTL.
+AUTH_CACHE_TTL_S = max(0.0, float(os.environ.get("AUTH_CACHE_TTL_S", "30")))
+_AUTH_CACHE_MAX = 2048
+_auth_cache_lock = threading.Lock()
+_jwt_cache: dict = {}      # token -> (expira_em, payload)
+_user_cache: dict = {}     # e-mail -> (expira_em, _Identidade | None)
+
+# Snapshot imutável do UserDB (compartilhado entre threads; sem sessão)
+_Identidade = namedtuple("_Identidade", "uid email nome role cargo telefone")
+
+
+def _auth_cache_get(cache: dict, chave):
+    with _auth_cache_lock:
+        item = cache.get(chave)
+        if item is None:
+            return False, None
+        if item[0] <= time.time():
+            cache.pop(chave, None)
+            return False, None
+        return True, item[1]
+
+
+def _auth_cache_put(cache: dict, chave, valor, expira_em: float) -> None:
+    if AUTH_CACHE_TTL_S <= 0:
+        return
+    with _auth_cache_lock:
+        if len(cache) >= _AUTH_CACHE_MAX:
+            agora = time.time()
+            for k in [k for k, v in cache.items() if v[0] <= agora]:
+                cache.pop(k, None)
+            if len(cache) >= _AUTH_CACHE_MAX:
+                cache.clear()
+        cache[chave] = (expira_em, valor)
+
+
+def _invalidar_cache_usuarios() -> None:
+    """Chamado após criar/editar/remover usuários."""
+    with _auth_cache_lock:
+        _user_cache.clear()
+
+
 def _decode_app_jwt(token: str) -> dict | None:
+    ok, decoded = _auth_cache_get(_jwt_cache, token)
+    if ok:
+        return decoded
     try:
         secret = _app_jwt_secret()
         if not secret:
             return None
-        return jwt.decode(token, secret, algorithms=["HS256"])
+        decoded = jwt.decode(token, secret, algorithms=["HS256"])
     except Exception:
         return None
+    # Nunca além do exp do próprio token
+    expira_em = min(time.time() + AUTH_CACHE_TTL_S, float(decoded.get("exp") or 0) or float("inf"))
+    _auth_cache_put(_jwt_cache, token, decoded, expira_em)
+    return decoded
 
 def _get_request_email_from_app_jwt() -> str | None:
+    if "auth_email" in g:
+        return g.auth_email
+    email = None
     tok = _get_bearer_token()
-    if not tok:
-        return None
-    decoded = _decode_app_jwt(tok)
-    if not decoded:
-        return None
-    email = (decoded.get("sub") or "").strip().lower()
-    return email or None
+    if tok:
+        decoded = _decode_app_jwt(tok)
+        if decoded:
+            email = (decoded.get("sub") or "").strip().lower() or None
+    g.auth_email = email
+    return email
 
 def _require_auth() -> str | None:
     """
@@ -488,18 +709,25 @@ def _require_auth() -> str | None:
 
 def _current_user_row():
     """
-    Retorna o registro UserDB do usuário autenticado (ou None).
+    Retorna o usuário autenticado (ou None): snapshot _Identidade com os campos do
+    UserDB (uid, email, nome, role, cargo, telefone). Resolvido uma vez por requisição.
     """
+    if "auth_user" in g:
+        return g.auth_user
     email = _require_auth()
-    if not email:
-        return None
-    try:
-        db = SessionLocal()
-        u = db.query(UserDB).filter(UserDB.email == email).first()
-        db.close()
-        return u
-    except Exception:
-        return None
+    u = None
+    if email:
+        ok, u = _auth_cache_get(_user_cache, email)
+        if not ok:
+            try:
+                with _sessao() as db:
+                    row = db.query(UserDB).filter(UserDB.email == email).first()
+            except Exception:
+                return None  # falha de banco: não guardar (nem em g)
+            u = _Identidade(row.uid, row.email, row.nome, row.role, row.cargo, row.telefone) if row else None
+            _auth_cache_put(_user_cache, email, u, time.time() + AUTH_CACHE_TTL_S)
+    g.auth_user = u
+    return u
 
 def _require_admin_access_app() -> bool:
     """
@@ -521,14 +749,9 @@ def _require_admin_access_app() -> bool:
             return True
     except Exception:
         pass
-    try:
-        db = SessionLocal()
-        u = db.query(UserDB).filter(UserDB.email == email).first()
-        db.close()
-        role = (u.role or "").strip().lower() if u else ""
-        return bool(u and role in ("admin", "gestor"))
-    except Exception:
-        return False
+    u = _current_user_row()
+    role = (u.role or "").strip().lower() if u else ""
+    return bool(u and role in ("admin", "gestor"))
 
 def _hash_password(password: str) -> str:
     if not bcrypt:
@@ -556,9 +779,8 @@ def auth_login():
         password = (data.get("password") or "").strip()
         if not email or not password:
             return jsonify({"success": False, "message": "Email e senha obrigatórios"}), 400
-        db = SessionLocal()
-        u = db.query(UserDB).filter(UserDB.email == email).first()
-        db.close()
+        with _sessao() as db:
+            u = db.query(UserDB).filter(UserDB.email == email).first()
         if not u or not u.password_hash:
             return jsonify({"success": False, "message": "Credenciais inválidas"}), 401
         if not _check_password(password, u.password_hash):
@@ -578,9 +800,7 @@ def auth_me():
     if not email:
         return jsonify({"success": False, "message": "Não autenticado"}), 401
     try:
-        db = SessionLocal()
-        u = db.query(UserDB).filter(UserDB.email == email).first()
-        db.close()
+        u = _current_user_row()
         if not u:
             return jsonify({"success": False, "message": "Usuário não encontrado"}), 404
         return jsonify({"success": True, "user": {"email": u.email, "nome": u.nome, "role": u.role, "cargo": u.cargo, "uid": u.uid, "telefone": u.telefone or ""}})
@@ -598,17 +818,14 @@ def auth_change_password():
         new_pwd = (data.get("newPassword") or "").strip()
         if not new_pwd or len(new_pwd) < 6:
             return jsonify({"success": False, "message": "Nova senha inválida (mínimo 6 caracteres)"}), 400
-        db = SessionLocal()
-        u = db.query(UserDB).filter(UserDB.email == email).first()
-        if not u or not u.password_hash:
-            db.close()
-            return jsonify({"success": False, "message": "Usuário sem senha configurada"}), 400
-        if not _check_password(current_pwd, u.password_hash):
-            db.close()
-            return jsonify({"success": False, "message": "Senha atual incorreta"}), 400
-        u.password_hash = _hash_password(new_pwd)
-        db.commit()
-        db.close()
+        with _sessao() as db:
+            u = db.query(UserDB).filter(UserDB.email == email).first()
+            if not u or not u.password_hash:
+                return jsonify({"success": False, "message": "Usuário sem senha configurada"}), 400
+            if not _check_password(current_pwd, u.password_hash):
+                return jsonify({"success": False, "message": "Senha atual incorreta"}), 400
+            u.password_hash = _hash_password(new_pwd)
+            db.commit()
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -629,16 +846,15 @@ def auth_bootstrap_admin():
         cargo = (data.get("cargo") or "").strip() or "Administrador"
         if not email or not password:
             return jsonify({"success": False, "message": "Email e senha obrigatórios"}), 400
-        db = SessionLocal()
-        total = db.query(UserDB).count()
-        if total > 0:
-            db.close()
-            return jsonify({"success": False, "message": "Bootstrap já executado"}), 400
-        uid = str(uuid.uuid4())
-        u = UserDB(uid=uid, email=email, nome=nome or email.split("@")[0], role="admin", cargo=cargo, password_hash=_hash_password(password))
-        db.add(u)
-        db.commit()
-        db.close()
+        with _sessao() as db:
+            total = db.query(UserDB).count()
+            if total > 0:
+                return jsonify({"success": False, "message": "Bootstrap já executado"}), 400
+            uid = str(uuid.uuid4())
+            u = UserDB(uid=uid, email=email, nome=nome or email.split("@")[0], role="admin", cargo=cargo, password_hash=_hash_password(password))
+            db.add(u)
+            db.commit()
+        _invalidar_cache_usuarios()
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -648,9 +864,8 @@ def admin_list_users():
     if not _require_admin_access_app():
         return jsonify({"success": False, "message": "Não autorizado"}), 403
     try:
-        db = SessionLocal()
-        rows = db.query(UserDB).order_by(UserDB.created_at.desc()).all()
-        db.close()
+        with _sessao() as db:
+            rows = db.query(UserDB).order_by(UserDB.created_at.desc()).all()
         items = [{"uid": u.uid, "email": u.email, "nome": u.nome, "role": u.role, "cargo": u.cargo, "telefone": u.telefone or "", "created_at": str(u.created_at)} for u in rows]
         return jsonify({"success": True, "items": items})
     except Exception as e:
@@ -672,16 +887,15 @@ def admin_create_user():
             return jsonify({"success": False, "message": "Email e senha obrigatórios"}), 400
         if role not in ("admin", "gestor", "vendedor", "instalador"):
             return jsonify({"success": False, "message": "Role inválida"}), 400
-        db = SessionLocal()
-        existing = db.query(UserDB).filter(UserDB.email == email).first()
-        if existing:
-            db.close()
-            return jsonify({"success": False, "message": "Usuário já existe"}), 400
-        uid = str(uuid.uuid4())
-        u = UserDB(uid=uid, email=email, nome=nome or email.split("@")[0], role=role, cargo=cargo, telefone=telefone, password_hash=_hash_password(password))
-        db.add(u)
-        db.commit()
-        db.close()
+        with _sessao() as db:
+            existing = db.query(UserDB).filter(UserDB.email == email).first()
+            if existing:
+                return jsonify({"success": False, "message": "Usuário já existe"}), 400
+            uid = str(uuid.uuid4())
+            u = UserDB(uid=uid, email=email, nome=nome or email.split("@")[0], role=role, cargo=cargo, telefone=telefone, password_hash=_hash_password(password))
+            db.add(u)
+            db.commit()
+        _invalidar_cache_usuarios()
         return jsonify({"success": True, "uid": uid})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -692,27 +906,25 @@ def admin_update_user(uid):
         return jsonify({"success": False, "message": "Não autorizado"}), 403
     try:
         data = request.get_json() or {}
-        db = SessionLocal()
-        u = db.query(UserDB).filter(UserDB.uid == uid).first()
-        if not u:
-            db.close()
-            return jsonify({"success": False, "message": "Usuário não encontrado"}), 404
-        if "nome" in data:
-            u.nome = (data.get("nome") or "").strip()
-        if "cargo" in data:
-            u.cargo = (data.get("cargo") or "").strip()
-        if "telefone" in data:
-            u.telefone = (data.get("telefone") or "").strip()
-        if "role" in data:
-            role = (data.get("role") or "").strip().lower()
-            if role not in ("admin", "gestor", "vendedor", "instalador"):
-                db.close()
-                return jsonify({"success": False, "message": "Role inválida"}), 400
-            u.role = role
-        if "password" in data and str(data.get("password") or "").strip():
-            u.password_hash = _hash_password(str(data.get("password")).strip())
-        db.commit()
-        db.close()
+        with _sessao() as db:
+            u = db.query(UserDB).filter(UserDB.uid == uid).first()
+            if not u:
+                return jsonify({"success": False, "message": "Usuário não encontrado"}), 404
+            if "nome" in data:
+                u.nome = (data.get("nome") or "").strip()
+            if "cargo" in data:
+                u.cargo = (data.get("cargo") or "").strip()
+            if "telefone" in data:
+                u.telefone = (data.get("telefone") or "").strip()
+            if "role" in data:
+                role = (data.get("role") or "").strip().lower()
+                if role not in ("admin", "gestor", "vendedor", "instalador"):
+                    return jsonify({"success": False, "message": "Role inválida"}), 400
+                u.role = role
+            if "password" in data and str(data.get("password") or "").strip():
+                u.password_hash = _hash_password(str(data.get("password")).strip())
+            db.commit()
+        _invalidar_cache_usuarios()
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
@@ -722,16 +934,41 @@ def admin_delete_user(uid):
     if not _require_admin_access_app():
         return jsonify({"success": False, "message": "Não autorizado"}), 403
     try:
-        db = SessionLocal()
-        u = db.query(UserDB).filter(UserDB.uid == uid).first()
-        if u:
-            db.delete(u)
-            db.commit()
-        db.close()
+        with _sessao() as db:
+            u = db.query(UserDB).filter(UserDB.uid == uid).first()
+            if u:
+                db.delete(u)
+                db.commit()
+        _invalidar_cache_usuarios()
         return jsonify({"success": True})
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+@app.route("/admin/metrics/timings", methods=["GET"])
+def admin_metrics_timings():
+    """
+    Histograma agregado (por processo/worker) das etapas de renderização:
+    template_load, irradiancia, nucleo, substituicoes, graficos, pagamentos,
+    chromium_launch, page_load, page_ready, pdf_print, ...
+    """
+    if not _require_admin_access_app():
+        return jsonify({"success": False, "message": "Não autorizado"}), 403
+    return jsonify({"success": True, "pid": os.getpid(), "timings": timing_snapshot(), "pdf_jobs": pdf_jobs.stats(),
+                    "pdf_admissao": pdf_service.admission_stats(), "pdf_exports": export_jobs.stats(),
+                    "db_pool": db_pool_stats()})
+
+@app.route("/admin/metrics/db-pool", methods=["GET"])
+def admin_metrics_db_pool():
+    """
+    Pool de conexões deste worker: configuração, conexões em uso/ociosas/overflow,
+    checkouts, espera no checkout (histograma db_pool_wait), timeouts e conexões
+    invalidadas (pre-ping). Total no Postgres ≈ workers × (pool_size + max_overflow).
+    """
+    if not _require_admin_access_app():
+        return jsonify({"success": False, "message": "Não autorizado"}), 403
+    return jsonify({"success": True, "pid": os.getpid(), "db_pool": db_pool_stats(),
+                    "espera_checkout": timing_snapshot().get("db_pool_wait")})
+
 def _slug(s: str) -> str:
     return ''.join(ch.lower() if ch.isalnum() else '_' for ch in (s or '')).strip('_')
 
@@ -921,10 +1158,50 @@ def format_endereco_resumido(endereco_raw: str, cidade: str | None = None) -> st
     except Exception:
         return endereco_raw or 'Endereço não informado'
 
-def apply_analise_financeira_graphs(template_html: str, proposta_data: dict) -> str:
+_ECHARTS_VENDOR_PATH = Path(__file__).parent / "public" / "vendor" / "echarts.min.js"
+
+
+@lru_cache(maxsize=1)
+def _echarts_vendor() -> tuple[bytes, str]:
+    """
+    Conteúdo do echarts.min.js (~1 MB) carregado UMA vez por processo + hash curto
+    usado no nome versionado (/vendor/echarts.<hash>.min.js).
+    """
+    try:
+        data = _ECHARTS_VENDOR_PATH.read_bytes()
+    except Exception as e:
+        print(f"⚠️ echarts.min.js indisponível: {e}")
+        data = b""
+    return data, hashlib.sha256(data).hexdigest()[:12]
+
+
+def _echarts_vendor_url() -> str:
+    return f"/vendor/echarts.{_echarts_vendor()[1]}.min.js"
+
+
+@app.route('/vendor/echarts.<version>.min.js', methods=['GET'])
+def serve_echarts_vendor(version):
+    """
+    ECharts com nome versionado pelo hash do conteúdo: pode ser cacheado "para sempre".
+    Hash antigo/desconhecido recebe o conteúdo atual sem cache longo.
+    """
+    data, current = _echarts_vendor()
+    if not data:
+        return "echarts.min.js não encontrado", 404
+    immutable = (version == current)
+    resp = app.response_class(data, mimetype="application/javascript")
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if immutable else 'no-cache'
+    resp.headers['ETag'] = f'"{current}"'
+    return resp
+
+
+def apply_analise_financeira_graphs(template_html: str, proposta_data: dict, inline_vendor: bool = False) -> str:
     """
     Substitui as imagens dos 5 gráficos no template gerando-os a partir do núcleo
     único `calcular_dimensionamento`, garantindo consistência com a planilha.
+
+    inline_vendor=True embute o echarts.min.js no HTML (renderização offline do PDF);
+    caso contrário o HTML referencia /vendor/echarts.<hash>.min.js (cache do navegador).
     """
     try:
         # Extrair e normalizar entradas
@@ -1124,17 +1401,17 @@ def apply_analise_financeira_graphs(template_html: str, proposta_data: dict) ->
         if "FOHAT_ECHARTS_BOOTSTRAP" in template_html:
             return template_html
 
-        try:
-            vendor_path = Path(__file__).parent / "public" / "vendor" / "echarts.min.js"
-            echarts_js = vendor_path.read_text(encoding="utf-8") if vendor_path.exists() else ""
-        except Exception:
-            echarts_js = ""
+        if inline_vendor:
+            echarts_js = _echarts_vendor()[0].decode("utf-8")
+            echarts_tag = f"<script>{echarts_js}</script>"
+        else:
+            echarts_tag = f'<script src="{_echarts_vendor_url()}"></script>'
 
         charts_json = json.dumps(charts_payload, ensure_ascii=False)
 
         bootstrap = f"""
 <!-- FOHAT_ECHARTS_BOOTSTRAP -->
-<script>{echarts_js}</script>
+{echarts_tag}
 <script>
 (function(){{
   try {{
@@ -1429,7 +1706,24 @@ def apply_analise_financeira_graphs(template_html: str, proposta_data: dict) ->
         print(f"⚠️ Erro ao aplicar gráficos analise_financeira: {e}")
         return template_html
 
-def process_template_html(proposta_data, template_filename: str = "template.html"):
+def _inject_render_declaration(template_html: str) -> str:
+    """
+    Insere <meta name="fohat-render"> no <head> descrevendo o conteúdo da página:
+    charts="echarts" quando há o bootstrap que sinaliza __FOHAT_ECHARTS_READY__,
+    senão "static" (PNGs embutidos). O renderizador espera só o que foi declarado.
+    """
+    try:
+        if 'name="fohat-render"' in template_html or "</head>" not in template_html:
+            return template_html
+        charts = "echarts" if "__FOHAT_ECHARTS_READY__" in template_html else "static"
+        meta = f"<meta name=\"fohat-render\" content='{json.dumps({'charts': charts})}'>\n"
+        return template_html.replace("</head>", meta + "</head>", 1)
+    except Exception as e:
+        print(f"⚠️ Falha ao declarar conteúdo para o renderizador: {e}")
+        return template_html
+
+
+def process_template_html(proposta_data, template_filename: str = "template.html", for_pdf: bool = False, deferred: list | None = None):
     """
     Processa template HTML com todas as substituições de variáveis e gráficos.
     Esta função centraliza toda a lógica de processamento para ser reutilizada
@@ -1437,10 +1731,20 @@ def process_template_html(proposta_data, template_filename: str = "template.html
     
     Args:
         proposta_data (dict): Dicionário com os dados da proposta
+        for_pdf (bool): HTML destinado ao Puppeteer (assets JS embutidos, sem rede)
+        deferred (list | None): se informado, gráficos e formas de pagamento NÃO são aplicados;
+            viram DeferredJob (html_stream) anexados à lista para envio em streaming
     
     Returns:
         str: HTML processado com todas as variáveis e gráficos substituídos
     """
+    # Substituições = tempo da chamada menos as etapas medidas dentro dela (spans/@timed)
+    with restante_timing("substituicoes"):
+        return _process_template_html(proposta_data, template_filename, for_pdf, deferred)
+
+
+def _process_template_html(proposta_data, template_filename: str, for_pdf: bool, deferred: list | None):
+    """Corpo de process_template_html (medido lá)."""
     try:
         # Carregar template HTML
         # Permite usar um template alternativo (ex.: "template copy.html") para testes sem afetar o template oficial.
@@ -1449,8 +1753,19 @@ def process_template_html(proposta_data, template_filename: str = "template.html
         if not template_path.exists():
             raise FileNotFoundError("Template não encontrado")
         
-        with open(template_path, 'r', encoding='utf-8') as f:
-            template_html = f.read()
+        with span("template_load"):
+            with open(template_path, 'r', encoding='utf-8') as f:
+                template_html = f.read()
+
+        # ECharts referenciado pelo template (template_online): URL versionada e cacheável
+        if 'src="/vendor/echarts.min.js"' in template_html:
+            if for_pdf:
+                template_html = template_html.replace(
+                    '<script src="/vendor/echarts.min.js"></script>',
+                    f"<script>{_echarts_vendor()[0].decode('utf-8')}</script>",
+                )
+            else:
+                template_html = template_html.replace('src="/vendor/echarts.min.js"', f'src="{_echarts_vendor_url()}"')
         
         # Converter imagens para base64
         fohat_base64 = convert_image_to_base64('/img/fohat.svg')
@@ -1875,7 +2190,8 @@ def process_template_html(proposta_data, template_filename: str = "template.html
                   f"consumo_r$={core_payload['consumo_mensal_reais']}, tarifa={core_payload['tarifa_energia']}, "
                   f"potencia={core_payload['potencia_sistema']}, preco_venda={core_payload['preco_venda']}, "
                   f"irr_mensal={_irr_vec[:3]}...")
-            core_calc = calcular_dimensionamento(core_payload)
+            with span("nucleo"):
+                core_calc = calcular_dimensionamento(core_payload)
             tabelas = core_calc.get("tabelas") or {}
             kpis_core = core_calc.get("metrics") or {}
         except Exception as _calc_err:
@@ -2115,135 +2431,10 @@ def process_template_html(proposta_data, template_filename: str = "template.html
         use_static_charts = True  # Sempre usar PNG para garantir funcionamento
         if use_static_charts:
             try:
-                # Gerar PNGs estáticos (Matplotlib) a partir das tabelas do núcleo
-                try:
-                    import matplotlib
-                    matplotlib.use("Agg")
-                    import matplotlib.pyplot as plt
-                    from matplotlib.ticker import FuncFormatter
-                    from matplotlib.patches import FancyBboxPatch
-                    import numpy as np
-                    print("📊 [GRAFICOS] Matplotlib carregado com sucesso")
-                except ImportError as import_err:
-                    print(f"❌ [GRAFICOS] ERRO CRÍTICO: Matplotlib não instalado! {import_err}")
-                    print("❌ [GRAFICOS] Adicione 'matplotlib' e 'numpy' ao requirements.txt")
-                    raise
-
-                # ====== TEMA VISUAL PREMIUM - Design Moderno 2024 ======
-                # Paleta de cores vibrante e moderna
-                BRAND_BLUE = "#2563EB"       # Azul vibrante (mais moderno)
-                BRAND_BLUE_DARK = "#1D4ED8"  # Azul escuro para contraste
-                BRAND_GREEN = "#10B981"      # Verde esmeralda vibrante
-                BRAND_GREEN_DARK = "#059669" # Verde escuro
-                BRAND_RED = "#EF4444"        # Vermelho coral moderno
-                BRAND_RED_DARK = "#DC2626"   # Vermelho escuro
-                BRAND_ORANGE = "#F59E0B"     # Laranja para destaque
-                BRAND_TEXT = "#1E293B"       # Texto principal (slate-800)
-                BRAND_MUTED = "#64748B"      # Texto secundário (slate-500)
-                BRAND_GRID = "#E2E8F0"       # Grid suave (slate-200)
-                BRAND_BG = "#FFFFFF"         # Fundo branco
-
-                # Configuração global de alta qualidade
-                plt.rcParams.update({
-                    "figure.facecolor": BRAND_BG,
-                    "axes.facecolor": BRAND_BG,
-                    "savefig.facecolor": BRAND_BG,
-                    "font.family": "sans-serif",
-                    "font.sans-serif": ["Poppins", "Inter", "Segoe UI", "DejaVu Sans", "Arial"],
-                    "font.size": 14,
-                    "font.weight": "medium",
-                    "axes.edgecolor": BRAND_GRID,
-                    "axes.labelcolor": BRAND_TEXT,
-                    "axes.labelweight": "bold",
-                    "axes.titleweight": "bold",
-                    "xtick.color": BRAND_MUTED,
-                    "ytick.color": BRAND_MUTED,
-                    "xtick.labelsize": 13,
-                    "ytick.labelsize": 13,
-                    "legend.fontsize": 14,
-                    "legend.frameon": False,
-                    "figure.dpi": 100,
-                })
-
-                def _to_data_uri(fig) -> str:
-                    buf = io.BytesIO()
-                    # DPI alto para máxima qualidade e nitidez
-                    fig.savefig(buf, format="png", dpi=220, bbox_inches="tight", 
-                               pad_inches=0.15, transparent=False)
-                    plt.close(fig)
-                    b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-                    return "data:image/png;base64," + b64
-
-                def _fmt_compact(v, _pos=None):
-                    """Formatar valores em formato compacto e legível"""
-                    try:
-                        v = float(v)
-                    except Exception:
-                        return ""
-                    av = abs(v)
-                    if av >= 1_000_000:
-                        return f"R$ {v/1_000_000:.1f} mi"
-                    if av >= 1_000:
-                        return f"R$ {v/1_000:.0f} mil"
-                    return f"R$ {v:,.0f}"
-
-                def _fmt_brl_full(v):
-                    """Formatar valor em BRL completo"""
-                    try:
-                        v = float(v)
-                        if v >= 1_000_000:
-                            return f"R$ {v/1_000_000:.2f} milhões"
-                        if v >= 1_000:
-                            return f"R$ {v:,.0f}".replace(",", ".")
-                        return f"R$ {v:.0f}"
-                    except Exception:
-                        return "R$ 0"
-
-                def _style_axes_modern(ax, show_y_grid=True):
-                    """Estilização moderna dos eixos - limpo e elegante"""
-                    # Grid suave apenas no eixo Y
-                    if show_y_grid:
-                        ax.grid(True, axis="y", color=BRAND_GRID, linewidth=1.5, alpha=0.8, linestyle="-")
-                    ax.grid(False, axis="x")
-                    
-                    # Remover bordas desnecessárias
-                    for side in ["top", "right"]:
-                        ax.spines[side].set_visible(False)
-                    for side in ["left", "bottom"]:
-                        ax.spines[side].set_color(BRAND_GRID)
-                        ax.spines[side].set_linewidth(1.5)
-                    
-                    # Ticks mais elegantes
-                    ax.tick_params(axis="both", which="both", length=0, pad=10)
-                    ax.set_axisbelow(True)
-                    
-                    # Fontes maiores e mais legíveis
-                    for label in ax.get_xticklabels():
-                        label.set_fontsize(14)
-                        label.set_fontweight("600")
-                        label.set_color(BRAND_MUTED)
-                    for label in ax.get_yticklabels():
-                        label.set_fontsize(13)
-                        label.set_fontweight("500")
-                        label.set_color(BRAND_MUTED)
-
-                def _add_value_labels(ax, bars, color=None, fontsize=16, offset=0.02, fmt_func=None):
-                    """Adicionar rótulos de valor em cima das barras"""
-                    if fmt_func is None:
-                        fmt_func = _fmt_compact
-                    for bar in bars:
-                        height = bar.get_height()
-                        label_color = color if color else BRAND_TEXT
-                        ax.annotate(
-                            fmt_func(height),
-                            xy=(bar.get_x() + bar.get_width() / 2, height),
-                            xytext=(0, 8),
-                            textcoords="offset points",
-                            ha='center', va='bottom',
-                            fontsize=fontsize,
-                            fontweight='bold',
-                            color=label_color
-                        )
+                # Gerar PNGs estáticos (Matplotlib) a partir das tabelas do núcleo.
+                # Os cinco gráficos rodam em paralelo no pool de processos (graficos_pool),
+                # com timeout por gráfico; o que falhar mantém o graficos_base64 pré-salvo.
+                from graficos_pool import render_graficos
 
                 # Usar as variáveis já calculadas anteriormente (tabelas, kpis_core)
                 # em vez de re-extrair de core_calc (que pode não existir se houve erro)
@@ -2273,350 +2464,164 @@ def process_template_html(proposta_data, template_filename: str = "template.html
                     _ck = parse_float(proposta_data.get("consumo_mensal_kwh", 0), 0.0)
                     consumo_vec = [float(_ck or 0.0)] * 12
 
-                meses = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
-
-                # ====== GRÁFICO 1: Slide 03 - Gasto Acumulado (Linha com área) ======
-                g = {}
-                try:
-                    idxs = [0, 4, 9, 14, 19, 24]
-                    xs = [f"Ano {i+1}" for i in idxs]
-                    ys = [float(cas[i]) for i in idxs] if len(cas) >= 25 else []
-                    if ys:
-                        fig, ax = plt.subplots(figsize=(14, 9.5))
-                        
-                        # Linha principal com marcadores destacados
-                        line = ax.plot(xs, ys, color=BRAND_BLUE, linewidth=4, marker="o", 
-                                       markersize=12, markerfacecolor=BRAND_BLUE, 
-                                       markeredgecolor="white", markeredgewidth=3, zorder=5)
-                        
-                        # Área com gradiente suave
-                        ax.fill_between(range(len(ys)), ys, [0]*len(ys), 
-                                       color=BRAND_BLUE, alpha=0.12)
-                        
-                        ax.set_ylim(0, max(ys)*1.18 if ys else 1)
-                        _style_axes_modern(ax)
-                        ax.yaxis.set_major_formatter(FuncFormatter(_fmt_compact))
-                        
-                        # Labels grandes e destacados nos pontos
-                        for xi, yi in enumerate(ys):
-                            ax.annotate(
-                                _fmt_compact(yi),
-                                xy=(xi, yi),
-                                xytext=(0, 30),
-                                textcoords="offset points",
-                                ha='center', va='bottom',
-                                fontsize=15,
-                                fontweight='bold',
-                                color=BRAND_TEXT,
-                                bbox=dict(boxstyle='round,pad=0.3', facecolor='white', 
-                                         edgecolor=BRAND_GRID, alpha=0.9)
-                            )
-                        
-                        fig.tight_layout(pad=1.5)
-                        g["grafico1"] = _to_data_uri(fig)
-                except Exception as _e:
-                    print(f"⚠️ Falha ao gerar grafico1 estático: {_e}")
-
-                # ====== GRÁFICO 2: Slide 04 - Custo Anual (não usado no template copy) ======
-                try:
-                    if ca:
-                        xs = [f"Ano {i+1}" for i in range(len(ca))]
-                        ys = [float(v) for v in ca]
-                        fig, ax = plt.subplots(figsize=(12, 5))
-                        ax.plot(xs, ys, color=BRAND_BLUE, linewidth=3.5)
-                        ax.fill_between(range(len(ys)), ys, [0]*len(ys), color=BRAND_BLUE, alpha=0.1)
-                        _style_axes_modern(ax)
-                        ax.yaxis.set_major_formatter(FuncFormatter(_fmt_compact))
-                        
-                        # Mostrar apenas alguns anos no eixo X
-                        tick_positions = [0, 4, 9, 14, 19, 24]
-                        ax.set_xticks(tick_positions)
-                        ax.set_xticklabels([xs[i] for i in tick_positions if i < len(xs)], fontsize=13)
-                        
-                        fig.tight_layout(pad=1.5)
-                        g["grafico2"] = _to_data_uri(fig)
-                except Exception as _e:
-                    print(f"⚠️ Falha ao gerar grafico2 estático: {_e}")
-
-                # ====== GRÁFICO 3: Slide 05 - Consumo x Produção (Barras Duplas) ======
-                try:
-                    if isinstance(consumo_vec, list) and len(consumo_vec) == 12 and isinstance(prod, list) and len(prod) == 12:
-                        # Figura maior verticalmente para ocupar todo o espaço do card
-                        fig, ax = plt.subplots(figsize=(14, 9.5))
-                        x = np.arange(12)
-                        width = 0.38
-                        
-                        # Barras com cores vibrantes (sem label para legenda)
-                        bars1 = ax.bar(x - width/2, consumo_vec, width, color=BRAND_BLUE, 
-                                      alpha=0.92, edgecolor='white', linewidth=1.7)
-                        bars2 = ax.bar(x + width/2, prod, width, color=BRAND_GREEN, 
-                                      alpha=0.92, edgecolor='white', linewidth=1.7)
-                        
-                        ax.set_xticks(x)
-                        ax.set_xticklabels(meses, fontsize=15, fontweight='700')
-                        _style_axes_modern(ax)
-                        
-                        # SEM legenda interna - removida conforme solicitado
-                        
-                        # Espaço para labels em cima das colunas
-                        ymax = max(max(consumo_vec), max(prod)) if (consumo_vec and prod) else 1
-                        ax.set_ylim(0, ymax * 1.18)
-                        
-                        # Labels em TODAS as colunas (consumo e produção)
-                        for i in range(12):
-                            try:
-                                cv = float(consumo_vec[i])
-                                pv = float(prod[i])
-                                # Label do consumo (azul)
-                                ax.annotate(f"{cv:.0f}", xy=(i - width/2, cv), xytext=(0, 4),
-                                           textcoords="offset points", ha='center', va='bottom',
-                                           fontsize=16, fontweight='bold', color=BRAND_BLUE_DARK)
-                                # Label da produção (verde)
-                                ax.annotate(f"{pv:.0f}", xy=(i + width/2, pv), xytext=(0, 4),
-                                           textcoords="offset points", ha='center', va='bottom',
-                                           fontsize=16, fontweight='bold', color=BRAND_GREEN_DARK)
-                            except Exception:
-                                pass
-                        
-                        # Ajustar margens para ocupar melhor o espaço
-                        fig.subplots_adjust(left=0.05, right=0.98, top=0.95, bottom=0.12)
-                        fig.tight_layout(pad=1.0)
-                        g["grafico3"] = _to_data_uri(fig)
-                except Exception as _e:
-                    print(f"⚠️ Falha ao gerar grafico3 estático: {_e}")
+                # Somente tipos simples: o dict é enviado (pickle) aos processos do pool.
+                # Sem conversão aqui: cada gráfico converte os seus dados no próprio bloco
+                # protegido, então um valor inválido derruba só o gráfico que o usa.
+                dados_graficos = {
+                    "cas": list(cas),
+                    "ca": list(ca),
+                    "fca": list(fca),
+                    "prod": list(prod),
+                    "consumo_vec": list(consumo_vec),
+                    "gasto_total_25_anos": parse_float((metrics or {}).get("gasto_total_25_anos", 0), 0.0),
+                    "preco_venda": parse_float(core_payload.get("preco_venda", 0), 0.0),
+                    "economia_total_25_calc": economia_total_25_calc,
+                }
 
-                # ====== GRÁFICO 4: Slide 07 - Payback (Fluxo de Caixa Acumulado) ======
-                try:
-                    if fca:
-                        xs_labels = [f"Ano {i+1}" for i in range(len(fca))]
-                        ys = [float(v) for v in fca]
-                        pay_idx = next((i for i, v in enumerate(ys) if v >= 0), None)
-                        
-                        fig, ax = plt.subplots(figsize=(14, 9.5))
-                        x_positions = list(range(len(fca)))
-                        
-                        # Cores diferentes para valores negativos e positivos
-                        colors_area = [BRAND_RED if y < 0 else BRAND_GREEN for y in ys]
-                        
-                        # Linha principal
-                        ax.plot(x_positions, ys, color=BRAND_GREEN, linewidth=4, zorder=4)
-                        
-                        # Área colorida (vermelho abaixo de zero, verde acima)
-                        ys_neg = [min(y, 0) for y in ys]
-                        ys_pos = [max(y, 0) for y in ys]
-                        ax.fill_between(x_positions, ys_neg, 0, color=BRAND_RED, alpha=0.15)
-                        ax.fill_between(x_positions, 0, ys_pos, color=BRAND_GREEN, alpha=0.15)
-                        
-                        # Linha do zero destacada
-                        ax.axhline(0, color=BRAND_TEXT, linewidth=2, alpha=0.3, linestyle='-')
-                        
-                        _style_axes_modern(ax)
-                        ax.yaxis.set_major_formatter(FuncFormatter(_fmt_compact))
-                        
-                        # Apenas alguns anos no eixo X
-                        tick_idx = [0, 4, 9, 14, 19, 24]
-                        ax.set_xticks(tick_idx)
-                        ax.set_xticklabels([xs_labels[i] for i in tick_idx if i < len(xs_labels)], fontsize=13)
-                        
-                        # Destaque do ponto de payback
-                        if pay_idx is not None:
-                            ax.axvline(pay_idx, color=BRAND_ORANGE, linestyle="--", linewidth=3, alpha=0.8)
-                            ax.scatter([pay_idx], [ys[pay_idx]], s=200, color=BRAND_ORANGE, 
-                                      edgecolors="white", linewidths=3, zorder=6)
-                            
-                            # Label do payback com destaque
-                            ax.annotate(
-                                f"PAYBACK\nAno {pay_idx+1}",
-                                xy=(pay_idx, ys[pay_idx]),
-                                xytext=(-100,20),
-                                textcoords="offset points",
-                                fontsize=16,
-                                fontweight='bold',
-                                color=BRAND_ORANGE,
-                                ha='left',
-                                bbox=dict(boxstyle='round,pad=0.5', facecolor='white', 
-                                         edgecolor=BRAND_ORANGE, linewidth=2, alpha=0.95),
-                                arrowprops=dict(arrowstyle='->', color=BRAND_ORANGE, lw=2)
-                            )
-                        
-                        fig.tight_layout(pad=1.5)
-                        g["grafico4"] = _to_data_uri(fig)
-                except Exception as _e:
-                    print(f"⚠️ Falha ao gerar grafico4 estático: {_e}")
+                def _calcular_graficos():
+                    with span("graficos"):
+                        pngs = render_graficos(dados_graficos)
+                    return {
+                        k: "data:image/png;base64," + base64.b64encode(png).decode("utf-8")
+                        for k, png in pngs.items()
+                    }
 
-                # ====== GRÁFICO 5: Slide 11 - Comparativo 25 Anos vs Investimento ======
-                try:
-                    if cas:
-                        sem_solar_25 = float(cas[-1]) if cas else 0.0
+                def _aplicar_graficos(html, g):
+                    # Injetar os PNGs no HTML substituindo os containers por <img>
+                    g = g or {}
+                    print(f"📊 [GRAFICOS] Gráficos gerados: {list(g.keys()) if g else 'NENHUM'}")
+                    if g:
+                        proposta_data.setdefault("graficos_base64", {})
+                        proposta_data["graficos_base64"].update(g)
+                        # reutilizar id_map + helper já definidos acima
+                        for k, v in g.items():
+                            if k in id_map and v:
+                                element_id = id_map[k]
+                                print(f"📊 [GRAFICOS] Injetando {k} -> #{element_id}")
+                                html = _inject_img_src(html, element_id, v)
                     else:
-                        sem_solar_25 = float(metrics.get("gasto_total_25_anos", 0) or 0.0)
-                    inv = float(core_payload.get("preco_venda", 0) or 0.0)
-                    
-                    fig, ax = plt.subplots(figsize=(14, 9.5))
-                    labels = ["Gasto SEM\nenergia solar\n(25 anos)", "Investimento\nno sistema"]
-                    vals = [sem_solar_25, inv]
-                    colors = [BRAND_RED, BRAND_GREEN]
-                    
-                    # Barras largas e impactantes
-                    bars = ax.bar(labels, vals, color=colors, width=0.55, 
-                                 edgecolor='white', linewidth=2)
-                    
-                    _style_axes_modern(ax, show_y_grid=True)
-                    ax.yaxis.set_major_formatter(FuncFormatter(_fmt_compact))
-                    
-                    # Eixo X mais legível
-                    ax.tick_params(axis='x', labelsize=16, pad=12)
-                    
-                    # Espaço para os labels
-                    ymax = max(vals) if vals else 1
-                    ax.set_ylim(0, ymax * 1.25)
-                    
-                    # Rótulos grandes e destacados em cima das barras
-                    for bar, val, color in zip(bars, vals, [BRAND_RED_DARK, BRAND_GREEN_DARK]):
-                        height = bar.get_height()
-                        ax.annotate(
-                            _fmt_brl_full(val),
-                            xy=(bar.get_x() + bar.get_width() / 2, height),
-                            xytext=(0, 12),
-                            textcoords="offset points",
-                            ha='center', va='bottom',
-                            fontsize=18,
-                            fontweight='bold',
-                            color=color,
-                            bbox=dict(boxstyle='round,pad=0.4', facecolor='white', 
-                                     edgecolor=color, linewidth=2, alpha=0.95)
-                        )
-                    
-                    # Adicionar indicador de economia
-                    # Usar economia_total_25_calc (fluxo de caixa acumulado) para consistência
-                    # com o valor mostrado no texto "Economia de R$..."
-                    if sem_solar_25 > 0 and inv > 0:
-                        # Priorizar economia_total_25_calc (economia líquida real)
-                        # Se não disponível, calcular como diferença simples
-                        economia = economia_total_25_calc if economia_total_25_calc > 0 else (sem_solar_25 - inv)
-                        economia_pct = (economia / sem_solar_25) * 100
-                        economia_text = f"Economia: {_fmt_brl_full(economia)} ({economia_pct:.0f}%)"
-                        ax.text(0.5, 0.02, economia_text, transform=ax.transAxes, 
-                               fontsize=16, fontweight='bold', color=BRAND_GREEN_DARK,
-                               ha='center', va='bottom',
-                               bbox=dict(boxstyle='round,pad=0.5', facecolor='#ECFDF5', 
-                                        edgecolor=BRAND_GREEN, linewidth=1.5))
-                    
-                    fig.tight_layout(pad=2)
-                    g["grafico5"] = _to_data_uri(fig)
-                except Exception as _e:
-                    print(f"⚠️ Falha ao gerar grafico5 estático: {_e}")
-
-                # Injetar os PNGs no HTML substituindo os containers por <img>
-                print(f"📊 [GRAFICOS] Gráficos gerados: {list(g.keys()) if g else 'NENHUM'}")
-                if g:
-                    proposta_data.setdefault("graficos_base64", {})
-                    proposta_data["graficos_base64"].update(g)
-                    # reutilizar id_map + helper já definidos acima
-                    for k, v in g.items():
-                        if k in id_map and v:
-                            element_id = id_map[k]
-                            print(f"📊 [GRAFICOS] Injetando {k} -> #{element_id}")
-                            template_html = _inject_img_src(template_html, element_id, v)
+                        print(f"⚠️ [GRAFICOS] Nenhum gráfico foi gerado!")
+                    return html
+
+                job_graficos = DeferredJob("graficos", list(id_map.values()), _calcular_graficos, _aplicar_graficos)
+                if deferred is not None:
+                    deferred.append(job_graficos)
                 else:
-                    print(f"⚠️ [GRAFICOS] Nenhum gráfico foi gerado!")
+                    template_html = job_graficos.run(template_html)
             except Exception as _e:
                 import traceback
                 print(f"⚠️ Falha ao gerar/injetar gráficos estáticos: {_e}")
                 traceback.print_exc()
         else:
-            template_html = apply_analise_financeira_graphs(template_html, proposta_data)
+            template_html = apply_analise_financeira_graphs(template_html, proposta_data, inline_vendor=for_pdf)
         
         # ====== FORMAS DE PAGAMENTO (Slide 12 no template copy / Slide 10 no template antigo) ======
-        try:
-            # Usar o preco_final_real calculado no início da função (já validado e robusto)
-            print(f"💳 [SLIDE10] Usando preco_final_real: R$ {preco_final_real:,.2f}")
+        # O cálculo das parcelas (lê formas de pagamento do ConfigDB) é a parte lenta:
+        # vira um job que pode ser adiado para o streaming.
+        def _calcular_pagamentos():
+            # Sempre ter um cálculo “fonte da verdade” para evitar financiamento zerado e layout antigo
+            with span("pagamentos"):
+                return calcular_parcelas_pagamento(preco_final_real) if preco_final_real > 0 else None
+
+        def _aplicar_pagamentos(html, pagamento_calc):
+            try:
+                # Usar o preco_final_real calculado no início da função (já validado e robusto)
+                print(f"💳 [SLIDE10] Usando preco_final_real: R$ {preco_final_real:,.2f}")
             
-            # Priorizar valores persistidos no payload (pré-calculados no /salvar-proposta)
-            payload_cartao = (proposta_data.get('parcelas_cartao') or '') if isinstance(proposta_data.get('parcelas_cartao'), str) else ''
-            payload_fin = (proposta_data.get('parcelas_financiamento') or '') if isinstance(proposta_data.get('parcelas_financiamento'), str) else ''
-            payload_avista = proposta_data.get('valor_avista_cartao')
-            payload_menor = proposta_data.get('menor_parcela_financiamento')
+                # Priorizar valores persistidos no payload (pré-calculados no /salvar-proposta)
+                payload_cartao = (proposta_data.get('parcelas_cartao') or '') if isinstance(proposta_data.get('parcelas_cartao'), str) else ''
+                payload_fin = (proposta_data.get('parcelas_financiamento') or '') if isinstance(proposta_data.get('parcelas_financiamento'), str) else ''
+                payload_avista = proposta_data.get('valor_avista_cartao')
+                payload_menor = proposta_data.get('menor_parcela_financiamento')
 
-            payload_cartao_count = payload_cartao.count('parcela-item') if payload_cartao else 0
-            has_payload_pagamento = bool(payload_cartao.strip() or payload_fin.strip() or payload_avista or payload_menor)
+                payload_cartao_count = payload_cartao.count('parcela-item') if payload_cartao else 0
+                has_payload_pagamento = bool(payload_cartao.strip() or payload_fin.strip() or payload_avista or payload_menor)
 
-            is_template_copy = (str(template_filename).lower().strip() == "template copy.html")
-            max_cartao_itens = 12 if is_template_copy else 18
+                is_template_copy = (str(template_filename).lower().strip() == "template copy.html")
+                max_cartao_itens = 12 if is_template_copy else 18
 
-            def _parse_brl_to_float(v) -> float:
-                try:
-                    if v is None:
+                def _parse_brl_to_float(v) -> float:
+                    try:
+                        if v is None:
+                            return 0.0
+                        if isinstance(v, (int, float)):
+                            return float(v)
+                        s = str(v).strip()
+                        for token in ['R$', 'r$', 'RS', 'rs']:
+                            s = s.replace(token, '')
+                        s = re.sub(r'\s+', '', s)
+                        # "10.495,50" -> "10495.50"
+                        if ',' in s:
+                            s = s.replace('.', '').replace(',', '.')
+                        else:
+                            # "892.857" (milhar) -> "892857"
+                            s = s.replace('.', '')
+                        return float(s)
+                    except Exception:
                         return 0.0
-                    if isinstance(v, (int, float)):
-                        return float(v)
-                    s = str(v).strip()
-                    for token in ['R$', 'r$', 'RS', 'rs']:
-                        s = s.replace(token, '')
-                    s = re.sub(r'\s+', '', s)
-                    # "10.495,50" -> "10495.50"
-                    if ',' in s:
-                        s = s.replace('.', '').replace(',', '.')
-                    else:
-                        # "892.857" (milhar) -> "892857"
-                        s = s.replace('.', '')
-                    return float(s)
-                except Exception:
-                    return 0.0
 
-            def _limit_parcela_items(html: str, max_items: int) -> str:
-                if not html:
-                    return ""
-                try:
-                    items = re.findall(r'<div class="parcela-item"[\s\S]*?</div>', html)
-                    if items:
-                        return "".join(items[:max_items])
-                except Exception:
-                    pass
-                # fallback simples: retorna como veio
-                return html
+                def _limit_parcela_items(html: str, max_items: int) -> str:
+                    if not html:
+                        return ""
+                    try:
+                        items = re.findall(r'<div class="parcela-item"[\s\S]*?</div>', html)
+                        if items:
+                            return "".join(items[:max_items])
+                    except Exception:
+                        pass
+                    # fallback simples: retorna como veio
+                    return html
             
-            if preco_final_real > 0:
-                # Sempre ter um cálculo “fonte da verdade” para evitar financiamento zerado e layout antigo
-                pagamento_calc = calcular_parcelas_pagamento(preco_final_real)
-
-                # Cartão: no template copy, exibir SOMENTE até 12x (demais sob consulta)
-                src_cartao = payload_cartao if payload_cartao.strip() else (pagamento_calc.get('parcelas_cartao', '') or '')
-                template_html = template_html.replace('{{parcelas_cartao}}', _limit_parcela_items(src_cartao, max_cartao_itens))
-
-                # Financiamento: alguns templates não mostram a lista, mas sempre precisamos do destaque.
-                src_fin = payload_fin if payload_fin.strip() else (pagamento_calc.get('parcelas_financiamento', '') or '')
-                # No template copy, mostrar mais opções mas ainda caber no slide
-                max_fin_itens = 8 if is_template_copy else 999
-                template_html = template_html.replace('{{parcelas_financiamento}}', _limit_parcela_items(src_fin, max_fin_itens))
-
-                # Destaques: se payload estiver vazio/zerado, usar o calculado.
-                av_payload_ok = _parse_brl_to_float(payload_avista) > 0
-                menor_payload_ok = _parse_brl_to_float(payload_menor) > 0
-                template_html = template_html.replace('{{valor_avista_cartao}}', str(payload_avista) if av_payload_ok else (pagamento_calc.get('valor_avista_cartao', 'R$ 0,00') or 'R$ 0,00'))
-                template_html = template_html.replace('{{menor_parcela_financiamento}}', str(payload_menor) if menor_payload_ok else (pagamento_calc.get('menor_parcela_financiamento', 'R$ 0,00') or 'R$ 0,00'))
-
-                if is_template_copy:
-                    print("✅ [SLIDE12] Template copy: cartão limitado a 12x e financiamento garantido pelo cálculo.")
-                elif has_payload_pagamento:
-                    print("✅ [SLIDE10] Usando payload (com fallback no cálculo quando necessário).")
-            else:
-                # Log completo do proposta_data para debug
-                print(f"⚠️ [SLIDE10] Preço zerado! Dump de proposta_data keys: {list(proposta_data.keys())}")
-                # Valores padrão se não tiver preço
-                template_html = template_html.replace('{{parcelas_cartao}}', '<div class="parcela-item"><span class="parcela-numero">Consulte</span><span class="parcela-valor">valores</span></div>')
-                template_html = template_html.replace('{{parcelas_financiamento}}', '<div class="parcela-item"><span class="parcela-numero">Consulte</span><span class="parcela-valor">valores</span></div>')
-                template_html = template_html.replace('{{valor_avista_cartao}}', 'Consulte')
-                template_html = template_html.replace('{{menor_parcela_financiamento}}', 'Consulte')
-        except Exception as e:
-            print(f"❌ [SLIDE10] Erro ao processar formas de pagamento: {e}")
-            import traceback
-            traceback.print_exc()
-            # Fallback - substituir com valores vazios para não mostrar as variáveis
-            template_html = template_html.replace('{{parcelas_cartao}}', '')
-            template_html = template_html.replace('{{parcelas_financiamento}}', '')
-            template_html = template_html.replace('{{valor_avista_cartao}}', 'R$ 0,00')
-            template_html = template_html.replace('{{menor_parcela_financiamento}}', 'R$ 0,00')
+                if preco_final_real > 0:
+                    # Cartão: no template copy, exibir SOMENTE até 12x (demais sob consulta)
+                    src_cartao = payload_cartao if payload_cartao.strip() else (pagamento_calc.get('parcelas_cartao', '') or '')
+                    html = html.replace('{{parcelas_cartao}}', _limit_parcela_items(src_cartao, max_cartao_itens))
+
+                    # Financiamento: alguns templates não mostram a lista, mas sempre precisamos do destaque.
+                    src_fin = payload_fin if payload_fin.strip() else (pagamento_calc.get('parcelas_financiamento', '') or '')
+                    # No template copy, mostrar mais opções mas ainda caber no slide
+                    max_fin_itens = 8 if is_template_copy else 999
+                    html = html.replace('{{parcelas_financiamento}}', _limit_parcela_items(src_fin, max_fin_itens))
+
+                    # Destaques: se payload estiver vazio/zerado, usar o calculado.
+                    av_payload_ok = _parse_brl_to_float(payload_avista) > 0
+                    menor_payload_ok = _parse_brl_to_float(payload_menor) > 0
+                    html = html.replace('{{valor_avista_cartao}}', str(payload_avista) if av_payload_ok else (pagamento_calc.get('valor_avista_cartao', 'R$ 0,00') or 'R$ 0,00'))
+                    html = html.replace('{{menor_parcela_financiamento}}', str(payload_menor) if menor_payload_ok else (pagamento_calc.get('menor_parcela_financiamento', 'R$ 0,00') or 'R$ 0,00'))
+
+                    if is_template_copy:
+                        print("✅ [SLIDE12] Template copy: cartão limitado a 12x e financiamento garantido pelo cálculo.")
+                    elif has_payload_pagamento:
+                        print("✅ [SLIDE10] Usando payload (com fallback no cálculo quando necessário).")
+                else:
+                    # Log completo do proposta_data para debug
+                    print(f"⚠️ [SLIDE10] Preço zerado! Dump de proposta_data keys: {list(proposta_data.keys())}")
+                    # Valores padrão se não tiver preço
+                    html = html.replace('{{parcelas_cartao}}', '<div class="parcela-item"><span class="parcela-numero">Consulte</span><span class="parcela-valor">valores</span></div>')
+                    html = html.replace('{{parcelas_financiamento}}', '<div class="parcela-item"><span class="parcela-numero">Consulte</span><span class="parcela-valor">valores</span></div>')
+                    html = html.replace('{{valor_avista_cartao}}', 'Consulte')
+                    html = html.replace('{{menor_parcela_financiamento}}', 'Consulte')
+            except Exception as e:
+                print(f"❌ [SLIDE10] Erro ao processar formas de pagamento: {e}")
+                import traceback
+                traceback.print_exc()
+                # Fallback - substituir com valores vazios para não mostrar as variáveis
+                html = html.replace('{{parcelas_cartao}}', '')
+                html = html.replace('{{parcelas_financiamento}}', '')
+                html = html.replace('{{valor_avista_cartao}}', 'R$ 0,00')
+                html = html.replace('{{menor_parcela_financiamento}}', 'R$ 0,00')
+            return html
+
+        job_pagamentos = DeferredJob(
+            "pagamentos",
+            ['{{parcelas_cartao}}', '{{parcelas_financiamento}}', '{{valor_avista_cartao}}', '{{menor_parcela_financiamento}}'],
+            _calcular_pagamentos,
+            _aplicar_pagamentos,
+        )
+        if deferred is not None:
+            deferred.append(job_pagamentos)
+        else:
+            template_html = job_pagamentos.run(template_html)
         
         # Injetar dados brutos para gráficos interativos
         try:
@@ -2628,6 +2633,9 @@ def process_template_html(proposta_data, template_filename: str = "template.html
             print(f"⚠️ Erro ao injetar PROPOSAL_JSON: {e}")
             template_html = template_html.replace('{{PROPOSAL_JSON}}', '{}')
 
+        # Declarar ao renderizador de PDF o que esperar (ver pdf_renderer/render_common.js)
+        template_html = _inject_render_declaration(template_html)
+
         return template_html
         
     except Exception as e:
@@ -2862,9 +2870,8 @@ def get_proposta_configs():
         me = _require_auth()
         if not me:
             return jsonify({"success": False, "message": "Não autenticado"}), 401
-        db = SessionLocal()
-        row = db.get(ConfigDB, "proposta_configs")
-        db.close()
+        with _sessao() as db:
+            row = db.get(ConfigDB, "proposta_configs")
         cfg = row.data if row else None
         if isinstance(cfg, dict):
             cfg = {"id": "proposta_configs", **cfg}
@@ -2893,15 +2900,14 @@ def save_proposta_configs():
         data.setdefault("chave", "proposta_configs")
         data.setdefault("tipo", "proposta")
 
-        db = SessionLocal()
-        row = db.get(ConfigDB, "proposta_configs")
-        if row:
-            row.data = data
-        else:
-            db.add(ConfigDB(id="proposta_configs", data=data))
-        db.commit()
-        row = db.get(ConfigDB, "proposta_configs")
-        db.close()
+        with _sessao() as db:
+            row = db.get(ConfigDB, "proposta_configs")
+            if row:
+                row.data = data
+            else:
+                db.add(ConfigDB(id="proposta_configs", data=data))
+            db.commit()
+            row = db.get(ConfigDB, "proposta_configs")
 
         cfg = row.data if row else data
         cfg = {"id": "proposta_configs", **(cfg if isinstance(cfg, dict) else {})}
@@ -3179,13 +3185,9 @@ def _load_formas_pagamento():
         if not USE_DB:
             return DEFAULT_FORMAS_PAGAMENTO
 
-        db = SessionLocal()
-        try:
+        with _sessao() as db:
             row = db.get(ConfigDB, "formas_pagamento")
             value = (row.data if row else None)
-        finally:
-            db.close()
-
         if isinstance(value, str):
             try:
                 value = json.loads(value)
@@ -3211,17 +3213,15 @@ def _save_formas_pagamento(data):
         if not isinstance(data, dict):
             return False
 
-        db = SessionLocal()
-        try:
+        with _sessao() as db:
             row = db.get(ConfigDB, "formas_pagamento")
             if row:
                 row.data = data
             else:
                 db.add(ConfigDB(id="formas_pagamento", data=data))
             db.commit()
+            _formas_hash_memo["expira"] = 0.0
             return True
-        finally:
-            db.close()
     except Exception as e:
         try:
             logging.warning(f"Erro ao salvar formas de pagamento: {e}")
@@ -3229,6 +3229,22 @@ def _save_formas_pagamento(data):
             print(f"⚠️ Erro ao salvar formas de pagamento: {e}")
     return False
 
+# Hash das formas de pagamento para a chave/ETag do HTML: memo por processo com TTL
+# curto, sem ida ao banco a cada visualização (inclusive nos 304). Salvar invalida
+# neste worker; nos demais vale o TTL.
+FORMAS_PAGAMENTO_HASH_TTL_S = max(0.0, float(os.environ.get("FORMAS_PAGAMENTO_HASH_TTL_S", "30")))
+_formas_hash_memo = {"hash": None, "expira": 0.0}
+
+def _formas_pagamento_hash() -> str:
+    agora = time.monotonic()
+    h = _formas_hash_memo["hash"]
+    if h is not None and agora < _formas_hash_memo["expira"]:
+        return h
+    formas = _load_formas_pagamento()
+    h = hashlib.sha256(json.dumps(formas, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    _formas_hash_memo.update(hash=h, expira=agora + FORMAS_PAGAMENTO_HASH_TTL_S)
+    return h
+
 @app.route('/config/formas-pagamento', methods=['GET'])
 def get_formas_pagamento():
     """Retorna configuração de formas de pagamento."""
@@ -3826,9 +3842,9 @@ def admin_relatorio_calculos_proposta(proposta_id):
             if role not in ("admin", "gestor"):
                 return jsonify({"success": False, "message": "Não autorizado"}), 403
 
-            db = SessionLocal()
-            row = db.get(PropostaDB, proposta_id)
-            db.close()
+            with _sessao() as db:
+                row = get_proposta(db, proposta_id, payload=True)
+            _liberar_sessao()
             if not row:
                 return jsonify({"success": False, "message": "Proposta não encontrada"}), 404
             proposta_data = row.payload or {}
@@ -4037,10 +4053,9 @@ def anexar_graficos_a_proposta(proposta_id):
         metrics = body.get('metrics') or {}
         # DB-first: atualizar payload no Postgres
         if USE_DB:
-            db = SessionLocal()
-            row = db.get(PropostaDB, proposta_id)
+            with _sessao() as db:
+                row = get_proposta(db, proposta_id, payload=True)
             if not row:
-                db.close()
                 return jsonify({"success": False, "message": "Proposta não encontrada"}), 404
             data = row.payload or {}
         else:
@@ -4060,16 +4075,14 @@ def anexar_graficos_a_proposta(proposta_id):
         except Exception:
             pass
         if USE_DB:
-            # sincronizar também colunas relevantes
-            try:
+            # sincronizar também colunas relevantes (mesma sessão da requisição da leitura acima)
+            with _sessao() as db:
                 row.payload = data
                 if data.get('anos_payback') is not None:
                     row.anos_payback = float(data.get('anos_payback') or 0)
                 if data.get('economia_mensal_estimada') is not None:
                     row.economia_mensal_estimada = float(data.get('economia_mensal_estimada') or 0)
                 db.commit()
-            finally:
-                db.close()
             return jsonify({"success": True, "message": "Gráficos anexados à proposta.", "source": "db"})
 
         with open(proposta_file, 'w', encoding='utf-8') as f:
@@ -4098,12 +4111,9 @@ def salvar_proposta():
         try:
             if incoming_id:
                 if USE_DB:
-                    db0 = SessionLocal()
-                    try:
-                        row0 = db0.get(PropostaDB, proposta_id)
+                    with _sessao() as db0:
+                        row0 = get_proposta(db0, proposta_id, payload=True)
                         existing_payload = (row0.payload or {}) if row0 else {}
-                    finally:
-                        db0.close()
                 else:
                     proposta_file0 = PROPOSTAS_DIR / f"{proposta_id}.json"
                     if proposta_file0.exists():
@@ -4315,8 +4325,7 @@ def salvar_proposta():
                 needs_vendedor_lookup = True
             
             if USE_DB and needs_vendedor_lookup and vendedor_email:
-                db_vendedor = SessionLocal()
-                try:
+                with _sessao() as db_vendedor:
                     user_vendedor = db_vendedor.query(UserDB).filter(
                         func.lower(UserDB.email) == vendedor_email.lower()
                     ).first()
@@ -4377,8 +4386,6 @@ def salvar_proposta():
                         if not proposta_data.get('vendedor_email'):
                             proposta_data['vendedor_email'] = vendedor_email
                         print(f"⚠️ [VENDEDOR] Usuário não encontrado no banco, usando email formatado: {proposta_data.get('vendedor_nome')}")
-                finally:
-                    db_vendedor.close()
         except Exception as e:
             print(f"⚠️ [VENDEDOR] Erro ao buscar dados do vendedor: {e}")
 
@@ -4403,8 +4410,7 @@ def salvar_proposta():
                 allow_create = (not is_draft)
 
                 if USE_DB:
-                    db2 = SessionLocal()
-                    try:
+                    with _sessao() as db2:
                         match = None
                         if email_c:
                             match = db2.query(ClienteDB).filter(func.lower(ClienteDB.email) == email_c.lower()).first()
@@ -4435,8 +4441,6 @@ def salvar_proposta():
                             ))
                             db2.commit()
                             proposta_data['cliente_id'] = new_cid
-                    finally:
-                        db2.close()
                 else:
                     # modo arquivo: criar/ligar no clientes.json
                     clientes_map = _load_clientes()
@@ -4613,25 +4617,30 @@ def salvar_proposta():
 
         # Persistir no banco de dados usando funções refatoradas (elimina duplicação)
         try:
-            db = SessionLocal()
-            row = db.get(PropostaDB, proposta_id)
-            if row:
-                # Preservar owner original
-                proposta_data['created_by'] = row.created_by or proposta_data.get('created_by')
-                proposta_data['created_by_email'] = row.created_by_email or proposta_data.get('created_by_email')
-                # Usar função refatorada para atualizar
-                _update_proposta_row(row, proposta_data)
-            else:
-                # Usar função refatorada para criar
-                row = _create_proposta_row(proposta_data, proposta_id)
-                db.add(row)
-            db.commit()
-            db.close()
+            with _sessao() as db:
+                row = db.get(PropostaDB, proposta_id)
+                if row:
+                    # Preservar owner original
+                    proposta_data['created_by'] = row.created_by or proposta_data.get('created_by')
+                    proposta_data['created_by_email'] = row.created_by_email or proposta_data.get('created_by_email')
+                    # Usar função refatorada para atualizar
+                    _update_proposta_row(row, proposta_data)
+                else:
+                    # Usar função refatorada para criar
+                    row = _create_proposta_row(proposta_data, proposta_id)
+                    db.add(row)
+                visibilidade.atualizar_propostas(db, [proposta_id])
+                db.commit()
             print(f"💾 Proposta {proposta_id} salva no banco de dados (upsert) com todos os campos")
         except Exception as e:
             import traceback
             print(f"⚠️ Falha ao salvar proposta no banco: {e}")
             traceback.print_exc()
+
+        # HTML renderizado desta proposta ficou obsoleto
+        html_cache.invalidate(proposta_id)
+        # PDF também: pré-gerar para o novo payload (o cliente costuma abrir o link logo em seguida)
+        _agendar_aquecimento_pdf(proposta_id)
         
         return jsonify({
             'success': True,
@@ -4645,6 +4654,222 @@ def salvar_proposta():
             'message': f'Erro ao salvar proposta: {str(e)}'
         }), 500
 
+
+def _versao_etag(versao) -> str:
+    return f'"v{versao}"'
+
+
+def _versao_if_match(valor: str | None):
+    """Versão do cabeçalho If-Match ("v12", W/"v12"); None se ausente ou "*"."""
+    m = re.search(r'(\d+)', valor or "")
+    return int(m.group(1)) if m else None
+
+
+def _resposta_patch(corpo: dict, status: int = 200, versao=None):
+    resp = jsonify(corpo)
+    resp.status_code = status
+    if versao is not None:
+        resp.headers['ETag'] = _versao_etag(versao)
+    return resp
+
+
+def _aplicar_patch_proposta(proposta_id: str, versao_base=None):
+    """
+    Aplica o JSON merge-patch (RFC 7386) do corpo à proposta: valida, grava numa
+    única instrução (ver proposta_patch) e devolve a nova versão (corpo e ETag).
+    Com `versao_base` (If-Match) a proposta precisa existir nessa versão; senão 412.
+    Sem KPIs/validação de negócio: isso continua no /salvar-proposta, chamado ao
+    concluir o dimensionamento.
+    """
+    me = _current_user_row() if USE_DB else None
+    if USE_DB and not me:
+        return _resposta_patch({"success": False, "message": "Não autenticado"}, 401)
+    proposta_id = (proposta_id or "").strip()
+    if (request.content_length or 0) > proposta_patch.PATCH_MAX_KB * 1024:
+        return _resposta_patch({"success": False, "message": "Patch grande demais"}, 413)
+    patch = request.get_json(force=True, silent=True)
+    try:
+        if not proposta_id:
+            raise ValueError("Proposta inválida")
+        proposta_patch.validar(patch, _to_float_or_none)
+    except ValueError as e:
+        return _resposta_patch({"success": False, "message": str(e)}, 400)
+
+    if not USE_DB:
+        # Modo arquivo (dev): sem controle de versão
+        proposta_file = PROPOSTAS_DIR / f"{proposta_id}.json"
+        atual = {}
+        if proposta_file.exists():
+            with open(proposta_file, "r", encoding="utf-8") as f:
+                atual = json.load(f) or {}
+        novo = proposta_patch.merge_patch(atual, patch)
+        novo["id"] = proposta_id
+        novo.setdefault("data_criacao", now_brasilia().isoformat())
+        with open(proposta_file, "w", encoding="utf-8") as f:
+            json.dump(novo, f, ensure_ascii=False, indent=2)
+        html_cache.invalidate(proposta_id)
+        return _resposta_patch({"success": True, "proposta_id": proposta_id, "created": not atual, "source": "file"})
+
+    role = (me.role or "").strip().lower()
+    pode_tudo = role in ("admin", "gestor")
+    with _sessao() as db:
+        resultado = proposta_patch.upsert(
+            db, proposta_id, patch, _proposta_fields_from_data, _to_float_or_none,
+            na_criacao={
+                "created_by": me.uid,
+                "created_by_email": me.email,
+                "user_id": me.uid,
+                "data_criacao": now_brasilia().isoformat(),
+                "status": "rascunho",
+            },
+            uid=me.uid, email=me.email, pode_tudo=pode_tudo, versao_base=versao_base,
+        )
+        if resultado is None:
+            db.rollback()
+            motivo, versao_atual = proposta_patch.motivo_recusa(db, proposta_id, me.uid, me.email, pode_tudo)
+            if motivo == "inexistente":
+                return _resposta_patch({"success": False, "message": "Proposta não encontrada"}, 412 if versao_base is not None else 404)
+            if motivo == "negado":
+                return _resposta_patch({"success": False, "message": "Acesso negado"}, 403)
+            print(f"⚠️ [PATCH] Conflito na proposta {proposta_id}: base v{versao_base}, atual v{versao_atual}")
+            return _resposta_patch({
+                "success": False,
+                "message": "A proposta foi alterada por outra gravação",
+                "versao": versao_atual,
+            }, 412, versao_atual)
+        criada, versao = resultado
+        if criada or any(k in patch for k in ("cliente_id", "cliente_telefone", "cliente_nome")):
+            visibilidade.atualizar_propostas(db, [proposta_id])
+        db.commit()
+    # Rascunho: só invalida o HTML; o PDF é aquecido no /salvar-proposta
+    html_cache.invalidate(proposta_id)
+    return _resposta_patch({
+        "success": True, "proposta_id": proposta_id, "created": criada, "versao": versao, "source": "db",
+    }, 201 if criada else 200, versao)
+
+
+@app.route('/propostas/<proposta_id>', methods=['PATCH'])
+def patch_proposta(proposta_id):
+    """
+    PATCH com JSON merge-patch (application/merge-patch+json).
+    If-Match: "v<versao>" (ETag da resposta anterior) recusa com 412 se outra
+    gravação mudou a proposta; sem If-Match cria a proposta se não existir.
+    """
+    try:
+        return _aplicar_patch_proposta(proposta_id, _versao_if_match(request.headers.get('If-Match')))
+    except Exception as e:
+        print(f"⚠️ [PATCH] Falha ao aplicar patch na proposta {proposta_id}: {e}")
+        return jsonify({"success": False, "message": f"Erro ao salvar rascunho: {str(e)}"}), 500
+
+
+@app.route('/propostas/<proposta_id>/autosave', methods=['POST'])
+def autosave_proposta(proposta_id):
+    """Mesmo que o PATCH, para clientes/proxies sem o método (versão em If-Match ou ?versao=)."""
+    try:
+        versao_base = _versao_if_match(request.headers.get('If-Match') or request.args.get('versao'))
+        return _aplicar_patch_proposta(proposta_id, versao_base)
+    except Exception as e:
+        print(f"⚠️ [autosave] Falha ao aplicar patch na proposta {proposta_id}: {e}")
+        return jsonify({"success": False, "message": f"Erro ao salvar rascunho: {str(e)}"}), 500
+
+
+def _html_cache_extra() -> str:
+    """
+    Dependências externas do HTML além do payload/template:
+    tabela de concessionárias (arquivo), formas de pagamento (ConfigDB, memo com TTL)
+    e versão do ECharts.
+    """
+    parts = []
+    try:
+        st = CONCESSIONARIAS_FILE.stat()
+        parts.append(f"conc:{st.st_mtime_ns}:{st.st_size}")
+    except OSError:
+        parts.append("conc:none")
+    try:
+        parts.append("fp:" + _formas_pagamento_hash())
+    except Exception:
+        parts.append("fp:none")
+    # URL versionada do ECharts fica embutida no HTML
+    parts.append(f"echarts:{_echarts_vendor()[1]}")
+    return "|".join(parts)
+
+
+def _proposta_html_key(proposta_data: dict, template_filename: str, fingerprint: str | None = None) -> str:
+    """Chave/ETag do HTML; com `fingerprint` (coluna render_fingerprint) não serializa o payload."""
+    template_path = Path(__file__).parent / "public" / (template_filename or "template.html").strip()
+    return html_cache_key(proposta_data, template_path, _html_cache_extra(), fingerprint=fingerprint)
+
+
+def _fingerprint_row(row) -> str:
+    """
+    render_fingerprint gravado da proposta, como está. Linha ainda não preenchida pela
+    migração (db.preencher_render_fingerprint): calculado em memória a partir do
+    payload, sem gravar (leitura não escreve no banco).
+    """
+    return row.render_fingerprint or render_fingerprint(row.payload or {})
+
+
+def _pdf_cache_key(proposta_data: dict, fingerprint: str | None = None) -> str:
+    """Chave do PDF em cache: a mesma do HTML do template.html (payload + template + dependências)."""
+    return _proposta_html_key(proposta_data, "template.html", fingerprint)
+
+
+def _render_proposta_html_cached(proposta_id: str, proposta_data: dict, template_filename: str, key: str | None = None) -> tuple[str, str, bool]:
+    """
+    Retorna (html, key, cache_hit). Em cache miss renderiza via process_template_html e grava.
+    """
+    key = key or _proposta_html_key(proposta_data, template_filename)
+    cached = html_cache.get(proposta_id, key)
+    if cached is not None:
+        return cached, key, True
+    html = process_template_html(proposta_data, template_filename=template_filename)
+    html_cache.put(proposta_id, key, html)
+    return html, key, False
+
+
+def _html_response(html: str, key: str, status: int = 200):
+    """Resposta HTML com ETag (revalidação obrigatória: o conteúdo muda ao salvar a proposta)."""
+    return html, status, {
+        'Content-Type': 'text/html; charset=utf-8',
+        'ETag': etag_for(key),
+        'Cache-Control': 'no-cache',
+    }
+
+
+def _html_not_modified(key: str):
+    return '', 304, {'ETag': etag_for(key), 'Cache-Control': 'no-cache'}
+
+
+def _proposta_html_response(proposta_id: str, proposta_data: dict | None, template_filename: str, key: str):
+    """
+    HTML da proposta: cache hit direto; em cache miss, streaming (capa primeiro,
+    gráficos/pagamentos preenchidos ao final). ?stream=0 força a renderização completa.
+    `proposta_data` None: o payload só é lido do banco em cache miss.
+    """
+    cached = html_cache.get(proposta_id, key)
+    if cached is not None:
+        return _html_response(cached, key)
+    if proposta_data is None:
+        proposta_data = _payload_proposta(proposta_id) or {}
+    # Render (e streaming) sem conexão do pool presa à requisição
+    _liberar_sessao()
+
+    if request.args.get('stream', '1') == '0':
+        html, key, _hit = _render_proposta_html_cached(proposta_id, proposta_data, template_filename, key)
+        return _html_response(html, key)
+
+    jobs = []
+    html = process_template_html(proposta_data, template_filename=template_filename, deferred=jobs)
+    chunks = stream_html(html, jobs, on_complete=lambda final: html_cache.put(proposta_id, key, final))
+    resp = Response(stream_with_context(chunks), mimetype='text/html')
+    resp.headers['Content-Type'] = 'text/html; charset=utf-8'
+    resp.headers['ETag'] = etag_for(key)
+    resp.headers['Cache-Control'] = 'no-cache'
+    # Evitar buffering em proxies (nginx/Railway) para o navegador receber a capa logo
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
 @app.route('/gerar-proposta-html/<proposta_id>', methods=['GET'])
 def gerar_proposta_html(proposta_id):
     """
@@ -4667,13 +4892,15 @@ def gerar_proposta_html(proposta_id):
         print(f"📄 [gerar_proposta_html] Usando template: {template_filename}")
         
         # Carregar dados da proposta
+        fingerprint = None
         if USE_DB:
-            db = SessionLocal()
-            row = db.get(PropostaDB, proposta_id)
-            db.close()
-            if not row:
-                return f"<html><body><h1>Proposta não encontrada</h1></body></html>", 404
-            proposta_data = row.payload or {}
+            with _sessao() as db:
+                # Sem o payload: com a impressão digital, 304/cache hit não precisam dele
+                row = db.get(PropostaDB, proposta_id)
+                if not row:
+                    return f"<html><body><h1>Proposta não encontrada</h1></body></html>", 404
+                proposta_data = None
+                fingerprint = _fingerprint_row(row)
         else:
             proposta_file = PROPOSTAS_DIR / f"{proposta_id}.json"
             if not proposta_file.exists():
@@ -4681,65 +4908,43 @@ def gerar_proposta_html(proposta_id):
             with open(proposta_file, 'r', encoding='utf-8') as f:
                 proposta_data = json.load(f)
         
-        # Processar template usando função centralizada
-        template_html = process_template_html(proposta_data, template_filename=template_filename)
+        # Cache por (payload, template, versão do motor): ETag permite 304 sem renderizar
+        key = _proposta_html_key(proposta_data, template_filename, fingerprint)
+        if etag_matches(request.headers.get('If-None-Match'), key):
+            print(f"✅ [gerar_proposta_html] 304 (ETag) - proposta_id={proposta_id}")
+            return _html_not_modified(key)
+
+        # Processar template usando função centralizada (variáveis restantes são verificadas por segmento)
+        resp = _proposta_html_response(proposta_id, proposta_data, template_filename, key)
         dur_ms = int((time.time() - start_ts) * 1000)
-        print(f"✅ [gerar_proposta_html] Concluído em {dur_ms} ms - proposta_id={proposta_id}")
-        
-        # Verificar variáveis restantes
-        variaveis_restantes = re.findall(r'\{\{[^}]+\}\}', template_html)
-        if variaveis_restantes:
-            print(f"⚠️ Variáveis não substituídas: {len(variaveis_restantes)}")
-        
-        return template_html, 200, {'Content-Type': 'text/html; charset=utf-8'}
+        print(f"✅ [gerar_proposta_html] Resposta iniciada em {dur_ms} ms - proposta_id={proposta_id}")
+        return resp
     
     except Exception as e:
         print(f"❌ [gerar_proposta_html] Erro: {e}")
         return f"<html><body><h1>Erro ao gerar proposta HTML: {str(e)}</h1></body></html>", 500
 
 
+def _pdf_saturado_response(e: RenderSaturated):
+    """503 rápido quando não há vaga de renderização (ver pdf_service.render_slot)."""
+    resp = jsonify({"success": False, "message": str(e), "retry_after": e.retry_after})
+    resp.headers["Retry-After"] = str(e.retry_after)
+    return resp, 503
+
+
 def _render_pdf_with_puppeteer(html: str, timeout_s: int = 60) -> bytes:
     """
     Renderiza o HTML em PDF usando Puppeteer (Chromium headless) via Node.
-    Retorna bytes do PDF.
+    Usa o serviço persistente (pdf_service / render_server.js) com fallback
+    automático para o render_pdf.js one-shot. Retorna bytes do PDF.
+    Sem vaga de renderização no host: RenderSaturated (rotas respondem 503).
     """
-    import time
     start = time.time()
     print(f"📄 [PDF] Iniciando renderização...")
-    
-    renderer = Path(__file__).parent / "pdf_renderer" / "render_pdf.js"
-    if not renderer.exists():
-        raise RuntimeError("pdf_renderer/render_pdf.js não encontrado.")
-
-    env = os.environ.copy()
-    env.setdefault("CHROMIUM_PATH", "/usr/bin/chromium")
-    env.setdefault("PUPPETEER_EXECUTABLE_PATH", "/usr/bin/chromium")
-
-    try:
-        proc = subprocess.run(
-            ["node", str(renderer)],
-            input=html.encode("utf-8"),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            env=env,
-            timeout=timeout_s,
-            check=False,
-        )
-    except subprocess.TimeoutExpired:
-        print(f"❌ [PDF] Timeout após {timeout_s}s")
-        raise RuntimeError("Timeout ao gerar PDF (Puppeteer).")
-
+    pdf_bytes = pdf_service.render_pdf(html, timeout_s=timeout_s)
     elapsed = time.time() - start
-    stderr_log = (proc.stderr or b"").decode("utf-8", errors="ignore")
-    if stderr_log:
-        print(f"📄 [PDF] Puppeteer log: {stderr_log[:500]}")
-    
-    if proc.returncode != 0 or not proc.stdout:
-        print(f"❌ [PDF] Falha rc={proc.returncode}")
-        raise RuntimeError(f"Falha ao gerar PDF (Puppeteer). rc={proc.returncode} err={stderr_log[:800]}")
-
-    print(f"✅ [PDF] Renderizado em {elapsed:.1f}s ({len(proc.stdout)} bytes)")
-    return proc.stdout
+    print(f"✅ [PDF] Renderizado em {elapsed:.1f}s ({len(pdf_bytes)} bytes)")
+    return pdf_bytes
 
 
 @app.route('/propostas/<proposta_id>/pdf', methods=['GET'])
@@ -4757,9 +4962,9 @@ def gerar_pdf_puppeteer(proposta_id):
             if not me:
                 return jsonify({"success": False, "message": "Não autenticado"}), 401
 
-            db = SessionLocal()
-            row = db.get(PropostaDB, proposta_id)
-            db.close()
+            with _sessao() as db:
+                row = get_proposta(db, proposta_id, payload=True)
+            _liberar_sessao()
             if not row:
                 return jsonify({"success": False, "message": "Proposta não encontrada"}), 404
 
@@ -4773,7 +4978,7 @@ def gerar_pdf_puppeteer(proposta_id):
             with open(proposta_file, "r", encoding="utf-8") as f:
                 proposta_data = json.load(f)
 
-        html = process_template_html(proposta_data)
+        html = process_template_html(proposta_data, for_pdf=True)
         pdf_bytes = _render_pdf_with_puppeteer(html, timeout_s=60)
 
         nome = (proposta_data or {}).get("cliente_nome") or "CLIENTE"
@@ -4790,14 +4995,136 @@ def gerar_pdf_puppeteer(proposta_id):
             download_name=filename,
             max_age=0,
         )
+    except RenderSaturated as e:
+        return _pdf_saturado_response(e)
     except Exception as e:
         print(f"❌ Erro ao gerar PDF (Puppeteer): {e}")
         return jsonify({"success": False, "message": str(e)}), 500
 
-def _calcular_hash_payload(payload: dict) -> str:
-    """Calcula hash MD5 do payload para detectar mudanças."""
-    payload_str = json.dumps(payload, sort_keys=True, default=str)
-    return hashlib.md5(payload_str.encode()).hexdigest()
+def _obter_pdf_proposta(proposta_id: str, force_regenerate: bool = False, origem: str = "ver_pdf_publico",
+                        db=None):
+    """
+    Carrega a proposta e devolve (caminho_pdf, proposta_data). O caminho aponta para a
+    cópia local endereçada por conteúdo (pdf_store), pronta para send_file com Range.
+    Usa o cache binário (tabela propostas_pdf_cache) quando o hash do payload confere;
+    senão gera e grava. Retorna (None, None) se a proposta não existir.
+    No modo DB, em cache hit `proposta_data` traz só cliente_nome (nome do arquivo).
+    `db`: sessão de quem chama (modo DB) — a da requisição (_sessao()) nas rotas, uma
+    própria nos jobs em background. Não é fechada aqui; só encerrada (close) durante
+    o render, para a conexão voltar ao pool.
+    Usado pela rota pública e pelos jobs assíncronos (pdf_jobs, exportação).
+    """
+    start_time = time.time()
+
+    # Carregar dados da proposta
+    if USE_DB:
+        row = db.get(PropostaDB, proposta_id)
+        if not row:
+            return None, None
+
+        # Cache hit não lê o payload: o nome do arquivo só precisa do cliente
+        proposta_data = {"cliente_nome": row.cliente_nome}
+
+        # Chave do PDF: impressão digital gravada ao salvar (sem serializar o payload)
+        pdf_path = None
+        with span("pdf_cache_lookup"):
+            current_hash = _pdf_cache_key(None, _fingerprint_row(row))
+            if not force_regenerate:
+                # Tentar usar cache (pode falhar se a tabela não existir ainda)
+                try:
+                    pdf_path = pdf_store.lookup(db, proposta_id, current_hash)
+                    if pdf_path is None:
+                        # PDF antigo em base64 na própria proposta: migrar para o cache binário
+                        pdf_path = pdf_store.migrar_legado(db, row, current_hash)
+                except Exception as e:
+                    db.rollback()
+                    print(f"⚠️ Cache não disponível (tabela pode não existir): {e}")
+                    pdf_path = None
+        if pdf_path is not None:
+            elapsed = time.time() - start_time
+            print(f"⚡ [{origem}] PDF do cache ({pdf_path.stat().st_size} bytes) em {elapsed:.2f}s")
+            return pdf_path, proposta_data
+
+        # Renderização única por (proposta, hash): pedidos simultâneos esperam a mesma
+        with pdf_store.single_flight(f"{proposta_id}:{current_hash}") as esperou:
+            if esperou:
+                try:
+                    pdf_path = pdf_store.lookup(db, proposta_id, current_hash)
+                except Exception as e:
+                    db.rollback()
+                    print(f"⚠️ Cache não disponível após espera: {e}")
+                if pdf_path is not None:
+                    elapsed = time.time() - start_time
+                    print(f"🤝 [{origem}] PDF renderizado por outra requisição em {elapsed:.2f}s")
+                    return pdf_path, proposta_data
+
+            # Gerar novo PDF
+            print(f"🔄 [{origem}] Gerando novo PDF...")
+            proposta_data = row.payload or {}
+            # Encerrar a sessão: a conexão volta ao pool durante o render (o store abaixo
+            # pega outra); se for a da requisição, o teardown só a fecha de novo
+            db.close()
+            cleanup_old_charts()
+            with span("html_render"):
+                html = process_template_html(proposta_data, template_filename="template.html", for_pdf=True)
+            pdf_bytes = _render_pdf_with_puppeteer(html, timeout_s=60)
+
+            # Salvar PDF no cache binário (antes de liberar o lock: quem espera relê daqui)
+            try:
+                with span("pdf_cache_store"):
+                    pdf_path = pdf_store.store(db, proposta_id, current_hash, pdf_bytes)
+                elapsed = time.time() - start_time
+                print(f"✅ [{origem}] PDF gerado e salvo no DB ({len(pdf_bytes)} bytes) em {elapsed:.2f}s")
+            except Exception as e:
+                db.rollback()
+                print(f"⚠️ Erro ao salvar cache no DB (tabela pode não existir): {e}")
+                pdf_path = pdf_store.materializar(pdf_bytes)
+            return pdf_path, proposta_data
+    else:
+        # Modo arquivo local: cache só na cópia local (referência por proposta + hash)
+        proposta_file = PROPOSTAS_DIR / f"{proposta_id}.json"
+        if not proposta_file.exists():
+            return None, None
+        with open(proposta_file, "r", encoding="utf-8") as f:
+            proposta_data = json.load(f)
+
+        chave = f"{proposta_id}:{_pdf_cache_key(proposta_data)}"
+        with pdf_store.single_flight(chave):
+            pdf_path = None if force_regenerate else pdf_store.lookup_ref(chave)
+            if pdf_path is not None:
+                print(f"⚡ [{origem}] PDF do cache local (modo arquivo)")
+                return pdf_path, proposta_data
+            cleanup_old_charts()
+            html = process_template_html(proposta_data, template_filename="template.html", for_pdf=True)
+            pdf_bytes = _render_pdf_with_puppeteer(html, timeout_s=60)
+            print(f"✅ [{origem}] PDF gerado (modo arquivo) ({len(pdf_bytes)} bytes)")
+            return pdf_store.store_ref(chave, pdf_bytes), proposta_data
+
+
+def _send_pdf_file(pdf_path: Path, download_name: str | None = None):
+    """
+    Envia o PDF do disco em blocos, com Accept-Ranges/Range e ETag (sha256 do conteúdo):
+    leitores no celular pedem as primeiras páginas sem baixar o arquivo inteiro.
+    """
+    return send_file(
+        str(pdf_path),
+        mimetype="application/pdf",
+        as_attachment=bool(download_name),
+        download_name=download_name,
+        conditional=True,
+        etag=pdf_path.stem,
+        max_age=0,
+    )
+
+
+def _nome_arquivo_pdf(proposta_data: dict) -> str:
+    nome = (proposta_data or {}).get("cliente_nome") or "CLIENTE"
+    safe_nome = re.sub(r"[\\/:*?\"<>|]+", " ", str(nome)).strip()
+    safe_nome = re.sub(r"\s+", " ", safe_nome).strip()[:80] or "CLIENTE"
+    # Obs: "/" não é permitido em nome de arquivo -> usamos DD-MM-YY
+    dt = now_brasilia().strftime("%d-%m-%y")
+    return f"{safe_nome} - {dt} - FOHAT ENERGIA SOLAR.pdf"
+
 
 @app.route('/proposta/<proposta_id>/ver-pdf', methods=['GET'])
 def ver_pdf_publico(proposta_id):
@@ -4819,106 +5146,286 @@ def ver_pdf_publico(proposta_id):
         action = "download" if download_mode else "visualização"
         
         print(f"📄 [ver_pdf_publico] Iniciando {action} - proposta_id={proposta_id}")
-        start_time = time.time()
 
-        # Carregar dados da proposta
-        if USE_DB:
-            db = SessionLocal()
-            row = db.get(PropostaDB, proposta_id)
-            if not row:
-                db.close()
-                return jsonify({"success": False, "message": "Proposta não encontrada"}), 404
-            
-            proposta_data = row.payload or {}
-            
-            # Calcular hash do payload atual
-            current_hash = _calcular_hash_payload(proposta_data)
-            
-            # Verificar se tem PDF em cache válido
-            pdf_bytes = None
-            cache_valid = False
-            
-            # Tentar usar cache (pode falhar se colunas não existirem ainda)
-            try:
-                cached_pdf = getattr(row, 'pdf_cache', None)
-                cached_hash = getattr(row, 'pdf_payload_hash', None)
-                
-                if not force_regenerate and cached_pdf and cached_hash == current_hash:
-                    # Cache válido! Usar PDF armazenado
-                    try:
-                        pdf_bytes = base64.b64decode(cached_pdf)
-                        cache_valid = True
-                        elapsed = time.time() - start_time
-                        print(f"⚡ [ver_pdf_publico] PDF do cache ({len(pdf_bytes)} bytes) em {elapsed:.2f}s")
-                    except Exception as e:
-                        print(f"⚠️ Erro ao decodificar cache, regenerando: {e}")
-                        cache_valid = False
-            except Exception as e:
-                print(f"⚠️ Cache não disponível (colunas podem não existir): {e}")
-                cache_valid = False
-            
-            if not cache_valid:
-                # Gerar novo PDF
-                print(f"🔄 [ver_pdf_publico] Gerando novo PDF...")
-                cleanup_old_charts()
-                html = process_template_html(proposta_data, template_filename="template.html")
-                pdf_bytes = _render_pdf_with_puppeteer(html, timeout_s=60)
-                
-                # Salvar PDF no banco de dados
-                try:
-                    row.pdf_cache = base64.b64encode(pdf_bytes).decode('utf-8')
-                    row.pdf_cached_at = now_brasilia()
-                    row.pdf_payload_hash = current_hash
-                    db.commit()
-                    elapsed = time.time() - start_time
-                    print(f"✅ [ver_pdf_publico] PDF gerado e salvo no DB ({len(pdf_bytes)} bytes) em {elapsed:.2f}s")
-                except Exception as e:
-                    db.rollback()
-                    print(f"⚠️ Erro ao salvar cache no DB (colunas podem não existir): {e}")
-            
-            db.close()
-        else:
-            # Modo arquivo local (sem cache)
-            proposta_file = PROPOSTAS_DIR / f"{proposta_id}.json"
-            if not proposta_file.exists():
-                return jsonify({"success": False, "message": "Proposta não encontrada"}), 404
-            with open(proposta_file, "r", encoding="utf-8") as f:
-                proposta_data = json.load(f)
-            
-            cleanup_old_charts()
-            html = process_template_html(proposta_data, template_filename="template.html")
-            pdf_bytes = _render_pdf_with_puppeteer(html, timeout_s=60)
-            print(f"✅ [ver_pdf_publico] PDF gerado (modo arquivo) ({len(pdf_bytes)} bytes)")
+        with _sessao() as db:
+            pdf_path, proposta_data = _obter_pdf_proposta(proposta_id, force_regenerate=force_regenerate, db=db)
+        if pdf_path is None:
+            return jsonify({"success": False, "message": "Proposta não encontrada"}), 404
 
-        # Gerar nome do arquivo para download
+        # Download com nome personalizado; sem parâmetro, abre no navegador
         if download_mode:
-            nome = (proposta_data or {}).get("cliente_nome") or "CLIENTE"
-            safe_nome = re.sub(r"[\\/:*?\"<>|]+", " ", str(nome)).strip()
-            safe_nome = re.sub(r"\s+", " ", safe_nome).strip()[:80] or "CLIENTE"
-            dt = now_brasilia().strftime("%d-%m-%y")
-            filename = f"{safe_nome} - {dt} - FOHAT ENERGIA SOLAR.pdf"
-            
-            return send_file(
-                io.BytesIO(pdf_bytes),
-                mimetype="application/pdf",
-                as_attachment=True,
-                download_name=filename,
-                max_age=0,
-            )
-        else:
-            # Retornar PDF para visualização no navegador
-            return send_file(
-                io.BytesIO(pdf_bytes),
-                mimetype="application/pdf",
-                as_attachment=False,
-                max_age=0,
-            )
+            return _send_pdf_file(pdf_path, _nome_arquivo_pdf(proposta_data))
+        return _send_pdf_file(pdf_path)
+    except RenderSaturated as e:
+        return _pdf_saturado_response(e)
     except Exception as e:
         print(f"❌ Erro ao gerar PDF: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"success": False, "message": str(e)}), 500
 
+# ====== PDF ASSÍNCRONO (fila de jobs) ======
+# POST enfileira e responde 202; status por polling (Retry-After); resultado quando pronto.
+# Mantém os workers do gunicorn livres durante a renderização.
+
+def _payload_proposta(proposta_id: str) -> dict | None:
+    """Somente o payload da proposta (None se não existir)."""
+    if USE_DB:
+        with _sessao() as db:
+            row = get_proposta(db, proposta_id, payload=True)
+            return (row.payload or {}) if row else None
+    proposta_file = PROPOSTAS_DIR / f"{proposta_id}.json"
+    if not proposta_file.exists():
+        return None
+    with open(proposta_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _pdf_key_proposta(proposta_id: str) -> str | None:
+    """Chave de conteúdo do PDF da proposta (None se não existir)."""
+    if USE_DB:
+        with _sessao() as db:
+            row = db.get(PropostaDB, proposta_id)
+            return _pdf_cache_key(None, _fingerprint_row(row)) if row else None
+    proposta_data = _payload_proposta(proposta_id)
+    return _pdf_cache_key(proposta_data) if proposta_data is not None else None
+
+
+def _render_pdf_job(proposta_id: str, force: bool) -> Path | None:
+    # Fora de requisição (consumidor do pdf_jobs): _sessao() abre e fecha uma sessão própria
+    with _sessao() as db:
+        pdf_path, _ = _obter_pdf_proposta(proposta_id, force_regenerate=force, origem="pdf_jobs", db=db)
+    return pdf_path
+
+
+pdf_jobs.configure(_render_pdf_job)
+
+
+def _chave_aquecimento_pdf(proposta_id: str) -> str | None:
+    """
+    Chave do pré-aquecimento: só faz sentido com cache no DB e quando o PDF
+    em cache não corresponde ao payload atual.
+    """
+    if not USE_DB:
+        return None
+    with _sessao() as db:
+        row = db.get(PropostaDB, proposta_id)
+        if not row:
+            return None
+        current_hash = _pdf_cache_key(None, _fingerprint_row(row))
+        if pdf_store.has_valid(db, proposta_id, current_hash):
+            return None
+        return f"{proposta_id}:{current_hash}"
+def _agendar_aquecimento_pdf(proposta_id: str) -> None:
+    """Pré-gera o PDF em background (debounce em pdf_jobs) para a 1ª visualização sair do cache."""
+    try:
+        pdf_jobs.schedule_warmup(proposta_id, _chave_aquecimento_pdf)
+    except Exception as e:
+        print(f"⚠️ [PDF_JOBS] Falha ao agendar pré-geração: {e}")
+
+
+# Intervalo sugerido (Retry-After) para o polling do status enquanto o job não termina
+PDF_JOBS_POLL_S = max(1, int(os.environ.get("PDF_JOBS_POLL_S", "1")))
+
+
+def _pdf_job_json(job: dict, status_code: int = 200):
+    body = pdf_job_view(job)
+    body["success"] = job.get("status") != "error"
+    body["status_url"] = f"/pdf-jobs/{job['job_id']}"
+    if job.get("status") == "done":
+        body["result_url"] = f"/pdf-jobs/{job['job_id']}/result"
+    resp = jsonify(body)
+    if job.get("status") not in ("done", "error"):
+        resp.headers["Retry-After"] = str(PDF_JOBS_POLL_S)
+    return resp, status_code
+
+
+@app.route('/propostas/<proposta_id>/pdf-jobs', methods=['POST'])
+def criar_pdf_job(proposta_id):
+    """
+    Enfileira a geração do PDF (rota pública, como /ver-pdf).
+    Body/query opcional: force=true ignora o cache e um job equivalente em andamento;
+    só vale para usuário autenticado (em chamada pública é ignorado).
+    Retorna 202 com job_id (200 se um job equivalente já existe); 503 se a fila estiver cheia.
+    Status por polling em /pdf-jobs/<job_id> (Retry-After indica o intervalo).
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        force = str(body.get("force", request.args.get("force", ""))).lower() == "true"
+        if force and not _require_auth():
+            force = False
+        pdf_key = _pdf_key_proposta(proposta_id)
+        if pdf_key is None:
+            return jsonify({"success": False, "message": "Proposta não encontrada"}), 404
+        chave = f"{proposta_id}:{pdf_key}"
+        try:
+            job, criado = pdf_jobs.submit(proposta_id, chave, force=force)
+        except QueueFull as e:
+            print(f"⚠️ [PDF_JOBS] Fila cheia: {e}")
+            resp = jsonify({"success": False, "message": "Muitos PDFs em geração. Tente novamente em instantes."})
+            resp.headers["Retry-After"] = "5"
+            return resp, 503
+        print(f"📥 [PDF_JOBS] {'Novo job' if criado else 'Job existente'} {job['job_id'][:8]} - proposta_id={proposta_id}")
+        return _pdf_job_json(job, 202 if criado else 200)
+    except Exception as e:
+        print(f"❌ [PDF_JOBS] Erro ao enfileirar: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route('/pdf-jobs/<job_id>', methods=['GET'])
+def status_pdf_job(job_id):
+    job = pdf_jobs.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "Job não encontrado"}), 404
+    return _pdf_job_json(job)
+
+
+@app.route('/pdf-jobs/<job_id>/result', methods=['GET'])
+def resultado_pdf_job(job_id):
+    """PDF do job pronto. download=true força download com nome personalizado."""
+    job = pdf_jobs.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "Job não encontrado"}), 404
+    if job.get("status") != "done":
+        return _pdf_job_json(job, 409)
+    path = pdf_jobs.result_path(job_id)
+    if not path:
+        return jsonify({"success": False, "message": "Resultado expirado"}), 410
+    if request.args.get('download', '').lower() == 'true':
+        return _send_pdf_file(path, _nome_arquivo_pdf(_payload_proposta(job["proposta_id"]) or {}))
+    return _send_pdf_file(path)
+
+
+def _ids_exportacao(params: dict) -> list:
+    """
+    IDs das propostas do filtro de exportação (mais recentes primeiro).
+    params: status, created_by (e-mail ou uid), de / ate (YYYY-MM-DD, created_at), limit.
+    Datas inválidas: ValueError.
+    """
+    status = str(params.get('status') or '').strip()
+    created_by = str(params.get('created_by') or '').strip()
+    limite = int(min(parse_float(params.get('limit') or PDF_EXPORT_MAX, PDF_EXPORT_MAX), PDF_EXPORT_MAX))
+    de = datetime.strptime(str(params['de']), "%Y-%m-%d") if params.get('de') else None
+    ate = datetime.strptime(str(params['ate']), "%Y-%m-%d") + timedelta(days=1) if params.get('ate') else None
+
+    if USE_DB:
+        with _sessao() as db:
+            q = db.query(PropostaDB.id)
+            if status:
+                q = q.filter(PropostaDB.status == status)
+            if created_by:
+                q = q.filter(or_(PropostaDB.created_by_email == created_by, PropostaDB.created_by == created_by))
+            if de:
+                q = q.filter(PropostaDB.created_at >= de)
+            if ate:
+                q = q.filter(PropostaDB.created_at < ate)
+            return [r[0] for r in q.order_by(PropostaDB.created_at.desc()).limit(limite).all()]
+
+    ids = []
+    for f in sorted(PROPOSTAS_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True):
+        try:
+            with open(f, "r", encoding="utf-8") as fh:
+                d = json.load(fh)
+        except Exception:
+            continue
+        if status and d.get("status") != status:
+            continue
+        if created_by and created_by not in (d.get("created_by_email"), d.get("created_by")):
+            continue
+        criado = str(d.get("created_at") or d.get("data_criacao") or "")[:10]
+        if (de and criado < de.strftime("%Y-%m-%d")) or (ate and criado >= ate.strftime("%Y-%m-%d")):
+            continue
+        ids.append(f.stem)
+        if len(ids) >= limite:
+            break
+    return ids
+
+
+def _export_job_json(job: dict, status_code: int = 200):
+    body = export_job_view(job)
+    body["success"] = job.get("status") != "error"
+    body["status_url"] = f"/admin/pdf-exports/{job['job_id']}"
+    if job.get("status") == "done":
+        body["result_url"] = f"/admin/pdf-exports/{job['job_id']}/result"
+    resp = jsonify(body)
+    if job.get("status") not in ("done", "error"):
+        resp.headers["Retry-After"] = str(max(PDF_JOBS_POLL_S, 2))
+    return resp, status_code
+
+
+@app.route('/admin/propostas/export-pdfs', methods=['POST'])
+def exportar_pdfs_zip():
+    """
+    Enfileira a exportação dos PDFs das propostas filtradas em um ZIP (admin/gestor).
+    Filtros (query ou body JSON): status, created_by (e-mail ou uid), de / ate
+    (YYYY-MM-DD, created_at), limit. PDFs em cache são reaproveitados; os demais são
+    renderizados com paralelismo limitado, em background (o ZIP vai para o disco).
+    Retorna 202 com job_id; status em /admin/pdf-exports/<job_id> e o ZIP em .../result.
+    """
+    if not _require_admin_access_app():
+        return jsonify({"success": False, "message": "Não autorizado"}), 403
+    try:
+        params = {**request.args.to_dict(), **(request.get_json(silent=True) or {})}
+        try:
+            ids = _ids_exportacao(params)
+        except ValueError:
+            return jsonify({"success": False, "message": "Datas devem estar no formato YYYY-MM-DD"}), 400
+        if not ids:
+            return jsonify({"success": False, "message": "Nenhuma proposta encontrada para o filtro"}), 404
+
+        def _obter(pid):
+            # Threads da exportação: sessão própria por PDF (a da requisição já terá fechado)
+            with _sessao() as db:
+                return _obter_pdf_proposta(pid, origem="export", db=db)
+
+        def _nomear(pid, payload):
+            return _nome_arquivo_pdf(payload).replace(".pdf", f" - {pid[:8]}.pdf")
+
+        filtros = {k: params.get(k) for k in ("status", "created_by", "de", "ate", "limit") if params.get(k)}
+        try:
+            job = export_jobs.submit(ids, _obter, _nomear, filtros=filtros)
+        except QueueFull as e:
+            print(f"⚠️ [EXPORT] Fila cheia: {e}")
+            resp = jsonify({"success": False, "message": "Já há exportações em andamento. Tente novamente em instantes."})
+            resp.headers["Retry-After"] = "30"
+            return resp, 503
+        print(f"📦 [EXPORT] Job {job['job_id'][:8]}: {len(ids)} PDFs (filtros={filtros or '*'})")
+        return _export_job_json(job, 202)
+    except Exception as e:
+        print(f"❌ [EXPORT] Erro: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+
+@app.route('/admin/pdf-exports/<job_id>', methods=['GET'])
+def status_exportacao_pdfs(job_id):
+    if not _require_admin_access_app():
+        return jsonify({"success": False, "message": "Não autorizado"}), 403
+    job = export_jobs.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "Exportação não encontrada"}), 404
+    return _export_job_json(job)
+
+
+@app.route('/admin/pdf-exports/<job_id>/result', methods=['GET'])
+def resultado_exportacao_pdfs(job_id):
+    """ZIP da exportação pronta (send_file com Range: downloads interrompidos retomam)."""
+    if not _require_admin_access_app():
+        return jsonify({"success": False, "message": "Não autorizado"}), 403
+    job = export_jobs.get(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "Exportação não encontrada"}), 404
+    if job.get("status") != "done":
+        return _export_job_json(job, 409)
+    path = export_jobs.result_path(job_id)
+    if not path:
+        return jsonify({"success": False, "message": "Resultado expirado"}), 410
+    nome = f"propostas-{datetime.fromtimestamp(job['created_at']).strftime('%Y%m%d-%H%M')}.zip"
+    resp = send_file(str(path), mimetype="application/zip", as_attachment=True, download_name=nome,
+                     conditional=True)
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+
 @app.route('/gerar-pdf/<proposta_id>', methods=['GET'])
 def gerar_pdf(proposta_id):
     """
@@ -4930,9 +5437,9 @@ def gerar_pdf(proposta_id):
         
         # Carregar dados da proposta
         if USE_DB:
-            db = SessionLocal()
-            row = db.get(PropostaDB, proposta_id)
-            db.close()
+            with _sessao() as db:
+                row = get_proposta(db, proposta_id, payload=True)
+            _liberar_sessao()
             if not row:
                 return jsonify({'success': False, 'message': 'Proposta não encontrada'}), 404
             proposta_data = row.payload or {}
@@ -4974,13 +5481,14 @@ def visualizar_proposta(proposta_id):
         print(f"📊 [visualizar_proposta] Views: {metrics['total_views']} total, {metrics['unique_views']} únicos")
         
         # Carregar dados da proposta
+        fingerprint = None
         if USE_DB:
-            db = SessionLocal()
-            row = db.get(PropostaDB, proposta_id)
-            db.close()
-            if not row:
-                return jsonify({'success': False, 'message': 'Proposta não encontrada'}), 404
-            proposta_data = row.payload or {}
+            with _sessao() as db:
+                row = db.get(PropostaDB, proposta_id)
+                if not row:
+                    return jsonify({'success': False, 'message': 'Proposta não encontrada'}), 404
+                proposta_data = None
+                fingerprint = _fingerprint_row(row)
         else:
             proposta_file = PROPOSTAS_DIR / f"{proposta_id}.json"
             if not proposta_file.exists():
@@ -4991,8 +5499,10 @@ def visualizar_proposta(proposta_id):
         # Visualização/Preview online agora usa template.html (formato de slides horizontal)
         # Isso garante consistência entre preview e PDF
         try:
-            processed = process_template_html(proposta_data, template_filename="template.html")
-            return processed, 200, {'Content-Type': 'text/html; charset=utf-8'}
+            key = _proposta_html_key(proposta_data, "template.html", fingerprint)
+            if etag_matches(request.headers.get('If-None-Match'), key):
+                return _html_not_modified(key)
+            return _proposta_html_response(proposta_id, proposta_data, "template.html", key)
         except Exception as e:
             print(f"❌ Falha no process_template_html em visualizar_proposta: {e}")
             return f"<html><body><h1>Erro ao carregar proposta</h1><pre>{str(e)}</pre></body></html>", 500
@@ -5059,9 +5569,8 @@ def health():
 @app.route('/db/health', methods=['GET'])
 def db_health():
     try:
-        db = SessionLocal()
-        db.execute(text('SELECT 1'))
-        db.close()
+        with _sessao() as db:
+            db.execute(text('SELECT 1'))
         return jsonify({'ok': True})
     except Exception as e:
         return jsonify({'ok': False, 'error': str(e)}), 500
@@ -5075,186 +5584,186 @@ def importar_locais():
         if not _require_role_admin_secret():
             return jsonify({'success': False, 'error': 'Não autorizado'}), 403
 
-        db = SessionLocal()
-        import_count = 0
+        with _sessao() as db:
+            import_count = 0
 
-        # -----------------------------
-        # Roles (data/users_roles.json)
-        # -----------------------------
-        try:
-            if ROLES_FILE.exists():
-                with open(ROLES_FILE, "r", encoding="utf-8") as f:
-                    roles = json.load(f) or {}
-                if isinstance(roles, dict):
-                    for email, raw in roles.items():
-                        email_l = (email or "").strip().lower()
-                        if not email_l:
-                            continue
-                        role = None
-                        nome = None
-                        cargo = None
-                        if isinstance(raw, dict):
-                            role = (raw.get("role") or "").strip().lower() or "vendedor"
-                            nome = (raw.get("nome") or "").strip() or None
-                            cargo = (raw.get("cargo") or "").strip() or None
-                        else:
-                            role = (str(raw).strip().lower() or "vendedor")
-                        try:
-                            existing = db.get(RoleDB, email_l)
-                            if existing:
-                                existing.role = role
-                                existing.nome = nome
-                                existing.cargo = cargo
-                            else:
-                                db.add(RoleDB(email=email_l, role=role, nome=nome, cargo=cargo))
-                            import_count += 1
-                        except Exception as e:
-                            print(f"⚠️ Falha ao importar role {email_l}: {e}")
-        except Exception as e:
-            print(f"⚠️ Falha ao importar roles do arquivo: {e}")
-
-        # -----------------------------
-        # Usuários (data/users.json)
-        # -----------------------------
-        try:
-            users_file = DATA_DIR / "users.json"
-            if users_file.exists():
-                with open(users_file, "r", encoding="utf-8") as f:
-                    users = json.load(f) or {}
-                if isinstance(users, dict):
-                    for uid, u in users.items():
-                        if not isinstance(u, dict):
-                            continue
-                        uid_v = (u.get("uid") or uid or "").strip()
-                        if not uid_v:
-                            continue
-                        email = (u.get("email") or "").strip().lower()
-                        nome = (u.get("nome") or "").strip() or (email.split("@")[0] if email else "")
-                        role = (u.get("role") or "").strip().lower() or "vendedor"
-                        # compat: "comum" -> "vendedor"
-                        if role == "comum":
-                            role = "vendedor"
-                        try:
-                            existing = db.get(UserDB, uid_v)
-                            if existing:
-                                existing.email = email
-                                existing.nome = nome
-                                existing.role = role
+            # -----------------------------
+            # Roles (data/users_roles.json)
+            # -----------------------------
+            try:
+                if ROLES_FILE.exists():
+                    with open(ROLES_FILE, "r", encoding="utf-8") as f:
+                        roles = json.load(f) or {}
+                    if isinstance(roles, dict):
+                        for email, raw in roles.items():
+                            email_l = (email or "").strip().lower()
+                            if not email_l:
+                                continue
+                            role = None
+                            nome = None
+                            cargo = None
+                            if isinstance(raw, dict):
+                                role = (raw.get("role") or "").strip().lower() or "vendedor"
+                                nome = (raw.get("nome") or "").strip() or None
+                                cargo = (raw.get("cargo") or "").strip() or None
                             else:
-                                db.add(UserDB(uid=uid_v, email=email, nome=nome, role=role))
-                            import_count += 1
-                        except Exception as e:
-                            print(f"⚠️ Falha ao importar user {uid_v}: {e}")
-        except Exception as e:
-            print(f"⚠️ Falha ao importar users do arquivo: {e}")
+                                role = (str(raw).strip().lower() or "vendedor")
+                            try:
+                                existing = db.get(RoleDB, email_l)
+                                if existing:
+                                    existing.role = role
+                                    existing.nome = nome
+                                    existing.cargo = cargo
+                                else:
+                                    db.add(RoleDB(email=email_l, role=role, nome=nome, cargo=cargo))
+                                import_count += 1
+                            except Exception as e:
+                                print(f"⚠️ Falha ao importar role {email_l}: {e}")
+            except Exception as e:
+                print(f"⚠️ Falha ao importar roles do arquivo: {e}")
 
-        # -----------------------------
-        # Configuração (data/configuracao.json)
-        # -----------------------------
-        try:
-            cfg_file = DATA_DIR / "configuracao.json"
-            if cfg_file.exists():
-                with open(cfg_file, "r", encoding="utf-8") as f:
-                    cfg = json.load(f) or {}
-                cfg_id = "default"
-                existing = db.get(ConfigDB, cfg_id)
-                if existing:
-                    existing.data = cfg
-                else:
-                    db.add(ConfigDB(id=cfg_id, data=cfg))
-                import_count += 1
-        except Exception as e:
-            print(f"⚠️ Falha ao importar configuracao.json: {e}")
+            # -----------------------------
+            # Usuários (data/users.json)
+            # -----------------------------
+            try:
+                users_file = DATA_DIR / "users.json"
+                if users_file.exists():
+                    with open(users_file, "r", encoding="utf-8") as f:
+                        users = json.load(f) or {}
+                    if isinstance(users, dict):
+                        for uid, u in users.items():
+                            if not isinstance(u, dict):
+                                continue
+                            uid_v = (u.get("uid") or uid or "").strip()
+                            if not uid_v:
+                                continue
+                            email = (u.get("email") or "").strip().lower()
+                            nome = (u.get("nome") or "").strip() or (email.split("@")[0] if email else "")
+                            role = (u.get("role") or "").strip().lower() or "vendedor"
+                            # compat: "comum" -> "vendedor"
+                            if role == "comum":
+                                role = "vendedor"
+                            try:
+                                existing = db.get(UserDB, uid_v)
+                                if existing:
+                                    existing.email = email
+                                    existing.nome = nome
+                                    existing.role = role
+                                else:
+                                    db.add(UserDB(uid=uid_v, email=email, nome=nome, role=role))
+                                import_count += 1
+                            except Exception as e:
+                                print(f"⚠️ Falha ao importar user {uid_v}: {e}")
+            except Exception as e:
+                print(f"⚠️ Falha ao importar users do arquivo: {e}")
 
-        # -----------------------------
-        # Clientes (data/clientes.json)
-        # -----------------------------
-        try:
-            clientes_file = DATA_DIR / "clientes.json"
-            if clientes_file.exists():
-                with open(clientes_file, "r", encoding="utf-8") as f:
-                    clientes = json.load(f) or {}
-                if isinstance(clientes, dict):
-                    for cid, c in clientes.items():
-                        if not isinstance(c, dict):
-                            continue
-                        cid_v = (c.get("id") or cid or "").strip()
-                        if not cid_v:
-                            continue
-                        try:
-                            existing = db.get(ClienteDB, cid_v)
-                            if existing:
-                                existing.nome = c.get("nome")
-                                existing.telefone = c.get("telefone")
-                                existing.email = c.get("email")
-                                existing.created_by = c.get("created_by")
-                                existing.created_by_email = c.get("created_by_email")
-                                existing.endereco_completo = c.get("endereco_completo")
-                                existing.cep = c.get("cep")
-                                existing.tipo = c.get("tipo")
-                                existing.observacoes = c.get("observacoes")
-                            else:
-                                db.add(ClienteDB(
-                                    id=cid_v,
-                                    nome=c.get("nome"),
-                                    telefone=c.get("telefone"),
-                                    email=c.get("email"),
-                                    created_by=c.get("created_by"),
-                                    created_by_email=c.get("created_by_email"),
-                                    endereco_completo=c.get("endereco_completo"),
-                                    cep=c.get("cep"),
-                                    tipo=c.get("tipo"),
-                                    observacoes=c.get("observacoes"),
-                                ))
-                            import_count += 1
-                        except Exception as e:
-                            print(f"⚠️ Falha ao importar cliente {cid_v}: {e}")
-        except Exception as e:
-            print(f"⚠️ Falha ao importar clientes.json: {e}")
+            # -----------------------------
+            # Configuração (data/configuracao.json)
+            # -----------------------------
+            try:
+                cfg_file = DATA_DIR / "configuracao.json"
+                if cfg_file.exists():
+                    with open(cfg_file, "r", encoding="utf-8") as f:
+                        cfg = json.load(f) or {}
+                    cfg_id = "default"
+                    existing = db.get(ConfigDB, cfg_id)
+                    if existing:
+                        existing.data = cfg
+                    else:
+                        db.add(ConfigDB(id=cfg_id, data=cfg))
+                    import_count += 1
+            except Exception as e:
+                print(f"⚠️ Falha ao importar configuracao.json: {e}")
 
-        # Importar propostas da pasta 'propostas' (usando função refatorada)
-        for file in PROPOSTAS_DIR.glob('*.json'):
+            # -----------------------------
+            # Clientes (data/clientes.json)
+            # -----------------------------
             try:
-                with open(file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                prop_id = file.stem
-                # Pular se já existe
-                if db.get(PropostaDB, prop_id):
-                    continue
-                # Usar função factory refatorada
-                row = _create_proposta_row(data, prop_id)
-                db.add(row)
-                import_count += 1
+                clientes_file = DATA_DIR / "clientes.json"
+                if clientes_file.exists():
+                    with open(clientes_file, "r", encoding="utf-8") as f:
+                        clientes = json.load(f) or {}
+                    if isinstance(clientes, dict):
+                        for cid, c in clientes.items():
+                            if not isinstance(c, dict):
+                                continue
+                            cid_v = (c.get("id") or cid or "").strip()
+                            if not cid_v:
+                                continue
+                            try:
+                                existing = db.get(ClienteDB, cid_v)
+                                if existing:
+                                    existing.nome = c.get("nome")
+                                    existing.telefone = c.get("telefone")
+                                    existing.email = c.get("email")
+                                    existing.created_by = c.get("created_by")
+                                    existing.created_by_email = c.get("created_by_email")
+                                    existing.endereco_completo = c.get("endereco_completo")
+                                    existing.cep = c.get("cep")
+                                    existing.tipo = c.get("tipo")
+                                    existing.observacoes = c.get("observacoes")
+                                else:
+                                    db.add(ClienteDB(
+                                        id=cid_v,
+                                        nome=c.get("nome"),
+                                        telefone=c.get("telefone"),
+                                        email=c.get("email"),
+                                        created_by=c.get("created_by"),
+                                        created_by_email=c.get("created_by_email"),
+                                        endereco_completo=c.get("endereco_completo"),
+                                        cep=c.get("cep"),
+                                        tipo=c.get("tipo"),
+                                        observacoes=c.get("observacoes"),
+                                    ))
+                                import_count += 1
+                            except Exception as e:
+                                print(f"⚠️ Falha ao importar cliente {cid_v}: {e}")
             except Exception as e:
-                print(f"⚠️ Falha ao importar {file.name}: {e}")
+                print(f"⚠️ Falha ao importar clientes.json: {e}")
 
-        # Importar propostas do arquivo data/propostas.json (legado)
-        try:
-            propostas_file = DATA_DIR / "propostas.json"
-            if propostas_file.exists():
-                with open(propostas_file, "r", encoding="utf-8") as f:
-                    propostas = json.load(f) or {}
-                if isinstance(propostas, dict):
-                    for pid, pdata in propostas.items():
-                        if not isinstance(pdata, dict):
-                            continue
-                        prop_id = (pdata.get("id") or pid or "").strip()
-                        if not prop_id:
-                            continue
-                        if db.get(PropostaDB, prop_id):
-                            continue
-                        try:
-                            # Usar função factory refatorada
-                            row = _create_proposta_row(pdata, prop_id)
-                            db.add(row)
-                            import_count += 1
-                        except Exception as e:
-                            print(f"⚠️ Falha ao importar proposta do arquivo data/propostas.json ({prop_id}): {e}")
-        except Exception as e:
-            print(f"⚠️ Falha ao importar data/propostas.json: {e}")
+            # Importar propostas da pasta 'propostas' (usando função refatorada)
+            for file in PROPOSTAS_DIR.glob('*.json'):
+                try:
+                    with open(file, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    prop_id = file.stem
+                    # Pular se já existe
+                    if db.get(PropostaDB, prop_id):
+                        continue
+                    # Usar função factory refatorada
+                    row = _create_proposta_row(data, prop_id)
+                    db.add(row)
+                    import_count += 1
+                except Exception as e:
+                    print(f"⚠️ Falha ao importar {file.name}: {e}")
 
-        db.commit()
-        db.close()
+            # Importar propostas do arquivo data/propostas.json (legado)
+            try:
+                propostas_file = DATA_DIR / "propostas.json"
+                if propostas_file.exists():
+                    with open(propostas_file, "r", encoding="utf-8") as f:
+                        propostas = json.load(f) or {}
+                    if isinstance(propostas, dict):
+                        for pid, pdata in propostas.items():
+                            if not isinstance(pdata, dict):
+                                continue
+                            prop_id = (pdata.get("id") or pid or "").strip()
+                            if not prop_id:
+                                continue
+                            if db.get(PropostaDB, prop_id):
+                                continue
+                            try:
+                                # Usar função factory refatorada
+                                row = _create_proposta_row(pdata, prop_id)
+                                db.add(row)
+                                import_count += 1
+                            except Exception as e:
+                                print(f"⚠️ Falha ao importar proposta do arquivo data/propostas.json ({prop_id}): {e}")
+            except Exception as e:
+                print(f"⚠️ Falha ao importar data/propostas.json: {e}")
+
+            db.commit()
+        _invalidar_cache_usuarios()
         return jsonify({'success': True, 'imported': import_count})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -5276,14 +5785,13 @@ def db_wipe_clientes_projetos():
         if not USE_DB:
             return jsonify({'success': False, 'error': 'USE_DB=false (não é Postgres).'}), 400
 
-        db = SessionLocal()
-        # TRUNCATE é mais rápido e limpa FKs (enderecos dependem de clientes).
-        # RESTART IDENTITY mantém consistência caso existam IDs incrementais (enderecos).
-        db.execute(text("TRUNCATE TABLE enderecos RESTART IDENTITY CASCADE;"))
-        db.execute(text("TRUNCATE TABLE clientes RESTART IDENTITY CASCADE;"))
-        db.execute(text("TRUNCATE TABLE propostas RESTART IDENTITY CASCADE;"))
-        db.commit()
-        db.close()
+        with _sessao() as db:
+            # TRUNCATE é mais rápido e limpa FKs (enderecos dependem de clientes).
+            # RESTART IDENTITY mantém consistência caso existam IDs incrementais (enderecos).
+            db.execute(text("TRUNCATE TABLE enderecos RESTART IDENTITY CASCADE;"))
+            db.execute(text("TRUNCATE TABLE clientes RESTART IDENTITY CASCADE;"))
+            db.execute(text("TRUNCATE TABLE propostas RESTART IDENTITY CASCADE;"))
+            db.commit()
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -5428,17 +5936,16 @@ def get_user_role():
             # Preferir DB quando disponível
             if USE_DB:
                 try:
-                    db = SessionLocal()
-                    existing = db.get(RoleDB, email)
-                    if existing:
-                        existing.role = "admin"
-                        existing.cargo = existing.cargo or "Administrador"
-                    else:
-                        db.add(RoleDB(email=email, role="admin", cargo="Administrador"))
-                    db.commit()
-                    # recarregar para retornar nome/cargo
-                    r = db.get(RoleDB, email)
-                    db.close()
+                    with _sessao() as db:
+                        existing = db.get(RoleDB, email)
+                        if existing:
+                            existing.role = "admin"
+                            existing.cargo = existing.cargo or "Administrador"
+                        else:
+                            db.add(RoleDB(email=email, role="admin", cargo="Administrador"))
+                        db.commit()
+                        # recarregar para retornar nome/cargo
+                        r = db.get(RoleDB, email)
                     return jsonify({'role': 'admin', 'nome': getattr(r, "nome", None), 'cargo': getattr(r, "cargo", "Administrador")})
                 except Exception as _db_err:
                     print(f"⚠️ Falha ao upsert admin no DB: {_db_err}")
@@ -5460,9 +5967,8 @@ def get_user_role():
         # Preferir DB (Postgres) em produção
         if USE_DB and email:
             try:
-                db = SessionLocal()
-                r = db.get(RoleDB, email)
-                db.close()
+                with _sessao() as db:
+                    r = db.get(RoleDB, email)
                 if r:
                     return jsonify({'role': r.role or 'vendedor', 'nome': r.nome, 'cargo': r.cargo})
             except Exception as _db_err:
@@ -5494,9 +6000,8 @@ def list_roles():
         if not _require_admin_access():
             return jsonify({'success': False, 'message': 'Não autorizado'}), 403
         if USE_DB:
-            db = SessionLocal()
-            rows = db.query(RoleDB).all()
-            db.close()
+            with _sessao() as db:
+                rows = db.query(RoleDB).all()
             items = [{'email': r.email, 'role': r.role, 'nome': r.nome, 'cargo': r.cargo} for r in rows]
             # Garantir que ADMIN_EMAILS apareça na lista, mesmo que não exista registro ainda
             admin_emails = _parse_env_emails("ADMIN_EMAILS")
@@ -5534,16 +6039,15 @@ def upsert_role():
         if not email or role not in ('admin', 'gestor', 'vendedor', 'instalador'):
             return jsonify({'success': False, 'message': 'Parâmetros inválidos'}), 400
         if USE_DB:
-            db = SessionLocal()
-            existing = db.get(RoleDB, email)
-            if existing:
-                existing.role = role
-                existing.nome = nome
-                existing.cargo = cargo
-            else:
-                db.add(RoleDB(email=email, role=role, nome=nome, cargo=cargo))
-            db.commit()
-            db.close()
+            with _sessao() as db:
+                existing = db.get(RoleDB, email)
+                if existing:
+                    existing.role = role
+                    existing.nome = nome
+                    existing.cargo = cargo
+                else:
+                    db.add(RoleDB(email=email, role=role, nome=nome, cargo=cargo))
+                db.commit()
             return jsonify({'success': True, 'source': 'db'})
 
         mapping = _load_roles()
@@ -5581,12 +6085,11 @@ def delete_role():
         if not email:
             return jsonify({'success': False, 'message': 'Email obrigatório'}), 400
         if USE_DB:
-            db = SessionLocal()
-            row = db.get(RoleDB, email)
-            if row:
-                db.delete(row)
-                db.commit()
-            db.close()
+            with _sessao() as db:
+                row = db.get(RoleDB, email)
+                if row:
+                    db.delete(row)
+                    db.commit()
             return jsonify({'success': True, 'source': 'db'})
 
         mapping = _load_roles()
@@ -5618,12 +6121,11 @@ def deletar_projeto(projeto_id):
             print(f"🗑️ Removido PDF da proposta: {pdf_path.name}")
         # Remover do banco (best-effort)
         try:
-            db = SessionLocal()
-            row = db.get(PropostaDB, projeto_id)
-            if row:
-                db.delete(row)
-                db.commit()
-            db.close()
+            with _sessao() as db:
+                row = db.get(PropostaDB, projeto_id)
+                if row:
+                    db.delete(row)
+                    db.commit()
         except Exception as e:
             print(f"⚠️ Falha ao remover do banco: {e}")
         return jsonify({'success': True})
@@ -5652,14 +6154,17 @@ def atualizar_status_projeto():
         # DB (persistente) — atualiza status dentro do payload
         if USE_DB:
             try:
-                db = SessionLocal()
-                row = db.get(PropostaDB, prop_id)
-                if row:
-                    payload = row.payload or {}
-                    payload['status'] = new_status
-                    row.payload = payload
-                    db.commit()
-                db.close()
+                with _sessao() as db:
+                    row = get_proposta(db, prop_id, payload=True)
+                    if row:
+                        # Cópia: o mesmo dict mutado e reatribuído não conta como alteração no ORM
+                        payload = dict(row.payload or {})
+                        payload['status'] = new_status
+                        row.payload = payload
+                        row.status = new_status
+                        db.commit()
+                        # Status não entra na impressão digital: normalmente o aquecimento não tem o que fazer
+                        _agendar_aquecimento_pdf(prop_id)
             except Exception as _e:
                 print(f"⚠️ Falha ao atualizar status no DB: {_e}")
 
@@ -5710,17 +6215,16 @@ def listar_clientes():
             if not me:
                 return jsonify({"success": False, "message": "Não autenticado"}), 401
         if USE_DB:
-            db = SessionLocal()
-            q = db.query(ClienteDB)
-            role = (me.role or "").strip().lower() if me else ""
-            if role not in ("admin", "gestor"):
-                # Vendedor/instalador: só seus clientes
-                q = q.filter(
-                    (ClienteDB.created_by_email == me.email) |
-                    (ClienteDB.created_by == me.uid)
-                )
-            rows = q.order_by(ClienteDB.created_at.desc()).all()
-            db.close()
+            with _sessao() as db:
+                q = db.query(ClienteDB)
+                role = (me.role or "").strip().lower() if me else ""
+                if role not in ("admin", "gestor"):
+                    # Vendedor/instalador: só seus clientes
+                    q = q.filter(
+                        (ClienteDB.created_by_email == me.email) |
+                        (ClienteDB.created_by == me.uid)
+                    )
+                rows = q.order_by(ClienteDB.created_at.desc()).all()
             clientes = []
             for r in rows:
                 clientes.append({
@@ -5767,9 +6271,8 @@ def criar_cliente():
         # Admin override
         if USE_DB and me and getattr(me, 'role', '') == 'admin' and data.get("created_by"):
             try:
-                db_t = SessionLocal()
-                tu = db_t.get(UserDB, data.get("created_by"))
-                db_t.close()
+                with _sessao() as db_t:
+                    tu = db_t.get(UserDB, data.get("created_by"))
                 if tu:
                     owner_uid = tu.uid
                     owner_email = tu.email
@@ -5794,22 +6297,23 @@ def criar_cliente():
         }
 
         if USE_DB:
-            db = SessionLocal()
-            db.add(ClienteDB(
-                id=cliente_id,
-                nome=cliente.get("nome"),
-                telefone=cliente.get("telefone"),
-                email=cliente.get("email"),
-                created_by=cliente.get("created_by"),
-                created_by_email=cliente.get("created_by_email"),
-                endereco_completo=cliente.get("endereco_completo"),
-                cep=cliente.get("cep"),
-                numero=cliente.get("numero"),
-                tipo=cliente.get("tipo"),
-                observacoes=cliente.get("observacoes"),
-            ))
-            db.commit()
-            db.close()
+            with _sessao() as db:
+                db.add(ClienteDB(
+                    id=cliente_id,
+                    nome=cliente.get("nome"),
+                    telefone=cliente.get("telefone"),
+                    email=cliente.get("email"),
+                    created_by=cliente.get("created_by"),
+                    created_by_email=cliente.get("created_by_email"),
+                    endereco_completo=cliente.get("endereco_completo"),
+                    cep=cliente.get("cep"),
+                    numero=cliente.get("numero"),
+                    tipo=cliente.get("tipo"),
+                    observacoes=cliente.get("observacoes"),
+                ))
+                # Propostas legadas com o mesmo telefone/nome passam a ser visíveis ao dono
+                visibilidade.atualizar_cliente(db, cliente_id)
+                db.commit()
         else:
             clientes = _load_clientes()
             clientes[cliente_id] = cliente
@@ -5829,42 +6333,42 @@ def atualizar_cliente(cliente_id):
             me = _current_user_row()
             if not me:
                 return jsonify({"success": False, "message": "Não autenticado"}), 401
-            db = SessionLocal()
-            row = db.get(ClienteDB, cliente_id)
-            if not row:
-                db.close()
-                return jsonify({"success": False, "message": "Cliente não encontrado"}), 404
-            # ACL: só admin/gestor ou dono do cliente
-            role = (me.role or "").strip().lower()
-            is_owner = (row.created_by_email == me.email) or (row.created_by == me.uid)
-            if role not in ("admin", "gestor") and not is_owner:
-                db.close()
-                return jsonify({"success": False, "message": "Não autorizado"}), 403
-            row.nome = data.get("nome", row.nome)
-            row.telefone = data.get("telefone", row.telefone)
-            row.email = data.get("email", row.email)
-            row.endereco_completo = data.get("endereco_completo", row.endereco_completo)
-            row.cep = data.get("cep", row.cep)
-            row.numero = data.get("numero", row.numero)
-            row.tipo = data.get("tipo", row.tipo)
-            row.observacoes = data.get("observacoes", row.observacoes)
-            db.commit()
-            cliente = {
-                "id": row.id,
-                "nome": row.nome,
-                "telefone": row.telefone,
-                "email": row.email,
-                "endereco_completo": row.endereco_completo,
-                "cep": row.cep,
-                "numero": row.numero,
-                "tipo": row.tipo,
-                "observacoes": row.observacoes,
-                "created_by": row.created_by,
-                "created_by_email": row.created_by_email,
-                "created_at": (row.created_at.isoformat() if row.created_at else None),
-                "updated_at": (row.updated_at.isoformat() if row.updated_at else None),
-            }
-            db.close()
+            with _sessao() as db:
+                row = db.get(ClienteDB, cliente_id)
+                if not row:
+                    return jsonify({"success": False, "message": "Cliente não encontrado"}), 404
+                # ACL: só admin/gestor ou dono do cliente
+                role = (me.role or "").strip().lower()
+                is_owner = (row.created_by_email == me.email) or (row.created_by == me.uid)
+                if role not in ("admin", "gestor") and not is_owner:
+                    return jsonify({"success": False, "message": "Não autorizado"}), 403
+                antes = {"telefone": row.telefone, "nome": row.nome}
+                row.nome = data.get("nome", row.nome)
+                row.telefone = data.get("telefone", row.telefone)
+                row.email = data.get("email", row.email)
+                row.endereco_completo = data.get("endereco_completo", row.endereco_completo)
+                row.cep = data.get("cep", row.cep)
+                row.numero = data.get("numero", row.numero)
+                row.tipo = data.get("tipo", row.tipo)
+                row.observacoes = data.get("observacoes", row.observacoes)
+                if antes != {"telefone": row.telefone, "nome": row.nome}:
+                    visibilidade.atualizar_cliente(db, cliente_id, antes)
+                db.commit()
+                cliente = {
+                    "id": row.id,
+                    "nome": row.nome,
+                    "telefone": row.telefone,
+                    "email": row.email,
+                    "endereco_completo": row.endereco_completo,
+                    "cep": row.cep,
+                    "numero": row.numero,
+                    "tipo": row.tipo,
+                    "observacoes": row.observacoes,
+                    "created_by": row.created_by,
+                    "created_by_email": row.created_by_email,
+                    "created_at": (row.created_at.isoformat() if row.created_at else None),
+                    "updated_at": (row.updated_at.isoformat() if row.updated_at else None),
+                }
             return jsonify({"success": True, "cliente": cliente})
 
         clientes = _load_clientes()
@@ -5898,24 +6402,28 @@ def deletar_cliente(cliente_id):
             me = _current_user_row()
             if not me:
                 return jsonify({"success": False, "message": "Não autenticado"}), 401
-            db = SessionLocal()
-            row = db.get(ClienteDB, cliente_id)
-            if not row:
-                db.close()
-                return jsonify({"success": False, "message": "Cliente não encontrado"}), 404
-            role = (me.role or "").strip().lower()
-            is_owner = (row.created_by_email == me.email) or (row.created_by == me.uid)
-            if role not in ("admin", "gestor") and not is_owner:
-                db.close()
-                return jsonify({"success": False, "message": "Não autorizado"}), 403
-            # (best-effort) apagar propostas vinculadas no DB
-            try:
-                db.query(PropostaDB).filter(PropostaDB.cliente_id == cliente_id).delete(synchronize_session=False)
-            except Exception as _e:
-                print(f"⚠️ Falha ao remover propostas do DB (cliente_id={cliente_id}): {_e}")
-            db.delete(row)
-            db.commit()
-            db.close()
+            with _sessao() as db:
+                row = db.get(ClienteDB, cliente_id)
+                if not row:
+                    return jsonify({"success": False, "message": "Cliente não encontrado"}), 404
+                role = (me.role or "").strip().lower()
+                is_owner = (row.created_by_email == me.email) or (row.created_by == me.uid)
+                if role not in ("admin", "gestor") and not is_owner:
+                    return jsonify({"success": False, "message": "Não autorizado"}), 403
+                # Propostas que o dono via por este cliente (telefone/nome): recalcular depois
+                try:
+                    afetadas = visibilidade.propostas_do_cliente(db, cliente_id, row.telefone, row.nome)
+                except Exception:
+                    db.rollback()
+                    afetadas = []
+                # (best-effort) apagar propostas vinculadas no DB
+                try:
+                    db.query(PropostaDB).filter(PropostaDB.cliente_id == cliente_id).delete(synchronize_session=False)
+                except Exception as _e:
+                    print(f"⚠️ Falha ao remover propostas do DB (cliente_id={cliente_id}): {_e}")
+                db.delete(row)
+                visibilidade.atualizar_propostas(db, afetadas)
+                db.commit()
             return jsonify({"success": True, "propostas_excluidas": None})
 
         clientes = _load_clientes()
@@ -5953,12 +6461,11 @@ def deletar_cliente(cliente_id):
                     propostas_excluidas += 1
                     # Remover do banco também
                     try:
-                        db = SessionLocal()
-                        row = db.get(PropostaDB, file.stem)
-                        if row:
-                            db.delete(row)
-                            db.commit()
-                        db.close()
+                        with _sessao() as db:
+                            row = db.get(PropostaDB, file.stem)
+                            if row:
+                                db.delete(row)
+                                db.commit()
                     except Exception:
                         pass
             except Exception as e:
@@ -6000,142 +6507,116 @@ def transferir_cliente(cliente_id):
         # Se apenas uid foi fornecido, buscar o email correspondente
         if new_owner_uid and not new_owner_email and USE_DB:
             try:
-                db_temp = SessionLocal()
-                new_user = db_temp.query(UserDB).filter(UserDB.uid == new_owner_uid).first()
-                if new_user and new_user.email:
-                    new_owner_email = new_user.email
-                db_temp.close()
+                with _sessao() as db_temp:
+                    new_user = db_temp.query(UserDB).filter(UserDB.uid == new_owner_uid).first()
+                    if new_user and new_user.email:
+                        new_owner_email = new_user.email
             except Exception as _e:
                 print(f"⚠️ [transferir_cliente] Não foi possível buscar email do novo owner: {_e}")
         
         if USE_DB:
-            db = SessionLocal()
-            # Buscar cliente
-            row = db.get(ClienteDB, cliente_id)
-            if not row:
-                db.close()
-                return jsonify({"success": False, "message": "Cliente não encontrado"}), 404
+            with _sessao() as db:
+                # Buscar cliente
+                row = db.get(ClienteDB, cliente_id)
+                if not row:
+                    return jsonify({"success": False, "message": "Cliente não encontrado"}), 404
             
-            # Atualizar proprietário
-            old_owner = row.created_by_email or row.created_by
-            nome_cliente = row.nome
-            telefone_cliente = row.telefone
-            row.created_by = new_owner_uid or row.created_by
-            row.created_by_email = new_owner_email or row.created_by_email
-            row.updated_at = now_brasilia()
-            new_owner = new_owner_email or new_owner_uid
-
-            # Transferir também TODAS as propostas vinculadas a este cliente
-            propostas_transferidas = 0
-            try:
-                def _norm_phone(s):
-                    try:
-                        return re.sub(r"\D+", "", str(s or ""))
-                    except Exception:
-                        return ""
-
-                nome_norm = (nome_cliente or "").strip().lower()
-                tel_norm = _norm_phone(telefone_cliente)
-
-                # Importante:
-                # - Muitas propostas antigas no Postgres não tinham cliente_id.
-                # - No frontend, se a proposta tem cliente_id, o match é estrito por ID.
-                # Portanto, ao transferir, também vinculamos cliente_id nas propostas legadas.
-                # Candidatos:
-                # - match por cliente_id (ideal)
-                # - match por telefone normalizado (mais confiável em dados legados)
-                # - match por nome (fallback)
-                # - match via payload JSON (legado)
-                conds = [PropostaDB.cliente_id == cliente_id]
-                if tel_norm and len(tel_norm) > 8:
-                    conds.append(
-                        func.regexp_replace(
-                            func.coalesce(PropostaDB.cliente_telefone, ""),
-                            r"\D",
-                            "",
-                            "g",
-                        ) == tel_norm
-                    )
-                if nome_norm:
-                    conds.append(func.lower(func.coalesce(PropostaDB.cliente_nome, "")) == nome_norm)
-                # Legado: alguns registros têm dados só no payload
-                conds.append(PropostaDB.payload.op("->>")("cliente_id") == cliente_id)
-                if tel_norm and len(tel_norm) > 8:
-                    conds.append(
-                        func.regexp_replace(
-                            func.coalesce(PropostaDB.payload.op("->>")("cliente_telefone"), ""),
-                            r"\D",
-                            "",
-                            "g",
-                        ) == tel_norm
-                    )
-                if nome_norm:
-                    conds.append(func.lower(func.coalesce(PropostaDB.payload.op("->>")("cliente_nome"), "")) == nome_norm)
-
-                q = db.query(PropostaDB).filter(or_(*conds))
-                cand = q.all()
-
-                updated_ids = set()
-                for p in cand:
-                    # confirmação extra por telefone quando cliente_id não bate
-                    if p.cliente_id != cliente_id:
-                        # se temos telefone, exigir match de telefone quando possível
-                        if tel_norm and len(tel_norm) > 8:
-                            p_tel = _norm_phone(p.cliente_telefone)
-                            if not p_tel:
-                                # fallback: tentar pelo payload
-                                try:
-                                    p_tel = _norm_phone((p.payload or {}).get("cliente_telefone"))
-                                except Exception:
-                                    p_tel = ""
-                            if p_tel and p_tel != tel_norm:
-                                continue
-                        else:
-                            # sem telefone, exigir match estrito por nome
-                            p_nome = (p.cliente_nome or "").strip().lower()
-                            if not p_nome:
-                                try:
-                                    p_nome = ((p.payload or {}).get("cliente_nome") or "").strip().lower()
-                                except Exception:
-                                    p_nome = ""
-                            if not nome_norm or p_nome != nome_norm:
-                                continue
-
-                    changed = False
-                    if new_owner_uid and p.created_by != new_owner_uid:
-                        p.created_by = new_owner_uid
-                        changed = True
-                    if new_owner_email and p.created_by_email != new_owner_email:
-                        p.created_by_email = new_owner_email
-                        changed = True
-
-                    # Vincular cliente_id se estiver vazio/diferente (para o contador no frontend)
-                    if p.cliente_id != cliente_id:
-                        p.cliente_id = cliente_id
-                        changed = True
-
-                    payload = p.payload or {}
-                    if isinstance(payload, dict):
-                        if new_owner_uid and payload.get("created_by") != new_owner_uid:
-                            payload["created_by"] = new_owner_uid
-                            changed = True
-                        if new_owner_email and payload.get("created_by_email") != new_owner_email:
-                            payload["created_by_email"] = new_owner_email
+                # Atualizar proprietário
+                old_owner = row.created_by_email or row.created_by
+                nome_cliente = row.nome
+                telefone_cliente = row.telefone
+                row.created_by = new_owner_uid or row.created_by
+                row.created_by_email = new_owner_email or row.created_by_email
+                row.updated_at = now_brasilia()
+                new_owner = new_owner_email or new_owner_uid
+
+                # Transferir também TODAS as propostas vinculadas a este cliente
+                propostas_transferidas = 0
+                try:
+                    def _norm_phone(s):
+                        try:
+                            return re.sub(r"\D+", "", str(s or ""))
+                        except Exception:
+                            return ""
+
+                    nome_norm = (nome_cliente or "").strip().lower()
+                    tel_norm = _norm_phone(telefone_cliente)
+
+                    # Importante:
+                    # - Muitas propostas antigas no Postgres não tinham cliente_id.
+                    # - No frontend, se a proposta tem cliente_id, o match é estrito por ID.
+                    # Portanto, ao transferir, também vinculamos cliente_id nas propostas legadas.
+                    # Candidatos:
+                    # - match por cliente_id (ideal)
+                    # - match por telefone normalizado (mais confiável em dados legados)
+                    # - match por nome (fallback)
+                    # - match via payload JSON (legado)
+                    # Colunas normalizadas cobrem também o legado com dados só no payload
+                    q = db.query(PropostaDB).options(*CARREGAR_PAYLOAD).filter(
+                        _filtro_propostas_do_cliente(cliente_id, tel_norm, nome_norm))
+                    cand = q.all()
+
+                    updated_ids = set()
+                    for p in cand:
+                        # confirmação extra por telefone quando cliente_id não bate
+                        if p.cliente_id != cliente_id:
+                            # se temos telefone, exigir match de telefone quando possível
+                            if tel_norm and len(tel_norm) > 8:
+                                p_tel = _norm_phone(p.cliente_telefone)
+                                if not p_tel:
+                                    # fallback: tentar pelo payload
+                                    try:
+                                        p_tel = _norm_phone((p.payload or {}).get("cliente_telefone"))
+                                    except Exception:
+                                        p_tel = ""
+                                if p_tel and p_tel != tel_norm:
+                                    continue
+                            else:
+                                # sem telefone, exigir match estrito por nome
+                                p_nome = (p.cliente_nome or "").strip().lower()
+                                if not p_nome:
+                                    try:
+                                        p_nome = ((p.payload or {}).get("cliente_nome") or "").strip().lower()
+                                    except Exception:
+                                        p_nome = ""
+                                if not nome_norm or p_nome != nome_norm:
+                                    continue
+
+                        changed = False
+                        if new_owner_uid and p.created_by != new_owner_uid:
+                            p.created_by = new_owner_uid
                             changed = True
-                        if payload.get("cliente_id") != cliente_id:
-                            payload["cliente_id"] = cliente_id
+                        if new_owner_email and p.created_by_email != new_owner_email:
+                            p.created_by_email = new_owner_email
                             changed = True
-                        p.payload = payload
 
-                    if changed:
-                        updated_ids.add(p.id)
+                        # Vincular cliente_id se estiver vazio/diferente (para o contador no frontend)
+                        if p.cliente_id != cliente_id:
+                            p.cliente_id = cliente_id
+                            changed = True
 
-                propostas_transferidas = len(updated_ids)
-            except Exception as _e:
-                print(f"⚠️ [transferir_cliente] Falha ao transferir propostas do cliente {cliente_id}: {_e}")
+                        payload = p.payload or {}
+                        if isinstance(payload, dict):
+                            if new_owner_uid and payload.get("created_by") != new_owner_uid:
+                                payload["created_by"] = new_owner_uid
+                                changed = True
+                            if new_owner_email and payload.get("created_by_email") != new_owner_email:
+                                payload["created_by_email"] = new_owner_email
+                                changed = True
+                            if payload.get("cliente_id") != cliente_id:
+                                payload["cliente_id"] = cliente_id
+                                changed = True
+                            p.payload = payload
+
+                        if changed:
+                            updated_ids.add(p.id)
+
+                    propostas_transferidas = len(updated_ids)
+                except Exception as _e:
+                    print(f"⚠️ [transferir_cliente] Falha ao transferir propostas do cliente {cliente_id}: {_e}")
             
-            db.commit()
-            db.close()
+                visibilidade.atualizar_cliente(db, cliente_id)
+                db.commit()
             
             # IMPORTANTE: não acessar atributos do ORM após fechar a sessão (evita DetachedInstanceError)
             print(f"✅ Cliente '{nome_cliente}' transferido de '{old_owner}' para '{new_owner}'. Propostas transferidas: {propostas_transferidas}")
@@ -6230,8 +6711,7 @@ def backfill_propostas_cliente(cliente_id):
                 return ""
 
         if USE_DB:
-            db = SessionLocal()
-            try:
+            with _sessao() as db:
                 c = db.get(ClienteDB, cliente_id)
                 if not c:
                     return jsonify({"success": False, "message": "Cliente não encontrado"}), 404
@@ -6239,33 +6719,8 @@ def backfill_propostas_cliente(cliente_id):
                 nome_norm = (c.nome or "").strip().lower()
                 tel_norm = _norm_phone(c.telefone)
 
-                conds = [PropostaDB.cliente_id == cliente_id]
-                if tel_norm and len(tel_norm) > 8:
-                    conds.append(
-                        func.regexp_replace(
-                            func.coalesce(PropostaDB.cliente_telefone, ""),
-                            r"\D",
-                            "",
-                            "g",
-                        ) == tel_norm
-                    )
-                if nome_norm:
-                    conds.append(func.lower(func.coalesce(PropostaDB.cliente_nome, "")) == nome_norm)
-                # Legado via payload JSON
-                conds.append(PropostaDB.payload.op("->>")("cliente_id") == cliente_id)
-                if tel_norm and len(tel_norm) > 8:
-                    conds.append(
-                        func.regexp_replace(
-                            func.coalesce(PropostaDB.payload.op("->>")("cliente_telefone"), ""),
-                            r"\D",
-                            "",
-                            "g",
-                        ) == tel_norm
-                    )
-                if nome_norm:
-                    conds.append(func.lower(func.coalesce(PropostaDB.payload.op("->>")("cliente_nome"), "")) == nome_norm)
-
-                cand = db.query(PropostaDB).filter(or_(*conds)).all()
+                cand = db.query(PropostaDB).options(*CARREGAR_PAYLOAD).filter(
+                    _filtro_propostas_do_cliente(cliente_id, tel_norm, nome_norm)).all()
                 updated = []
                 for p in cand:
                     changed = False
@@ -6280,6 +6735,7 @@ def backfill_propostas_cliente(cliente_id):
                     if changed:
                         updated.append(p.id)
 
+                visibilidade.atualizar_cliente(db, cliente_id)
                 db.commit()
                 return jsonify({
                     "success": True,
@@ -6288,9 +6744,6 @@ def backfill_propostas_cliente(cliente_id):
                     "propostas_ids": updated[:50],
                     "source": "db",
                 })
-            finally:
-                db.close()
-
         # modo arquivo
         clientes = _load_clientes()
         cliente = clientes.get(cliente_id)
@@ -6477,95 +6930,212 @@ def buscar_cep_proxy(cep):
         print(f"⚠️ Erro ao buscar CEP {cep}: {e}")
         return jsonify({"erro": True, "message": str(e)}), 500
 
+# -----------------------------------------------------------------------------
+# Listagem de projetos: projeção de colunas + paginação por cursor (keyset)
+# -----------------------------------------------------------------------------
+LISTAGEM_LIMIT_PADRAO = 50
+LISTAGEM_LIMIT_MAX = 200
+# Resposta antiga (sem limit/cursor, lista sem envelope): limitada a este número de itens;
+# se houver mais, o cabeçalho X-Next-Cursor traz o cursor para continuar paginado
+LISTAGEM_LEGADO_MAX = max(1, int(os.environ.get("LISTAGEM_LEGADO_MAX", "1000")))
+
+# Colunas da tabela usadas no resumo (nunca payload/pdf_cache): os campos que só
+# existem no payload vêm de propostas.resumo (db.RESUMO_CHAVES), mantido ao gravar
+_LISTAGEM_COLUNAS = (
+    "id", "created_at", "created_by", "created_by_email", "cliente_id", "cliente_nome",
+    "cliente_telefone", "cliente_endereco", "cidade", "preco_final", "custo_total_projeto",
+    "potencia_sistema", "economia_mensal_estimada", "anos_payback", "payback_meses",
+    "consumo_mensal_kwh", "tarifa_energia", "quantidade_placas", "potencia_placa_w",
+    "geracao_media_mensal", "area_necessaria", "irradiacao_media", "economia_total_25_anos",
+    "conta_atual_anual", "gasto_acumulado_payback", "modulo_marca", "modulo_modelo",
+    "inversor_marca", "inversor_modelo", "owner_cliente_id", "resumo",
+    # Valem enquanto a migração não preencheu o resumo de uma linha antiga
+    "nome_projeto", "status", "estado", "tipo_telhado", "concessionaria", "vendedor_email", "preco_venda",
+)
+# Resumo ainda não preenchido (db.preencher_colunas_derivadas): mesmas chaves tiradas das colunas
+_LISTAGEM_RESUMO_COLUNAS = (
+    "nome_projeto", "status", "estado", "tipo_telhado", "concessionaria", "vendedor_email", "preco_venda",
+    "created_by_email",
+)
+
+
+def _listagem_query(db):
+    return resumo_propostas_query(db, colunas=_LISTAGEM_COLUNAS)
+
+
+def _listagem_payload(r) -> dict:
+    """Campos do payload da linha: o resumo gravado ou, numa linha antiga, as colunas."""
+    if isinstance(r.resumo, dict):
+        return r.resumo
+    return {k: getattr(r, k, None) for k in _LISTAGEM_RESUMO_COLUNAS}
+
+
+def _encode_cursor(created_at: str, proposta_id: str) -> str:
+    raw = json.dumps([created_at, proposta_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    """(created_at ISO, id) do último item da página anterior."""
+    try:
+        created_at, proposta_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return str(created_at), str(proposta_id)
+    except Exception:
+        raise ValueError("cursor inválido")
+
+
+def _filtros_listagem(args) -> dict:
+    """
+    Parâmetros de /projetos/list (os filtros que Projetos.jsx/Pipeline.jsx faziam no cliente):
+    q (nome do projeto/cidade/cliente), status (lista separada por vírgula), cliente_id,
+    vendedor (e-mail ou prefixo), ordem (desc|asc por data de criação), limit e cursor.
+    Só há ordenação por data de criação: é a única que Projetos.jsx e Pipeline.jsx usam.
+    """
+    ordem = (args.get("ordem") or "desc").strip().lower()
+    if ordem not in ("asc", "desc"):
+        raise ValueError("ordem deve ser 'asc' ou 'desc'")
+    limit = LISTAGEM_LIMIT_PADRAO
+    if args.get("limit"):
+        try:
+            limit = int(args.get("limit"))
+        except ValueError:
+            raise ValueError("limit inválido")
+    vendedor = (args.get("vendedor") or "").strip().lower()
+    paginado = "limit" in args or "cursor" in args
+    return {
+        "q": (args.get("q") or "").strip().lower(),
+        "status": [s.strip() for s in (args.get("status") or "").split(",") if s.strip()],
+        "cliente_id": (args.get("cliente_id") or "").strip(),
+        "vendedor": "" if vendedor == "todos" else vendedor,
+        "ordem": ordem,
+        # Sem limit/cursor: resposta antiga (lista sem envelope, até LISTAGEM_LEGADO_MAX itens)
+        "paginado": paginado,
+        "limit": max(1, min(limit, LISTAGEM_LIMIT_MAX)) if paginado else LISTAGEM_LEGADO_MAX,
+        "cursor": _decode_cursor(args.get("cursor")) if args.get("cursor") else None,
+    }
+
+
+def _like_escape(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _vendedor_confere(valor, vendedor: str) -> bool:
+    """Mesmo critério do filtro de usuário do Projetos.jsx: e-mail igual ou mesmo prefixo."""
+    v = str(valor or "").strip().lower()
+    if not v:
+        return False
+    return v == vendedor or v.split("@")[0] == vendedor.split("@")[0]
+
+
+def _aplicar_filtros_listagem(q, f: dict):
+    # Campos do payload pelo resumo gravado na linha (nunca o payload inteiro)
+    resumo = PropostaDB.resumo.op("->>")
+    if f["cliente_id"]:
+        q = q.filter(or_(PropostaDB.cliente_id == f["cliente_id"], PropostaDB.owner_cliente_id == f["cliente_id"]))
+    if f["status"]:
+        q = q.filter(func.coalesce(resumo("status"), PropostaDB.status, "dimensionamento").in_(f["status"]))
+    if f["vendedor"]:
+        prefixo = f["vendedor"].split("@")[0]
+        conds = []
+        for col in (resumo("vendedor_email"), PropostaDB.vendedor_email,
+                    PropostaDB.created_by_email, resumo("created_by_email")):
+            c = func.lower(func.coalesce(col, ""))
+            conds += [c == f["vendedor"], c == prefixo, c.like(_like_escape(prefixo) + "@%", escape="\\")]
+        q = q.filter(or_(*conds))
+    if f["q"]:
+        termo = f"%{_like_escape(f['q'])}%"
+        q = q.filter(or_(
+            func.lower(func.coalesce(resumo("nome_projeto"), PropostaDB.nome_projeto, "")).like(termo, escape="\\"),
+            func.lower(func.coalesce(PropostaDB.cidade, "")).like(termo, escape="\\"),
+            func.lower(func.coalesce(PropostaDB.cliente_nome, "")).like(termo, escape="\\"),
+        ))
+    if f["cursor"]:
+        c_at, c_id = f["cursor"]
+        try:
+            c_at = datetime.fromisoformat(c_at)
+        except ValueError:
+            raise ValueError("cursor inválido")
+        chave = tuple_(PropostaDB.created_at, PropostaDB.id)
+        valor = tuple_(c_at, c_id)
+        q = q.filter(chave < valor if f["ordem"] == "desc" else chave > valor)
+    if f["ordem"] == "desc":
+        return q.order_by(PropostaDB.created_at.desc(), PropostaDB.id.desc())
+    return q.order_by(PropostaDB.created_at.asc(), PropostaDB.id.asc())
+
+
+def _filtrar_lista_arquivos(projetos: list, f: dict) -> list:
+    """Modo arquivo: mesmos filtros/ordem/cursor aplicados em memória."""
+    def confere(p):
+        if f["cliente_id"] and p.get("cliente_id") != f["cliente_id"]:
+            return False
+        if f["status"] and p.get("status") not in f["status"]:
+            return False
+        if f["vendedor"] and not any(_vendedor_confere(p.get(k), f["vendedor"]) for k in ("vendedor_email", "created_by_email")):
+            return False
+        if f["q"] and not any(f["q"] in str(p.get(k) or "").lower() for k in ("nome_projeto", "cidade", "cliente_nome")):
+            return False
+        return True
+
+    chave = lambda p: (p.get("created_date") or "", str(p.get("id")))
+    desc = f["ordem"] == "desc"
+    projetos = sorted((p for p in projetos if confere(p)), key=chave, reverse=desc)
+    if f["cursor"]:
+        projetos = [p for p in projetos if (chave(p) < f["cursor"] if desc else chave(p) > f["cursor"])]
+    return projetos
+
+
+def _resposta_listagem(projetos: list, f: dict, tem_mais: bool):
+    proximo = None
+    if tem_mais and projetos:
+        ultimo = projetos[-1]
+        proximo = _encode_cursor(ultimo.get("created_date") or "", str(ultimo.get("id")))
+    if not f["paginado"]:
+        resp = jsonify(projetos)
+        if proximo:
+            resp.headers["X-Next-Cursor"] = proximo
+        return resp
+    return jsonify({"success": True, "items": projetos, "next_cursor": proximo, "has_more": bool(proximo)})
+
+
 @app.route('/projetos/list', methods=['GET'])
 def listar_projetos():
     """
-    Lista projetos a partir dos arquivos JSON gerados em 'propostas/' para alimentar o dashboard.
-    Retorna uma coleção normalizada de projetos (não depende do Supabase).
+    Lista os projetos para o dashboard (resumo por projeto, sem payload/pdf_cache).
+    Com `limit`/`cursor` responde paginado: {items, next_cursor, has_more}, ordenado por
+    (created_at, id); sem eles mantém a resposta antiga (lista sem envelope), limitada a
+    LISTAGEM_LEGADO_MAX itens (X-Next-Cursor quando há mais). Filtros: ver _filtros_listagem.
     """
     try:
+        try:
+            filtros = _filtros_listagem(request.args)
+        except ValueError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
         if USE_DB:
             me = _current_user_row()
             if not me:
                 return jsonify({"success": False, "message": "Não autenticado"}), 401
-            db = SessionLocal()
-            q = db.query(PropostaDB)
-            role = (me.role or "").strip().lower()
-            if role not in ("admin", "gestor"):
-                # Regra de negócio:
-                # - Se o CLIENTE é do usuário, ele deve conseguir ver as propostas desse cliente.
-                # - Além disso, suportar legado onde created_by/cliente_id existam apenas no payload.
-                # Nota: materializar ids evita casos onde IN(subquery) + JSON ops não casam bem
-                # em alguns planos/tipos no Postgres.
-                owned_rows = db.query(ClienteDB.id, ClienteDB.nome, ClienteDB.telefone).filter(
-                    (ClienteDB.created_by_email == me.email) |
-                    (ClienteDB.created_by == me.uid)
-                ).all()
-                owned_ids = [r[0] for r in (owned_rows or []) if r and r[0]]
-
-                def _norm_phone(s):
-                    try:
-                        return re.sub(r"\D+", "", str(s or ""))
-                    except Exception:
-                        return ""
-
-                def _norm_name(s):
-                    return str(s or "").strip().lower()
-
-                phone_to_client_id = {}
-                name_to_client_id = {}
-                for cid, nome, tel in (owned_rows or []):
-                    n = _norm_name(nome)
-                    if n and len(n) >= 3:
-                        name_to_client_id.setdefault(n, cid)
-                    t = _norm_phone(tel)
-                    if t and len(t) > 8:
-                        phone_to_client_id.setdefault(t, cid)
-
-                q = q.filter(or_(
-                    (PropostaDB.created_by_email == me.email),
-                    (PropostaDB.created_by == me.uid),
-                    (PropostaDB.payload.op("->>")("created_by_email") == me.email),
-                    (PropostaDB.payload.op("->>")("created_by") == me.uid),
-                    (PropostaDB.cliente_id.in_(owned_ids) if owned_ids else text("1=0")),
-                    (PropostaDB.payload.op("->>")("cliente_id").in_(owned_ids) if owned_ids else text("1=0")),
-                    # Legado: incluir propostas do usuário pelo vínculo do cliente via telefone/nome
-                    (
-                        func.regexp_replace(func.coalesce(PropostaDB.cliente_telefone, ""), r"\D", "", "g").in_(list(phone_to_client_id.keys()))
-                        if phone_to_client_id else text("1=0")
-                    ),
-                    (
-                        func.lower(func.coalesce(PropostaDB.cliente_nome, "")).in_(list(name_to_client_id.keys()))
-                        if name_to_client_id else text("1=0")
-                    ),
-                    (
-                        func.regexp_replace(func.coalesce(PropostaDB.payload.op("->>")("cliente_telefone"), ""), r"\D", "", "g").in_(list(phone_to_client_id.keys()))
-                        if phone_to_client_id else text("1=0")
-                    ),
-                    (
-                        func.lower(func.coalesce(PropostaDB.payload.op("->>")("cliente_nome"), "")).in_(list(name_to_client_id.keys()))
-                        if name_to_client_id else text("1=0")
-                    ),
-                ))
-            rows = q.order_by(PropostaDB.created_at.desc()).all()
-            db.close()
+            with _sessao() as db:
+                q = _listagem_query(db)
+                role = (me.role or "").strip().lower()
+                restrito = role not in ("admin", "gestor")
+                if restrito:
+                    # Regra de negócio (criador ou dono do cliente, inclusive legado por
+                    # telefone/nome) materializada em proposta_visibilidade: um join pela PK
+                    q = q.add_columns(PropostaVisibilidadeDB.via_cliente_id).join(
+                        PropostaVisibilidadeDB, PropostaVisibilidadeDB.proposta_id == PropostaDB.id,
+                    ).filter(PropostaVisibilidadeDB.user_email == me.email)
+                q = _aplicar_filtros_listagem(q, filtros)
+                rows = q.limit(filtros["limit"] + 1).all()
+            tem_mais = len(rows) > filtros["limit"]
+            if tem_mais:
+                rows = rows[:filtros["limit"]]
             projetos = []
             for r in rows:
-                data = r.payload or {}
+                data = _listagem_payload(r)
                 # Inferir cliente_id correto para propostas legadas (para o contador na tela de Clientes)
-                inferred_cliente_id = r.cliente_id or (data.get("cliente_id") if isinstance(data, dict) else None)
-                if role not in ("admin", "gestor") and owned_ids:
-                    if inferred_cliente_id not in owned_ids:
-                        try:
-                            p_tel = _norm_phone(r.cliente_telefone) or _norm_phone((data or {}).get("cliente_telefone"))
-                            if p_tel and p_tel in phone_to_client_id:
-                                inferred_cliente_id = phone_to_client_id[p_tel]
-                            else:
-                                p_nome = _norm_name(r.cliente_nome) or _norm_name((data or {}).get("cliente_nome"))
-                                if p_nome and p_nome in name_to_client_id:
-                                    inferred_cliente_id = name_to_client_id[p_nome]
-                        except Exception:
-                            pass
+                inferred_cliente_id = r.cliente_id or r.owner_cliente_id or data.get("cliente_id")
+                if restrito and r.via_cliente_id:
+                    inferred_cliente_id = r.via_cliente_id
                 projetos.append({
                     "id": r.id,
                     "proposta_id": r.id,
@@ -6581,7 +7151,7 @@ def listar_projetos():
                     "cidade": r.cidade,
                     "estado": data.get("estado"),
                     "endereco_completo": r.cliente_endereco or data.get("endereco_completo"),
-                    "status": data.get("status") or "dimensionamento",
+                    "status": data.get("status") or r.status or "dimensionamento",
                     "prioridade": data.get("prioridade") or "Normal",
                     "created_date": (r.created_at.isoformat() if r.created_at else None),
                     "data_criacao": (r.created_at.isoformat() if r.created_at else None),
@@ -6618,7 +7188,7 @@ def listar_projetos():
                     "marca_inversor": r.inversor_marca or data.get("marca_inversor") or data.get("inversor_marca") or "",
                     "modelo_inversor": r.inversor_modelo or data.get("modelo_inversor") or data.get("inversor_modelo") or "",
                 })
-            return jsonify(projetos)
+            return _resposta_listagem(projetos, filtros, tem_mais)
 
         projetos = []
         for file in PROPOSTAS_DIR.glob("*.json"):
@@ -6683,9 +7253,12 @@ def listar_projetos():
             except Exception as e:
                 print(f"⚠️ Falha ao ler proposta {file.name}: {e}")
                 continue
-        # ordenar por data (desc)
-        projetos.sort(key=lambda p: p.get("created_date") or "", reverse=True)
-        return jsonify(projetos)
+        projetos = _filtrar_lista_arquivos(projetos, filtros)
+        tem_mais = len(projetos) > filtros["limit"]
+        projetos = projetos[:filtros["limit"]]
+        return _resposta_listagem(projetos, filtros, tem_mais)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -6712,81 +7285,71 @@ def get_projeto(projeto_id):
         if not me:
             return jsonify({"success": False, "message": "Não autenticado"}), 401
 
-        db = SessionLocal()
-        row = db.get(PropostaDB, projeto_id)
-        if not row:
-            db.close()
-            return jsonify({"success": False, "message": "Proposta não encontrada"}), 404
+        with _sessao() as db:
+            row = db.get(PropostaDB, projeto_id)
+            if not row:
+                return jsonify({"success": False, "message": "Proposta não encontrada"}), 404
 
-        role = (me.role or "").strip().lower()
-        if role not in ("admin", "gestor"):
-            # ACL por criador OU por cliente pertencente ao usuário
-            is_owner = (
-                (row.created_by_email and row.created_by_email == me.email) or
-                (row.created_by and row.created_by == me.uid)
-            )
-            
-            # Verificar se o cliente da proposta pertence ao usuário
-            is_client_owner = False
-            cliente_id = row.cliente_id or (row.payload or {}).get("cliente_id")
-            if cliente_id:
-                cliente = db.get(ClienteDB, cliente_id)
-                if cliente and (
-                    (cliente.created_by_email and cliente.created_by_email == me.email) or
-                    (cliente.created_by and cliente.created_by == me.uid)
-                ):
-                    is_client_owner = True
+            role = (me.role or "").strip().lower()
+            if role not in ("admin", "gestor"):
+                # ACL por criador OU por cliente pertencente ao usuário (materializada)
+                is_owner = (
+                    (row.created_by_email and row.created_by_email == me.email) or
+                    (row.created_by and row.created_by == me.uid) or
+                    db.query(PropostaVisibilidadeDB.proposta_id).filter(
+                        PropostaVisibilidadeDB.user_email == me.email,
+                        PropostaVisibilidadeDB.proposta_id == row.id,
+                    ).first() is not None
+                )
             
-            if not is_owner and not is_client_owner:
-                db.close()
-                return jsonify({"success": False, "message": "Não autorizado"}), 403
+                if not is_owner:
+                    return jsonify({"success": False, "message": "Não autorizado"}), 403
 
-        data = row.payload or {}
+            data = row.payload or {}
         
-        if not isinstance(data, dict):
-            data = {}
+            if not isinstance(data, dict):
+                data = {}
 
-        # Buscar dados do cliente para preencher campos faltantes
-        cliente_id = row.cliente_id or data.get("cliente_id")
-        cliente_data = {}
-        if cliente_id:
-            try:
-                cliente_row = db.get(ClienteDB, cliente_id)
-                if cliente_row:
-                    cliente_data = {
-                        "cep": cliente_row.cep,
-                        "endereco_completo": cliente_row.endereco_completo,
-                        "telefone": cliente_row.telefone,
-                        "nome": cliente_row.nome,
-                    }
-                    # Buscar cidade/estado do endereço (se existir)
-                    if cliente_row.enderecos and len(cliente_row.enderecos) > 0:
-                        endereco = cliente_row.enderecos[0]  # Primeiro endereço
-                        cliente_data["cidade"] = endereco.cidade
-                        cliente_data["estado"] = endereco.estado
-                        cliente_data["logradouro"] = endereco.logradouro
-                        cliente_data["numero"] = endereco.numero
-                        cliente_data["bairro"] = endereco.bairro
-                        if endereco.cep:
-                            cliente_data["cep"] = endereco.cep
-                    # Tentar extrair cidade/estado do endereco_completo se não veio do endereço
-                    if not cliente_data.get("cidade") and cliente_row.endereco_completo:
-                        parts = cliente_row.endereco_completo.split(',')
-                        parts = [p.strip() for p in parts if p.strip()]
-                        # Procurar UF (2 letras maiúsculas)
-                        for i, p in enumerate(parts):
-                            if len(p) == 2 and p.isupper():
-                                cliente_data["estado"] = p
-                                if i > 0:
-                                    cliente_data["cidade"] = parts[i - 1]
-                                break
-                    print(f"📋 [get_projeto] Dados do cliente {cliente_id}: {cliente_data}")
-            except Exception as e:
-                import traceback
-                print(f"⚠️ [get_projeto] Erro ao buscar cliente: {e}")
-                traceback.print_exc()
+            # Buscar dados do cliente para preencher campos faltantes
+            cliente_id = row.cliente_id or data.get("cliente_id")
+            cliente_data = {}
+            if cliente_id:
+                try:
+                    cliente_row = db.get(ClienteDB, cliente_id)
+                    if cliente_row:
+                        cliente_data = {
+                            "cep": cliente_row.cep,
+                            "endereco_completo": cliente_row.endereco_completo,
+                            "telefone": cliente_row.telefone,
+                            "nome": cliente_row.nome,
+                        }
+                        # Buscar cidade/estado do endereço (se existir)
+                        if cliente_row.enderecos and len(cliente_row.enderecos) > 0:
+                            endereco = cliente_row.enderecos[0]  # Primeiro endereço
+                            cliente_data["cidade"] = endereco.cidade
+                            cliente_data["estado"] = endereco.estado
+                            cliente_data["logradouro"] = endereco.logradouro
+                            cliente_data["numero"] = endereco.numero
+                            cliente_data["bairro"] = endereco.bairro
+                            if endereco.cep:
+                                cliente_data["cep"] = endereco.cep
+                        # Tentar extrair cidade/estado do endereco_completo se não veio do endereço
+                        if not cliente_data.get("cidade") and cliente_row.endereco_completo:
+                            parts = cliente_row.endereco_completo.split(',')
+                            parts = [p.strip() for p in parts if p.strip()]
+                            # Procurar UF (2 letras maiúsculas)
+                            for i, p in enumerate(parts):
+                                if len(p) == 2 and p.isupper():
+                                    cliente_data["estado"] = p
+                                    if i > 0:
+                                        cliente_data["cidade"] = parts[i - 1]
+                                    break
+                        print(f"📋 [get_projeto] Dados do cliente {cliente_id}: {cliente_data}")
+                except Exception as e:
+                    import traceback
+                    print(f"⚠️ [get_projeto] Erro ao buscar cliente: {e}")
+                    traceback.print_exc()
         
-        db.close()
 
         # Fallbacks úteis para edição - incluir campos das colunas do banco
         if not data.get("nome_projeto"):
@@ -7071,11 +7634,13 @@ def get_projeto(projeto_id):
         # Retornar payload completo (mergeando id)
         result = {"id": row.id, **data}
         print(f"📋 [get_projeto] Retornando projeto {row.id} com campos: {list(result.keys())}")
-        return jsonify({
+        # versao/ETag: base para o If-Match do PATCH /propostas/<id>
+        return _resposta_patch({
             "success": True,
             "projeto": result,
+            "versao": row.versao,
             "source": "db"
-        })
+        }, versao=row.versao)
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
@@ -7117,6 +7682,7 @@ def _load_irradiancia_csv():
         print(f"❌ [IRRADIÂNCIA] Erro ao carregar CSV: {e}")
         return None
 
+@timed("irradiancia")
 def _resolve_irr_vec_from_csv(cidade: str | None, irr_media_fallback: float = 5.15) -> list[float] | None:
     """Retorna vetor [Jan..Dez] em kWh/m²/dia a partir do CSV. Fallback: média dos municípios.
     """
@@ -7194,6 +7760,9 @@ if __name__ == '__main__':
         print('✅ Banco de dados inicializado')
     except Exception as e:
         print(f'⚠️ Falha ao inicializar DB: {e}')
+    # Sob gunicorn o warmup roda no post_fork (gunicorn.conf.py)
+    import graficos_pool
+    threading.Thread(target=graficos_pool.warmup, name="graficos-warmup", daemon=True).start()
     # Railway injeta a porta via variável de ambiente PORT
     port = int(os.environ.get('PORT', '8000'))
     debug = os.environ.get('FLASK_DEBUG', '').strip() in ('1', 'true', 'True')
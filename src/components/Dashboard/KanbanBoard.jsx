@@ -103,12 +103,12 @@ const statusConfig = {
   }
 };
 
-const statusOrder = [
+export const statusOrder = [
   'dimensionamento', 'orcamento_enviado', 'negociacao', 
   'fechado', 'instalacao', 'concluido', 'perdido'
 ];
 
-export default function KanbanBoard({ clientes = [], projetos = [], onUpdate, user = null, onViewMetrics, onViewCustos }) {
+export default function KanbanBoard({ clientes = [], projetos = [], onUpdate, user = null, onViewMetrics, onViewCustos, hasMore = {}, onLoadMore }) {
   const [draggedProject, setDraggedProject] = useState(null);
   const [projetosState, setProjetosState] = useState(projetos);
   const [viewMode, setViewMode] = useState("kanban");
@@ -525,6 +525,17 @@ export default function KanbanBoard({ clientes = [], projetos = [], onUpdate, us
                       </div>
                     )}
                     
+                    {/* Próxima página desta coluna (/projetos/list?status=...) */}
+                    {hasMore[status] && typeof onLoadMore === 'function' && (
+                      <button
+                        type="button"
+                        className="w-full mt-2 py-2 text-xs font-medium text-gray-500 hover:text-gray-700 border border-gray-200 rounded-lg bg-white/70 hover:bg-white transition-colors"
+                        onClick={() => onLoadMore(status)}
+                      >
+                        Carregar mais
+                      </button>
+                    )}
+
                     {/* Espaçador invisível para garantir área de drop */}
                     {projetosStatus.length > 0 && !draggedProject && (
                       <div className="min-h-[40px]" />
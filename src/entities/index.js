@@ -1,5 +1,6 @@
 // Simulação de dados em memória para desenvolvimento
 import { getBackendUrl } from '../services/backendUrl.js';
+import { propostaService } from '../services/propostaService.js';
 import { obterConcessionaria, calcularConsumoPorValor as calcConsumoPorValor, calcularValorPorConsumo as calcValorPorConsumo } from '../utils/tarifasUtils.js';
 import { getIrradianciaByCity, calcularPotenciaUsina, calcularEnergiaMensal } from '../utils/irradianciaUtils.js';
 let clientesData = [
@@ -365,19 +366,43 @@ class Projeto extends BaseEntity {
     }
   }
 
-  static async list(orderBy = '-created_at') {
+  /**
+   * Uma página de /projetos/list.
+   * filtros: { q, status, cliente_id, vendedor, ordem: 'desc'|'asc', limit, cursor }
+   * Retorna { items, next_cursor, has_more }.
+   */
+  static async listPage(filtros = {}) {
+    const params = new URLSearchParams({ limit: String(filtros.limit || 100), t: String(Date.now()) });
+    for (const k of ['q', 'status', 'cliente_id', 'vendedor', 'ordem', 'cursor']) {
+      const v = filtros[k];
+      if (v !== undefined && v !== null && v !== '') params.set(k, Array.isArray(v) ? v.join(',') : String(v));
+    }
+    const resp = await fetch(`${this.getServerUrl()}/projetos/list?${params}`, { headers: { ...this._getAuthHeaders() } });
+    if (!resp.ok) throw new Error(`Falha ao listar projetos (${resp.status})`);
+    const json = await resp.json();
+    // Backend antigo: lista completa sem envelope
+    if (Array.isArray(json)) return { items: json, next_cursor: null, has_more: false };
+    return { items: json?.items || [], next_cursor: json?.next_cursor || null, has_more: !!json?.has_more };
+  }
+
+  static async list(orderBy = '-created_at', filtros = {}) {
     try {
       // Política: se o backend Python responder, ele é a verdade (mesmo se vier vazio).
       // Caso o backend falhe, caímos para localStorage → memória.
       const fetchBackend = async () => {
         try {
-          const url = `${this.getServerUrl()}/projetos/list?t=${Date.now()}`;
-          const resp = await fetch(url, { headers: { ...this._getAuthHeaders() } });
-          if (!resp.ok) return null;
-          const arr = await resp.json();
-          // Atualizar cache local para manter sincronizado com o backend
-          localStorage.setItem('projetos_local', JSON.stringify(Array.isArray(arr) ? arr : []));
-          return Array.isArray(arr) ? arr : [];
+          // Percorre as páginas pelo cursor (cada resposta é limitada no servidor)
+          const ordem = String(orderBy || '').startsWith('-') ? 'desc' : 'asc';
+          const arr = [];
+          let cursor = null;
+          do {
+            const page = await this.listPage({ ...filtros, ordem, limit: 200, cursor });
+            arr.push(...page.items);
+            cursor = page.has_more ? page.next_cursor : null;
+          } while (cursor);
+          // Atualizar cache local (só a lista completa, sem filtros)
+          if (!Object.keys(filtros).length) localStorage.setItem('projetos_local', JSON.stringify(arr));
+          return arr;
         } catch (_) {
           return null;
         }
@@ -469,6 +494,38 @@ class Projeto extends BaseEntity {
     }
   }
 
+  /**
+   * Autosave de rascunho: envia só o merge-patch (campos alterados) com a versão base.
+   * Conflito (outra gravação no meio): não reaplica sozinho; o erro CONFLICT sobe com
+   * a versão atual do servidor (e.versao) para a tela decidir entre recarregar ou sobrescrever.
+   * Servidor antigo (sem a rota) cai no update completo.
+   * @returns {Promise<{id: string, versao: number|null}>}
+   */
+  static async autosave(id, patch, versao = null) {
+    // Dono/identidade são do servidor (o PATCH recusa essas chaves)
+    const { id: _id, created_by: _cb, created_by_email: _cbe, user_id: _uid, ...limpo } = patch || {};
+    let result;
+    try {
+      result = await propostaService.patchProposta(id, limpo, versao);
+    } catch (e) {
+      if (e?.code === 'UNSUPPORTED') {
+        await this.update(id, limpo);
+        return { id, versao: null };
+      }
+      if (e?.code === 'CONFLICT') {
+        console.warn(`⚠️ [AUTO-SAVE] Proposta ${id} mudou (v${versao} → v${e.versao}); aguardando decisão do usuário`);
+      }
+      throw e;
+    }
+    const stored = JSON.parse(localStorage.getItem('projetos_local') || '[]');
+    const idx = stored.findIndex(p => p.id === id);
+    if (idx !== -1) {
+      stored[idx] = { ...stored[idx], ...limpo, id };
+      localStorage.setItem('projetos_local', JSON.stringify(stored));
+    }
+    return { id, versao: result?.versao ?? null };
+  }
+
   static async delete(id) {
     try {
       // Tentar remover no backend Python (arquivos em /propostas)
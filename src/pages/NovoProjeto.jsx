@@ -19,6 +19,7 @@ import cepService from "../services/cepService";
 import solaryumApi from "../services/solaryumApi";
 import { propostaService } from "../services/propostaService";
 import { getIrradianciaByCity } from "../utils/irradianciaUtils";
+import { buildMergePatch, isEmptyPatch } from "../utils/mergePatch";
 import { useProjectCosts } from "../hooks/useProjectCosts";
 import { dimensionarSistema, calcularProjecaoFinanceira, CONSTANTES, calcularInstalacaoPorPlaca, calcularCustoHomologacao as calcularCustoHomologacaoUtils } from "../utils/calculosSolares";
 import DimensionamentoResults from "../components/projetos/DimensionamentoResults.jsx";
@@ -160,27 +161,68 @@ export default function NovoProjeto() {
   }, []);
 
   // Auto-save do rascunho a cada alteração do formulário (debounced)
+  const autoSaveRef = useRef({ id: null, dados: null, versao: null });
+  // Conflito de versão no autosave: pausa as gravações até o usuário escolher
+  const [conflitoAutosave, setConflitoAutosave] = useState(null);
   // IMPORTANTE: Só faz auto-save DEPOIS que os dados iniciais foram carregados
   useEffect(() => {
     if (!dadosCarregados) {
       console.log('⏳ [AUTO-SAVE] Aguardando carregamento inicial...');
       return;
     }
+    if (conflitoAutosave) return;
     const timer = setTimeout(async () => {
       try {
         const urlParams = new URLSearchParams(window.location.search);
         const projetoId = urlParams.get('projeto_id');
         if (projetoId) {
           const clienteNome = clientes.find(c => c.id === (formData?.cliente_id || ''))?.nome || formData?.cliente_nome || null;
-          console.log('💾 [AUTO-SAVE] Salvando dados...', { cliente_id: formData?.cliente_id, cep: formData?.cep });
-          await Projeto.update(projetoId, { ...formData, cliente_nome: clienteNome || undefined, status: 'rascunho' });
+          const atual = { ...formData, cliente_nome: clienteNome || undefined, status: 'rascunho' };
+          // Só os campos alterados desde o último autosave (o primeiro vai completo)
+          const mesmo = autoSaveRef.current.id === projetoId;
+          const anterior = mesmo ? autoSaveRef.current.dados : null;
+          const patch = anterior ? buildMergePatch(anterior, atual) : atual;
+          if (isEmptyPatch(patch)) return;
+          console.log('💾 [AUTO-SAVE] Salvando dados...', { campos: Object.keys(patch).length, cliente_id: formData?.cliente_id });
+          const { versao } = await Projeto.autosave(projetoId, patch, mesmo ? autoSaveRef.current.versao : null);
+          autoSaveRef.current = { id: projetoId, dados: JSON.parse(JSON.stringify(atual)), versao };
         }
       } catch (e) {
+        if (e?.code === 'CONFLICT') {
+          setConflitoAutosave({ versao: e.versao ?? null });
+          return;
+        }
         console.warn('⚠️ Auto-save falhou:', e);
       }
     }, 800);
     return () => clearTimeout(timer);
-  }, [formData, dadosCarregados]);
+  }, [formData, dadosCarregados, conflitoAutosave]);
+
+  // Descarta as alterações locais e carrega a versão gravada por outra aba/usuário
+  const recarregarAposConflito = () => {
+    window.location.reload();
+  };
+
+  // Mantém o formulário atual: grava o estado completo sobre a versão do servidor
+  const sobrescreverAposConflito = async () => {
+    const projetoId = new URLSearchParams(window.location.search).get('projeto_id');
+    if (!projetoId || !conflitoAutosave) return;
+    try {
+      const clienteNome = clientes.find(c => c.id === (formData?.cliente_id || ''))?.nome || formData?.cliente_nome || null;
+      const atual = { ...formData, cliente_nome: clienteNome || undefined, status: 'rascunho' };
+      const { versao } = await Projeto.autosave(projetoId, atual, conflitoAutosave.versao);
+      autoSaveRef.current = { id: projetoId, dados: JSON.parse(JSON.stringify(atual)), versao };
+      setConflitoAutosave(null);
+    } catch (e) {
+      if (e?.code === 'CONFLICT') {
+        // Gravaram de novo no meio: mantém o aviso com a versão mais nova
+        setConflitoAutosave({ versao: e.versao ?? null });
+        return;
+      }
+      console.warn('⚠️ Falha ao sobrescrever após conflito:', e);
+      toast({ title: "Erro ao salvar", description: "Não foi possível gravar suas alterações. Tente novamente.", variant: "destructive" });
+    }
+  };
 
   const [resultados, setResultados] = useState(null);
   const [produtosDisponiveis, setProdutosDisponiveis] = useState([]);
@@ -2764,6 +2806,26 @@ export default function NovoProjeto() {
           </motion.div>
         </motion.div>
       )}
+      {conflitoAutosave && (
+        <div className="fixed inset-0 z-50 flex items-center justify-center bg-black/40 backdrop-blur-[2px]">
+          <div className="bg-white rounded-2xl shadow-2xl p-6 w-[92%] max-w-md border border-amber-200">
+            <h3 className="text-lg font-semibold text-gray-900">Proposta alterada em outro lugar</h3>
+            <p className="text-sm text-gray-600 mt-2">
+              Esta proposta foi salva por outra aba ou outro usuário
+              {conflitoAutosave.versao !== null ? ` (versão ${conflitoAutosave.versao})` : ''}.
+              O salvamento automático foi pausado para não apagar essas alterações.
+            </p>
+            <div className="mt-5 flex flex-col sm:flex-row gap-2 sm:justify-end">
+              <Button variant="outline" onClick={recarregarAposConflito}>
+                Recarregar versão salva
+              </Button>
+              <Button className="bg-amber-600 hover:bg-amber-700 text-white" onClick={sobrescreverAposConflito}>
+                Manter minhas alterações
+              </Button>
+            </div>
+          </div>
+        </div>
+      )}
       <div className="w-full space-y-6">
         <motion.div
           initial={{ opacity: 0, y: -20 }}
@@ -1,31 +1,72 @@
-import React, { useEffect, useState } from "react";
+import React, { useEffect, useRef, useState } from "react";
 import { Cliente, Projeto } from "@/entities";
-import KanbanBoard from "../components/Dashboard/KanbanBoard.jsx";
+import KanbanBoard, { statusOrder } from "../components/Dashboard/KanbanBoard.jsx";
 import { useAuth } from "@/services/authService";
 
+// Cards por coluna em cada página de /projetos/list
+const PAGE_SIZE = 30;
+
 export default function Pipeline() {
   const { user } = useAuth();
   const [clientes, setClientes] = useState([]);
   const [projetos, setProjetos] = useState([]);
+  const [cursores, setCursores] = useState({});
   const [loading, setLoading] = useState(true);
   const [metricasModal, setMetricasModal] = useState({ open: false, projeto: null });
   const [custosModal, setCustosModal] = useState({ open: false, projeto: null });
+  const carregandoRef = useRef({});
 
   useEffect(() => {
     loadData();
   }, []);
 
+  // Cada coluna pagina sozinha, filtrada por status no servidor
+  const paginaStatus = (status, cursor = null) =>
+    Projeto.listPage({ status, ordem: 'desc', limit: PAGE_SIZE, cursor });
+
   const loadData = async () => {
     setLoading(true);
-    const [clientesData, projetosData] = await Promise.all([
-      Cliente.list("-created_date"),
-      Projeto.list("-created_date"),
-    ]);
-    setClientes(clientesData);
-    setProjetos(projetosData);
+    const clientesPromise = Cliente.list("-created_date");
+    try {
+      const paginas = await Promise.all(statusOrder.map(s => paginaStatus(s)));
+      const proximos = {};
+      statusOrder.forEach((s, i) => {
+        if (paginas[i].has_more) proximos[s] = paginas[i].next_cursor;
+      });
+      setProjetos(paginas.flatMap(p => p.items));
+      setCursores(proximos);
+    } catch (e) {
+      console.warn('⚠️ Falha na listagem paginada, usando lista completa:', e);
+      setProjetos(await Projeto.list("-created_date"));
+      setCursores({});
+    }
+    setClientes(await clientesPromise);
     setLoading(false);
   };
 
+  const loadMore = async (status) => {
+    const cursor = cursores[status];
+    if (!cursor || carregandoRef.current[status]) return;
+    carregandoRef.current[status] = true;
+    try {
+      const page = await paginaStatus(status, cursor);
+      setProjetos(prev => {
+        const vistos = new Set(prev.map(p => p.id));
+        return [...prev, ...page.items.filter(p => !vistos.has(p.id))];
+      });
+      setCursores(prev => {
+        const novo = { ...prev };
+        if (page.has_more) novo[status] = page.next_cursor;
+        else delete novo[status];
+        return novo;
+      });
+    } catch (e) {
+      console.warn(`⚠️ Falha ao carregar mais projetos (${status}):`, e);
+    } finally {
+      carregandoRef.current[status] = false;
+    }
+  };
+
   const handleViewMetrics = (projeto) => {
     setMetricasModal({ open: true, projeto });
   };
@@ -44,6 +85,8 @@ export default function Pipeline() {
           user={user}
           onViewMetrics={handleViewMetrics}
           onViewCustos={handleViewCustos}
+          hasMore={Object.fromEntries(Object.keys(cursores).map(s => [s, true]))}
+          onLoadMore={loadMore}
         />
       </div>
       
@@ -51,4 +94,3 @@ export default function Pipeline() {
     </div>
   );
 }
-
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef, useCallback } from "react";
 import { Projeto, Cliente } from "@/entities";
 import { Button } from "@/components/ui/button";
 import { Card, CardContent } from "@/components/ui/card";
@@ -60,6 +60,9 @@ const statusStyles = {
   perdido: "bg-rose-50 text-rose-700 border-rose-200"
 };
 
+// Tamanho de cada página de /projetos/list
+const PAGE_SIZE = 60;
+
 // Função para verificar se a proposta venceu (3 dias)
 const checkVencimento = (dateStr) => {
   if (!dateStr) return false;
@@ -77,9 +80,13 @@ const checkVencimento = (dateStr) => {
 export default function Projetos() {
   const [projetos, setProjetos] = useState([]);
   const [clientes, setClientes] = useState([]);
-  const [filteredProjetos, setFilteredProjetos] = useState([]);
   const [searchTerm, setSearchTerm] = useState("");
+  const [buscaServidor, setBuscaServidor] = useState("");
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const sentinelaRef = useRef(null);
+  const consultaRef = useRef(0);
   const [usuarios, setUsuarios] = useState([]);
   const { user } = useAuth();
   const [selectedUserEmail, setSelectedUserEmail] = useState(
@@ -107,79 +114,79 @@ export default function Projetos() {
   const [confirmTitle, setConfirmTitle] = useState("");
   const [confirmMessage, setConfirmMessage] = useState("");
 
-  // Carregamento de dados (mantido igual)
-  useEffect(() => { loadData(); loadUsers(); }, []);
+  // Filtros aplicados no servidor (/projetos/list): a lista vem paginada por cursor
+  const clienteIdUrl = new URLSearchParams(window.location.search).get('cliente_id') || '';
+  const filtrosServidor = {
+    q: buscaServidor,
+    cliente_id: clienteIdUrl,
+    vendedor: user?.role === 'admin' && selectedUserEmail !== 'todos' ? selectedUserEmail : '',
+  };
+  const chaveFiltros = JSON.stringify(filtrosServidor);
+  // Itens da página atual já chegam filtrados
+  const filteredProjetos = projetos;
+
+  useEffect(() => { loadClientes(); loadUsers(); }, []);
 
-  // Lógica de filtragem (mantida igual)
+  // Debounce da busca para não disparar uma consulta por tecla
   useEffect(() => {
-    const urlParams = new URLSearchParams(window.location.search);
-    const clienteId = urlParams.get('cliente_id');
-    
-    const base = (() => {
-      let arr = projetos;
-      if (clienteId) {
-        arr = arr.filter(p => p.cliente_id === clienteId);
-      }
-      
-      // Filtros de Admin/Gestor (Lógica mantida)
-      if (user?.role === 'admin') {
-        if (selectedUserEmail && selectedUserEmail !== 'todos') {
-          // ... (mesma lógica de filtro admin)
-           const raw = String(selectedUserEmail || '').toLowerCase().trim();
-           const matchKey = (val) => String(val || '').toLowerCase().includes(raw); // Simplificado para brevidade visual, a lógica original era mais complexa
-           
-           // Recriando lógica original simplificada para não quebrar
-           // Se precisar da lógica exata, copio do original. Vou assumir filtro simples aqui ou copiar full se necessário.
-           // Copiando full logic abaixo para garantir:
-           const emailPrefix = raw.includes('@') ? raw.split('@')[0] : raw;
-           const mk = (value) => {
-             const v = String(value || '').toLowerCase().trim();
-             if (!v) return false;
-             if (v === raw) return true;
-             const vPrefix = v.includes('@') ? v.split('@')[0] : v;
-             return vPrefix === emailPrefix;
-           };
-           // ... (rest of logic omitted for brevity in response but should be in code)
-           // Para garantir que funciona, vou usar a filtragem básica que já estava no useEffect original se possível.
-           // Na verdade, vou confiar que 'filteredProjetos' é atualizado corretamente se eu replicar a lógica.
-           // Vou manter a lógica original completa no useEffect.
-           return arr.filter(p => {
-             const candidates = [p?.vendedor_email, p?.payload?.vendedor_email, p?.created_by_email, p?.payload?.created_by_email];
-             if (candidates.some(mk)) return true;
-             return false; // Simplificado
-           });
-        }
-        return arr;
-      }
-      return arr;
-    })();
-    
-    if (!searchTerm) {
-      setFilteredProjetos(base);
-      return;
+    const t = setTimeout(() => setBuscaServidor(searchTerm.trim()), 300);
+    return () => clearTimeout(t);
+  }, [searchTerm]);
+
+  // Filtro mudou: recomeça do primeiro cursor
+  useEffect(() => { loadData(); }, [chaveFiltros]);
+
+  const carregarPagina = async (cursor) => {
+    const consulta = consultaRef.current;
+    try {
+      const page = await Projeto.listPage({ ...filtrosServidor, ordem: 'desc', limit: PAGE_SIZE, cursor });
+      if (consulta !== consultaRef.current) return; // resposta de um filtro antigo
+      setProjetos(prev => (cursor ? [...prev, ...page.items] : page.items));
+      setNextCursor(page.has_more ? page.next_cursor : null);
+    } catch (e) {
+      console.warn('⚠️ Falha na listagem paginada, usando lista completa:', e);
+      if (consulta !== consultaRef.current || cursor) return;
+      // Backend indisponível: Projeto.list cai para o cache local; só a busca é refeita aqui
+      const termo = filtrosServidor.q.toLowerCase();
+      const todos = await Projeto.list("-created_date");
+      setProjetos(!termo ? todos : todos.filter(p =>
+        [p.nome_projeto, p.cidade, p.cliente_nome].some(v => String(v || '').toLowerCase().includes(termo))
+      ));
+      setNextCursor(null);
     }
-    
-    const filtered = base.filter(p => 
-      p.nome_projeto?.toLowerCase().includes(searchTerm.toLowerCase()) ||
-      p.cidade?.toLowerCase().includes(searchTerm.toLowerCase()) ||
-      p.cliente_nome?.toLowerCase().includes(searchTerm.toLowerCase())
-    );
-    setFilteredProjetos(filtered);
-  }, [searchTerm, projetos, user, selectedUserEmail]);
+  };
 
-  // Loaders (mantidos)
   const loadData = async () => {
+    consultaRef.current += 1;
     setLoading(true);
-    const [projetosData, clientesData] = await Promise.all([
-      Projeto.list("-created_date"),
-      Cliente.list()
-    ]);
-    setProjetos(projetosData);
-    setClientes(clientesData);
-    setFilteredProjetos(projetosData); // Inicial simples
+    await carregarPagina(null);
     setLoading(false);
   };
 
+  const loadMore = useCallback(async () => {
+    if (!nextCursor || loadingMore || loading) return;
+    setLoadingMore(true);
+    await carregarPagina(nextCursor);
+    setLoadingMore(false);
+  }, [nextCursor, loadingMore, loading, chaveFiltros]);
+
+  // Carrega a próxima página quando o fim da lista entra na tela
+  useEffect(() => {
+    const el = sentinelaRef.current;
+    if (!el || typeof IntersectionObserver === 'undefined') return;
+    const obs = new IntersectionObserver((entries) => {
+      if (entries.some(e => e.isIntersecting)) loadMore();
+    }, { rootMargin: '400px' });
+    obs.observe(el);
+    return () => obs.disconnect();
+  }, [loadMore]);
+
+  const loadClientes = async () => {
+    try {
+      setClientes(await Cliente.list());
+    } catch (_) { setClientes([]); }
+  };
+
   const loadUsers = async () => {
     try {
       const serverUrl = getBackendUrl();
@@ -607,6 +614,16 @@ export default function Projetos() {
         </div>
       )}
 
+      {/* Paginação: sentinela para scroll infinito + botão de fallback */}
+      <div ref={sentinelaRef} />
+      {nextCursor && !loading && (
+        <div className="flex justify-center">
+          <Button variant="outline" onClick={loadMore} disabled={loadingMore}>
+            {loadingMore ? "Carregando..." : "Carregar mais"}
+          </Button>
+        </div>
+      )}
+
       {/* Empty State */}
       {filteredProjetos.length === 0 && !loading && (
         <div className="text-center py-20 bg-white border border-slate-200 border-dashed rounded-xl">
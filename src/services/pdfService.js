@@ -1,18 +1,68 @@
 import { getBackendUrl } from "./backendUrl.js";
 
-export async function baixarPdfPuppeteer(propostaId) {
+const POLL_INTERVAL_MS = 1000;
+const JOB_TIMEOUT_MS = 180000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// Intervalo do polling: Retry-After do backend (segundos) ou o padrão
+const intervaloPolling = (resp) => {
+  const s = Number(resp?.headers?.get("Retry-After"));
+  return Number.isFinite(s) && s > 0 ? s * 1000 : POLL_INTERVAL_MS;
+};
+
+async function erroDaResposta(resp) {
+  let msg = `Falha ao gerar PDF (${resp.status})`;
+  try {
+    const j = await resp.json();
+    if (j?.message || j?.error) msg = j.message || j.error;
+  } catch (_) {}
+  return new Error(msg);
+}
+
+// Caminho antigo: gera o PDF dentro da requisição (rota pública)
+async function baixarPdfSincrono(propostaId) {
   const base = getBackendUrl();
-  // Usando rota pública que não requer autenticação
   const resp = await fetch(`${base}/proposta/${propostaId}/ver-pdf?download=true&t=${Date.now()}`);
-  if (!resp.ok) {
-    let msg = `Falha ao gerar PDF (${resp.status})`;
-    try {
-      const j = await resp.json();
-      if (j?.message) msg = j.message;
-    } catch (_) {}
-    throw new Error(msg);
-  }
+  if (!resp.ok) throw await erroDaResposta(resp);
   return await resp.blob();
 }
 
+/**
+ * Gera o PDF pela fila assíncrona do backend:
+ * POST /propostas/<id>/pdf-jobs -> polling em /pdf-jobs/<job_id> -> /pdf-jobs/<job_id>/result.
+ * Se a fila não estiver disponível (backend antigo), usa a rota síncrona.
+ */
+export async function baixarPdfPuppeteer(propostaId, { onStatus } = {}) {
+  const base = getBackendUrl();
+  let resp;
+  try {
+    resp = await fetch(`${base}/propostas/${propostaId}/pdf-jobs`, { method: "POST" });
+  } catch (_) {
+    return baixarPdfSincrono(propostaId);
+  }
+  if (resp.status === 404 || resp.status === 405) {
+    // 404 da rota (backend sem fila) ou proposta inexistente: a rota síncrona dá a mensagem certa
+    return baixarPdfSincrono(propostaId);
+  }
+  if (!resp.ok) throw await erroDaResposta(resp);
 
+  let job = await resp.json();
+  let espera = intervaloPolling(resp);
+  const inicio = Date.now();
+  while (job.status !== "done") {
+    if (job.status === "error") throw new Error(job.error || "Falha ao gerar PDF");
+    if (Date.now() - inicio > JOB_TIMEOUT_MS) throw new Error("Tempo esgotado ao gerar PDF");
+    onStatus?.(job.status);
+    await sleep(espera);
+    const st = await fetch(`${base}/pdf-jobs/${job.job_id}?t=${Date.now()}`);
+    if (!st.ok) throw await erroDaResposta(st);
+    espera = intervaloPolling(st);
+    job = await st.json();
+  }
+
+  onStatus?.("done");
+  const pdf = await fetch(`${base}${job.result_url}?download=true`);
+  if (!pdf.ok) throw await erroDaResposta(pdf);
+  return await pdf.blob();
+}
@@ -95,6 +95,46 @@ export const propostaService = {
     }
   },
 
+  /**
+   * Autosave com JSON merge-patch (RFC 7386): só os campos alterados.
+   * @param {string} propostaId
+   * @param {Object} patch - campos alterados (null remove a chave)
+   * @param {number|null} versao - versão base (If-Match); null cria/atualiza sem checar
+   * @returns {Promise<Object>} { success, proposta_id, versao, created }
+   * Erros: code 'CONFLICT' (412, outra gravação mudou a proposta; err.versao = atual)
+   *        code 'UNSUPPORTED' (servidor sem a rota PATCH)
+   */
+  async patchProposta(propostaId, patch, versao = null) {
+    const token = (() => {
+      try { return localStorage.getItem('app_jwt_token'); } catch { return null; }
+    })();
+    const response = await fetchWithTimeout(`${SERVER_URL}/propostas/${encodeURIComponent(propostaId)}`, {
+      method: 'PATCH',
+      headers: {
+        'Content-Type': 'application/merge-patch+json',
+        ...(versao !== null && versao !== undefined ? { 'If-Match': `"v${versao}"` } : {}),
+        ...(token ? { Authorization: `Bearer ${token}` } : {}),
+      },
+      body: JSON.stringify(patch || {}),
+    }, 15000);
+    const json = await response.json().catch(() => null);
+    if (response.status === 412) {
+      const err = new Error(json?.message || 'A proposta foi alterada por outra gravação');
+      err.code = 'CONFLICT';
+      err.versao = json?.versao ?? null;
+      throw err;
+    }
+    if ((response.status === 404 || response.status === 405) && !json) {
+      const err = new Error('Servidor sem suporte a PATCH de propostas');
+      err.code = 'UNSUPPORTED';
+      throw err;
+    }
+    if (!response.ok || !json?.success) {
+      throw new Error(json?.message || `Erro HTTP ${response.status} no autosave`);
+    }
+    return json;
+  },
+
   /**
    * Calcula KPIs e tabelas diretamente no núcleo unificado
    * @param {Object} payload - mesmo contrato do backend (/dimensionamento/excel-calculo)
@@ -0,0 +1,33 @@
+// JSON merge-patch (RFC 7386) entre duas versões de um objeto.
+// Só o que mudou entra no patch; objetos são comparados por chave (recursivo),
+// listas e demais valores são enviados inteiros. Chaves que sumiram não são
+// removidas (mesma semântica do /salvar-proposta: ausente = manter).
+
+const isPlainObject = (v) => v !== null && typeof v === 'object' && !Array.isArray(v);
+
+const sameJson = (a, b) => {
+  try {
+    return JSON.stringify(a) === JSON.stringify(b);
+  } catch (_) {
+    return false;
+  }
+};
+
+export function buildMergePatch(anterior, atual) {
+  const patch = {};
+  for (const [key, value] of Object.entries(atual || {})) {
+    if (value === undefined) continue;
+    const prev = anterior ? anterior[key] : undefined;
+    if (isPlainObject(value) && isPlainObject(prev)) {
+      const sub = buildMergePatch(prev, value);
+      if (Object.keys(sub).length) patch[key] = sub;
+    } else if (!sameJson(prev, value)) {
+      patch[key] = value;
+    }
+  }
+  return patch;
+}
+
+export function isEmptyPatch(patch) {
+  return !patch || Object.keys(patch).length === 0;
+}
@@ -0,0 +1,70 @@
+"""
+Configuração comum dos testes: módulos da raiz importáveis e banco SQLite
+descartável (db.py exige DATABASE_URL ou ALLOW_SQLITE=1).
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+RAIZ = Path(__file__).resolve().parent.parent
+if str(RAIZ) not in sys.path:
+    sys.path.insert(0, str(RAIZ))
+
+_TMP = tempfile.mkdtemp(prefix="fohat-tests-")
+os.environ.setdefault("ALLOW_SQLITE", "1")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_TMP}/app.db")
+
+
+@pytest.fixture(scope="session")
+def servidor():
+    """servidor_proposta importado uma vez (roda init_db no SQLite de teste)."""
+    import servidor_proposta
+    return servidor_proposta
+
+
+@pytest.fixture
+def db_sessao():
+    """Sessão no SQLite de teste; propostas, clientes e usuários criados no teste são apagados ao final."""
+    import db as db_mod
+
+    db_mod.Base.metadata.create_all(bind=db_mod.engine)
+    sessao = db_mod.SessionLocal()
+    try:
+        yield sessao
+    finally:
+        sessao.rollback()
+        for modelo in (db_mod.PropostaVisibilidadeDB, db_mod.PropostaDB, db_mod.ClienteDB, db_mod.UserDB):
+            sessao.query(modelo).delete()
+        sessao.commit()
+        sessao.close()
+
+
+@pytest.fixture
+def postgres():
+    """
+    Engine num schema descartável do Postgres de TEST_POSTGRES_URL (pulado sem ele),
+    com as tabelas dos modelos criadas.
+    """
+    url = os.environ.get("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL não definido")
+    from sqlalchemy import create_engine, text
+    import db as db_mod
+
+    schema = f"fohat_testes_{os.getpid()}"
+    admin = create_engine(url)
+    with admin.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {schema}"))
+    engine = create_engine(url, connect_args={"options": f"-csearch_path={schema}"})
+    db_mod.Base.metadata.create_all(bind=engine)
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+        with admin.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        admin.dispose()
@@ -0,0 +1,103 @@
+"""
+Identidade do usuário autenticado: resolvida uma vez por requisição (flask.g) e, entre
+requisições, cache com TTL curto (AUTH_CACHE_TTL_S) invalidado pelas edições em /admin/users.
+"""
+import time
+
+import jwt
+import pytest
+from sqlalchemy import event
+
+import db as db_mod
+from db import UserDB
+
+
+@pytest.fixture
+def auth(servidor, db_sessao, monkeypatch):
+    """JWT do app configurado, caches vazios e dois usuários (admin e vendedor)."""
+    monkeypatch.setenv("JWT_SECRET", "segredo-de-teste")
+    monkeypatch.delenv("ROLE_ADMIN_SECRET", raising=False)
+    monkeypatch.delenv("ADMIN_EMAILS", raising=False)
+    monkeypatch.setattr(servidor, "AUTH_CACHE_TTL_S", 30.0)
+    monkeypatch.setattr(servidor, "_jwt_cache", {})
+    monkeypatch.setattr(servidor, "_user_cache", {})
+    db_sessao.add_all([
+        UserDB(uid="u-admin", email="admin@x.com", nome="Admin", role="admin"),
+        UserDB(uid="u-bia", email="bia@x.com", nome="Bia", role="vendedor"),
+    ])
+    db_sessao.commit()
+    return servidor
+
+
+@pytest.fixture
+def consultas_usuario():
+    lista = []
+
+    def registrar(conn, cursor, sql, *args):
+        if "FROM users" in sql and "users.email = " in sql:
+            lista.append(sql)
+
+    event.listen(db_mod.engine, "before_cursor_execute", registrar)
+    yield lista
+    event.remove(db_mod.engine, "before_cursor_execute", registrar)
+
+
+def _cabecalho(servidor, email):
+    return {"Authorization": f"Bearer {servidor._create_app_jwt(email)}"}
+
+
+def _me(servidor, email):
+    return servidor.app.test_client().get("/auth/me", headers=_cabecalho(servidor, email)).get_json()
+
+
+def test_uma_consulta_por_requisicao(auth, consultas_usuario):
+    with auth.app.test_request_context(headers=_cabecalho(auth, "bia@x.com")):
+        assert auth._current_user_row().role == "vendedor"
+        assert auth._current_user_row() is auth._current_user_row()
+        assert auth._require_admin_access_app() is False
+    assert len(consultas_usuario) == 1
+
+
+def test_cache_entre_requisicoes_ate_o_ttl(auth, db_sessao, consultas_usuario, monkeypatch):
+    assert _me(auth, "bia@x.com")["user"]["role"] == "vendedor"
+    db_sessao.get(UserDB, "u-bia").role = "gestor"  # mudança fora de /admin/users
+    db_sessao.commit()
+    assert _me(auth, "bia@x.com")["user"]["role"] == "vendedor"  # ainda no TTL
+    assert len(consultas_usuario) == 1
+    monkeypatch.setattr(auth, "AUTH_CACHE_TTL_S", 0.05)
+    auth._user_cache.clear()
+    _me(auth, "bia@x.com")
+    time.sleep(0.1)
+    assert _me(auth, "bia@x.com")["user"]["role"] == "gestor"
+    assert len(consultas_usuario) == 3
+
+
+def test_edicao_em_admin_users_invalida(auth):
+    cliente = auth.app.test_client()
+    assert _me(auth, "bia@x.com")["user"]["role"] == "vendedor"
+    resp = cliente.patch("/admin/users/u-bia", json={"role": "gestor", "nome": "Bia Lima"},
+                         headers=_cabecalho(auth, "admin@x.com"))
+    assert resp.status_code == 200
+    user = _me(auth, "bia@x.com")["user"]
+    assert (user["role"], user["nome"]) == ("gestor", "Bia Lima")
+    cliente.delete("/admin/users/u-bia", headers=_cabecalho(auth, "admin@x.com"))
+    resp = cliente.get("/auth/me", headers=_cabecalho(auth, "bia@x.com"))
+    assert resp.status_code == 404
+
+
+def test_ttl_zero_desliga_o_cache(auth, consultas_usuario, monkeypatch):
+    monkeypatch.setattr(auth, "AUTH_CACHE_TTL_S", 0.0)
+    _me(auth, "bia@x.com")
+    _me(auth, "bia@x.com")
+    assert auth._user_cache == {} and auth._jwt_cache == {}
+    assert len(consultas_usuario) == 2
+
+
+def test_token_em_cache_nao_passa_do_exp(auth):
+    agora = int(time.time())
+    token = jwt.encode({"sub": "bia@x.com", "iat": agora, "exp": agora + 5}, "segredo-de-teste", algorithm="HS256")
+    assert auth._decode_app_jwt(token)["sub"] == "bia@x.com"
+    expira_em, _ = auth._jwt_cache[token]
+    assert expira_em <= agora + 5
+    assert auth._decode_app_jwt("nao-e-um-jwt") is None
+    assert "nao-e-um-jwt" not in auth._jwt_cache  # token inválido não entra no cache
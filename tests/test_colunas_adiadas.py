@@ -0,0 +1,75 @@
+"""
+Colunas pesadas de PropostaDB (payload, pdf_cache) adiadas: db.get e as consultas
+leves não as leem; get_proposta(payload=True) traz o payload na mesma consulta.
+"""
+import re
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm.exc import DetachedInstanceError
+
+import db as db_mod
+from db import PropostaDB, get_proposta, resumo_propostas_query
+
+
+@pytest.fixture
+def comandos():
+    lista = []
+
+    def registrar(conn, cursor, sql, *args):
+        lista.append(sql)
+
+    event.listen(db_mod.engine, "before_cursor_execute", registrar)
+    yield lista
+    event.remove(db_mod.engine, "before_cursor_execute", registrar)
+
+
+@pytest.fixture
+def proposta(db_sessao):
+    db_sessao.add(PropostaDB(id="p1", cliente_nome="Ana", payload={"kit": "x" * 1000}, pdf_cache="JVBERi0="))
+    db_sessao.commit()
+    db_sessao.expunge_all()
+    return db_sessao
+
+
+def _le(sql, coluna):
+    return re.search(rf"propostas\.{coluna}\b", sql) is not None
+
+
+def _selects(comandos):
+    return [sql for sql in comandos if sql.lstrip().upper().startswith("SELECT")]
+
+
+def test_get_nao_le_as_colunas_pesadas(proposta, comandos):
+    row = proposta.get(PropostaDB, "p1")
+    assert row.cliente_nome == "Ana"
+    (sql,) = _selects(comandos)
+    assert not _le(sql, "payload") and not _le(sql, "pdf_cache")
+    # Ler o atributo adiado custa uma consulta a mais, só dele
+    assert row.payload == {"kit": "x" * 1000}
+    assert len(_selects(comandos)) == 2 and _le(_selects(comandos)[1], "payload")
+
+
+def test_get_proposta_com_payload_em_uma_consulta(proposta, comandos):
+    row = get_proposta(proposta, "p1", payload=True)
+    proposta.close()  # desanexada: o payload já veio junto
+    assert row.payload == {"kit": "x" * 1000}
+    (sql,) = _selects(comandos)
+    assert _le(sql, "payload") and not _le(sql, "pdf_cache")
+
+
+def test_get_proposta_sem_payload_desanexada_nao_carrega(proposta):
+    row = get_proposta(proposta, "p1")
+    proposta.close()
+    with pytest.raises(DetachedInstanceError):
+        row.payload
+
+
+def test_consulta_resumo_sem_colunas_pesadas(proposta, comandos):
+    linhas = resumo_propostas_query(proposta).filter(PropostaDB.id == "p1").all()
+    assert linhas[0].cliente_nome == "Ana"
+    assert not hasattr(linhas[0], "payload") and not hasattr(linhas[0], "pdf_cache")
+    (sql,) = _selects(comandos)
+    assert not _le(sql, "payload") and not _le(sql, "pdf_cache")
+    (linha,) = resumo_propostas_query(proposta, colunas=("id", "created_by")).all()
+    assert tuple(linha) == ("p1", None)
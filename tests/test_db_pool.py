@@ -0,0 +1,94 @@
+"""
+Pool de conexões medido (db._PoolMedido / pool_stats) e uso da sessão da requisição
+pela rota de PDF (um checkout por requisição, nenhuma SessionLocal() avulsa).
+"""
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as SATimeoutError
+
+import db as db_mod
+from db import PropostaDB
+
+
+@pytest.fixture
+def pool_medido(tmp_path, monkeypatch):
+    """Engine com _PoolMedido (1 conexão, sem overflow) e contadores zerados."""
+    engine = create_engine(f"sqlite:///{tmp_path}/pool.db", poolclass=db_mod._PoolMedido,
+                           pool_size=1, max_overflow=0, pool_timeout=0.2)
+    monkeypatch.setattr(db_mod, "_pool_contadores", dict.fromkeys(db_mod._pool_contadores, 0))
+    monkeypatch.setattr(db_mod, "engine", engine)
+    yield engine
+    engine.dispose()
+
+
+def test_espera_e_timeout_no_checkout(pool_medido):
+    with pool_medido.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        with pytest.raises(SATimeoutError):
+            pool_medido.connect()
+    stats = db_mod.pool_stats()
+    assert stats["timeouts"] == 1
+    assert stats["espera_ms_max"] >= 150  # esperou o pool_timeout inteiro
+    assert stats["espera_ms_total"] >= stats["espera_ms_max"]
+
+
+def test_pool_stats_mostra_conexoes_do_pool(pool_medido):
+    with pool_medido.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        stats = db_mod.pool_stats()
+        assert stats["tamanho"] == 1 and stats["em_uso"] == 1 and stats["ociosas"] == 0
+    stats = db_mod.pool_stats()
+    assert stats["em_uso"] == 0 and stats["ociosas"] == 1
+    assert stats["config"]["pool_size"] == db_mod.DB_POOL_SIZE
+    assert stats["espera_ms_media"] == 0.0  # nenhum checkout contado pelos listeners deste engine
+
+
+def test_contadores_do_engine_da_aplicacao(servidor, monkeypatch):
+    monkeypatch.setattr(db_mod, "_pool_contadores", dict.fromkeys(db_mod._pool_contadores, 0))
+    with db_mod.engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    stats = db_mod.pool_stats()
+    assert stats["checkouts"] == 1 and stats["checkins"] == 1
+
+
+def test_ver_pdf_usa_a_sessao_da_requisicao(servidor, db_sessao, monkeypatch, tmp_path):
+    db_sessao.add(PropostaDB(id="p1", cliente_nome="Ana", payload={"cliente_nome": "Ana"}))
+    db_sessao.commit()
+    pdf = tmp_path / "p1.pdf"
+    pdf.write_bytes(b"%PDF-1.4 cache")
+    sessoes = []
+
+    def sessao_contada():
+        sessoes.append(db_mod.SessionLocal())
+        return sessoes[-1]
+
+    monkeypatch.setattr(servidor, "USE_DB", True)
+    monkeypatch.setattr(servidor, "SessionLocal", sessao_contada)
+
+    def lookup(db, proposta_id, chave):
+        assert db is servidor.g.get("_db_sessao")  # a sessão compartilhada da requisição
+        return pdf
+
+    monkeypatch.setattr(servidor.pdf_store, "lookup", lookup)
+    resp = servidor.app.test_client().get("/proposta/p1/ver-pdf")
+    assert resp.status_code == 200 and resp.data == b"%PDF-1.4 cache"
+    assert len(sessoes) == 1
+
+
+def test_job_de_pdf_abre_e_fecha_sessao_propria(servidor, monkeypatch):
+    sessoes, recebidas, fechadas = [], [], []
+
+    def sessao_contada():
+        sessao = db_mod.SessionLocal()
+        sessao.close = lambda: fechadas.append(sessao)
+        sessoes.append(sessao)
+        return sessao
+
+    def obter(proposta_id, force_regenerate=False, origem="", db=None):
+        recebidas.append(db)
+        return None, None
+
+    monkeypatch.setattr(servidor, "SessionLocal", sessao_contada)
+    monkeypatch.setattr(servidor, "_obter_pdf_proposta", obter)
+    assert servidor._render_pdf_job("p1", False) is None
+    assert recebidas == sessoes == fechadas and len(sessoes) == 1
@@ -0,0 +1,89 @@
+"""
+Pool de gráficos (graficos_pool.render_graficos): prazo do lote e fallback inline.
+Gráficos falsos (funções deste módulo) num pool com fork, para o worker enxergá-las.
+"""
+import os
+import time
+
+import pytest
+
+import graficos_pool
+
+PID_TESTE = os.getpid()
+
+
+def _rapido(dados):
+    return b"png-rapido"
+
+
+def _moderado(dados):
+    time.sleep(0.7)
+    return b"png-moderado"
+
+
+def _lento(dados):
+    time.sleep(30)
+    return b"png-lento"
+
+
+def _derruba_o_worker(dados):
+    """Mata o processo do pool (BrokenProcessPool); inline, no processo do teste, desenha."""
+    if os.getpid() != PID_TESTE:
+        os._exit(1)
+    return b"png-inline"
+
+
+def _com_erro(dados):
+    raise ValueError("dado inválido")
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    if "fork" not in graficos_pool.multiprocessing.get_all_start_methods():
+        pytest.skip("fork indisponível nesta plataforma")
+    monkeypatch.setenv("GRAFICOS_POOL_START_METHOD", "fork")
+    monkeypatch.setattr(graficos_pool, "GRAFICOS_POOL_WORKERS", 2)
+    monkeypatch.setattr(graficos_pool, "_warm_worker", lambda: None)
+    monkeypatch.setattr(graficos_pool, "GRAFICOS", {
+        "rapido": _rapido, "moderado": _moderado, "moderado2": _moderado, "lento": _lento,
+        "derruba": _derruba_o_worker, "erro": _com_erro,
+    })
+    graficos_pool._reset_pool(terminar=True)
+    yield graficos_pool
+    graficos_pool._reset_pool(terminar=True)
+
+
+def test_lote_no_prazo(pool):
+    assert pool.render_graficos({}, ["rapido", "erro"], timeout_s=10) == {"rapido": b"png-rapido"}
+    assert pool._POOL is not None  # erro de um gráfico não descarta o pool
+
+
+def test_grafico_lento_estoura_o_prazo_e_o_pool_e_reiniciado(pool):
+    inicio = time.monotonic()
+    out = pool.render_graficos({}, ["lento", "rapido"], timeout_s=1)
+    assert out == {"rapido": b"png-rapido"}
+    assert time.monotonic() - inicio < 5
+    assert pool._POOL is None
+    # O próximo lote sobe outro pool e não herda o gráfico travado
+    assert pool.render_graficos({}, ["rapido"], timeout_s=5) == {"rapido": b"png-rapido"}
+
+
+def test_grafico_na_fila_interna_nao_conta_prazo_antes_de_rodar(pool, monkeypatch):
+    # 1 worker: "moderado2" aparece como running() já na submissão (fila interna do
+    # ProcessPoolExecutor), mas só roda depois do primeiro; o prazo é do lote (2 rodadas)
+    monkeypatch.setattr(pool, "GRAFICOS_POOL_WORKERS", 1)
+    pool._reset_pool(terminar=True)
+    out = pool.render_graficos({}, ["moderado", "moderado2"], timeout_s=1)
+    assert out == {"moderado": b"png-moderado", "moderado2": b"png-moderado"}
+    assert pool._POOL is not None
+
+
+def test_pool_quebrado_desenha_inline(pool):
+    out = pool.render_graficos({}, ["derruba", "rapido"], timeout_s=10)
+    assert out["derruba"] == b"png-inline"
+    assert out["rapido"] == b"png-rapido"
+
+
+def test_sem_pool_desenha_inline(pool, monkeypatch):
+    monkeypatch.setattr(pool, "GRAFICOS_POOL_WORKERS", 0)
+    assert pool.render_graficos({}, ["derruba", "erro"]) == {"derruba": b"png-inline"}
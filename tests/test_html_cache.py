@@ -0,0 +1,70 @@
+"""Chave/ETag do HTML renderizado e o cache em memória + disco (html_cache)."""
+import html_cache as hc
+from html_cache import HtmlCache, cache_key, etag_for, etag_matches, payload_hash, render_fingerprint
+
+
+def _template(tmp_path, conteudo="<html>{{nome}}</html>"):
+    p = tmp_path / "template.html"
+    p.write_text(conteudo, encoding="utf-8")
+    return p
+
+
+def test_payload_hash_ignora_campos_volateis():
+    base = {"cliente_nome": "Ana", "potencia": 5.5}
+    volatil = {**base, "status": "fechado", "updated_at": "2026-01-01", "graficos_base64": {"g1": "x"}}
+    assert payload_hash(base) == payload_hash(volatil)
+    assert payload_hash(base) != payload_hash({**base, "potencia": 6.0})
+
+
+def test_payload_hash_independe_da_ordem_das_chaves():
+    assert payload_hash({"a": 1, "b": 2}) == payload_hash({"b": 2, "a": 1})
+
+
+def test_cache_key_com_fingerprint_igual_a_do_payload(tmp_path):
+    tpl = _template(tmp_path)
+    payload = {"cliente_nome": "Ana"}
+    assert cache_key(payload, tpl, "x") == cache_key(None, tpl, "x", fingerprint=render_fingerprint(payload))
+
+
+def test_cache_key_muda_com_template_extra_e_versao(tmp_path, monkeypatch):
+    tpl = _template(tmp_path)
+    payload = {"cliente_nome": "Ana"}
+    chave = cache_key(payload, tpl, "fp:1")
+    assert cache_key(payload, tpl, "fp:2") != chave
+    tpl.write_text("<html>outro {{nome}}</html>", encoding="utf-8")
+    assert cache_key(payload, tpl, "fp:1") != chave
+    atual = cache_key(payload, tpl, "fp:1")
+    monkeypatch.setattr(hc, "ENGINE_VERSION", "teste")
+    assert cache_key(payload, tpl, "fp:1") != atual
+
+
+def test_etag_matches():
+    chave = "a" * 64
+    tag = etag_for(chave)
+    assert etag_matches(tag, chave)
+    assert etag_matches(f'"outra", W/{tag}', chave)
+    assert etag_matches("*", chave)
+    assert not etag_matches('"outra"', chave)
+    assert not etag_matches(None, chave)
+
+
+def test_cache_guarda_so_a_ultima_versao_da_proposta(tmp_path):
+    cache = HtmlCache(tmp_path / "cache", mem_items=8, disk_max_bytes=1 << 20)
+    cache.put("p1", "k1" * 20, "<p>v1</p>")
+    cache.put("p1", "k2" * 20, "<p>v2</p>")
+    assert cache.get("p1", "k1" * 20) is None
+    assert cache.get("p1", "k2" * 20) == "<p>v2</p>"
+    assert len(list((tmp_path / "cache").glob("p1.*.html"))) == 1
+
+
+def test_cache_em_disco_compartilhado_entre_instancias(tmp_path):
+    HtmlCache(tmp_path / "cache", mem_items=8, disk_max_bytes=1 << 20).put("p1", "k" * 40, "<p>ok</p>")
+    outro_worker = HtmlCache(tmp_path / "cache", mem_items=8, disk_max_bytes=1 << 20)
+    assert outro_worker.get("p1", "k" * 40) == "<p>ok</p>"
+
+
+def test_invalidate_remove_memoria_e_disco(tmp_path):
+    cache = HtmlCache(tmp_path / "cache", mem_items=8, disk_max_bytes=1 << 20)
+    cache.put("p1", "k" * 40, "<p>ok</p>")
+    cache.invalidate("p1")
+    assert cache.get("p1", "k" * 40) is None
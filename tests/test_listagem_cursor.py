@@ -0,0 +1,92 @@
+"""Paginação por cursor (keyset em (created_at, id)) de /projetos/list."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from db import PropostaDB
+
+
+def _paginas(buscar, servidor, **args):
+    """Percorre todas as páginas seguindo o cursor; devolve a lista de páginas (ids)."""
+    paginas, cursor = [], None
+    while True:
+        params = dict(args, **({"cursor": cursor} if cursor else {}))
+        f = servidor._filtros_listagem(params)
+        itens, ultimo, tem_mais = buscar(f)
+        paginas.append(itens)
+        if not tem_mais:
+            return paginas
+        cursor = servidor._encode_cursor(*ultimo)
+
+
+def test_cursor_ida_e_volta(servidor):
+    cursor = servidor._encode_cursor("2026-01-01T10:00:00", "abc")
+    assert "=" not in cursor
+    assert servidor._decode_cursor(cursor) == ("2026-01-01T10:00:00", "abc")
+
+
+@pytest.mark.parametrize("ruim", ["nao-e-base64!", "", "W10"])
+def test_cursor_invalido(servidor, ruim):
+    with pytest.raises(ValueError):
+        servidor._decode_cursor(ruim)
+
+
+def test_filtros_listagem(servidor):
+    f = servidor._filtros_listagem({"limit": "100000", "status": "lead, fechado", "vendedor": "Todos"})
+    assert f["paginado"] and f["limit"] == servidor.LISTAGEM_LIMIT_MAX
+    assert f["status"] == ["lead", "fechado"]
+    assert f["vendedor"] == ""
+    assert not servidor._filtros_listagem({})["paginado"]
+    with pytest.raises(ValueError):
+        servidor._filtros_listagem({"ordem": "lado"})
+
+
+def test_modo_arquivo_percorre_tudo_sem_repetir(servidor):
+    # Três projetos com a mesma data: o id desempata
+    projetos = [{"id": f"p{i}", "created_date": "2026-01-01T00:00:00" if i < 3 else f"2026-01-0{i}T00:00:00",
+                 "status": "lead"} for i in range(7)]
+
+    def buscar(f):
+        itens = servidor._filtrar_lista_arquivos(projetos, f)[:f["limit"] + 1]
+        tem_mais = len(itens) > f["limit"]
+        itens = itens[:f["limit"]]
+        return [p["id"] for p in itens], (itens[-1]["created_date"], itens[-1]["id"]), tem_mais
+
+    for ordem in ("desc", "asc"):
+        paginas = _paginas(buscar, servidor, limit="2", ordem=ordem)
+        ids = [i for pg in paginas for i in pg]
+        assert sorted(ids) == sorted(p["id"] for p in projetos)
+        assert len(ids) == len(set(ids))
+        assert all(len(pg) <= 2 for pg in paginas)
+    assert ids[:3] == ["p0", "p1", "p2"]
+
+
+def test_sql_keyset_com_datas_empatadas(servidor, db_sessao):
+    t0 = datetime(2026, 1, 1)
+    for i in range(7):
+        db_sessao.add(PropostaDB(
+            id=f"p{i}", created_at=t0 if i < 3 else t0 + timedelta(hours=i),
+            payload={"status": "lead" if i % 2 else "fechado", "nome_projeto": f"Projeto {i}"},
+        ))
+    db_sessao.commit()
+
+    def buscar(f):
+        q = servidor._aplicar_filtros_listagem(db_sessao.query(PropostaDB.id, PropostaDB.created_at), f)
+        rows = q.limit(f["limit"] + 1).all()
+        tem_mais = len(rows) > f["limit"]
+        rows = rows[:f["limit"]]
+        return [r.id for r in rows], (rows[-1].created_at.isoformat(), rows[-1].id), tem_mais
+
+    paginas = _paginas(buscar, servidor, limit="2")
+    assert [i for pg in paginas for i in pg] == ["p6", "p5", "p4", "p3", "p2", "p1", "p0"]
+    paginas = _paginas(buscar, servidor, limit="2", status="lead")
+    assert [i for pg in paginas for i in pg] == ["p5", "p3", "p1"]
+
+
+def test_sql_keyset_compara_a_tupla(servidor, db_sessao):
+    f = servidor._filtros_listagem({"cursor": servidor._encode_cursor("2026-01-01T00:00:00", "p1")})
+    q = servidor._aplicar_filtros_listagem(db_sessao.query(PropostaDB.id), f)
+    sql = str(q.statement.compile(dialect=postgresql.dialect()))
+    assert "(propostas.created_at, propostas.id) < (" in sql
+    assert "ORDER BY propostas.created_at DESC, propostas.id DESC" in sql
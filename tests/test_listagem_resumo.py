@@ -0,0 +1,110 @@
+"""
+/projetos/list lê os campos do payload do resumo gravado na linha (propostas.resumo),
+nunca do payload; a resposta antiga (sem limit/cursor) é limitada.
+"""
+import re
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import event, text
+from sqlalchemy.dialects import postgresql
+
+import db as db_mod
+from db import PropostaDB, PropostaVisibilidadeDB
+
+
+@pytest.fixture
+def listagem(servidor, db_sessao, monkeypatch):
+    """Rota no modo banco (SQLite de teste), autenticada como admin."""
+    monkeypatch.setattr(servidor, "USE_DB", True)
+    monkeypatch.setattr(servidor, "_current_user_row",
+                        lambda: SimpleNamespace(uid="u1", email="admin@x.com", role="admin"))
+    t0 = datetime(2026, 1, 1)
+    for i in range(5):
+        db_sessao.add(PropostaDB(id=f"p{i}", created_at=t0 + timedelta(hours=i), cliente_nome=f"Cliente {i}", payload={
+            "nome_projeto": f"Projeto {i}", "status": "fechado" if i % 2 else "lead", "prioridade": "Alta",
+            "vendedor_email": "bia@x.com", "graficos_base64": {"g": "x" * 1000},
+        }))
+    db_sessao.commit()
+    return servidor.app.test_client()
+
+
+@pytest.fixture
+def comandos():
+    lista = []
+
+    def registrar(conn, cursor, sql, *args):
+        lista.append(sql)
+
+    event.listen(db_mod.engine, "before_cursor_execute", registrar)
+    yield lista
+    event.remove(db_mod.engine, "before_cursor_execute", registrar)
+
+
+def _le_payload(sql):
+    return re.search(r"propostas\.payload\b", sql) is not None
+
+
+def test_consulta_nao_referencia_o_payload(servidor, db_sessao):
+    f = servidor._filtros_listagem({"limit": "10", "status": "lead", "vendedor": "bia", "q": "proj"})
+    q = servidor._listagem_query(db_sessao).join(
+        PropostaVisibilidadeDB, PropostaVisibilidadeDB.proposta_id == PropostaDB.id)
+    sql = str(servidor._aplicar_filtros_listagem(q, f).statement.compile(dialect=postgresql.dialect()))
+    assert not _le_payload(sql)
+    assert "propostas.resumo ->> " in sql
+
+
+def test_resumo_mantido_ao_gravar(servidor, db_sessao):
+    db_sessao.add(PropostaDB(id="p1", payload={"status": "lead", "prioridade": "Alta", "kit": {"grande": 1}}))
+    db_sessao.commit()
+    row = db_sessao.get(PropostaDB, "p1")
+    assert row.resumo == {"status": "lead", "prioridade": "Alta"}
+    row.payload = {**row.payload, "status": "fechado"}
+    db_sessao.commit()
+    db_sessao.expire_all()
+    assert db_sessao.get(PropostaDB, "p1").resumo["status"] == "fechado"
+
+
+def test_rota_lista_pelo_resumo_sem_ler_payload(listagem, comandos):
+    resp = listagem.get("/projetos/list?limit=2&status=fechado")
+    corpo = resp.get_json()
+    assert resp.status_code == 200
+    assert [p["id"] for p in corpo["items"]] == ["p3", "p1"]
+    assert corpo["items"][0]["status"] == "fechado" and corpo["items"][0]["prioridade"] == "Alta"
+    assert corpo["items"][0]["nome_projeto"] == "Projeto 3"
+    assert corpo["has_more"] is False
+    assert comandos and not any(_le_payload(sql) for sql in comandos)
+
+
+def test_linha_sem_resumo_usa_as_colunas(listagem, db_sessao):
+    db_sessao.execute(text("UPDATE propostas SET resumo = NULL, status = 'negociacao', nome_projeto = 'Coluna' "
+                           "WHERE id = 'p4'"))
+    db_sessao.commit()
+    item = listagem.get("/projetos/list?limit=1").get_json()["items"][0]
+    assert item["id"] == "p4"
+    assert item["status"] == "negociacao" and item["nome_projeto"] == "Coluna"
+    assert item["prioridade"] == "Normal"
+    ids = [p["id"] for p in listagem.get("/projetos/list?limit=10&status=negociacao").get_json()["items"]]
+    assert ids == ["p4"]
+
+
+def test_resposta_antiga_limitada(listagem, servidor, monkeypatch):
+    monkeypatch.setattr(servidor, "LISTAGEM_LEGADO_MAX", 3)
+    resp = listagem.get("/projetos/list")
+    assert [p["id"] for p in resp.get_json()] == ["p4", "p3", "p2"]
+    cursor = resp.headers["X-Next-Cursor"]
+    resto = listagem.get(f"/projetos/list?cursor={cursor}").get_json()
+    assert [p["id"] for p in resto["items"]] == ["p1", "p0"]
+    monkeypatch.setattr(servidor, "LISTAGEM_LEGADO_MAX", 10)
+    resp = listagem.get("/projetos/list")
+    assert len(resp.get_json()) == 5 and "X-Next-Cursor" not in resp.headers
+
+
+def test_status_do_kanban_atualiza_payload_e_resumo(listagem, db_sessao):
+    resp = listagem.post("/projetos/status", json={"id": "p0", "status": "negociacao"})
+    assert resp.get_json()["success"]
+    db_sessao.expire_all()
+    row = db_sessao.get(PropostaDB, "p0")
+    assert row.payload["status"] == "negociacao"
+    assert row.resumo["status"] == "negociacao" and row.status == "negociacao"
@@ -0,0 +1,85 @@
+"""
+Migração leve do init_db: assinatura em schema_version (caminho rápido), colunas
+faltantes numa consulta ao catálogo e DEFAULT das colunas novas.
+"""
+import pytest
+from sqlalchemy import Column, MetaData, String, Table, create_engine, text
+
+import db as db_mod
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    """SQLite vazio no lugar do engine da aplicação."""
+    engine = create_engine(f"sqlite:///{tmp_path}/migracao.db")
+    monkeypatch.setattr(db_mod, "engine", engine)
+    monkeypatch.setattr(db_mod, "DATABASE_URL", f"sqlite:///{tmp_path}/migracao.db")
+    yield engine
+    engine.dispose()
+
+
+def _colunas(engine, tabela):
+    with engine.connect() as conn:
+        return {r[1]: r for r in conn.execute(text(f"PRAGMA table_info({tabela})"))}
+
+
+def test_versao_gravada_sem_tabela(banco):
+    assert db_mod._versao_gravada() is None
+    with banco.begin() as conn:
+        assert db_mod._versao_gravada(conn) is None
+        assert conn.execute(text("SELECT 1")).scalar() == 1  # a transação segue utilizável
+
+
+def test_init_db_grava_a_versao_e_depois_pula(banco, monkeypatch):
+    db_mod.init_db()
+    assert db_mod._versao_gravada() == db_mod._assinatura_schema()
+    monkeypatch.setattr(db_mod.Base.metadata, "create_all",
+                        lambda *a, **k: pytest.fail("migrou com o schema em dia"))
+    db_mod.init_db()
+
+
+def test_assinatura_acompanha_a_versao_dos_passos(banco, monkeypatch):
+    atual = db_mod._assinatura_schema()
+    assert atual.startswith(f"{db_mod.SCHEMA_VERSAO}-")
+    monkeypatch.setattr(db_mod, "SCHEMA_VERSAO", db_mod.SCHEMA_VERSAO + 1)
+    assert db_mod._assinatura_schema() != atual
+
+
+def test_colunas_faltantes_sao_adicionadas(banco):
+    with banco.begin() as conn:
+        conn.execute(text("CREATE TABLE propostas (id VARCHAR PRIMARY KEY, payload JSON)"))
+        conn.execute(text("INSERT INTO propostas (id, payload) VALUES ('antiga', '{}')"))
+    db_mod.init_db()
+    colunas = _colunas(banco, "propostas")
+    assert set(colunas) == {c.name for c in db_mod.PropostaDB.__table__.columns}
+    assert colunas["versao"][3] == 1 and colunas["versao"][4] == "'1'"  # NOT NULL DEFAULT '1'
+    with banco.connect() as conn:
+        assert conn.execute(text("SELECT versao FROM propostas WHERE id = 'antiga'")).scalar() == 1
+        assert db_mod._adicionar_colunas_faltantes(conn) == 0
+
+
+def test_versao_nao_gravada_com_passo_pendente(banco, monkeypatch):
+    monkeypatch.setattr(db_mod, "_derivadas_pendentes", lambda conn: True)
+    db_mod.init_db()
+    assert db_mod._versao_gravada() is None
+
+
+def test_ddl_do_default_sai_pelo_dialeto(banco):
+    tabela = Table("t", MetaData(),
+                   Column("a", String(10), server_default="it's", nullable=False),
+                   Column("b", String(10), server_default=text("'x' || 'y'")))
+    assert db_mod._ddl_coluna(tabela.c.a) == "a VARCHAR(10) DEFAULT 'it''s' NOT NULL"
+    assert db_mod._ddl_coluna(tabela.c.b) == "b VARCHAR(10) DEFAULT 'x' || 'y'"
+
+
+def test_versao_gravada_na_transacao_do_postgres(postgres, monkeypatch):
+    monkeypatch.setattr(db_mod, "engine", postgres)
+    with postgres.begin() as conn:
+        conn.execute(text("DROP TABLE schema_version"))
+        assert db_mod._versao_gravada(conn) is None
+        assert conn.execute(text("SELECT 1")).scalar() == 1  # o erro não abortou a transação
+        db_mod.SchemaVersionDB.__table__.create(conn)
+        db_mod._gravar_versao(conn, "v1")
+        assert db_mod._versao_gravada(conn) == "v1"
+        db_mod._gravar_versao(conn, "v2")  # UPDATE da linha única
+    assert db_mod._versao_gravada() == "v2"
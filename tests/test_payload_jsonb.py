@@ -0,0 +1,103 @@
+"""
+Conversão online de propostas.payload de json para jsonb (db.migrar_payload_jsonb):
+coluna sombra + trigger, cópia em lotes, troca curta e índices de expressão.
+Só Postgres (TEST_POSTGRES_URL).
+"""
+import json
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import db as db_mod
+
+
+@pytest.fixture
+def pg_json(postgres, monkeypatch):
+    """Schema descartável com o payload ainda em json e três propostas gravadas."""
+    monkeypatch.setattr(db_mod, "engine", postgres)
+    monkeypatch.setattr(db_mod, "DATABASE_URL", "postgresql://teste")
+    monkeypatch.setattr(db_mod, "PAYLOAD_JSONB_LOTE", 2)
+    with postgres.begin() as conn:
+        conn.execute(text("ALTER TABLE propostas ALTER COLUMN payload TYPE json USING payload::json"))
+        for i in range(3):
+            conn.execute(text("INSERT INTO propostas (id, payload) VALUES (:i, CAST(:p AS json))"),
+                         {"i": f"p{i}", "p": json.dumps({"cliente_nome": f"Cliente {i}", "i": i})})
+        conn.execute(text("INSERT INTO propostas (id) VALUES ('sem-payload')"))
+    return postgres
+
+
+def _valor(engine, sql, **params):
+    with engine.connect() as conn:
+        return conn.execute(text(sql), params).scalar()
+
+
+def _payloads(engine):
+    with engine.connect() as conn:
+        return dict(conn.execute(text("SELECT id, payload::text FROM propostas")).all())
+
+
+def test_migracao_completa_preserva_os_dados(pg_json, monkeypatch):
+    reinicios = []
+    monkeypatch.setattr(db_mod, "init_db", lambda: reinicios.append(1))
+    antes = {k: json.loads(v) if v else None for k, v in _payloads(pg_json).items()}
+
+    assert db_mod.migrar_payload_jsonb() is True
+    with pg_json.connect() as conn:
+        assert db_mod._tipo_payload(conn) == "jsonb"
+    depois = {k: json.loads(v) if v else None for k, v in _payloads(pg_json).items()}
+    assert depois == antes
+    assert _valor(pg_json, "SELECT count(*) FROM information_schema.columns "
+                           "WHERE table_schema = current_schema() AND table_name = 'propostas' "
+                           "AND column_name IN ('payload_jsonb', 'payload_json_antigo')") == 0
+    assert _valor(pg_json, "SELECT count(*) FROM pg_trigger WHERE tgname = 'trg_propostas_payload_jsonb'") == 0
+    assert reinicios == [1]  # init_db cria os índices e grava a versão
+    assert db_mod.migrar_payload_jsonb() is True  # já é jsonb: nada a fazer
+
+
+def test_boot_prepara_e_so_troca_sem_pendencias(pg_json):
+    assert db_mod._payload_jsonb_no_boot() is False  # linhas ainda sem cópia
+    with pg_json.begin() as conn:
+        assert db_mod._tipo_payload(conn) == "json"
+        # Gravações durante a cópia: o trigger mantém a coluna sombra
+        conn.execute(text("UPDATE propostas SET payload = CAST('{\"novo\": 1}' AS json) WHERE id = 'p0'"))
+        conn.execute(text("INSERT INTO propostas (id, payload) VALUES ('p9', CAST('{\"a\": 9}' AS json))"))
+    assert _valor(pg_json, "SELECT payload_jsonb::text FROM propostas WHERE id = 'p0'") == '{"novo": 1}'
+    assert _valor(pg_json, "SELECT payload_jsonb::text FROM propostas WHERE id = 'p9'") == '{"a": 9}'
+    assert _valor(pg_json, "SELECT count(*) FROM propostas WHERE payload_jsonb IS NULL AND payload IS NOT NULL") == 2
+
+    assert db_mod._copiar_payload_jsonb() == 2  # lotes de PAYLOAD_JSONB_LOTE
+    assert db_mod._payload_jsonb_no_boot() is True  # cópia completa: troca no boot
+    with pg_json.connect() as conn:
+        assert db_mod._tipo_payload(conn) == "jsonb"
+    assert json.loads(_payloads(pg_json)["p0"]) == {"novo": 1}
+
+
+def test_outro_processo_com_o_lock_adia(pg_json, monkeypatch):
+    monkeypatch.setattr(db_mod, "init_db", lambda: pytest.fail("init_db sem migrar"))
+    outro = create_engine(pg_json.url)
+    try:
+        with outro.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(hashtext('fohat_payload_jsonb'))"))
+            assert db_mod.migrar_payload_jsonb() is False
+            assert db_mod._payload_jsonb_no_boot() is False
+            conn.execute(text("SELECT pg_advisory_unlock(hashtext('fohat_payload_jsonb'))"))
+    finally:
+        outro.dispose()
+    with pg_json.connect() as conn:
+        assert db_mod._tipo_payload(conn) == "json"
+
+
+def test_indices_do_payload_so_com_jsonb(pg_json, monkeypatch):
+    monkeypatch.setattr(db_mod, "init_db", lambda: None)
+    assert db_mod._criar_indices_payload() is False
+    db_mod.migrar_payload_jsonb()
+    assert db_mod._criar_indices_payload() is True
+    with pg_json.connect() as conn:
+        nomes = {r[0] for r in conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = 'propostas'"))}
+    assert set(db_mod._INDICES_PAYLOAD) <= nomes
+
+
+def test_sem_postgres_nao_migra(monkeypatch):
+    monkeypatch.setattr(db_mod, "DATABASE_URL", "sqlite:///x.db")
+    assert db_mod.migrar_payload_jsonb() is False
@@ -0,0 +1,154 @@
+"""Exportação em lote dos PDFs como ZIP (pdf_export): streaming, erros e o job em background."""
+import io
+import json
+import os
+import threading
+import time
+import zipfile
+
+import pytest
+
+import pdf_export
+from pdf_export import ExportJobs, escrever_zip, stream_zip
+from pdf_jobs import QueueFull
+from pdf_service import RenderSaturated
+
+
+@pytest.fixture
+def pdfs(tmp_path):
+    """Três PDFs falsos; o último maior que um bloco de leitura."""
+    conteudos = {
+        "a": b"%PDF-a",
+        "b": b"%PDF-b",
+        "c": b"%PDF-" + os.urandom(3 * pdf_export._CHUNK),
+    }
+    caminhos = {}
+    for pid, dados in conteudos.items():
+        caminhos[pid] = tmp_path / f"{pid}.pdf"
+        caminhos[pid].write_bytes(dados)
+    return caminhos, conteudos
+
+
+def _obter(caminhos):
+    def obter(pid):
+        if pid == "quebrada":
+            raise RuntimeError("falhou a renderização")
+        if pid not in caminhos:
+            return None, None
+        return caminhos[pid], {"cliente_nome": "Mesmo Cliente" if pid in ("a", "b") else pid}
+    return obter
+
+
+def _nomear(pid, payload):
+    return f"{payload.get('cliente_nome')}.pdf"
+
+
+def test_zip_com_entradas_nomes_unicos_e_erros(pdfs):
+    caminhos, conteudos = pdfs
+    progresso = []
+    dados = b"".join(stream_zip(["a", "b", "c", "sumiu", "quebrada"], _obter(caminhos), _nomear,
+                                progresso=lambda e, err: progresso.append((e, err))))
+    with zipfile.ZipFile(io.BytesIO(dados)) as zf:
+        assert zf.testzip() is None
+        nomes = set(zf.namelist())
+        assert nomes == {"Mesmo Cliente.pdf", "Mesmo Cliente (2).pdf", "c.pdf", "ERROS.txt"}
+        assert {zf.read("Mesmo Cliente.pdf"), zf.read("Mesmo Cliente (2).pdf")} == {conteudos["a"], conteudos["b"]}
+        assert zf.read("c.pdf") == conteudos["c"]
+        erros = zf.read("ERROS.txt").decode("utf-8")
+    assert "sumiu: proposta não encontrada" in erros
+    assert "quebrada: falhou a renderização" in erros
+    assert progresso[-1] == (3, 2)
+
+
+def test_zip_sai_em_blocos_antes_de_obter_tudo(pdfs):
+    caminhos, _ = pdfs
+    chamadas = []
+
+    def obter(pid):
+        chamadas.append(pid)
+        return caminhos["c"], {"cliente_nome": pid}
+
+    ids = [f"p{i}" for i in range(20)]
+    gerador = stream_zip(ids, obter, _nomear, paralelo=1)
+    primeiro = next(gerador)
+    assert primeiro  # já há bytes do ZIP com a primeira entrada
+    assert len(chamadas) < len(ids)  # janela limitada: o resto ainda não foi pedido
+    gerador.close()
+    time.sleep(0.1)
+    assert len(chamadas) < len(ids)  # fechar o gerador cancela os pendentes
+
+
+def test_saturado_espera_e_tenta_de_novo(pdfs, monkeypatch):
+    caminhos, conteudos = pdfs
+    monkeypatch.setattr(pdf_export.time, "sleep", lambda s: None)
+    tentativas = []
+
+    def obter(pid):
+        tentativas.append(pid)
+        if len(tentativas) == 1:
+            raise RenderSaturated("ocupado", retry_after=1)
+        return caminhos["a"], {"cliente_nome": "a"}
+
+    dados = b"".join(stream_zip(["a"], obter, _nomear))
+    with zipfile.ZipFile(io.BytesIO(dados)) as zf:
+        assert zf.namelist() == ["a.pdf"]
+    assert len(tentativas) == 2
+
+
+def test_escrever_zip_troca_atomica(pdfs, tmp_path):
+    caminhos, _ = pdfs
+    destino = tmp_path / "saida" / "export.zip"
+    tamanho = escrever_zip(["a", "c"], _obter(caminhos), _nomear, destino)
+    assert tamanho == destino.stat().st_size
+    assert zipfile.is_zipfile(destino)
+    assert [p.name for p in destino.parent.iterdir()] == ["export.zip"]
+
+
+def _esperar(jobs, job_id, timeout=5.0):
+    fim = time.monotonic() + timeout
+    while time.monotonic() < fim:
+        job = jobs.get(job_id)
+        if job and job["status"] in ("done", "error"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("job não terminou")
+
+
+def test_job_em_background_grava_o_zip(pdfs, tmp_path):
+    caminhos, _ = pdfs
+    jobs = ExportJobs(base_dir=tmp_path / "exports", workers=1, max_pending=2)
+    job = jobs.submit(["a", "b", "sumiu"], _obter(caminhos), _nomear, filtros={"status": ["fechado"]})
+    assert job["status"] == "queued"
+    final = _esperar(jobs, job["job_id"])
+    assert final["status"] == "done"
+    assert (final["total"], final["exportados"], final["erros"]) == (3, 2, 1)
+    zip_path = jobs.result_path(job["job_id"])
+    assert zip_path is not None and zipfile.is_zipfile(zip_path)
+    assert final["size"] == zip_path.stat().st_size
+    assert set(pdf_export.public_view(final)) >= {"job_id", "status", "total", "size"}
+    assert "owner_pid" not in pdf_export.public_view(final)
+
+
+def test_fila_cheia_e_job_orfao(pdfs, tmp_path):
+    caminhos, _ = pdfs
+    liberar = threading.Event()
+
+    def obter_lento(pid):
+        liberar.wait(5)
+        return caminhos["a"], {"cliente_nome": pid}
+
+    jobs = ExportJobs(base_dir=tmp_path / "exports", workers=1, max_pending=1)
+    job = jobs.submit(["a"], obter_lento, _nomear)
+    try:
+        with pytest.raises(QueueFull):
+            jobs.submit(["b"], obter_lento, _nomear)
+    finally:
+        liberar.set()
+    assert _esperar(jobs, job["job_id"])["status"] == "done"
+
+    # Estado deixado por um worker que morreu no meio da exportação
+    orfao = dict(job, job_id="orfao", status="running", owner_pid=2 ** 22 + 12345)
+    (tmp_path / "exports" / "orfao.json").write_text(json.dumps(orfao), encoding="utf-8")
+    assert jobs.get("orfao")["status"] == "error"
+    assert jobs.result_path("orfao") is None
+    assert jobs.get("../fora") is None
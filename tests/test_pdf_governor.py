@@ -0,0 +1,96 @@
+"""Controle de admissão das renderizações de PDF (pdf_service.render_slot)."""
+import threading
+import time
+
+import pytest
+
+import pdf_service
+from pdf_service import RenderSaturated, render_slot
+
+pytestmark = pytest.mark.skipif(pdf_service.fcntl is None, reason="flock indisponível nesta plataforma")
+
+
+@pytest.fixture
+def governador(tmp_path, monkeypatch):
+    """Uma vaga de renderização e um lugar na fila, em diretório próprio."""
+    monkeypatch.setattr(pdf_service, "_SLOTS_DIR", tmp_path / "slots")
+    monkeypatch.setattr(pdf_service, "PDF_RENDER_MAX_CONCURRENT", 1)
+    monkeypatch.setattr(pdf_service, "PDF_RENDER_QUEUE", 1)
+    monkeypatch.setattr(pdf_service, "_admissao", dict.fromkeys(pdf_service._admissao, 0))
+    return pdf_service
+
+
+def _ocupar(evento_ocupado, evento_soltar, segura_s=5.0):
+    """Thread que segura a vaga até `evento_soltar`."""
+    def _run():
+        with render_slot():
+            evento_ocupado.set()
+            evento_soltar.wait(segura_s)
+    t = threading.Thread(target=_run, daemon=True)
+    t.start()
+    assert evento_ocupado.wait(2)
+    return t
+
+
+def test_admite_ate_o_limite(governador):
+    with render_slot():
+        pass
+    with render_slot():
+        pass
+    assert governador.admission_stats()["admitidos"] == 2
+
+
+def test_fila_cheia_responde_saturado(governador, monkeypatch):
+    monkeypatch.setattr(governador, "PDF_RENDER_QUEUE", 0)
+    ocupado, soltar = threading.Event(), threading.Event()
+    t = _ocupar(ocupado, soltar)
+    try:
+        with pytest.raises(RenderSaturated) as exc:
+            with render_slot(timeout_s=1):
+                pass
+        assert exc.value.retry_after == 10
+        assert governador.admission_stats()["rejeitados_fila"] == 1
+    finally:
+        soltar.set()
+        t.join()
+
+
+def test_fila_espera_a_vaga_liberar(governador):
+    ocupado, soltar = threading.Event(), threading.Event()
+    t = _ocupar(ocupado, soltar)
+    threading.Timer(0.3, soltar.set).start()
+    t0 = time.monotonic()
+    with render_slot(timeout_s=5):
+        espera = time.monotonic() - t0
+    t.join()
+    assert 0.2 <= espera < 5
+    assert governador.admission_stats()["admitidos"] == 2
+
+
+def test_espera_esgotada_responde_saturado(governador):
+    ocupado, soltar = threading.Event(), threading.Event()
+    t = _ocupar(ocupado, soltar)
+    try:
+        with pytest.raises(RenderSaturated) as exc:
+            with render_slot(timeout_s=1):
+                pass
+        assert exc.value.retry_after == 1
+        assert governador.admission_stats()["rejeitados_espera"] == 1
+        # O lugar na fila foi devolvido: outro pedido consegue entrar nela
+        lugar = governador._try_slot("fila", governador.PDF_RENDER_QUEUE)
+        assert lugar is not None
+        governador._release_slot(lugar)
+    finally:
+        soltar.set()
+        t.join()
+
+
+def test_render_pdf_passa_pelo_governador(governador, monkeypatch):
+    dentro = []
+    monkeypatch.setattr(governador, "_render_pdf",
+                        lambda html, timeout_s: dentro.append(governador._try_slot("render", 1) is None) or b"%PDF")
+    assert governador.render_pdf("<html></html>") == b"%PDF"
+    assert dentro == [True]  # a vaga estava ocupada durante a renderização
+    vaga = governador._try_slot("render", 1)
+    assert vaga is not None  # e foi liberada ao final
+    governador._release_slot(vaga)
@@ -0,0 +1,171 @@
+"""
+Fila de PDFs (pdf_jobs): os workers da API só gravam o job; o consumidor (processo
+separado) pega os marcadores da fila e executa. Rota: fila cheia => 503 e `force`
+ignorado em chamada anônima.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import pdf_jobs as pdf_jobs_mod
+from pdf_jobs import PdfJobs, QueueFull, _pid_vivo
+
+PID_MORTO = 2 ** 22 + 12345
+
+
+@pytest.fixture
+def fila(tmp_path, monkeypatch):
+    """Fila em diretório próprio, sem subir consumidor; render devolve bytes."""
+    jobs = PdfJobs(base_dir=tmp_path / "jobs", workers=1, max_pending=2)
+    chamadas = []
+
+    def render(proposta_id, force):
+        chamadas.append((proposta_id, force))
+        return b"%PDF-" + proposta_id.encode()
+
+    jobs.configure(render)
+    monkeypatch.setattr(jobs, "ensure_consumer", lambda: None)
+    jobs.chamadas = chamadas
+    return jobs
+
+
+def _esperar(jobs, job_id, timeout_s=5.0):
+    limite = time.time() + timeout_s
+    while time.time() < limite:
+        job = jobs.get(job_id)
+        if job["status"] in ("done", "error"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("job não terminou")
+
+
+def test_submit_so_grava_e_o_consumidor_executa(fila):
+    job, criado = fila.submit("p1", "p1:h1", force=True)
+    assert criado and job["status"] == "queued" and job["owner_pid"] is None
+    assert fila.chamadas == []  # nada roda no processo que enfileirou
+    assert fila.stats()["pending"] == 1
+
+    parar = threading.Event()
+    t = threading.Thread(target=fila.consume, args=(parar,), daemon=True)
+    t.start()
+    try:
+        pronto = _esperar(fila, job["job_id"])
+    finally:
+        parar.set()
+        t.join(5)
+    assert pronto["status"] == "done" and pronto["size"] == len(b"%PDF-p1")
+    assert pronto["owner_pid"] is not None
+    assert fila.chamadas == [("p1", True)]
+    assert fila.result_path(job["job_id"]).read_bytes() == b"%PDF-p1"
+    assert fila.stats()["pending"] == 0
+    # Mesmo conteúdo: reaproveita o job pronto
+    assert fila.submit("p1", "p1:h1") == (pronto, False)
+
+
+def test_marcador_so_e_pego_uma_vez(fila):
+    job, _ = fila.submit("p1", "p1:h1")
+    outro = PdfJobs(base_dir=fila.base_dir)
+    assert fila._claim()["job_id"] == job["job_id"]
+    assert outro._claim() is None
+    assert fila.get(job["job_id"])["status"] == "running"
+
+
+def test_fila_cheia(fila):
+    fila.submit("p1", "p1:h1")
+    fila.submit("p2", "p2:h1")
+    with pytest.raises(QueueFull):
+        fila.submit("p3", "p3:h1")
+    # Pedido repetido não ocupa lugar na fila
+    assert fila.submit("p1", "p1:h1")[1] is False
+    fila._claim()
+    assert fila.submit("p3", "p3:h1")[1] is True
+
+
+def test_pid_vivo():
+    assert _pid_vivo(os.getpid())
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    assert not _pid_vivo(proc.pid)
+
+
+def test_job_em_execucao_de_consumidor_morto_vira_erro(fila):
+    job, _ = fila.submit("p1", "p1:h1")
+    fila._claim()
+    estado = json.loads(fila._path(job["job_id"]).read_text(encoding="utf-8"))
+    fila._write(dict(estado, owner_pid=PID_MORTO))
+    orfao = fila.get(job["job_id"])
+    assert orfao["status"] == "error" and "interrompido" in orfao["error"]
+    assert fila.result_path(job["job_id"]) is None
+    # Job órfão não é reaproveitado: um novo pedido cria outro job
+    assert fila.submit("p1", "p1:h1")[1] is True
+
+
+def test_job_na_fila_sobrevive_ao_consumidor_e_pede_outro(tmp_path, monkeypatch):
+    jobs = PdfJobs(base_dir=tmp_path / "jobs")
+    jobs.configure(lambda pid, force: b"%PDF")
+    subidas = []
+    monkeypatch.setattr(jobs, "ensure_consumer", lambda: subidas.append(1))
+    job, _ = jobs.submit("p1", "p1:h1")
+    assert jobs.get(job["job_id"])["status"] == "queued"
+    assert len(subidas) == 2  # no submit e na consulta
+
+
+def test_consumidor_unico_pelo_lock(tmp_path):
+    if pdf_jobs_mod.fcntl is None:
+        pytest.skip("flock indisponível nesta plataforma")
+    jobs = PdfJobs(base_dir=tmp_path / "jobs")
+    assert not jobs.consumer_alive()  # cria o diretório e o arquivo de lock
+    with open(jobs._lock_path(), "a") as fh:
+        pdf_jobs_mod.fcntl.flock(fh, pdf_jobs_mod.fcntl.LOCK_EX)
+        assert jobs.consumer_alive()
+    assert not jobs.consumer_alive()
+
+
+def test_consumidor_encerra_ocioso(fila):
+    inicio = time.time()
+    fila.consume(idle_s=0)
+    assert time.time() - inicio < 2
+
+
+@pytest.fixture
+def rota(servidor, monkeypatch):
+    """POST /propostas/<id>/pdf-jobs com fila falsa."""
+    pedidos = []
+
+    class FilaFalsa:
+        cheia = False
+
+        def submit(self, proposta_id, chave, force=False):
+            pedidos.append(force)
+            if self.cheia:
+                raise QueueFull("2 PDFs na fila")
+            return {"job_id": "j1", "proposta_id": proposta_id, "status": "queued"}, True
+
+    falsa = FilaFalsa()
+    monkeypatch.setattr(servidor, "pdf_jobs", falsa)
+    monkeypatch.setattr(servidor, "_pdf_key_proposta", lambda pid: "h1")
+    falsa.pedidos = pedidos
+    return falsa
+
+
+def test_fila_cheia_responde_503(servidor, rota):
+    rota.cheia = True
+    resp = servidor.app.test_client().post("/propostas/p1/pdf-jobs")
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == "5"
+    assert resp.get_json()["success"] is False
+
+
+def test_force_anonimo_e_ignorado(servidor, rota, monkeypatch):
+    cliente = servidor.app.test_client()
+    monkeypatch.setattr(servidor, "_require_auth", lambda: None)
+    resp = cliente.post("/propostas/p1/pdf-jobs", json={"force": True})
+    assert resp.status_code == 202 and resp.headers["Retry-After"]
+    monkeypatch.setattr(servidor, "_require_auth", lambda: "ana@x.com")
+    cliente.post("/propostas/p1/pdf-jobs?force=true")
+    assert rota.pedidos == [False, True]
@@ -0,0 +1,121 @@
+"""
+Renderização composta: separação dos slides estáticos (pdf_static.split_static) e
+volta ao HTML inteiro quando o renderizador recusa a composição (422).
+"""
+import io
+import json
+import urllib.error
+from pathlib import Path
+
+import pytest
+
+import pdf_service
+from pdf_service import RenderTimeout
+from pdf_static import STATIC_ATTR, split_static
+
+TEMPLATE = Path(__file__).resolve().parent.parent / "public" / "template.html"
+
+
+def _proposta(nome):
+    """template.html com o nome do cliente já escapado, como sai do processamento."""
+    return TEMPLATE.read_text(encoding="utf-8").replace("{{cliente_nome}}", nome)
+
+
+def _html(*secoes):
+    return "<html><head><title>Proposta - Ana</title></head><body>\n" + "\n".join(secoes) + "\n</body></html>"
+
+
+def _secao(ident, estatico=False, meta="Ana | 02"):
+    attr = f" {STATIC_ATTR}" if estatico else ""
+    return (f'<section class="page" id="{ident}"{attr}><div class="page-inner">'
+            f'<div class="slide-header"><h2 class="slide-title">T</h2>'
+            f'<div class="header-meta">{meta}</div></div><p>{ident}</p></div></section>')
+
+
+def test_template_separa_slides_estaticos_sem_paginas_overlay():
+    job = split_static(_proposta("Zuleica &amp; Filhos"))
+    assert job["layout"] == ["d", "s", "d", "d", "s", "d", "d", "d", "d", "s", "d", "d", "d"]
+    assert job["headers"] == ["Zuleica & Filhos | 02", "Zuleica & Filhos | 05", "Zuleica & Filhos | 10"]
+    # O Chromium imprime só as páginas dinâmicas: uma <section> por "d"
+    assert job["dynamic_html"].count("<section") == job["layout"].count("d")
+    for ident in ("slide-fohat", "slide-04", "slide-09"):
+        assert f'id="{ident}"' not in job["dynamic_html"]
+        assert f'id="{ident}"' in job["static_html"]
+    assert "Zuleica" not in job["static_html"]
+
+
+def test_documento_estatico_nao_depende_do_cliente():
+    a = split_static(_proposta("Ana"))
+    b = split_static(_proposta("Bruno Souza"))
+    assert a["static_key"] == b["static_key"] and a["static_html"] == b["static_html"]
+    assert a["dynamic_html"] != b["dynamic_html"]
+
+
+def test_cabecalho_em_varias_linhas_vira_texto_simples():
+    meta = "\n          Ana <b>Lima</b> &amp; Cia\n          | 03\n        "
+    job = split_static(_html(_secao("a"), _secao("b", estatico=True, meta=meta)))
+    assert job["layout"] == ["d", "s"]
+    assert job["headers"] == ["Ana Lima & Cia | 03"]
+    assert '<div class="header-meta"></div>' in job["static_html"]
+    assert "<title>Fohat</title>" in job["static_html"]
+
+
+@pytest.mark.parametrize("html", [
+    _html(_secao("a"), _secao("b")),  # nenhum slide marcado
+    _html(_secao("a", estatico=True), _secao("b", estatico=True)),  # nada dinâmico
+    _html(_secao("a"), _secao("b", estatico=True).replace("<p>", "<section><p>", 1)),  # seção aninhada
+    "<section class='page' data-fohat-static></section>",  # sem <head>
+])
+def test_sem_composicao_utilizavel_retorna_none(html):
+    assert split_static(html) is None
+
+
+def test_slide_marcado_sem_cabecalho_fica_dinamico():
+    sem_cabecalho = f'<section class="page" id="c" {STATIC_ATTR}><p>c</p></section>'
+    job = split_static(_html(_secao("a"), sem_cabecalho, _secao("b", estatico=True)))
+    assert job["layout"] == ["d", "d", "s"]
+
+
+@pytest.fixture
+def renderizador(monkeypatch):
+    """Serviço "no ar"; chamadas registradas como (composta?, corpo)."""
+    chamadas = []
+    monkeypatch.setattr(pdf_service, "PDF_STATIC_PAGES", True)
+    monkeypatch.setattr(pdf_service, "ensure_service", lambda: True)
+    return chamadas
+
+
+def test_422_do_servico_renderiza_o_html_inteiro(renderizador, monkeypatch):
+    def servico(corpo, timeout_s, composite=False):
+        renderizador.append((composite, corpo))
+        if composite:
+            raise urllib.error.HTTPError("/render-composite", 422, "LayoutMismatch", {}, io.BytesIO(b"paginas"))
+        return b"%PDF-inteiro"
+
+    monkeypatch.setattr(pdf_service, "render_via_service", servico)
+    monkeypatch.setattr(pdf_service, "render_oneshot", lambda *a, **k: pytest.fail("one-shot com o serviço no ar"))
+    html = _proposta("Ana")
+    assert pdf_service._render_pdf(html, 5) == b"%PDF-inteiro"
+    assert [c for c, _ in renderizador] == [True, False]
+    job = json.loads(renderizador[0][1])
+    assert set(job) == {"dynamic_html", "static_html", "static_key", "layout", "headers"}
+    assert renderizador[1][1] == html
+
+
+def test_timeout_da_composta_nao_renderiza_de_novo(renderizador, monkeypatch):
+    def servico(corpo, timeout_s, composite=False):
+        renderizador.append((composite, corpo))
+        raise TimeoutError()
+
+    monkeypatch.setattr(pdf_service, "render_via_service", servico)
+    with pytest.raises(RenderTimeout):
+        pdf_service._render_pdf(_proposta("Ana"), 5)
+    assert [c for c, _ in renderizador] == [True]
+
+
+def test_desligado_renderiza_o_html_inteiro(renderizador, monkeypatch):
+    monkeypatch.setattr(pdf_service, "PDF_STATIC_PAGES", False)
+    monkeypatch.setattr(pdf_service, "render_via_service",
+                        lambda corpo, t, composite=False: renderizador.append(composite) or b"%PDF")
+    pdf_service._render_pdf(_proposta("Ana"), 5)
+    assert renderizador == [False]
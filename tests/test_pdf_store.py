@@ -0,0 +1,209 @@
+"""
+Armazenamento dos PDFs (pdf_store): single_flight entre threads/processos, limpeza
+da cópia local (LRU com as referências; lock só apagado quando livre), migração
+do PDF base64 legado para a tabela binária e envio com Range/ETag pela rota ver-pdf.
+"""
+import base64
+import os
+import threading
+import time
+
+import pytest
+
+import pdf_store
+from db import PdfCacheDB, PropostaDB
+
+PDF = b"%PDF-1.4 legado"
+
+sem_flock = pytest.mark.skipif(pdf_store.fcntl is None, reason="flock indisponível nesta plataforma")
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdf_store, "PDF_STORE_DIR", tmp_path / "pdfs")
+    monkeypatch.setattr(pdf_store, "_LOCKS_DIR", tmp_path / "locks")
+    return pdf_store
+
+
+def _segurar(chave, dentro, soltar):
+    def _run():
+        with pdf_store.single_flight(chave) as esperou:
+            dentro.append(esperou)
+            soltar.wait(5)
+    t = threading.Thread(target=_run, daemon=True)
+    t.start()
+    limite = time.time() + 2
+    while not dentro and time.time() < limite:
+        time.sleep(0.01)
+    assert dentro == [False]
+    return t
+
+
+@sem_flock
+def test_single_flight_segundo_pedido_espera_o_primeiro(store):
+    dentro, soltar = [], threading.Event()
+    t = _segurar("p1:h1", dentro, soltar)
+    threading.Timer(0.3, soltar.set).start()
+    inicio = time.monotonic()
+    with store.single_flight("p1:h1") as esperou:
+        assert esperou is True
+        assert time.monotonic() - inicio >= 0.25
+    t.join(2)
+    with store.single_flight("p1:h2") as esperou:  # outra chave não espera
+        assert esperou is False
+
+
+@sem_flock
+def test_single_flight_desiste_no_timeout(store):
+    dentro, soltar = [], threading.Event()
+    t = _segurar("p1:h1", dentro, soltar)
+    try:
+        with store.single_flight("p1:h1", timeout_s=0.3) as esperou:
+            assert esperou is True  # seguiu sem o lock
+    finally:
+        soltar.set()
+        t.join(2)
+
+
+@sem_flock
+def test_limpeza_nao_apaga_lock_em_uso(store):
+    dentro, soltar = [], threading.Event()
+    t = _segurar("p1:h1", dentro, soltar)
+    try:
+        velho = time.time() - 2 * 86400
+        for p in store._LOCKS_DIR.glob("*.lock"):
+            os.utime(p, (velho, velho))
+        parado = store._LOCKS_DIR / "parado.lock"
+        parado.touch()
+        os.utime(parado, (velho, velho))
+        store._prune()
+        assert len(list(store._LOCKS_DIR.glob("*.lock"))) == 1  # só o parado saiu
+        with store.single_flight("p1:h1", timeout_s=0.3) as esperou:
+            assert esperou is True  # o dono continua valendo
+    finally:
+        soltar.set()
+        t.join(2)
+
+
+@sem_flock
+def test_lock_de_arquivo_apagado_nao_vale(store, monkeypatch):
+    # Simula a limpeza apagando o arquivo entre o open e o flock de quem chega
+    abrir = open
+    apagou = []
+
+    def open_e_apaga(caminho, *args, **kwargs):
+        fh = abrir(caminho, *args, **kwargs)
+        if str(caminho).endswith(".lock") and not apagou:
+            os.unlink(caminho)
+            apagou.append(caminho)
+        return fh
+
+    monkeypatch.setattr("builtins.open", open_e_apaga)
+    with store.single_flight("p1:h1") as esperou:
+        assert esperou is False
+        assert apagou and apagou[0].exists()  # reabriu e travou o arquivo atual
+
+
+def test_referencias_saem_junto_com_o_pdf(store, monkeypatch):
+    monkeypatch.setattr(store, "PDF_STORE_MAX_MB", 1)
+    antigo = store.store_ref("p1:h1", b"%PDF" + b"a" * 700_000)
+    store.store_ref("p1:h1-copia", antigo.read_bytes())
+    velho = time.time() - 3600
+    os.utime(antigo, (velho, velho))
+    usado = store.store_ref("p2:h1", b"%PDF" + b"b" * 700_000)  # passa do limite: sai o menos usado
+    assert not antigo.exists() and usado.exists()
+    assert store.lookup_ref("p1:h1") is None
+    assert not store._ref_path("p1:h1").exists() and not store._ref_path("p1:h1-copia").exists()
+    assert store.lookup_ref("p2:h1") == usado
+
+
+def test_referencia_antiga_de_pdf_em_uso_e_mantida(store):
+    path = store.store_ref("p1:h1", PDF)
+    velho = time.time() - 2 * 86400
+    os.utime(store._ref_path("p1:h1"), (velho, velho))
+    store._prune()
+    assert store.lookup_ref("p1:h1") == path
+
+
+@pytest.fixture
+def sessao_pdf(db_sessao, store):
+    yield db_sessao
+    db_sessao.rollback()
+    db_sessao.query(PdfCacheDB).delete()
+    db_sessao.commit()
+
+
+def test_migrar_legado_move_para_a_tabela_binaria(sessao_pdf):
+    row = PropostaDB(id="p1", payload={}, pdf_cache=base64.b64encode(PDF).decode(), pdf_payload_hash="h1")
+    sessao_pdf.add(row)
+    sessao_pdf.commit()
+
+    path = pdf_store.migrar_legado(sessao_pdf, row, "h1")
+    assert path.read_bytes() == PDF
+    sessao_pdf.expire_all()
+    assert sessao_pdf.get(PropostaDB, "p1").pdf_cache is None
+    cache = sessao_pdf.get(PdfCacheDB, "p1")
+    assert cache.payload_hash == "h1" and bytes(cache.pdf) == PDF
+    assert pdf_store.lookup(sessao_pdf, "p1", "h1") == path
+
+
+def test_migrar_legado_de_outro_payload_so_limpa_a_coluna(sessao_pdf):
+    row = PropostaDB(id="p1", payload={}, pdf_cache=base64.b64encode(PDF).decode(), pdf_payload_hash="velho")
+    sessao_pdf.add(row)
+    sessao_pdf.commit()
+
+    assert pdf_store.migrar_legado(sessao_pdf, row, "h1") is None
+    sessao_pdf.expire_all()
+    assert sessao_pdf.get(PropostaDB, "p1").pdf_cache is None
+    assert sessao_pdf.get(PdfCacheDB, "p1") is None
+    assert pdf_store.migrar_legado(sessao_pdf, sessao_pdf.get(PropostaDB, "p1"), "h1") is None
+
+
+def test_copia_local_perdida_volta_do_banco(sessao_pdf):
+    path = pdf_store.store(sessao_pdf, "p1", "h1", PDF)
+    assert path == pdf_store.path_for(pdf_store.sha256_hex(PDF))
+    path.unlink()
+    assert pdf_store.lookup(sessao_pdf, "p1", "h1") == path
+    assert path.read_bytes() == PDF
+    assert pdf_store.lookup(sessao_pdf, "p1", "outro-hash") is None
+    assert pdf_store.lookup(sessao_pdf, "p2", "h1") is None
+
+
+@pytest.fixture
+def pdf_na_rota(servidor, sessao_pdf, monkeypatch):
+    """Proposta com o PDF já no cache binário; rota ver-pdf no modo DB."""
+    row = PropostaDB(id="p1", cliente_nome="Ana/Lima", payload={"cliente_nome": "Ana/Lima"})
+    sessao_pdf.add(row)
+    sessao_pdf.commit()
+    chave = servidor._pdf_cache_key(None, servidor._fingerprint_row(row))
+    conteudo = b"%PDF-1.4 " + bytes(range(256)) * 8
+    path = pdf_store.store(sessao_pdf, "p1", chave, conteudo)
+    monkeypatch.setattr(servidor, "USE_DB", True)
+    monkeypatch.setattr(servidor, "_render_pdf_with_puppeteer",
+                        lambda *a, **k: pytest.fail("renderizou com o PDF em cache"))
+    return servidor.app.test_client(), conteudo, path
+
+
+def test_ver_pdf_atende_range(pdf_na_rota):
+    cliente, conteudo, path = pdf_na_rota
+    inteiro = cliente.get("/proposta/p1/ver-pdf")
+    assert inteiro.status_code == 200 and inteiro.data == conteudo
+    assert inteiro.headers["Accept-Ranges"] == "bytes"
+    assert inteiro.headers["Content-Type"] == "application/pdf"
+    assert inteiro.headers["ETag"].strip('"') == path.stem
+
+    parte = cliente.get("/proposta/p1/ver-pdf", headers={"Range": "bytes=0-99"})
+    assert parte.status_code == 206 and parte.data == conteudo[:100]
+    assert parte.headers["Content-Range"] == f"bytes 0-99/{len(conteudo)}"
+    fim = cliente.get("/proposta/p1/ver-pdf", headers={"Range": "bytes=-10"})
+    assert fim.status_code == 206 and fim.data == conteudo[-10:]
+
+
+def test_ver_pdf_condicional_e_download(pdf_na_rota):
+    cliente, conteudo, path = pdf_na_rota
+    resp = cliente.get("/proposta/p1/ver-pdf", headers={"If-None-Match": f'"{path.stem}"'})
+    assert resp.status_code == 304 and resp.data == b""
+    baixar = cliente.get("/proposta/p1/ver-pdf?download=true")
+    disposicao = baixar.headers["Content-Disposition"]
+    assert baixar.status_code == 200 and disposicao.startswith("attachment")
+    assert "Ana Lima - " in disposicao and "FOHAT ENERGIA SOLAR.pdf" in disposicao
@@ -0,0 +1,283 @@
+"""
+JSON merge-patch do autosave (proposta_patch): a versão Python (RFC 7386) e a
+expressão jsonb gerada por _merge_sql.
+
+Sem Postgres no ambiente de teste, a expressão é avaliada por um interpretador
+mínimo da gramática que _merge_sql produz (CASE/jsonb_typeof, `-` text[], `||`
+jsonb_build_object, `->`). Com TEST_POSTGRES_URL definido, a mesma comparação
+roda também no banco de verdade.
+"""
+import json
+import os
+import re
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+import proposta_patch
+from proposta_patch import _merge_sql, _Params, merge_patch, upsert, validar
+
+ALVO = "propostas.payload::jsonb"
+
+
+def _to_float(v):
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+CASOS = [
+    # Exemplos do apêndice A da RFC 7386
+    ({"a": "b"}, {"a": "c"}, {"a": "c"}),
+    ({"a": "b"}, {"b": "c"}, {"a": "b", "b": "c"}),
+    ({"a": "b"}, {"a": None}, {}),
+    ({"a": "b", "b": "c"}, {"a": None}, {"b": "c"}),
+    ({"a": ["b"]}, {"a": "c"}, {"a": "c"}),
+    ({"a": "c"}, {"a": ["b"]}, {"a": ["b"]}),
+    ({"a": {"b": "c"}}, {"a": {"b": "d", "c": None}}, {"a": {"b": "d"}}),
+    ({"a": [{"b": "c"}]}, {"a": [1]}, {"a": [1]}),
+    ({"e": None}, {"a": 1}, {"a": 1, "e": None}),
+    ([1, 2], {"a": "b", "c": None}, {"a": "b"}),
+    ({}, {"a": {"bb": {"ccc": None}}}, {"a": {"bb": {}}}),
+    # Payload nulo (proposta sem payload) e subobjeto que era escalar
+    (None, {"a": {"b": 1}}, {"a": {"b": 1}}),
+    ({"a": 5}, {"a": {"b": 1}}, {"a": {"b": 1}}),
+]
+
+
+class _Avaliador:
+    """Interpreta a expressão de _merge_sql sobre um payload Python."""
+
+    _TOKENS = re.compile(r"\s*(propostas\.payload::jsonb|'\{\}'::jsonb|'object'|:p\d+|text\[\]|\|\||->|"
+                         r"[(),=-]|[A-Za-z_]+)")
+
+    def __init__(self, sql, params, payload):
+        self.toks = self._TOKENS.findall(sql)
+        assert "".join(self.toks) == re.sub(r"\s+", "", sql), "token desconhecido na expressão"
+        self.i, self.params, self.payload = 0, params, payload
+
+    def _prox(self, esperado=None):
+        tok = self.toks[self.i]
+        self.i += 1
+        if esperado is not None:
+            assert tok == esperado, f"esperava {esperado!r}, veio {tok!r}"
+        return tok
+
+    def _espia(self):
+        return self.toks[self.i] if self.i < len(self.toks) else None
+
+    def avaliar(self):
+        valor = self._expr()
+        assert self.i == len(self.toks)
+        return valor
+
+    def _cast(self):
+        self._prox("CAST"), self._prox("(")
+        valor = self.params[self._prox()[1:]]
+        self._prox("AS")
+        tipo = self._prox()
+        self._prox(")")
+        return json.loads(valor) if tipo == "jsonb" else valor
+
+    def _expr(self):
+        tok = self._espia()
+        if tok == ALVO:
+            self._prox()
+            return self.payload
+        if tok == "CAST":
+            return self._cast()
+        self._prox("(")
+        if self._espia() == "CASE":
+            for t in ("CASE", "WHEN", "jsonb_typeof", "("):
+                self._prox(t)
+            x = self._expr()
+            for t in (")", "=", "'object'", "THEN"):
+                self._prox(t)
+            self._expr()
+            self._prox("ELSE"), self._prox("'{}'::jsonb"), self._prox("END"), self._prox(")")
+            return dict(x) if isinstance(x, dict) else {}
+        esquerda = self._expr()
+        op = self._prox()
+        if op == "-":
+            chaves = self._cast()
+            resultado = {k: v for k, v in esquerda.items() if k not in chaves}
+        elif op == "||":
+            self._prox("jsonb_build_object"), self._prox("(")
+            pares = []
+            while True:
+                chave = self._cast()
+                self._prox(",")
+                pares.append((chave, self._expr()))
+                if self._prox() == ")":
+                    break
+            resultado = {**esquerda, **dict(pares)}
+        else:
+            assert op == "->"
+            chave = self._cast()
+            resultado = esquerda.get(chave) if isinstance(esquerda, dict) else None
+        self._prox(")")
+        return resultado
+
+
+def _merge_via_sql(payload, patch):
+    params = _Params()
+    sql = _merge_sql(ALVO, patch, params)
+    return _Avaliador(sql, params.valores, payload).avaliar()
+
+
+@pytest.mark.parametrize("alvo,patch,esperado", CASOS)
+def test_merge_patch_python(alvo, patch, esperado):
+    assert merge_patch(alvo, patch) == esperado
+
+
+@pytest.mark.parametrize("alvo,patch,esperado", CASOS)
+def test_merge_sql_igual_ao_python(alvo, patch, esperado):
+    assert _merge_via_sql(alvo, patch) == esperado
+
+
+def test_merge_sql_divide_jsonb_build_object(monkeypatch):
+    # jsonb_build_object aceita no máximo 100 argumentos
+    monkeypatch.setattr(proposta_patch, "_PARES_POR_OBJETO", 3)
+    patch = {f"k{i}": i for i in range(8)}
+    params = _Params()
+    sql = _merge_sql(ALVO, patch, params)
+    assert sql.count("jsonb_build_object") == 3
+    assert _Avaliador(sql, params.valores, {"x": 1}).avaliar() == {"x": 1, **patch}
+
+
+def test_merge_sql_so_usa_parametros():
+    # Chaves e valores do cliente nunca entram no texto da instrução
+    params = _Params()
+    sql = _merge_sql(ALVO, {"a'; DROP TABLE propostas; --": {"b": "c'"}}, params)
+    assert "DROP" not in sql and "c'" not in sql
+
+
+def test_validar():
+    validar({"potencia_kw": "5.5", "status": "rascunho"}, _to_float)
+    for ruim in ([], {"id": "x"}, {"status": "fechado"}, {"potencia_kw": "muito"},
+                 {"a": {"b": {"c": {"d": {"e": {"f": {"g": {"h": {"i": 1}}}}}}}}}):
+        with pytest.raises(ValueError):
+            validar(ruim, _to_float)
+
+
+class _DbCaptura:
+    def __init__(self):
+        self.sql, self.params = None, None
+
+    def execute(self, stmt, params):
+        self.sql, self.params = stmt.text, params
+
+        class _R:
+            @staticmethod
+            def first():
+                return None
+        return _R()
+
+
+def _campos(payload, _id):
+    return {"cliente_nome": payload.get("cliente_nome"), "nome_projeto": payload.get("nome_projeto")}
+
+
+def _upsert(**kw):
+    db = _DbCaptura()
+    base = dict(na_criacao={"status": "rascunho"}, uid="u1", email="a@x.com", pode_tudo=False)
+    upsert(db, "p1", kw.pop("patch"), _campos, _to_float, **base, **kw)
+    return db
+
+
+def test_upsert_insert_on_conflict_com_guarda():
+    db = _upsert(patch={"cliente_nome": "Ana", "id": "outro"})
+    assert db.sql.startswith("INSERT INTO propostas (")
+    assert "ON CONFLICT (id) DO UPDATE SET (payload, render_fingerprint, resumo) = (SELECT m.novo, md5(" in db.sql
+    assert "render_fingerprint = NULL" not in db.sql
+    assert "WHERE :" in db.sql and "proposta_visibilidade" in db.sql
+    assert "cliente_nome_norm = " in db.sql and "versao = propostas.versao + 1" in db.sql
+    assert "outro" not in db.params.values()  # chave protegida descartada
+    # Todos os parâmetros referenciados existem (e vice-versa)
+    usados = set(re.findall(r":(p\d+)", db.sql))
+    assert usados == set(db.params)
+    compilado = text(db.sql).compile(dialect=postgresql.dialect())
+    assert set(compilado.params) == usados
+
+
+def test_upsert_com_versao_base_e_update_condicional():
+    db = _upsert(patch={"nome_projeto": "X"}, versao_base=3)
+    assert db.sql.startswith("UPDATE propostas SET ")
+    assert "ON CONFLICT" not in db.sql
+    nome = next(k for k, v in db.params.items() if v == 3)
+    assert f"propostas.versao = :{nome}" in db.sql
+
+
+@pytest.mark.skipif(not os.environ.get("TEST_POSTGRES_URL"), reason="TEST_POSTGRES_URL não definido")
+@pytest.mark.parametrize("alvo,patch,esperado", CASOS)
+def test_merge_sql_no_postgres(alvo, patch, esperado):
+    engine = create_engine(os.environ["TEST_POSTGRES_URL"])
+    params = _Params()
+    expr = _merge_sql("CAST(:alvo AS jsonb)", patch, params)
+    with engine.connect() as conn:
+        resultado = conn.execute(text(f"SELECT {expr}"), {**params.valores, "alvo": json.dumps(alvo)}).scalar()
+    assert resultado == esperado
+
+
+def _fingerprint(engine, proposta_id):
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT render_fingerprint FROM propostas WHERE id = :i"),
+                            {"i": proposta_id}).scalar()
+
+
+def test_upsert_calcula_fingerprint_no_postgres(postgres):
+    Sessao = sessionmaker(bind=postgres)
+
+    def gravar(patch, versao_base=None):
+        with Sessao() as db:
+            upsert(db, "p1", patch, _campos, _to_float, na_criacao={"status": "rascunho"},
+                   uid="u1", email="a@x.com", pode_tudo=True, versao_base=versao_base)
+            db.commit()
+        return _fingerprint(postgres, "p1")
+
+    criada = gravar({"cliente_nome": "Ana"})
+    mesclada = gravar({"nome_projeto": "X"})
+    assert criada and mesclada and mesclada != criada
+    # Só campo volátil mudou: mesma impressão digital (o HTML não muda)
+    assert gravar({"status": "rascunho", "updated_at": "agora"}, versao_base=2) == mesclada
+    assert gravar({"nome_projeto": "Y"}, versao_base=3) not in (None, mesclada)
+    assert gravar({"nome_projeto": "X"}) == mesclada
+    with postgres.connect() as conn:
+        resumo = conn.execute(text("SELECT resumo FROM propostas WHERE id = 'p1'")).scalar()
+    assert resumo == {"cliente_nome": "Ana", "nome_projeto": "X", "status": "rascunho"}
+
+
+def test_patch_seguido_de_get_nao_carrega_payload(servidor, postgres, monkeypatch):
+    monkeypatch.setattr(servidor, "USE_DB", True)
+    monkeypatch.setattr(servidor, "SessionLocal", sessionmaker(bind=postgres, autoflush=False))
+    monkeypatch.setattr(servidor, "_current_user_row",
+                        lambda: SimpleNamespace(uid="u1", email="a@x.com", role="vendedor"))
+    cliente = servidor.app.test_client()
+
+    resp = cliente.patch("/propostas/p1", json={"cliente_nome": "Ana", "nome_projeto": "X"})
+    assert resp.status_code == 201
+    resp = cliente.patch("/propostas/p1", json={"nome_projeto": "Y"}, headers={"If-Match": resp.headers["ETag"]})
+    assert resp.status_code == 200
+    fp = _fingerprint(postgres, "p1")
+    assert fp
+
+    comandos = []
+
+    def registrar(conn, cursor, sql, *args):
+        comandos.append(sql)
+
+    # Cliente com o HTML atual (aberto em outra aba, aquecido): 304 só pela impressão digital
+    etag = servidor.etag_for(servidor._proposta_html_key(None, "template_online.html", fp))
+    event.listen(postgres, "before_cursor_execute", registrar)
+    try:
+        resp = cliente.get("/gerar-proposta-html/p1", headers={"If-None-Match": etag})
+    finally:
+        event.remove(postgres, "before_cursor_execute", registrar)
+    assert resp.status_code == 304
+    assert comandos, "a leitura deveria consultar a proposta"
+    assert not any(re.search(r"propostas\.payload\b", sql) for sql in comandos)
+    assert not any(sql.lstrip().upper().startswith("UPDATE") for sql in comandos)
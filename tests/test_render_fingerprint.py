@@ -0,0 +1,137 @@
+"""
+Impressão digital de renderização (propostas.render_fingerprint): gravada ao salvar,
+lida como está nos acessos (sem serializar nem carregar o payload) e preenchida nas
+linhas antigas pela migração, nunca por uma leitura.
+"""
+import json
+import re
+
+import pytest
+from sqlalchemy import event, text
+
+import db as db_mod
+import html_cache as hc
+from db import PropostaDB
+from html_cache import HtmlCache, render_fingerprint
+
+PAYLOAD = {"cliente_nome": "Ana", "potencia_kw": 5.5, "graficos_base64": {"g1": "x" * 1000}}
+
+
+@pytest.fixture
+def rota(servidor, db_sessao, monkeypatch, tmp_path):
+    """Rotas de leitura no modo banco (SQLite de teste) com cache de HTML descartável."""
+    monkeypatch.setattr(servidor, "USE_DB", True)
+    monkeypatch.setattr(servidor, "html_cache", HtmlCache(tmp_path / "html", 8, 1024 * 1024))
+    return servidor
+
+
+@pytest.fixture
+def comandos():
+    """SQL emitido no engine durante o teste."""
+    lista = []
+
+    def registrar(conn, cursor, sql, *args):
+        lista.append(sql)
+
+    event.listen(db_mod.engine, "before_cursor_execute", registrar)
+    yield lista
+    event.remove(db_mod.engine, "before_cursor_execute", registrar)
+
+
+def _leu_payload(comandos):
+    return any(re.search(r"propostas\.payload\b", sql) and sql.lstrip().upper().startswith("SELECT")
+               for sql in comandos)
+
+
+def _gravou(comandos):
+    return any(sql.lstrip().upper().startswith(("UPDATE", "INSERT")) for sql in comandos)
+
+
+def test_orm_grava_fingerprint_ao_salvar(servidor, db_sessao):
+    db_sessao.add(PropostaDB(id="p1", payload=PAYLOAD))
+    db_sessao.commit()
+    assert db_sessao.get(PropostaDB, "p1").render_fingerprint == render_fingerprint(PAYLOAD)
+
+
+def test_flush_sem_payload_carregado_nao_le_o_payload(servidor, db_sessao, comandos):
+    db_sessao.add(PropostaDB(id="p1", payload=PAYLOAD))
+    db_sessao.commit()
+    db_sessao.expunge_all()
+    row = db_sessao.get(PropostaDB, "p1")
+    row.status = "enviada"
+    row.render_fingerprint = None  # linha antiga: nem assim o flush carrega o payload
+    del comandos[:]
+    db_sessao.commit()
+    assert not _leu_payload(comandos)
+
+
+def test_cache_hit_nao_serializa_nem_carrega_o_payload(rota, db_sessao, comandos, monkeypatch):
+    db_sessao.add(PropostaDB(id="p1", payload=PAYLOAD))
+    db_sessao.commit()
+    chave = rota._proposta_html_key(None, "template_online.html", render_fingerprint(PAYLOAD))
+    rota.html_cache.put("p1", chave, "<html>em cache</html>")
+
+    def proibido(*args, **kwargs):
+        raise AssertionError("payload serializado num cache hit")
+
+    monkeypatch.setattr(hc, "payload_hash", proibido)
+    del comandos[:]
+    resp = rota.app.test_client().get("/gerar-proposta-html/p1")
+    assert resp.status_code == 200
+    assert resp.get_data(as_text=True) == "<html>em cache</html>"
+    assert not _leu_payload(comandos)
+    assert not _gravou(comandos)
+
+
+def test_linha_antiga_vale_em_memoria_sem_gravar(rota, db_sessao, comandos):
+    db_sessao.add(PropostaDB(id="p1", payload=PAYLOAD))
+    db_sessao.commit()
+    db_sessao.execute(text("UPDATE propostas SET render_fingerprint = NULL WHERE id = 'p1'"))
+    db_sessao.commit()
+    etag = rota.etag_for(rota._proposta_html_key(PAYLOAD, "template_online.html"))
+    del comandos[:]
+    resp = rota.app.test_client().get("/gerar-proposta-html/p1", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert not _gravou(comandos)
+    db_sessao.expire_all()
+    assert db_sessao.get(PropostaDB, "p1").render_fingerprint is None
+
+
+def test_preencher_colunas_derivadas_em_lotes(servidor, db_sessao, monkeypatch):
+    monkeypatch.setattr(db_mod, "DERIVADAS_LOTE", 2)
+    for i in range(5):
+        db_sessao.add(PropostaDB(id=f"p{i}", payload={**PAYLOAD, "i": i}))
+    db_sessao.add(PropostaDB(id="vazia"))
+    db_sessao.commit()
+    db_sessao.execute(text("UPDATE propostas SET render_fingerprint = NULL, resumo = NULL"))
+    db_sessao.commit()
+    with db_mod.engine.connect() as conn:
+        assert db_mod._derivadas_pendentes(conn)
+
+    assert db_mod.preencher_colunas_derivadas() == 5
+    db_sessao.expire_all()
+    for i in range(5):
+        row = db_sessao.get(PropostaDB, f"p{i}")
+        assert row.render_fingerprint == render_fingerprint({**PAYLOAD, "i": i})
+        assert row.resumo == {"cliente_nome": "Ana"}
+    with db_mod.engine.connect() as conn:
+        assert not db_mod._derivadas_pendentes(conn)
+
+
+def test_preencher_colunas_derivadas_no_postgres(postgres, monkeypatch):
+    monkeypatch.setattr(db_mod, "engine", postgres)
+    monkeypatch.setattr(db_mod, "DATABASE_URL", "postgresql://teste")
+    with postgres.begin() as conn:
+        for i, payload in enumerate([PAYLOAD, {**PAYLOAD, "status": "fechado"}, {**PAYLOAD, "potencia_kw": 6}]):
+            conn.execute(text("INSERT INTO propostas (id, payload) VALUES (:i, CAST(:p AS jsonb))"),
+                         {"i": f"p{i}", "p": json.dumps(payload)})
+        conn.execute(text("INSERT INTO propostas (id, payload) VALUES ('lista', CAST('[1]' AS jsonb))"))
+    assert db_mod.preencher_colunas_derivadas() == 4
+    with postgres.connect() as conn:
+        linhas = {r.id: r for r in conn.execute(text("SELECT id, render_fingerprint, resumo FROM propostas"))}
+    assert all(r.render_fingerprint for r in linhas.values())
+    assert linhas["p0"].render_fingerprint == linhas["p1"].render_fingerprint  # só campo volátil mudou
+    assert linhas["p2"].render_fingerprint != linhas["p0"].render_fingerprint
+    assert linhas["p1"].resumo == {"cliente_nome": "Ana", "status": "fechado"}
+    assert linhas["lista"].resumo == {}
+    assert db_mod.preencher_colunas_derivadas() == 0
@@ -0,0 +1,106 @@
+"""
+Vínculo normalizado das propostas (cliente_telefone_norm, cliente_nome_norm,
+owner_cliente_id): listener ao gravar, filtro por cliente e preenchimento do legado
+no Postgres.
+"""
+import json
+
+import pytest
+from sqlalchemy import inspect, text
+
+import db as db_mod
+from db import PropostaDB
+
+LEGADO = {"cliente_telefone": "(11) 98888-7777", "cliente_nome": "  Carlos SOUZA ", "cliente_id": "c1",
+          "created_by": "u-ana", "created_by_email": "ana@x.com"}
+
+
+@pytest.fixture
+def sessao(servidor, db_sessao):
+    """Sessão com o listener de servidor_proposta registrado."""
+    return db_sessao
+
+
+def test_insert_normaliza_a_partir_do_payload_legado(sessao):
+    sessao.add(PropostaDB(id="p1", payload=LEGADO))
+    sessao.commit()
+    row = sessao.get(PropostaDB, "p1")
+    assert (row.cliente_telefone_norm, row.cliente_nome_norm, row.owner_cliente_id) == \
+        ("11988887777", "carlos souza", "c1")
+    assert (row.created_by, row.created_by_email) == ("u-ana", "ana@x.com")
+
+
+def test_coluna_prevalece_sobre_o_payload(sessao):
+    sessao.add(PropostaDB(id="p1", cliente_telefone="21 91111-2222", cliente_nome="Bia", cliente_id="c2",
+                          created_by_email="bia@x.com", payload=LEGADO))
+    sessao.commit()
+    row = sessao.get(PropostaDB, "p1")
+    assert (row.cliente_telefone_norm, row.cliente_nome_norm, row.owner_cliente_id) == ("21911112222", "bia", "c2")
+    assert row.created_by_email == "bia@x.com"
+
+
+def test_update_sem_payload_carregado_nao_apaga_o_vinculo(sessao):
+    sessao.add(PropostaDB(id="p1", payload=LEGADO))
+    sessao.commit()
+    sessao.expunge_all()
+    row = sessao.get(PropostaDB, "p1")  # payload adiado, não carregado
+    row.status = "fechado"
+    sessao.commit()
+    assert "payload" in inspect(row).unloaded
+    assert (row.cliente_telefone_norm, row.cliente_nome_norm, row.owner_cliente_id) == \
+        ("11988887777", "carlos souza", "c1")
+    row.cliente_telefone = "(31) 97777-6666"  # valor da própria linha substitui o gravado
+    sessao.commit()
+    assert row.cliente_telefone_norm == "31977776666" and row.owner_cliente_id == "c1"
+
+
+def test_update_com_payload_limpa_o_que_saiu(sessao):
+    sessao.add(PropostaDB(id="p1", payload=LEGADO))
+    sessao.commit()
+    row = sessao.get(PropostaDB, "p1")
+    row.payload = {"cliente_nome": "Outro"}
+    sessao.commit()
+    assert (row.cliente_telefone_norm, row.cliente_nome_norm, row.owner_cliente_id) == (None, "outro", None)
+
+
+def test_filtro_propostas_do_cliente(servidor, sessao):
+    sessao.add_all([
+        PropostaDB(id="por-id", cliente_id="c1"),
+        PropostaDB(id="por-payload", payload={"cliente_id": "c1"}),
+        PropostaDB(id="por-tel", cliente_telefone="11 98888 7777"),
+        PropostaDB(id="por-nome", cliente_nome="CARLOS souza"),
+        PropostaDB(id="outra", cliente_id="c2", cliente_telefone="11 91234 5678", cliente_nome="Bia"),
+        PropostaDB(id="tel-curto", cliente_telefone="7777"),
+    ])
+    sessao.commit()
+
+    def ids(tel, nome):
+        filtro = servidor._filtro_propostas_do_cliente("c1", tel, nome)
+        return {r[0] for r in sessao.query(PropostaDB.id).filter(filtro)}
+
+    assert ids("11988887777", "carlos souza") == {"por-id", "por-payload", "por-tel", "por-nome"}
+    assert ids("7777", "") == {"por-id", "por-payload"}  # telefone curto não casa
+
+
+def test_preenchimento_do_legado_no_postgres(postgres):
+    with postgres.begin() as conn:
+        conn.execute(text("INSERT INTO propostas (id, payload) VALUES ('legado', CAST(:p AS jsonb))"),
+                     {"p": json.dumps(LEGADO)})
+        conn.execute(text("INSERT INTO propostas (id, cliente_telefone, cliente_nome, payload) "
+                          "VALUES ('colunas', '21 91111-2222', ' Bia ', CAST(:p AS jsonb))"),
+                     {"p": json.dumps(LEGADO)})
+        conn.execute(text("INSERT INTO propostas (id) VALUES ('vazia')"))
+        db_mod._backfill_vinculo_normalizado(conn)
+    with postgres.connect() as conn:
+        linhas = {r.id: r for r in conn.execute(text(
+            "SELECT id, cliente_telefone_norm, cliente_nome_norm, owner_cliente_id, created_by, created_by_email "
+            "FROM propostas"))}
+    assert tuple(linhas["legado"])[1:] == ("11988887777", "carlos souza", "c1", "u-ana", "ana@x.com")
+    assert tuple(linhas["colunas"])[1:4] == ("21911112222", "bia", "c1")
+    assert tuple(linhas["vazia"])[1:] == (None,) * 5
+    with postgres.begin() as conn:
+        conn.execute(text("UPDATE propostas SET cliente_nome = 'Mudou' WHERE id = 'legado'"))
+        db_mod._backfill_vinculo_normalizado(conn)  # só linhas sem vínculo: as já preenchidas ficam
+    with postgres.connect() as conn:
+        assert conn.execute(text("SELECT cliente_nome_norm FROM propostas WHERE id = 'legado'")).scalar() \
+            == "carlos souza"
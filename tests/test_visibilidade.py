@@ -0,0 +1,123 @@
+"""Materialização de quem vê cada proposta (visibilidade / proposta_visibilidade)."""
+import visibilidade
+from db import ClienteDB, PropostaDB, PropostaVisibilidadeDB, UserDB
+
+
+def _mapa(db):
+    """{(e-mail, proposta): via_cliente_id} gravado na tabela."""
+    return {(r.user_email, r.proposta_id): r.via_cliente_id for r in db.query(PropostaVisibilidadeDB).all()}
+
+
+def _proposta(db, pid, **campos):
+    tel = visibilidade.norm_telefone(campos.get("cliente_telefone")) or None
+    nome = visibilidade.norm_nome(campos.get("cliente_nome")) or None
+    db.add(PropostaDB(id=pid, cliente_telefone_norm=tel, cliente_nome_norm=nome, **campos))
+
+
+def _cenario(db):
+    db.add_all([
+        UserDB(uid="u-ana", email="ana@x.com", nome="Ana", role="vendedor"),
+        UserDB(uid="u-bia", email="bia@x.com", nome="Bia", role="vendedor"),
+        ClienteDB(id="c-bia", nome="Carlos Souza", telefone="(11) 98888-7777", created_by="u-bia"),
+        ClienteDB(id="c-homonimo", nome="Carlos Souza", telefone=None, created_by_email="caio@x.com"),
+    ])
+    # Criada pela Ana para o cliente da Bia
+    _proposta(db, "p-id", created_by="u-ana", cliente_id="c-bia")
+    # Legado sem cliente_id: casa com o cliente da Bia pelo telefone
+    _proposta(db, "p-tel", created_by_email="dani@x.com", cliente_telefone="11 98888 7777", cliente_nome="Carlos Souza")
+    # Legado só com o nome: casa com os dois clientes homônimos
+    _proposta(db, "p-nome", created_by_email="dani@x.com", cliente_nome=" carlos souza ")
+    db.commit()
+
+
+def test_rebuild_aplica_as_regras(db_sessao):
+    _cenario(db_sessao)
+    visibilidade.rebuild(db_sessao)
+    assert _mapa(db_sessao) == {
+        ("ana@x.com", "p-id"): None,          # criadora (e-mail resolvido pelo uid)
+        ("bia@x.com", "p-id"): None,          # dona do cliente da própria proposta
+        ("dani@x.com", "p-tel"): None,
+        ("bia@x.com", "p-tel"): "c-bia",      # telefone normalizado
+        ("caio@x.com", "p-tel"): "c-homonimo",  # nome (>= 3 letras)
+        ("dani@x.com", "p-nome"): None,
+        ("bia@x.com", "p-nome"): "c-bia",
+        ("caio@x.com", "p-nome"): "c-homonimo",
+    }
+
+
+def test_atualizacao_incremental_igual_ao_rebuild(db_sessao):
+    _cenario(db_sessao)
+    visibilidade.rebuild(db_sessao)
+    esperado = _mapa(db_sessao)
+    db_sessao.query(PropostaVisibilidadeDB).delete()
+    db_sessao.commit()
+    visibilidade.atualizar_propostas(db_sessao, ["p-id", "p-tel", "p-nome"])
+    assert _mapa(db_sessao) == esperado
+
+
+def test_transferencia_do_cliente_move_a_visibilidade(db_sessao):
+    _cenario(db_sessao)
+    visibilidade.rebuild(db_sessao)
+    c = db_sessao.get(ClienteDB, "c-bia")
+    c.created_by, c.created_by_email = None, "ana@x.com"
+    db_sessao.commit()
+    visibilidade.atualizar_cliente(db_sessao, "c-bia")
+    mapa = _mapa(db_sessao)
+    assert not any(email == "bia@x.com" for email, _ in mapa)
+    assert mapa[("ana@x.com", "p-tel")] == "c-bia"
+    assert mapa[("ana@x.com", "p-id")] is None
+
+
+def test_edicao_do_telefone_desfaz_o_vinculo_antigo(db_sessao):
+    _cenario(db_sessao)
+    visibilidade.rebuild(db_sessao)
+    c = db_sessao.get(ClienteDB, "c-bia")
+    antes = {"telefone": c.telefone, "nome": c.nome}
+    c.telefone, c.nome = "(21) 91111-2222", "Outro Nome"
+    db_sessao.commit()
+    visibilidade.atualizar_cliente(db_sessao, "c-bia", antes)
+    mapa = _mapa(db_sessao)
+    assert ("bia@x.com", "p-tel") not in mapa
+    assert ("bia@x.com", "p-nome") not in mapa
+    assert mapa[("bia@x.com", "p-id")] is None
+
+
+def test_garantir_populada_so_com_tabela_vazia(db_sessao):
+    _cenario(db_sessao)
+    visibilidade.garantir_populada(db_sessao)
+    total = len(_mapa(db_sessao))
+    assert total > 0
+    db_sessao.query(PropostaVisibilidadeDB).filter(PropostaVisibilidadeDB.proposta_id == "p-id").delete()
+    db_sessao.commit()
+    visibilidade.garantir_populada(db_sessao)
+    assert len(_mapa(db_sessao)) == total - 2
+
+
+def test_candidatos_so_os_clientes_que_casam(db_sessao):
+    _cenario(db_sessao)
+    db_sessao.add_all([
+        ClienteDB(id="c-outro", nome="Zuleica Prado", telefone="(31) 97777-6666", created_by="u-ana"),
+        ClienteDB(id="c-pontos", nome="Outro Nome", telefone="+55 11.98888/7777", created_by="u-ana"),
+    ])
+    db_sessao.commit()
+    props = visibilidade.resumo_propostas_query(db_sessao, colunas=visibilidade._COLUNAS).filter(
+        PropostaDB.id.in_(["p-id", "p-tel"])).all()
+    ids = {c.id for c in visibilidade._clientes_candidatos(db_sessao, props)}
+    assert ids == {"c-bia", "c-homonimo"}  # "c-pontos" tem o DDI: outro número
+
+
+def test_atualizacao_fica_na_transacao_de_quem_chama(db_sessao, monkeypatch):
+    _cenario(db_sessao)
+    visibilidade.atualizar_propostas(db_sessao, ["p-id"])
+    db_sessao.rollback()  # sem commit do chamador, nada foi gravado
+    assert _mapa(db_sessao) == {}
+
+    def falha(*args):
+        raise RuntimeError("falhou")
+
+    db_sessao.get(PropostaDB, "p-id").cliente_nome = "Nome Novo"
+    monkeypatch.setattr(visibilidade, "_gravar", falha)
+    visibilidade.atualizar_propostas(db_sessao, ["p-id"])  # desfaz só o SAVEPOINT
+    db_sessao.commit()
+    db_sessao.expire_all()
+    assert db_sessao.get(PropostaDB, "p-id").cliente_nome == "Nome Novo"
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+timing.py
+=========
+Instrumentação leve por etapa (spans) para a geração de proposta/PDF.
+
+- `with span("nucleo"):` mede a etapa; `@timed("irradiancia")` mede uma função inteira.
+- Dentro de uma requisição Flask, as etapas ficam em `g` e viram o header
+  `Server-Timing` (ver `server_timing_header`). Trabalho enviado a um executor
+  leva o coletor da requisição com `propagar(fn)` (em respostas em streaming o
+  header já saiu; essas etapas ficam só no histograma).
+- `with restante("substituicoes"):` registra o tempo do bloco menos as etapas
+  medidas diretamente dentro dele, na mesma thread (aninhadas não contam duas vezes).
+- Todas as medições alimentam um histograma agregado em memória (por processo),
+  exposto por `snapshot()` para o endpoint de métricas.
+"""
+from __future__ import annotations
+
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+try:
+    from flask import g, has_request_context
+except Exception:  # pragma: no cover - módulo usado também fora do Flask
+    g = None
+
+    def has_request_context() -> bool:
+        return False
+
+# Limites superiores dos buckets (ms)
+BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 40000, 60000]
+
+
+class _Histograma:
+    __slots__ = ("count", "total_ms", "max_ms", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def add(self, ms: float) -> None:
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.buckets[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+
+    def percentil(self, p: float) -> float:
+        """Estimativa pelo limite superior do bucket (suficiente para ver onde o tempo vai)."""
+        if not self.count:
+            return 0.0
+        alvo = p * self.count
+        acumulado = 0
+        for i, n in enumerate(self.buckets):
+            acumulado += n
+            if acumulado >= alvo:
+                return min(float(BUCKETS_MS[i]), self.max_ms) if i < len(BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 1) if self.count else 0.0,
+            "p50_ms": self.percentil(0.50),
+            "p95_ms": self.percentil(0.95),
+            "max_ms": round(self.max_ms, 1),
+            "buckets": {(f"le_{b}" if i < len(BUCKETS_MS) else "inf"): n
+                        for i, (b, n) in enumerate(zip(BUCKETS_MS + [None], self.buckets))},
+        }
+
+
+_HIST: Dict[str, _Histograma] = {}
+_LOCK = threading.Lock()
+
+# Por thread: coletor do Server-Timing herdado via propagar() e pilha de blocos
+# abertos (cada nível acumula o tempo das etapas filhas, para o restante())
+_local = threading.local()
+
+
+def _coletor_atual() -> Optional[list]:
+    coletor = getattr(_local, "coletor", None)
+    if coletor is not None:
+        return coletor
+    if has_request_context():
+        coletor = getattr(g, "_server_timing", None)
+        if coletor is None:
+            coletor = g._server_timing = []
+        return coletor
+    return None
+
+
+def propagar(fn):
+    """Envolve `fn` para rodar em outra thread anotando no Server-Timing da requisição atual."""
+    coletor = _coletor_atual()
+    if coletor is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        anterior = getattr(_local, "coletor", None)
+        _local.coletor = coletor
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.coletor = anterior
+    return wrapper
+
+
+def _pilha() -> List[List[float]]:
+    pilha = getattr(_local, "pilha", None)
+    if pilha is None:
+        pilha = _local.pilha = []
+    return pilha
+
+
+def record(nome: str, ms: float) -> None:
+    """Registra uma medição (ms) no histograma e, se houver requisição ativa, no Server-Timing."""
+    try:
+        ms = float(ms)
+    except Exception:
+        return
+    if ms < 0:
+        return
+    with _LOCK:
+        h = _HIST.get(nome)
+        if h is None:
+            h = _HIST[nome] = _Histograma()
+        h.add(ms)
+    coletor = _coletor_atual()
+    if coletor is not None:
+        coletor.append((nome, ms))
+
+
+class Span:
+    __slots__ = ("nome", "inicio", "ms")
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.inicio = time.perf_counter()
+        self.ms = 0.0
+
+
+@contextmanager
+def span(nome: str, etapas: Optional[List[Span]] = None) -> Iterator[Span]:
+    """Mede o bloco. Se `etapas` for informado, o span também é anexado à lista (para somatórios)."""
+    s = Span(nome)
+    pilha = _pilha()
+    pilha.append([0.0])
+    try:
+        yield s
+    finally:
+        pilha.pop()
+        s.ms = (time.perf_counter() - s.inicio) * 1000.0
+        if pilha:
+            pilha[-1][0] += s.ms
+        record(nome, s.ms)
+        if etapas is not None:
+            etapas.append(s)
+
+
+@contextmanager
+def restante(nome: str) -> Iterator[None]:
+    """
+    Registra como `nome` o tempo do bloco menos as etapas (span/@timed) medidas
+    diretamente dentro dele nesta thread. Só registra se o bloco terminar sem erro.
+    """
+    inicio = time.perf_counter()
+    pilha = _pilha()
+    nivel = [0.0]
+    pilha.append(nivel)
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        pilha.pop()
+        total = (time.perf_counter() - inicio) * 1000.0
+        if pilha:
+            pilha[-1][0] += total
+        if ok:
+            record(nome, total - nivel[0])
+
+
+def timed(nome: str):
+    """Decorator: mede cada chamada da função como uma etapa."""
+    def deco(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(nome):
+                return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def server_timing_header() -> Optional[str]:
+    """Valor do header Server-Timing com as etapas da requisição atual (somadas por nome)."""
+    if not has_request_context():
+        return None
+    etapas = getattr(g, "_server_timing", None)
+    if not etapas:
+        return None
+    somas: Dict[str, float] = {}
+    for nome, ms in etapas:
+        somas[nome] = somas.get(nome, 0.0) + ms
+    return ", ".join(f"{nome};dur={ms:.1f}" for nome, ms in somas.items())
+
+
+def snapshot() -> Dict[str, dict]:
+    with _LOCK:
+        return {nome: h.to_dict() for nome, h in sorted(_HIST.items())}
+
+
+def reset() -> None:
+    with _LOCK:
+        _HIST.clear()
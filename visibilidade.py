@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+visibilidade.py
+===============
+Mapa materializado usuário → propostas visíveis (tabela proposta_visibilidade).
+
+A regra é a mesma que listar_projetos/get_projeto calculavam a cada requisição.
+Um usuário (e-mail) vê a proposta se:
+- é o criador (created_by_email, ou o e-mail do usuário created_by);
+- é dono (created_by/created_by_email) do cliente da proposta, casado por id
+  (cliente_id/owner_cliente_id), telefone normalizado (> 8 dígitos) ou nome (>= 3 letras).
+
+`via_cliente_id` guarda o cliente do usuário inferido por telefone/nome quando o
+cliente da própria proposta não é dele (contador de propostas na tela de Clientes).
+
+Atualização incremental nas gravações (`atualizar_propostas`, `atualizar_cliente`),
+dentro da transação de quem grava (o commit é do chamador), e reconstrução completa
+com `rebuild` / `python visibilidade.py --rebuild`.
+"""
+from __future__ import annotations
+
+import re
+import sys
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import func, or_
+
+from db import ClienteDB, PropostaDB, PropostaVisibilidadeDB, UserDB, resumo_propostas_query
+
+_COLUNAS = ("id", "created_by", "created_by_email", "cliente_id", "owner_cliente_id",
+            "cliente_telefone_norm", "cliente_nome_norm")
+_SEPARADORES_TELEFONE = (" ", "-", "(", ")", "+", ".", "/")
+
+
+def norm_telefone(s) -> str:
+    return re.sub(r"\D+", "", str(s or ""))
+
+
+def norm_nome(s) -> str:
+    return str(s or "").strip().lower()
+
+
+def _indices_clientes(clientes) -> tuple:
+    por_id, por_tel, por_nome = {}, {}, {}
+    for c in clientes:
+        por_id[c.id] = c
+        t = norm_telefone(c.telefone)
+        if len(t) > 8:
+            por_tel.setdefault(t, []).append(c)
+        n = norm_nome(c.nome)
+        if len(n) >= 3:
+            por_nome.setdefault(n, []).append(c)
+    return por_id, por_tel, por_nome
+
+
+def _visiveis(p, indices: tuple, email_por_uid: Dict[str, str]) -> Dict[str, Optional[str]]:
+    """{e-mail: via_cliente_id} de quem vê a proposta `p`."""
+    por_id, por_tel, por_nome = indices
+
+    def emails(created_by_email, created_by):
+        return {e for e in (created_by_email, email_por_uid.get(created_by or "")) if e}
+
+    vis = {e: None for e in emails(p.created_by_email, p.created_by)}
+    inferido = p.cliente_id or p.owner_cliente_id
+    decididos = set()  # usuários dono do cliente da própria proposta: sem via
+    for cid in {p.cliente_id, p.owner_cliente_id}:
+        c = por_id.get(cid)
+        if c is None:
+            continue
+        donos = emails(c.created_by_email, c.created_by)
+        for e in donos:
+            vis.setdefault(e, None)
+        if cid == inferido:
+            decididos |= donos
+    # Legado: telefone tem precedência sobre nome
+    candidatos = (por_tel.get(p.cliente_telefone_norm or "") or []) + (por_nome.get(p.cliente_nome_norm or "") or [])
+    for c in candidatos:
+        for e in emails(c.created_by_email, c.created_by):
+            if e in decididos:
+                continue
+            vis[e] = c.id
+            decididos.add(e)
+    return vis
+
+
+def _emails_por_uid(db, uids: Optional[Iterable[str]] = None) -> Dict[str, str]:
+    q = db.query(UserDB.uid, UserDB.email)
+    if uids is not None:
+        uids = [u for u in set(uids) if u]
+        if not uids:
+            return {}
+        q = q.filter(UserDB.uid.in_(uids))
+    return {uid: email for uid, email in q.all() if email}
+
+
+def _telefone_sem_formatacao_sql(coluna):
+    """Telefone sem os separadores comuns, em SQL portátil (SQLite não tem regexp_replace)."""
+    expr = func.coalesce(coluna, "")
+    for sep in _SEPARADORES_TELEFONE:
+        expr = func.replace(expr, sep, "")
+    return expr
+
+
+def _clientes_candidatos(db, props: List) -> List:
+    """Clientes que podem casar com as propostas (id, telefone ou nome)."""
+    ids = {i for p in props for i in (p.cliente_id, p.owner_cliente_id) if i}
+    tels = {p.cliente_telefone_norm for p in props if p.cliente_telefone_norm and len(p.cliente_telefone_norm) > 8}
+    nomes = {p.cliente_nome_norm for p in props if p.cliente_nome_norm and len(p.cliente_nome_norm) >= 3}
+    conds = []
+    if ids:
+        conds.append(ClienteDB.id.in_(ids))
+    postgres = db.bind.dialect.name == "postgresql"
+    if tels:
+        if postgres:
+            conds.append(func.regexp_replace(func.coalesce(ClienteDB.telefone, ""), r"\D", "", "g").in_(tels))
+        else:
+            conds.append(_telefone_sem_formatacao_sql(ClienteDB.telefone).in_(tels))
+    if nomes:
+        conds.append(func.lower(func.trim(func.coalesce(ClienteDB.nome, ""))).in_(nomes))
+    if not conds:
+        return []
+    clientes = db.query(ClienteDB).filter(or_(*conds)).all()
+    if postgres:
+        return clientes
+    # SQLite de dev: a consulta acima só traz candidatos; a normalização de verdade
+    # (a mesma das propostas) é aplicada aqui. lower() do SQLite só trata ASCII.
+    return [c for c in clientes
+            if c.id in ids or norm_telefone(c.telefone) in tels or norm_nome(c.nome) in nomes]
+
+
+def _gravar(db, props: List, indices: tuple, email_por_uid: Dict[str, str]) -> int:
+    linhas = []
+    for p in props:
+        for email, via in _visiveis(p, indices, email_por_uid).items():
+            linhas.append({"user_email": email, "proposta_id": p.id, "via_cliente_id": via})
+    if linhas:
+        db.bulk_insert_mappings(PropostaVisibilidadeDB, linhas)
+    return len(linhas)
+
+
+def atualizar_propostas(db, proposta_ids: Iterable[str]) -> None:
+    """
+    Recalcula quem vê as propostas indicadas, na transação de quem chama (que faz o
+    commit junto com a gravação que motivou a atualização). Best-effort: roda num
+    SAVEPOINT; se falhar, só ele é desfeito e o erro é logado.
+    """
+    ids = [i for i in set(proposta_ids or []) if i]
+    if not ids:
+        return
+    try:
+        with db.begin_nested():
+            props = resumo_propostas_query(db, colunas=_COLUNAS).filter(PropostaDB.id.in_(ids)).all()
+            clientes = _clientes_candidatos(db, props)
+            uids = [p.created_by for p in props] + [c.created_by for c in clientes]
+            db.query(PropostaVisibilidadeDB).filter(
+                PropostaVisibilidadeDB.proposta_id.in_(ids)).delete(synchronize_session=False)
+            _gravar(db, props, _indices_clientes(clientes), _emails_por_uid(db, uids))
+    except Exception as e:
+        print(f"⚠️ [VISIBILIDADE] Falha ao atualizar {len(ids)} proposta(s): {e}")
+
+
+def propostas_do_cliente(db, cliente_id: str, telefone=None, nome=None) -> List[str]:
+    """Ids das propostas ligadas ao cliente (por id, telefone/nome normalizados ou via)."""
+    tel, n = norm_telefone(telefone), norm_nome(nome)
+    conds = [PropostaDB.cliente_id == cliente_id, PropostaDB.owner_cliente_id == cliente_id]
+    if len(tel) > 8:
+        conds.append(PropostaDB.cliente_telefone_norm == tel)
+    if len(n) >= 3:
+        conds.append(PropostaDB.cliente_nome_norm == n)
+    ids = {r[0] for r in db.query(PropostaDB.id).filter(or_(*conds)).all()}
+    ids |= {r[0] for r in db.query(PropostaVisibilidadeDB.proposta_id).filter(
+        PropostaVisibilidadeDB.via_cliente_id == cliente_id).all()}
+    return list(ids)
+
+
+def atualizar_cliente(db, cliente_id: str, antes: Optional[dict] = None) -> None:
+    """
+    Recalcula as propostas afetadas por criação/edição/transferência/remoção do cliente.
+    `antes`: {"telefone", "nome"} anteriores à edição (propostas que deixaram de casar).
+    Como atualizar_propostas: sem commit, falha desfeita só no SAVEPOINT.
+    """
+    try:
+        with db.begin_nested():
+            ids = set()
+            c = db.get(ClienteDB, cliente_id)
+            if c is not None:
+                ids |= set(propostas_do_cliente(db, cliente_id, c.telefone, c.nome))
+            if antes:
+                ids |= set(propostas_do_cliente(db, cliente_id, antes.get("telefone"), antes.get("nome")))
+    except Exception as e:
+        print(f"⚠️ [VISIBILIDADE] Falha ao localizar propostas do cliente {cliente_id}: {e}")
+        return
+    atualizar_propostas(db, ids)
+
+
+def rebuild(db) -> int:
+    """Reconstrói a tabela inteira (uma transação). Retorna o número de linhas."""
+    props = resumo_propostas_query(db, colunas=_COLUNAS).all()
+    indices = _indices_clientes(db.query(ClienteDB).all())
+    db.query(PropostaVisibilidadeDB).delete(synchronize_session=False)
+    total = _gravar(db, props, indices, _emails_por_uid(db))
+    db.commit()
+    print(f"✅ [VISIBILIDADE] {total} vínculos para {len(props)} propostas")
+    return total
+
+
+def garantir_populada(db) -> None:
+    """Primeira subida com a tabela vazia: constrói antes de servir a listagem."""
+    try:
+        if db.query(PropostaVisibilidadeDB.proposta_id).first() is None and db.query(PropostaDB.id).first() is not None:
+            rebuild(db)
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ [VISIBILIDADE] Falha ao construir a tabela: {e}")
+
+
+if __name__ == "__main__":
+    if "--rebuild" not in sys.argv[1:]:
+        print("Uso: python visibilidade.py --rebuild")
+        sys.exit(2)
+    from db import SessionLocal, init_db
+    init_db()
+    _db = SessionLocal()
+    try:
+        rebuild(_db)
+    finally:
+        _db.close()